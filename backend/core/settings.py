@@ -1,5 +1,6 @@
 # backend/core/settings.py
 
+import copy
 import os
 from pathlib import Path
 import dj_database_url 
@@ -30,6 +31,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework', 
     'drf_spectacular',
     'quicknotes',
@@ -38,11 +40,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # El primero, para medir la petición entera (quicknotes/metricas.py)
+    'quicknotes.metricas.metricas_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Lecturas a las réplicas y a la primaria tras escribir (quicknotes/replicas.py)
+    'quicknotes.replicas.primaria_tras_escribir_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -85,11 +91,94 @@ DATABASES = {
         'PASSWORD': 'ecommerce_bd_password',
         'HOST': 'db',
         'PORT': '5432',
+        # Segundos que cada worker reutiliza su conexión entre peticiones
+        # (0 = una conexión nueva por petición). Con runserver no sirve de
+        # nada: abre un hilo, y una conexión, por petición
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        # Comprueba la conexión reutilizada al empezar cada petición, por si
+        # PostgreSQL la cerró (reinicio, idle_session_timeout...)
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
-# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
+# Pool de conexiones de psycopg 3 (pip install "psycopg[binary,pool]"),
+# compartido por los hilos de cada worker. Es la opción con el worker ASGI,
+# en el que las conexiones persistentes no se reutilizan bien. No es
+# compatible con CONN_MAX_AGE: el pool ya mantiene las conexiones abiertas
+if int(os.environ.get('DB_POOL_MAX_SIZE', 0)):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            # Segundos que una petición espera una conexión libre antes de fallar
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Réplicas de lectura (ver quicknotes/replicas.py): DB_REPLICAS="host:puerto,host:puerto",
+# con el mismo usuario y la misma base de datos que la primaria
+DATABASE_REPLICAS = []
+for numero, direccion in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    host, _, puerto = direccion.strip().partition(':')
+    alias = f'replica_{numero}'
+    DATABASES[alias] = {
+        **copy.deepcopy(DATABASES['default']),
+        'HOST': host,
+        'PORT': puerto or '5432',
+        # En los tests la réplica es otra conexión a la base de datos de prueba
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASES[alias].setdefault('OPTIONS', {})['connect_timeout'] = 2
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['quicknotes.replicas.ReplicaRouter']
+
+# Segundos que las lecturas de un usuario van a la primaria tras escribir.
+# Debe ser mayor que REPLICA_MAX_RETRASO para que lea lo que escribió
+REPLICA_FIJAR_SEGUNDOS = float(os.environ.get('REPLICA_FIJAR_SEGUNDOS', 5))
+# Retraso máximo (segundos) de una réplica para seguir recibiendo lecturas
+REPLICA_MAX_RETRASO = float(os.environ.get('REPLICA_MAX_RETRASO', 2))
+# Cada cuántos segundos se mide el retraso de cada réplica (en cada proceso)
+REPLICA_COMPROBAR_CADA = float(os.environ.get('REPLICA_COMPROBAR_CADA', 5))
+
+# Métricas de las peticiones (ver quicknotes/metricas.py): cabecera
+# Server-Timing en cada respuesta y consultas lentas en el log. Server-Timing
+# muestra a cualquiera cuánto tarda cada parte: por defecto, solo con DEBUG
+METRICAS_SERVER_TIMING = os.environ.get('METRICAS_SERVER_TIMING', str(DEBUG)).lower() == 'true'
+METRICAS_SQL_LENTA_MS = float(os.environ.get('METRICAS_SQL_LENTA_MS', 200))
+# Directorio en el que cada worker deja sus métricas para publicarlas sumadas
+# (gunicorn lo vacía al arrancar y suma las de cada worker que termina). Sin
+# él, cada proceso publica solo las suyas
+METRICAS_DIR = os.environ.get('METRICAS_DIR') or None
+METRICAS_VOLCAR_CADA = float(os.environ.get('METRICAS_VOLCAR_CADA', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'quicknotes': {'handlers': ['consola'], 'level': 'INFO'},
+    },
+}
+
+# Sustituye al PBKDF2PasswordHasher de Django (mismo algoritmo): no pueden
+# estar los dos en la lista
+PASSWORD_HASHERS = [
+    'quicknotes.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Iteraciones de PBKDF2 (1.000.000 es el valor de Django 5.2). Las contraseñas
+# se vuelven a cifrar con el valor nuevo en el siguiente login
+PASSWORD_PBKDF2_ITERACIONES = int(os.environ.get('PASSWORD_PBKDF2_ITERACIONES', 1_000_000))
 
+# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
     # ... (puedes dejar los por defecto)
 ]
@@ -111,14 +200,64 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caché (catálogo de productos, ver quicknotes/cache.py). En memoria del proceso
+# por defecto; con varios procesos hace falta una compartida: REDIS_URL=redis://...
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Segundos que se guarda cada página del catálogo
+CATALOGO_CACHE_TTL = int(os.environ.get('CATALOGO_CACHE_TTL', 300))
+
+# Días que se guardan los cambios de la sincronización incremental (ver quicknotes/cambios.py)
+CAMBIOS_RETENCION_DIAS = int(os.environ.get('CAMBIOS_RETENCION_DIAS', 30))
+
+# Límites de peticiones y de concurrencia de las acciones caras (ver quicknotes/limites.py)
+LIMITES_ACTIVOS = os.environ.get('LIMITES_ACTIVOS', 'true').lower() == 'true'
+# Pedidos registrados a la vez entre todos los procesos
+LIMITE_PEDIDOS_CONCURRENTES = int(os.environ.get('LIMITE_PEDIDOS_CONCURRENTES', 16))
+# Logins a la vez (PBKDF2 ocupa un núcleo en cada uno): como mucho, los núcleos de los servidores
+LIMITE_LOGINS_CONCURRENTES = int(os.environ.get('LIMITE_LOGINS_CONCURRENTES', 8))
+
+# Listados y detalles con values() en lugar del serializer (ver quicknotes/lectura_rapida.py)
+LECTURA_RAPIDA = os.environ.get('LECTURA_RAPIDA', 'true').lower() == 'true'
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # El mismo JSON que el JSONRenderer de DRF, con orjson (ver quicknotes/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'quicknotes.renderers.JSONRapidoRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        # JWT sin consultar la base de datos: rol y cliente vienen en el token.
+        # Va primero para que un token rechazado responda 401 (y no 403)
+        'quicknotes.authentication.TokenUsuarioAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
 }
 
+# Segundos que se guardan en la caché el rol, el cliente y el estado de cada
+# usuario para validar sus tokens (los cambios hechos con el ORM los descartan antes)
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 60))
+# Segundos que vale un ticket del flujo de eventos (ver quicknotes/authentication.py)
+EVENTOS_TICKET_TTL = int(os.environ.get('EVENTOS_TICKET_TTL', 30))
+
+# El login, los tokens y request.user usan la tabla 'usuarios' (con su rol),
+# no auth_user
+AUTH_USER_MODEL = 'quicknotes.Usuario'
+
 AUTHENTICATION_BACKENDS = [
     'quicknotes.authentication.EmailBackend',
     'django.contrib.auth.backends.ModelBackend',
@@ -4,8 +4,7 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 # --- ¡CAMBIO IMPORTANTE! ---
 # Ya no importamos TokenObtainPairView, sino nuestra propia vista
-from rest_framework_simplejwt.views import TokenRefreshView
-from quicknotes.views import UsuarioRegisterView, MyTokenObtainPairView # <-- Añadir MyTokenObtainPairView
+from quicknotes.views import UsuarioRegisterView, MyTokenObtainPairView, MyTokenRefreshView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -18,7 +17,7 @@ urlpatterns = [
     # Usamos nuestra vista personalizada en lugar de la que viene por defecto
     path('api/token/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'), # Login
     
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/refresh/', MyTokenRefreshView.as_view(), name='token_refresh'),
 
     # --- URLs de Documentación ---
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
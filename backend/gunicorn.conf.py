@@ -0,0 +1,89 @@
+# backend/gunicorn.conf.py
+#
+# Perfil de producción: gunicorn -c gunicorn.conf.py
+# (servicio backend-prod de docker-compose.yml). Todo se ajusta por entorno.
+#
+# - GUNICORN_WORKER=sync (por defecto): core.wsgi, un proceso por petición
+#   en curso. Con DB_CONN_MAX_AGE cada proceso reutiliza su conexión.
+# - GUNICORN_WORKER=asgi: core.asgi con uvicorn (pip install uvicorn-worker).
+#   Usar con el pool de conexiones (DB_POOL_MAX_SIZE), ver core/settings.py.
+import logging
+import multiprocessing
+import os
+import re
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+
+# Dos procesos por núcleo más uno, como recomienda gunicorn: mientras unos
+# esperan a PostgreSQL, otros usan la CPU
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# (clase de worker, aplicación)
+WORKERS = {
+    'sync': ('sync', 'core.wsgi:application'),
+    'asgi': ('uvicorn_worker.UvicornWorker', 'core.asgi:application'),
+}
+worker_class, wsgi_app = WORKERS[os.environ.get('GUNICORN_WORKER', 'sync')]
+
+# Django se importa una vez en el proceso maestro y los workers lo heredan al
+# hacer fork: arrancan antes y comparten la memoria del código. Importar la
+# aplicación no abre conexiones a la base de datos, así que ningún worker
+# hereda un socket de PostgreSQL
+preload_app = True
+
+# Reinicia cada worker tras unas miles de peticiones (con algo de azar para
+# que no coincidan todos) y corta las que se quedan colgadas
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+class SinQueryDeEventos(logging.Filter):
+    """
+    Quita la query string de api/async/eventos/ en el log de accesos: lleva el
+    ticket del flujo de eventos (ver quicknotes/authentication.py).
+    """
+    patron = re.compile(r'(/api/async/eventos/)\?[^\s"]*')
+
+    def filter(self, record):
+        mensaje = record.getMessage()
+        if '/api/async/eventos/?' in mensaje:
+            record.msg, record.args = self.patron.sub(r'\1', mensaje), ()
+        return True
+
+
+# gunicorn.access con el worker sync y uvicorn.access con el ASGI
+for nombre in ('gunicorn.access', 'uvicorn.access'):
+    logging.getLogger(nombre).addFilter(SinQueryDeEventos())
+
+
+def on_starting(server):
+    # Con varios workers, sin Redis cada uno tendría su propia caché: el
+    # catálogo no se invalidaría en todos, los tickets de eventos se podrían
+    # reutilizar y los límites admitirían N veces más
+    if server.cfg.workers > 1 and not os.environ.get('REDIS_URL'):
+        raise SystemExit(f'Con {server.cfg.workers} workers hace falta REDIS_URL (o GUNICORN_WORKERS=1).')
+
+    # Métricas de los workers (METRICAS_DIR, ver quicknotes/metricas.py): se
+    # empieza de cero en cada arranque
+    directorio = os.environ.get('METRICAS_DIR')
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+        for archivo in os.listdir(directorio):
+            if archivo.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(directorio, archivo))
+
+
+def child_exit(server, worker):
+    # Las métricas del worker que termina (o se reinicia) se suman a las de
+    # los anteriores: los contadores no bajan y no quedan archivos de PIDs
+    # muertos, que un worker nuevo con el mismo PID pisaría
+    directorio = os.environ.get('METRICAS_DIR')
+    if directorio:
+        from quicknotes.metricas import retirar_proceso
+        retirar_proceso(directorio, worker.pid)
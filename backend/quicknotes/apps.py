@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class QuicknotesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quicknotes'
+
+    def ready(self):
+        from . import devoluciones, metricas, signals  # noqa: F401
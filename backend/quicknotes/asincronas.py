@@ -0,0 +1,135 @@
+"""
+Vistas asíncronas de lectura del catálogo y los pedidos (core.asgi).
+
+Las vistas de los ViewSets son síncronas: con el worker ASGI
+(GUNICORN_WORKER=asgi) cada petición en curso ocupa un hilo del worker, y
+un cliente lento lo retiene hasta que termina. Estas son corrutinas:
+mientras esperan a PostgreSQL o a la caché, el bucle de eventos atiende
+otras peticiones, así que un solo worker mantiene miles de conexiones
+abiertas (keep-alive) sin un hilo por cada una.
+
+- GET api/async/productos/ y api/async/productos/<id>/
+- GET api/async/pedidos/ y api/async/pedidos/<id>/
+- GET api/async/eventos/: avisos del stock y del estado de los pedidos con
+  Server-Sent Events (ver quicknotes.eventos), con el token en la cabecera o
+  un ticket de POST api/async/eventos/ticket/ en ?ticket=
+
+Responden lo mismo que sus equivalentes síncronos: los mismos serializers,
+la misma paginación por cursor, los mismos ?fields= y ?expand= (ver
+quicknotes.campos) y los mismos permisos (productos para
+cualquier usuario autenticado, sus pedidos para un cliente y todos para
+empleados y administradores). El catálogo también se sirve desde su caché,
+con ETag. Solo aceptan el token JWT, no la sesión.
+
+Las consultas usan la API asíncrona del ORM (aget(), afirst(), async for).
+Django las ejecuta todavía en un hilo aparte, pero la petición no retiene
+ninguno mientras espera.
+"""
+from functools import partial, wraps
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound
+from rest_framework.request import Request
+
+from .authentication import TicketDeEventosAuthentication, TokenUsuarioAuthentication
+from .cache import adesde_cache
+from .campos import elegir_campos, recortar_consulta
+from .eventos import flujo_de_eventos
+from .models import Pedido, Producto
+from .pagination import NombrePagination, PedidoPagination
+from .pedidos import pedidos_visibles
+from .renderers import JSONRapidoRenderer
+from .serializers import PedidoSerializer, ProductoSerializer
+
+
+def _json(datos, status=200):
+    return HttpResponse(JSONRapidoRenderer().render(datos), status=status, content_type='application/json')
+
+
+def vista_asincrona(vista=None, autenticacion_class=TokenUsuarioAuthentication):
+    """
+    Autentica la petición con el JWT (request.user es un UsuarioToken) y
+    convierte las excepciones de DRF en la misma respuesta que las vistas
+    síncronas. La vista recibe un Request de DRF, para query_params.
+    """
+    if vista is None:
+        return partial(vista_asincrona, autenticacion_class=autenticacion_class)
+    autenticacion = autenticacion_class()
+
+    @wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        request = Request(request)
+        try:
+            usuario = await autenticacion.aautenticar(request)
+            if usuario is None:
+                raise NotAuthenticated()
+            request.user = usuario
+            return await vista(request, *args, **kwargs)
+        except APIException as e:
+            response = _json(e.detail if isinstance(e.detail, (list, dict)) else {'detail': e.detail},
+                             status=e.status_code)
+            if e.status_code == 401:
+                response['WWW-Authenticate'] = autenticacion.authenticate_header(request)
+            return response
+
+    return require_safe(envoltura)
+
+
+@vista_asincrona
+async def productos(request):
+    return await adesde_cache(request, _listar_productos)
+
+
+async def _listar_productos(request):
+    paginador = NombrePagination()
+    campos = elegir_campos(ProductoSerializer, request.query_params)
+    productos = recortar_consulta(Producto.objects.defer('busqueda'), ProductoSerializer, campos,
+                                  paginador.ordering)
+    pagina = await paginador.apaginate_queryset(productos, request)
+    return _json(paginador.get_paginated_response(ProductoSerializer(pagina, many=True, campos=campos).data).data)
+
+
+@vista_asincrona
+async def producto(request, pk):
+    async def detalle(request):
+        campos = elegir_campos(ProductoSerializer, request.query_params, lista=False)
+        productos = recortar_consulta(Producto.objects.defer('busqueda'), ProductoSerializer, campos)
+        try:
+            return _json(ProductoSerializer(await productos.aget(pk=pk), campos=campos).data)
+        except Producto.DoesNotExist:
+            raise NotFound()
+
+    return await adesde_cache(request, detalle)
+
+
+@vista_asincrona
+async def pedidos(request):
+    paginador = PedidoPagination()
+    # Los pedidos de la página con su cliente (y sus líneas con
+    # ?expand=detalle_pedidos): una o dos consultas, como en PedidoViewSet,
+    # y ninguna más al serializarlos
+    campos = elegir_campos(PedidoSerializer, request.query_params)
+    pedidos = recortar_consulta(pedidos_visibles(request.user), PedidoSerializer, campos, paginador.ordering)
+    pagina = await paginador.apaginate_queryset(pedidos, request)
+    return _json(paginador.get_paginated_response(PedidoSerializer(pagina, many=True, campos=campos).data).data)
+
+
+@vista_asincrona
+async def pedido(request, pk):
+    campos = elegir_campos(PedidoSerializer, request.query_params, lista=False)
+    pedidos = recortar_consulta(pedidos_visibles(request.user), PedidoSerializer, campos)
+    try:
+        return _json(PedidoSerializer(await pedidos.aget(pk=pk), campos=campos).data)
+    except Pedido.DoesNotExist:
+        raise NotFound()
+
+
+# EventSource, en el navegador, no puede enviar la cabecera Authorization
+@vista_asincrona(autenticacion_class=TicketDeEventosAuthentication)
+async def eventos(request):
+    response = StreamingHttpResponse(flujo_de_eventos(request.user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Que nginx no guarde los avisos en su búfer
+    response['X-Accel-Buffering'] = 'no'
+    return response
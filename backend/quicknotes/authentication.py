@@ -1,5 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth import backends, get_user_model
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Lower
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
 
 UserModel = get_user_model()
 
@@ -9,24 +22,216 @@ class EmailBackend(backends.ModelBackend):
     iniciar sesión usando su dirección de correo electrónico o su nombre de usuario,
     ignorando mayúsculas y minúsculas.
     """
+    def usuarios_con_login(self, username):
+        """
+        Usuarios cuyo 'username' O 'email' coinciden con lo que se escribió en
+        el formulario, sin distinguir mayúsculas. Es una sola consulta que usa
+        los índices lower() de 'usuarios' (migración 0009). En el caso
+        improbable de que coincidan dos (el username de uno es el email de
+        otro), primero el del username.
+        """
+        texto = Lower(Value(username))
+        return UserModel.objects.alias(
+            username_lower=Lower('username'), email_lower=Lower('email'),
+        ).filter(
+            Q(username_lower=texto) | Q(email_lower=texto)
+        ).order_by(
+            Case(When(username_lower=texto, then=0), default=1), 'id'
+        )
+
     def authenticate(self, request, username=None, password=None, **kwargs):
-        try:
-            # --- ¡LA CLAVE ESTÁ AQUÍ! ---
-            # Buscamos un usuario donde el 'username' O el 'email' coincidan
-            # con lo que el usuario escribió en el formulario de login.
-            # 'iexact' significa 'exactamente igual, pero ignorando mayúsculas/minúsculas'.
-            user = UserModel.objects.get(
-                Q(username__iexact=username) | Q(email__iexact=username)
-            )
-        except UserModel.DoesNotExist:
-            # Si no se encuentra ningún usuario con ese username o email, paramos.
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        user = self.usuarios_con_login(username).first()
+
+        if user is None:
+            # Igual que ModelBackend: se calcula un hash para que no se note
+            # por el tiempo de respuesta si el usuario existe
+            UserModel().set_password(password)
             return None
-        except UserModel.MultipleObjectsReturned:
-            # En el caso improbable de que haya duplicados, priorizamos el username.
-            return UserModel.objects.filter(username__iexact=username).first()
 
-        # Si encontramos un usuario, verificamos su contraseña y si su cuenta está activa.
+        # Si encontramos un usuario, verificamos su contraseña y si su cuenta
+        # está activa. check_password() vuelve a cifrar la contraseña si el
+        # coste configurado cambió (ver quicknotes/hashers.py).
         if user.check_password(password) and self.user_can_authenticate(user):
             return user
-        
-        return None
\ No newline at end of file
+
+        return None
+
+
+# --- Autenticación por token sin consultar la base de datos ---
+#
+# El token de acceso lleva el rol y el cliente del usuario (claims 'rol' y
+# 'cliente_id', ver MyTokenObtainPairSerializer), así que los permisos y el
+# filtrado de los querysets no necesitan cargar el Usuario ni su Cliente.
+# Para poder revocarlos, cada petición compara esos claims con los datos
+# actuales del usuario, que se guardan en la caché durante AUTH_CACHE_TTL
+# segundos. Cambiar el rol, desactivar al usuario o cambiar su cliente borra
+# esa entrada (quicknotes/signals.py): los tokens que ya no coinciden se
+# rechazan con 401 y el cliente tiene que renovarlos, con los datos nuevos.
+
+def _clave_usuario(usuario_id):
+    return f'auth:usuario:{usuario_id}'
+
+
+def datos_de_usuario(usuario_id):
+    """
+    Rol, cliente y estado actuales del usuario: de la caché o, si no están,
+    de una sola consulta (que se guarda). None si el usuario no existe.
+    """
+    clave = _clave_usuario(usuario_id)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = _datos(_consulta_usuario(usuario_id).first())
+        if datos is None:
+            return None
+        cache.set(clave, datos, settings.AUTH_CACHE_TTL)
+    return datos
+
+
+async def adatos_de_usuario(usuario_id):
+    """Como datos_de_usuario(), para las vistas asíncronas."""
+    clave = _clave_usuario(usuario_id)
+    datos = await cache.aget(clave)
+    if datos is None:
+        datos = _datos(await _consulta_usuario(usuario_id).afirst())
+        if datos is None:
+            return None
+        await cache.aset(clave, datos, settings.AUTH_CACHE_TTL)
+    return datos
+
+
+def _consulta_usuario(usuario_id):
+    return UserModel.objects.filter(pk=usuario_id).values('rol', 'is_active', 'cliente__id')
+
+
+def _datos(fila):
+    if fila is None:
+        return None
+    return {'rol': fila['rol'], 'cliente_id': fila['cliente__id'], 'activo': fila['is_active']}
+
+
+def olvidar_usuario(usuario_id):
+    """
+    Descarta los datos cacheados del usuario (ahora y al confirmar la
+    transacción, como invalidar_catalogo()): sus tokens se vuelven a comprobar.
+    """
+    clave = _clave_usuario(usuario_id)
+    cache.delete(clave)
+    transaction.on_commit(lambda: cache.delete(clave))
+
+
+def claims_de_usuario(usuario_id):
+    """
+    Claims de autorización que se añaden a los tokens del usuario. Un usuario
+    borrado o desactivado no recibe tokens nuevos (401).
+    """
+    datos = datos_de_usuario(usuario_id)
+    if datos is None or not datos['activo']:
+        raise AuthenticationFailed('Usuario inexistente o inactivo.', code='user_inactive')
+    return {'rol': datos['rol'], 'cliente_id': datos['cliente_id']}
+
+
+class UsuarioToken(TokenUser):
+    """Usuario de la petición construido a partir de los claims del token."""
+
+    @cached_property
+    def rol(self):
+        return self.token['rol']
+
+    @cached_property
+    def cliente_id(self):
+        return self.token.get('cliente_id')
+
+
+class TokenUsuarioAuthentication(JWTAuthentication):
+    """
+    Como JWTAuthentication, pero request.user es un UsuarioToken y no una
+    fila de 'usuarios'. Solo consulta la base de datos si los datos del
+    usuario no están en la caché.
+    """
+
+    def get_user(self, validated_token):
+        return self._usuario(validated_token, datos_de_usuario(self._usuario_id(validated_token)))
+
+    async def aautenticar(self, request):
+        """
+        Como authenticate(), para las vistas asíncronas (quicknotes.asincronas):
+        el UsuarioToken de la petición o None si no trae token.
+        """
+        header = self.get_header(request)
+        raw_token = None if header is None else self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self._usuario(validated_token, await adatos_de_usuario(self._usuario_id(validated_token)))
+
+    @staticmethod
+    def _usuario_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('El token no identifica a ningún usuario.')
+
+    @staticmethod
+    def _usuario(validated_token, datos):
+        if datos is None or not datos['activo']:
+            raise AuthenticationFailed('Usuario inexistente o inactivo.', code='user_inactive')
+        # Tokens emitidos antes de un cambio de rol o de cliente (o sin claims)
+        if 'rol' not in validated_token or (
+            validated_token['rol'] != datos['rol'] or validated_token.get('cliente_id') != datos['cliente_id']
+        ):
+            raise InvalidToken('Los permisos del usuario han cambiado: renueva el token.')
+
+        return UsuarioToken(validated_token)
+
+
+# --- Tickets del flujo de eventos ---
+#
+# EventSource no puede enviar la cabecera Authorization, y el token de acceso
+# en la URL acabaría en los logs de accesos y de los proxies. El navegador
+# pide con su token (POST api/async/eventos/ticket/) un ticket que solo abre
+# el flujo de eventos, caduca en EVENTOS_TICKET_TTL segundos y se usa una vez.
+
+class TicketDeEventos(Token):
+    """
+    JWT con los claims de autorización del usuario. Tiene otro token_type, así
+    que no sirve como token de acceso.
+    """
+    token_type = 'eventos'
+
+    @property
+    def lifetime(self):
+        return timedelta(seconds=settings.EVENTOS_TICKET_TTL)
+
+    @classmethod
+    def para(cls, usuario_id):
+        ticket = cls()
+        ticket[api_settings.USER_ID_CLAIM] = usuario_id
+        for claim, valor in claims_de_usuario(usuario_id).items():
+            ticket[claim] = valor
+        return ticket
+
+
+class TicketDeEventosAuthentication(TokenUsuarioAuthentication):
+    """
+    Autenticación del flujo de eventos: el ticket de ?ticket= o, fuera del
+    navegador, el token de acceso en la cabecera.
+    """
+
+    async def aautenticar(self, request):
+        raw_ticket = request.query_params.get('ticket')
+        if raw_ticket is None:
+            return await super().aautenticar(request)
+        try:
+            ticket = TicketDeEventos(raw_ticket)
+        except TokenError:
+            raise InvalidToken('El ticket no es válido o ha caducado.')
+        # add() no pisa una clave que ya está: solo la primera conexión la crea
+        if not await cache.aadd(f"eventos:ticket:{ticket[api_settings.JTI_CLAIM]}", True,
+                                settings.EVENTOS_TICKET_TTL):
+            raise InvalidToken('El ticket ya se usó.')
+        return self._usuario(ticket, await adatos_de_usuario(self._usuario_id(ticket)))
@@ -0,0 +1,76 @@
+"""
+Búsqueda de productos por texto.
+
+- productos.busqueda guarda el tsvector del nombre (peso A) y la descripción
+  (peso B) con la configuración 'spanish'. Lo mantiene el trigger
+  busqueda_producto (función producto_busqueda(), migración 0008), así que ni
+  el filtro ni el ranking tienen que volver a analizar el texto de cada fila.
+  Cada palabra buscada se trata como prefijo ('lapt' encuentra 'laptop').
+- productos_busqueda_idx: GIN sobre esa columna.
+- productos_nombre_trgm_idx: GIN de trigramas sobre el nombre (pg_trgm), que
+  tolera errores de escritura ('lpatop'). pg_trgm viene con los paquetes
+  contrib de PostgreSQL; si el servidor no lo tiene, la migración no crea este
+  índice y la búsqueda funciona solo por prefijos.
+
+Los índices se crean con CONCURRENTLY y la columna se rellena por lotes, sin
+bloquear la tabla. La relevancia combina ts_rank con la similitud de
+trigramas del nombre y se pagina por cursor (BusquedaPagination).
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from .models import Producto
+
+CONFIG = 'spanish'
+
+_trigramas = None
+
+
+def trigramas_disponibles():
+    """Si pg_trgm está instalado en la base de datos (se consulta una vez por proceso)."""
+    global _trigramas
+    if _trigramas is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            _trigramas = cursor.fetchone()[0]
+    return _trigramas
+
+
+def _consulta_por_prefijos(texto):
+    palabras = re.findall(r'\w+', texto.lower())
+    if not palabras:
+        return None
+    return SearchQuery(' & '.join(f'{palabra}:*' for palabra in palabras), search_type='raw', config=CONFIG)
+
+
+def buscar_productos(q, activo=True, precio_min=None, precio_max=None):
+    """
+    Productos que coinciden con 'q', anotados con 'relevancia'. Sin orden:
+    lo aplica la paginación.
+    """
+    productos = Producto.objects.all()
+    if activo is not None:
+        productos = productos.filter(activo=activo)
+    if precio_min is not None:
+        productos = productos.filter(precio__gte=precio_min)
+    if precio_max is not None:
+        productos = productos.filter(precio__lte=precio_max)
+
+    consulta = _consulta_por_prefijos(q)
+    coincide = Q(busqueda=consulta) if consulta else Q(pk__in=[])
+    relevancia = SearchRank(F('busqueda'), consulta) if consulta else Value(0.0)
+
+    if trigramas_disponibles():
+        # '<%' (word_similarity por encima de pg_trgm.word_similarity_threshold)
+        # usa productos_nombre_trgm_idx
+        coincide |= Q(RawSQL('%s <%% "productos"."nombre"', [q], output_field=BooleanField()))
+        relevancia = relevancia + RawSQL('word_similarity(%s, "productos"."nombre")', [q])
+
+    return productos.defer('busqueda').filter(coincide).annotate(
+        relevancia=Cast(relevancia, FloatField()),
+    )
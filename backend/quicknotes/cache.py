@@ -0,0 +1,154 @@
+"""
+Caché del catálogo de productos.
+
+El listado y el detalle de productos se piden en cada carga de la tienda,
+pero los productos cambian pocas veces al día. Las respuestas ya renderizadas
+se guardan en la caché de Django (settings.CACHES: en memoria del proceso por
+defecto, Redis si se define REDIS_URL) bajo una clave que incluye la versión
+del catálogo:
+
+- Cualquier cambio que afecte a lo que se muestra de un producto (altas,
+  ediciones y bajas, liquidación del stock) incrementa la versión con
+  invalidar_catalogo(), así que las entradas anteriores dejan de usarse. Las
+  ventas no: descuentan de los cupos y productos.stock no baja hasta que se
+  liquidan (ver quicknotes.reservas).
+- Cada respuesta lleva un ETag fuerte derivado de la misma clave (los bytes
+  servidos para una clave son siempre los mismos). Un cliente que repite la
+  petición con If-None-Match recibe 304 sin que se consulte el catálogo.
+
+La versión se incrementa en el momento y otra vez tras el commit: una lectura
+que se cuele entre ambos y guarde datos anteriores queda con una versión que
+ya no se usa. Por lo mismo, lo que se guarda se lee de la primaria y no de
+una réplica que pueda ir atrasada (ver quicknotes.replicas).
+
+Con LocMemCache cada proceso tiene su propia versión: sirve para un solo
+proceso (desarrollo, tests). Con varios workers, o si el liquidador corre en
+otro proceso, hay que configurar una caché compartida (REDIS_URL).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .replicas import leer_de_la_primaria
+
+CLAVE_VERSION = 'catalogo:version'
+
+
+def version_catalogo():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        # Si la caché perdió la versión se empieza en un valor nuevo, que nunca
+        # coincide con el de las entradas que pudieran quedar
+        cache.add(CLAVE_VERSION, time.time_ns(), timeout=None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+async def aversion_catalogo():
+    """Como version_catalogo(), para las vistas asíncronas."""
+    version = await cache.aget(CLAVE_VERSION)
+    if version is None:
+        await cache.aadd(CLAVE_VERSION, time.time_ns(), timeout=None)
+        version = await cache.aget(CLAVE_VERSION)
+    return version
+
+
+def _clave_catalogo(version, ruta, tipo):
+    return hashlib.sha256('|'.join([str(version), ruta, tipo]).encode()).hexdigest()[:32]
+
+
+def _con_etag(response, etag):
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response['ETag'] = etag
+        # El cliente puede guardarla, pero debe revalidarla en cada uso
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _incrementar_version():
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.add(CLAVE_VERSION, time.time_ns(), timeout=None)
+
+
+def invalidar_catalogo():
+    """Descarta las respuestas cacheadas del catálogo (ahora y al confirmar la transacción)."""
+    _incrementar_version()
+    transaction.on_commit(_incrementar_version)
+
+
+class CatalogoCacheMixin:
+    """
+    Sirve 'list' y 'retrieve' desde la caché del catálogo, con ETag y 304.
+    La respuesta no puede depender del usuario, solo de la URL.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._desde_cache(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._desde_cache(request, super().retrieve, *args, **kwargs)
+
+    def _desde_cache(self, request, generar, *args, **kwargs):
+        # La API navegable (HTML) muestra el usuario: solo se cachea el JSON
+        if request.accepted_renderer.format != 'json':
+            return generar(request, *args, **kwargs)
+
+        # La versión se lee antes de consultar: si cambia mientras tanto, lo
+        # que se guarde queda con la versión vieja
+        clave = _clave_catalogo(version_catalogo(), request.get_full_path(), request.accepted_media_type)
+        etag = f'"{clave}"'
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            guardada = cache.get(f'catalogo:{clave}')
+            if guardada is not None:
+                contenido, content_type = guardada
+                response = HttpResponse(contenido, content_type=content_type)
+            else:
+                leer_de_la_primaria()
+                response = generar(request, *args, **kwargs)
+                self._clave_catalogo = clave
+        return _con_etag(response, etag)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        clave = getattr(self, '_clave_catalogo', None)
+        if clave and response.status_code == status.HTTP_200_OK:
+            response.render()
+            cache.set(f'catalogo:{clave}', (response.content, response['Content-Type']),
+                      settings.CATALOGO_CACHE_TTL)
+        return response
+
+
+async def adesde_cache(request, generar):
+    """
+    La caché del catálogo (con ETag y 304) para las vistas asíncronas:
+    'generar' es la corrutina que responde el JSON si no está guardado.
+    """
+    clave = _clave_catalogo(await aversion_catalogo(), request.get_full_path(), 'application/json')
+    etag = f'"{clave}"'
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return _con_etag(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+    guardada = await cache.aget(f'catalogo:{clave}')
+    if guardada is not None:
+        contenido, content_type = guardada
+        return _con_etag(HttpResponse(contenido, content_type=content_type), etag)
+
+    leer_de_la_primaria()
+    response = await generar(request)
+    if response.status_code == status.HTTP_200_OK:
+        await cache.aset(f'catalogo:{clave}', (response.content, response['Content-Type']),
+                         settings.CATALOGO_CACHE_TTL)
+    return _con_etag(response, etag)
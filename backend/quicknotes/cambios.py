@@ -0,0 +1,167 @@
+"""
+Sincronización incremental: qué cambió desde la última consulta.
+
+Los terminales de venta y el ERP sondean los listados cada minuto; sin una
+forma de pedir solo lo que cambió, vuelven a descargarlo todo. Los triggers
+de productos, pedidos, detalle_pedidos y devoluciones (migración 0015)
+apuntan en la tabla cambios cada registro dado de alta, modificado o
+borrado, con la transacción que lo hizo. 'productos/cambios',
+'pedidos/cambios', etc. (CambiosMixin) devuelven lo que cambió después de un
+cursor:
+
+1. Sin ?desde= solo devuelve el cursor actual. El cliente lo guarda, descarga
+   el listado completo y desde entonces sondea con ?desde=<cursor>.
+2. Cada respuesta trae los registros que cambiaron, como los devuelve el
+   detalle ('datos'), o {'id', 'baja': true} si ya no existen, y el cursor
+   'siguiente'. Si 'hay_mas', se pide otra vez enseguida.
+
+El cursor es opaco y avanza en el orden de las transacciones, no en el de
+los ids: un id se reserva al insertar pero la transacción puede confirmar
+después que otra con un id mayor. Solo se devuelven las transacciones
+anteriores a la más antigua que sigue abierta (pg_snapshot_xmin), así que lo
+que queda detrás del cursor ya no puede cambiar: una transacción larga
+retrasa el feed, pero no se pierde nada. Cada consulta es un rango del
+índice (tabla, transaccion, id).
+
+Un registro que cambia varias veces sale una sola vez por respuesta, con su
+estado actual. Los registros se purgan pasados CAMBIOS_RETENCION_DIAS días
+(manage.py purgar_cambios); un cursor más antiguo responde 410 y el cliente
+debe volver a descargar el listado. Los pedidos archivados
+(quicknotes.particiones) no generan bajas.
+"""
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .permissions import IsEmpleadoUser
+
+# Filas borradas por transacción al purgar
+PURGA_POR_LOTE = 10000
+
+# Margen de la purga sobre la retención: una transacción que dure menos que
+# esto no deja cambios detrás de un cursor que todavía vale
+MARGEN_PURGA = timedelta(days=1)
+
+
+class CambiosConsultaSerializer(serializers.Serializer):
+    """Parámetros de '<recurso>/cambios' (en la query string)."""
+    desde = serializers.CharField(required=False)
+    limite = serializers.IntegerField(min_value=1, max_value=1000, default=500)
+
+
+def _codificar(transaccion, id, fecha):
+    texto = f'{transaccion}.{id}.{int(fecha.timestamp())}'
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def _decodificar(cursor):
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        transaccion, id, segundos = (int(parte) for parte in texto.split('.'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError({'desde': ['Cursor no válido.']})
+    return transaccion, id, datetime.fromtimestamp(segundos, tz=dt_timezone.utc)
+
+
+def cambios_desde(tabla, transaccion, id, limite):
+    """
+    Los cambios de 'tabla' posteriores a (transaccion, id), en orden, de
+    transacciones ya terminadas: ([(transaccion, id, registro_id, fecha)],
+    horizonte), donde horizonte es la transacción abierta más antigua.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH horizonte AS (
+                SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS transaccion
+            )
+            SELECT h.transaccion, c.transaccion, c.id, c.registro_id, c.fecha
+            FROM horizonte h
+            LEFT JOIN LATERAL (
+                SELECT transaccion, id, registro_id, fecha FROM cambios
+                WHERE tabla = %s AND (transaccion, id) > (%s, %s) AND transaccion < h.transaccion
+                ORDER BY transaccion, id
+                LIMIT %s
+            ) c ON true
+            """,
+            [tabla, transaccion, id, limite]
+        )
+        filas = cursor.fetchall()
+    return [fila[1:] for fila in filas if fila[2] is not None], filas[0][0]
+
+
+def purgar_cambios(dias=None):
+    """Borra los cambios de más de 'dias' días (CAMBIOS_RETENCION_DIAS). Devuelve cuántos."""
+    dias = settings.CAMBIOS_RETENCION_DIAS if dias is None else dias
+    corte = timezone.now() - timedelta(days=dias) - MARGEN_PURGA
+    total = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                "DELETE FROM cambios WHERE id IN (SELECT id FROM cambios WHERE fecha < %s LIMIT %s)",
+                [corte, PURGA_POR_LOTE]
+            )
+            total += cursor.rowcount
+            if cursor.rowcount < PURGA_POR_LOTE:
+                return total
+
+
+class CambiosMixin:
+    """
+    Añade '<recurso>/cambios' a un ViewSet: los registros de su tabla que
+    cambiaron desde un cursor, serializados con el serializer del ViewSet y
+    solo si get_queryset() los devuelve. Por defecto, solo para empleados y
+    administradores.
+    """
+
+    @action(detail=False, methods=['get'], permission_classes=[IsEmpleadoUser])
+    def cambios(self, request):
+        consulta = CambiosConsultaSerializer(data=request.query_params)
+        consulta.is_valid(raise_exception=True)
+        ahora = timezone.now()
+        if 'desde' not in consulta.validated_data:
+            _, horizonte = cambios_desde(self._tabla_cambios(), 0, 0, 0)
+            return Response({'cambios': [], 'siguiente': _codificar(horizonte, 0, ahora), 'hay_mas': False})
+
+        transaccion, id, fecha = _decodificar(consulta.validated_data['desde'])
+        if fecha < ahora - timedelta(days=settings.CAMBIOS_RETENCION_DIAS):
+            return Response({'error': 'El cursor caducó: vuelve a descargar el listado.'},
+                            status=status.HTTP_410_GONE)
+
+        limite = consulta.validated_data['limite']
+        filas, horizonte = cambios_desde(self._tabla_cambios(), transaccion, id, limite)
+        hay_mas = len(filas) == limite
+        if filas:
+            transaccion, id, _, fecha = filas[-1]
+        if not hay_mas and horizonte > transaccion:
+            # Todo lo anterior al horizonte ya se devolvió
+            transaccion, id, fecha = horizonte, 0, ahora
+        return Response({
+            'cambios': self._registros_cambiados([fila[2] for fila in filas]),
+            'siguiente': _codificar(transaccion, id, fecha),
+            'hay_mas': hay_mas,
+        })
+
+    def _tabla_cambios(self):
+        return self.get_queryset().model._meta.db_table
+
+    def _registros_cambiados(self, ids):
+        # Cada registro una vez, en el orden de su último cambio
+        ids = list(reversed(dict.fromkeys(reversed(ids))))
+        visibles = {objeto.pk: objeto for objeto in self.get_queryset().filter(pk__in=ids)}
+        # Los que no se ven pero existen (p. ej. pedidos de otro cliente) no se informan
+        modelo = self.get_queryset().model
+        existentes = set(modelo._base_manager.filter(pk__in=set(ids) - set(visibles)).values_list('pk', flat=True))
+        datos = iter(self.get_serializer([visibles[i] for i in ids if i in visibles], many=True).data)
+        return [
+            {'id': i, 'baja': False, 'datos': next(datos)} if i in visibles else {'id': i, 'baja': True}
+            for i in ids if i in visibles or i not in existentes
+        ]
@@ -0,0 +1,192 @@
+"""
+Selección de campos en los listados y detalles (?fields= y ?expand=).
+
+Los listados devuelven por defecto una representación compacta
+(Meta.campos_lista del serializer): por ejemplo, los pedidos sin sus líneas.
+El detalle devuelve todos los campos.
+
+- ?fields=id,total deja solo esos campos (separados por comas);
+- ?expand=detalle_pedidos añade campos a los de por defecto (o a los de
+  ?fields=), normalmente las relaciones anidadas.
+
+Un nombre que el serializer no tiene responde 400. Además de recortar el
+JSON, la consulta solo lee las columnas de esos campos (only()), solo hace
+los JOIN (select_related) de las relaciones que se devuelven y solo
+precarga (prefetch_related) las líneas anidadas si se piden.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .pagination import ordenamiento_de
+
+# Acciones GET cuyos serializers aceptan ?fields= y ?expand=
+ACCIONES = ('list', 'retrieve', 'buscar')
+
+
+class CamposSerializerMixin:
+    """
+    Serializer que acepta campos=[...] para devolver solo esos campos.
+    Meta.campos_lista, si existe, son los campos de los listados.
+    """
+
+    def __init__(self, *args, campos=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if campos is not None:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
+
+
+@lru_cache(maxsize=None)
+def _nombres(serializer_class):
+    return tuple(serializer_class().fields)
+
+
+def _lista_de(parametros, nombre):
+    valor = parametros.get(nombre)
+    if valor is None:
+        return None
+    return [campo.strip() for campo in valor.split(',') if campo.strip()]
+
+
+def elegir_campos(serializer_class, parametros, lista=True):
+    """
+    Campos a devolver según ?fields= y ?expand= (en 'parametros', los
+    query_params de la petición), o None si son todos.
+    """
+    todos = _nombres(serializer_class)
+    pedidos = _lista_de(parametros, 'fields')
+    expandir = _lista_de(parametros, 'expand') or []
+
+    desconocidos = [campo for campo in (pedidos or []) + expandir if campo not in todos]
+    if desconocidos:
+        raise ValidationError({
+            'fields': [f"Campo desconocido: '{campo}'. Disponibles: {', '.join(todos)}." for campo in desconocidos]
+        })
+
+    if pedidos is None:
+        pedidos = getattr(serializer_class.Meta, 'campos_lista', todos) if lista else todos
+    elegidos = set(pedidos) | set(expandir)
+    if elegidos >= set(todos):
+        return None
+    # En el orden del serializer
+    return [campo for campo in todos if campo in elegidos]
+
+
+def _columnas(serializer, prefijo=''):
+    """
+    Columnas (para only()), relaciones a unir (select_related) y a precargar
+    (prefetch_related) que necesitan los campos del serializer. None si algún
+    campo no sale de una columna (p. ej. un SerializerMethodField).
+    """
+    modelo = serializer.Meta.model
+    columnas, unir, precargar = {prefijo + 'id'}, set(), set()
+    for campo in serializer.fields.values():
+        if campo.write_only:
+            continue
+        if isinstance(campo, serializers.ListSerializer):
+            if prefijo or campo.source == '*' or '.' in campo.source:
+                return None
+            precargar.add(campo.source)
+            continue
+        if campo.source == '*':
+            return None
+        partes = campo.source.split('.')
+        if isinstance(campo, serializers.ModelSerializer):
+            # Relación anidada de un solo objeto: en el mismo JOIN
+            if len(partes) > 1:
+                return None
+            anidadas = _columnas(campo, f'{prefijo}{partes[0]}__')
+            if anidadas is None or anidadas[2]:
+                return None
+            columnas |= anidadas[0] | {prefijo + partes[0]}
+            unir |= {prefijo + partes[0]} | anidadas[1]
+            continue
+        if len(partes) > 2:
+            return None
+        try:
+            relacion = modelo._meta.get_field(partes[0])
+        except FieldDoesNotExist:
+            # 'pedido_id' es la columna de la relación 'pedido'
+            relacion = next((f for f in modelo._meta.concrete_fields if f.attname == partes[0]), None)
+            if relacion is None or len(partes) > 1:
+                return None
+        if not relacion.concrete:
+            return None
+        columnas.add(prefijo + relacion.name)
+        if len(partes) == 2:
+            # 'cliente.nombre': la columna de la relación y la del otro modelo
+            if not relacion.is_relation:
+                return None
+            columnas.add(f'{prefijo}{relacion.name}__{partes[1]}')
+            unir.add(prefijo + relacion.name)
+    return columnas, unir, precargar
+
+
+def recortar_consulta(queryset, serializer_class, campos, ordenamiento=()):
+    """
+    Limita el queryset a lo que necesitan 'campos' del serializer: only() con
+    sus columnas y las del ordenamiento (la paginación por cursor las lee),
+    y solo los select_related y prefetch_related que usan. Se mantienen los
+    Prefetch del queryset original (con su propio only()).
+    """
+    if campos is None:
+        return queryset
+    necesarias = _columnas(serializer_class(campos=campos), '')
+    if necesarias is None:
+        return queryset
+    columnas, unir, precargar = necesarias
+    columnas |= {campo.lstrip('-') for campo in ordenamiento
+                 if _es_columna(queryset.model, campo.lstrip('-'))}
+
+    previas = {
+        (lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup).split('__')[0]: lookup
+        for lookup in queryset._prefetch_related_lookups
+    }
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if unir:
+        queryset = queryset.select_related(*sorted(unir))
+    if precargar:
+        queryset = queryset.prefetch_related(*(previas.get(nombre, nombre) for nombre in sorted(precargar)))
+    return queryset.only(*sorted(columnas))
+
+
+def _es_columna(modelo, nombre):
+    try:
+        return modelo._meta.get_field(nombre).concrete
+    except FieldDoesNotExist:
+        return False
+
+
+class CamposMixin:
+    """
+    ?fields= y ?expand= en las acciones de lectura de un ViewSet. Recorta el
+    serializer y las columnas de la consulta; el ordenamiento de la
+    paginación se lee siempre. Se aplica en filter_queryset(), que list y
+    retrieve llaman con el resultado de get_queryset() (que los ViewSets
+    redefinen).
+    """
+
+    def campos(self):
+        """Los campos elegidos para esta petición, o None si son todos."""
+        if not hasattr(self, '_campos'):
+            campos = None
+            if self.request is not None and self.request.method in ('GET', 'HEAD') and self.action in ACCIONES:
+                campos = elegir_campos(self.get_serializer_class(), self.request.query_params,
+                                       lista=self.action != 'retrieve')
+            self._campos = campos
+        return self._campos
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), CamposSerializerMixin):
+            kwargs.setdefault('campos', self.campos())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request is None or self.action not in ACCIONES:
+            return queryset
+        return recortar_consulta(queryset, self.get_serializer_class(), self.campos(), ordenamiento_de(self))
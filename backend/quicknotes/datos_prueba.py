@@ -0,0 +1,277 @@
+"""
+Datos de prueba para medir la API (manage.py generar_datos).
+
+Genera usuarios, clientes, productos y un historial de pedidos con sus
+líneas y devoluciones del tamaño que se pida (millones de pedidos), con
+sentencias INSERT ... SELECT por lotes y sin pasar por el ORM. Los datos no
+son uniformes, como en una tienda real:
+
+- Unos pocos clientes hacen muchos pedidos y unos pocos productos se llevan
+  la mayoría de las ventas (sesgo: con 2, el 10 % más popular recibe cerca
+  del 30 %; con 3, cerca del 45 %).
+- Los pedidos se reparten en los últimos 'dias' días, más los recientes.
+- Cada pedido tiene de 1 a 2 x lineas_por_pedido - 1 líneas y una parte de
+  las líneas se devuelve (aprobada, solicitada o rechazada).
+
+El historial se inserta con los triggers de ventas, de stock, de tareas y
+del registro de cambios desactivados (en la transacción de cada lote): las
+ventas antiguas no reservan stock, las devoluciones antiguas no encolan
+tareas ni se apuntan para la sincronización incremental y los acumulados de
+ventas se reconstruyen una vez al final en lugar de en cada lote. Todos
+los usuarios tienen la contraseña CONTRASENA; sus usernames empiezan por
+PREFIJO (clientes y empleados), que es como los encuentra manage.py
+bench_api.
+"""
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import invalidar_catalogo
+from .particiones import crear_particiones
+from .ventas import reconstruir_ventas
+
+CONTRASENA = 'datos-prueba-123'
+PREFIJO = 'datos'
+
+NOMBRES = ['Laptop', 'Mouse', 'Teclado', 'Monitor', 'Auriculares', 'Silla', 'Cámara', 'Impresora', 'Router', 'Tablet']
+MODELOS = ['Gamer', 'Pro', 'Ultra', 'Básico', 'Inalámbrico', 'Compacto', 'Ergonómico', 'Portátil']
+NOMBRES_CLIENTE = ['Ana', 'Luis', 'María', 'Carlos', 'Lucía', 'Jorge', 'Sofía', 'Pedro', 'Elena', 'Diego']
+APELLIDOS = ['García', 'Díaz', 'Pérez', 'López', 'Torres', 'Ramos', 'Vega', 'Castro', 'Rojas', 'Paz']
+MOTIVOS = ['Llegó dañado', 'No era lo que esperaba', 'Talla o modelo equivocado', 'Se recibió tarde']
+
+# Triggers que no se disparan al insertar el historial (por tabla)
+TRIGGERS_HISTORIAL = {
+    'pedidos': ['ventas_pedidos_alta', 'registrar_cambios_alta'],
+    'detalle_pedidos': ['actualizar_stock', 'ventas_lineas_alta', 'registrar_cambios_alta'],
+    'devoluciones': ['valorar_devolucion', 'ventas_devoluciones_alta', 'encolar_devoluciones_alta',
+                     'registrar_cambios_alta'],
+}
+
+
+def _ultimo_id(cursor, tabla):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}")
+    return cursor.fetchone()[0]
+
+
+def _triggers_historial(cursor, accion):
+    for tabla, triggers in TRIGGERS_HISTORIAL.items():
+        for trigger in triggers:
+            cursor.execute(f"ALTER TABLE {tabla} {accion} TRIGGER {trigger}")
+
+
+def _insertar_usuarios(cursor, clientes, empleados):
+    base = _ultimo_id(cursor, 'usuarios')
+    # La misma contraseña (y el mismo hash) para todos: cifrar millones de
+    # contraseñas distintas llevaría horas
+    parametros = {'hash': make_password(CONTRASENA), 'base': base, 'prefijo': PREFIJO,
+                  'clientes': clientes, 'empleados': empleados,
+                  'nombres': NOMBRES_CLIENTE, 'apellidos': APELLIDOS}
+    cursor.execute(
+        """
+        INSERT INTO usuarios (password, is_superuser, username, first_name, last_name,
+                              email, is_staff, is_active, date_joined, rol)
+        SELECT %(hash)s, false,
+               %(prefijo)s || '_' || rol || '_' || (%(base)s + g), '', '',
+               %(prefijo)s || '.' || (%(base)s + g) || '@example.com', false, true, CURRENT_TIMESTAMP, rol
+        FROM generate_series(1, %(clientes)s + %(empleados)s) AS g,
+             LATERAL (SELECT CASE WHEN g <= %(clientes)s THEN 'cliente' ELSE 'empleado' END AS rol) r
+        """,
+        parametros
+    )
+    cursor.execute(
+        """
+        INSERT INTO clientes (usuario_id, nombre, apellido, direccion, telefono, email)
+        SELECT u.id,
+               (%(nombres)s::text[])[1 + u.id %% cardinality(%(nombres)s::text[])],
+               (%(apellidos)s::text[])[1 + (u.id / 7) %% cardinality(%(apellidos)s::text[])],
+               'Calle ' || (1 + u.id %% 200) || ' nº ' || (1 + u.id %% 97),
+               '+51 9' || lpad((u.id %% 100000000)::text, 8, '0'),
+               u.email
+        FROM usuarios u
+        WHERE u.id > %(base)s AND u.rol = 'cliente'
+        """,
+        parametros
+    )
+
+
+def _insertar_productos(cursor, productos):
+    base = _ultimo_id(cursor, 'productos')
+    cursor.execute(
+        """
+        INSERT INTO productos (sku, nombre, descripcion, precio, stock, fecha_creacion, activo)
+        SELECT %(prefijo)s || '-' || (%(base)s + g),
+               (%(nombres)s::text[])[1 + g %% cardinality(%(nombres)s::text[])]
+                   || ' ' || (%(modelos)s::text[])[1 + floor(random() * cardinality(%(modelos)s::text[]))::int]
+                   || ' ' || (%(base)s + g),
+               'Modelo ' || left(md5(g::text), 8),
+               -- Muchos productos baratos y pocos caros
+               round((5 + power(random(), 3) * 2000)::numeric, 2),
+               -- Stock de sobra para los pedidos de bench_api
+               1000 + floor(random() * 10000)::int,
+               CURRENT_TIMESTAMP - random() * interval '2 years',
+               random() > 0.05
+        FROM generate_series(1, %(productos)s) AS g
+        """,
+        {'prefijo': PREFIJO, 'base': base, 'productos': productos, 'nombres': NOMBRES, 'modelos': MODELOS}
+    )
+
+
+def _preparar_muestras(cursor):
+    """
+    Numera al azar los clientes y los productos activos (de 1 a n): el
+    historial elige por número, con sesgo hacia los primeros.
+    """
+    cursor.execute("DROP TABLE IF EXISTS muestra_clientes, muestra_productos")
+    cursor.execute(
+        """
+        CREATE TEMP TABLE muestra_clientes AS
+        SELECT row_number() OVER (ORDER BY random()) AS n, id FROM clientes
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TEMP TABLE muestra_productos AS
+        SELECT row_number() OVER (ORDER BY random()) AS n, id, precio FROM productos WHERE activo
+        """
+    )
+    for tabla in ('muestra_clientes', 'muestra_productos'):
+        cursor.execute(f"CREATE UNIQUE INDEX ON {tabla} (n)")
+        cursor.execute(f"ANALYZE {tabla}")
+    cursor.execute("SELECT (SELECT COUNT(*) FROM muestra_clientes), (SELECT COUNT(*) FROM muestra_productos)")
+    return cursor.fetchone()
+
+
+def _insertar_pedidos(cursor, pedidos, parametros):
+    """Un lote de pedidos con sus líneas y devoluciones, en la transacción en curso."""
+    parametros = {**parametros, 'pedidos': pedidos}
+    # El azar de cada fila se guarda en una columna: usado en varias
+    # expresiones da siempre el mismo valor
+    cursor.execute(
+        """
+        CREATE TEMP TABLE lote_pedidos AS
+        SELECT nextval(pg_get_serial_sequence('pedidos', 'id')) AS id,
+               1 + floor(power(random(), %(sesgo)s) * %(n_clientes)s)::bigint AS n_cliente,
+               CURRENT_TIMESTAMP - %(dias)s * power(random(), 1.5) * interval '1 day' AS fecha_pedido,
+               1 + floor(random() * (2 * %(lineas)s - 1))::int AS lineas,
+               random() AS azar
+        FROM generate_series(1, %(pedidos)s)
+        """,
+        parametros
+    )
+    cursor.execute(
+        """
+        CREATE TEMP TABLE lote_lineas AS
+        SELECT p.id AS pedido_id, p.fecha_pedido, pr.id AS producto_id, pr.precio, l.cantidad, random() AS azar
+        FROM lote_pedidos p
+        CROSS JOIN LATERAL (
+            SELECT 1 + floor(power(random(), %(sesgo)s) * %(n_productos)s)::bigint AS n_producto,
+                   1 + floor(power(random(), 3) * 5)::int AS cantidad
+            FROM generate_series(1, p.lineas)
+        ) l
+        JOIN muestra_productos pr ON pr.n = l.n_producto
+        """,
+        parametros
+    )
+    cursor.execute(
+        """
+        INSERT INTO pedidos (id, cliente_id, fecha_pedido, estado, total)
+        SELECT p.id, c.id, p.fecha_pedido,
+               CASE
+                   WHEN p.fecha_pedido > CURRENT_TIMESTAMP - interval '2 days' AND p.azar < 0.6 THEN 'pendiente'
+                   WHEN p.fecha_pedido > CURRENT_TIMESTAMP - interval '7 days' AND p.azar < 0.6 THEN 'enviado'
+                   WHEN p.azar < 0.95 THEN 'entregado'
+                   ELSE 'cancelado'
+               END,
+               COALESCE(t.total, 0)
+        FROM lote_pedidos p
+        JOIN muestra_clientes c ON c.n = p.n_cliente
+        LEFT JOIN (
+            SELECT pedido_id, SUM(cantidad * precio) AS total FROM lote_lineas GROUP BY pedido_id
+        ) t ON t.pedido_id = p.id
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO detalle_pedidos (pedido_id, fecha_pedido, producto_id, cantidad, precio_unitario, subtotal)
+        SELECT pedido_id, fecha_pedido, producto_id, cantidad, precio, cantidad * precio FROM lote_lineas
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO devoluciones (pedido_id, fecha_pedido, producto_id, cantidad, fecha_devolucion, motivo, estado,
+                                  importe)
+        SELECT pedido_id, fecha_pedido, producto_id, cantidad,
+               LEAST(CURRENT_TIMESTAMP, fecha_pedido + azar / %(devoluciones)s * interval '30 days'),
+               (%(motivos)s::text[])[1 + floor(azar / %(devoluciones)s * cardinality(%(motivos)s::text[]))::int],
+               CASE
+                   WHEN azar / %(devoluciones)s < 0.6 THEN 'aprobada'
+                   WHEN azar / %(devoluciones)s < 0.85 THEN 'solicitada'
+                   ELSE 'rechazada'
+               END,
+               cantidad * precio
+        FROM lote_lineas
+        WHERE azar < %(devoluciones)s
+        """,
+        parametros
+    )
+    cursor.execute("DROP TABLE lote_lineas, lote_pedidos")
+
+
+def generar_datos(clientes=10_000, empleados=10, productos=10_000, pedidos=1_000_000, lineas_por_pedido=3,
+                  devoluciones=0.02, dias=365, sesgo=2.0, lote=50_000, semilla=None, progreso=None):
+    """
+    Añade los datos a los que ya hay y devuelve cuántos registros se
+    insertaron de cada tipo. 'devoluciones' es la fracción de líneas
+    devueltas; con 'semilla' (de -1 a 1) los datos son los mismos en cada
+    ejecución sobre la misma base de datos.
+    """
+    progreso = progreso or (lambda mensaje: None)
+    inicio = time.monotonic()
+    with connection.cursor() as cursor:
+        antes = {tabla: _ultimo_id(cursor, tabla)
+                 for tabla in ('usuarios', 'clientes', 'productos', 'pedidos', 'detalle_pedidos', 'devoluciones')}
+        if semilla is not None:
+            cursor.execute("SELECT setseed(%s)", [semilla])
+        # Los pedidos de hoy necesitan la partición de este mes
+        crear_particiones()
+
+        with transaction.atomic():
+            _insertar_usuarios(cursor, clientes, empleados)
+            _insertar_productos(cursor, productos)
+        progreso(f'{clientes} clientes, {empleados} empleados y {productos} productos')
+        if productos:
+            invalidar_catalogo()
+
+        n_clientes, n_productos = _preparar_muestras(cursor)
+        if pedidos and not (n_clientes and n_productos):
+            raise ValueError('Hacen falta clientes y productos activos para generar pedidos.')
+        parametros = {'sesgo': sesgo, 'n_clientes': n_clientes, 'n_productos': n_productos,
+                      'dias': dias, 'lineas': lineas_por_pedido, 'devoluciones': devoluciones or 1e-9,
+                      'motivos': MOTIVOS}
+        for desde in range(0, pedidos, lote):
+            with transaction.atomic():
+                # Las claves foráneas se comprueban al terminar cada INSERT y no
+                # al confirmar: no se pueden reactivar los triggers con
+                # comprobaciones pendientes
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                _triggers_historial(cursor, 'DISABLE')
+                _insertar_pedidos(cursor, min(lote, pedidos - desde), parametros)
+                _triggers_historial(cursor, 'ENABLE')
+            progreso(f'{min(desde + lote, pedidos)} pedidos')
+
+        cursor.execute("DROP TABLE IF EXISTS muestra_clientes, muestra_productos")
+        if pedidos:
+            reconstruir_ventas(desde=(timezone.now() - timedelta(days=dias + 1)).date())
+            progreso('Acumulados de ventas reconstruidos')
+        for tabla in antes:
+            cursor.execute(f"ANALYZE {tabla}")
+
+        insertados = {}
+        for tabla, ultimo in antes.items():
+            cursor.execute(f"SELECT COUNT(*) FROM {tabla} WHERE id > %s", [ultimo])
+            insertados[tabla] = cursor.fetchone()[0]
+    progreso(f'Generación: {time.monotonic() - inicio:.1f} s')
+    return insertados
@@ -0,0 +1,34 @@
+"""
+Efectos de aprobar una devolución.
+
+Al pasar a 'aprobada' (por la API, el admin o SQL), un trigger encola una
+tarea devolucion_aprobada en la misma transacción (migración 0012); la
+respuesta no espera a nada más. El worker (manage.py procesar_tareas) las
+procesa por lotes con procesar_devoluciones(), en PostgreSQL:
+
+- repone el stock con una sola actualización por producto, lo que vuelve a
+  repartir sus cupos (ver quicknotes.reservas);
+- descuenta el importe devuelto del total de cada pedido;
+- marca la devolución con fecha_reposicion, así que repetir la tarea no hace
+  nada.
+
+Los acumulados de ventas no esperan a la tarea: sus triggers ya cuentan la
+devolución aprobada al momento (ver quicknotes.ventas).
+"""
+from django.db import connection
+
+from .cache import invalidar_catalogo
+from .tareas import manejador
+
+
+@manejador('devolucion_aprobada', lote=500)
+def procesar_devoluciones(lote):
+    """Procesa las devoluciones aprobadas del lote. Devuelve cuántas procesó."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT procesar_devoluciones(%s)",
+                       [[datos['devolucion_id'] for datos in lote]])
+        procesadas = cursor.fetchone()[0]
+    if procesadas:
+        # productos.stock cambió: el catálogo cacheado ya no vale
+        invalidar_catalogo()
+    return procesadas
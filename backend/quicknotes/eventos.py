@@ -0,0 +1,197 @@
+"""
+Avisos en tiempo real del stock de los productos y del estado de los pedidos.
+
+Las páginas de productos y pedidos volvían a pedir los listados enteros para
+mostrar el stock y el estado al día. Ahora los triggers de productos y
+pedidos (migración 0016) publican con NOTIFY en el canal CANAL cada cambio
+de productos.stock y de pedidos.estado, al confirmarse la transacción, y
+'api/async/eventos/' (quicknotes.asincronas) los reenvía a los navegadores
+con Server-Sent Events.
+
+- Una sola conexión por proceso (por bucle de eventos) escucha el canal
+  (Difusor): la abre el primer navegador que se conecta y se cierra cuando
+  se va el último. El bucle la lee cuando hay algo (add_reader), sin hilos.
+- Cada navegador tiene una Suscripcion con su filtro: el stock lo ven todos;
+  los pedidos, los empleados y administradores todos y un cliente solo los
+  suyos.
+- Un navegador lento no retiene a los demás ni hace crecer la memoria: de
+  un mismo producto o pedido solo se guarda el último aviso sin enviar, y si
+  acumula más de MAX_PENDIENTES distintos se le envía 'desbordado' y se
+  cierra su flujo (el navegador vuelve a pedir los listados y se reconecta).
+
+Solo funciona con el worker ASGI (core.asgi).
+"""
+import asyncio
+import json
+import logging
+import weakref
+
+from django.db import connections
+
+logger = logging.getLogger('quicknotes.eventos')
+
+CANAL = 'quicknotes_eventos'
+
+# Avisos distintos (productos o pedidos) sin enviar por navegador
+MAX_PENDIENTES = 1000
+
+# Segundos sin avisos tras los que se envía un comentario, para que los
+# proxies no cierren la conexión y se note si el navegador se fue
+LATIDO = 15
+
+# Milisegundos que espera el navegador antes de reconectarse
+REINTENTO_MS = 3000
+
+
+def filtro_de(usuario):
+    """Qué avisos puede recibir 'usuario' (un UsuarioToken)."""
+    if usuario.rol in ['administrador', 'empleado']:
+        return lambda evento: True
+    return lambda evento: evento['tipo'] == 'stock' or (
+        usuario.cliente_id is not None and evento.get('cliente_id') == usuario.cliente_id
+    )
+
+
+class Suscripcion:
+    """Los avisos pendientes de enviar a un navegador."""
+
+    def __init__(self, filtro, max_pendientes=MAX_PENDIENTES):
+        self.filtro = filtro
+        self.max_pendientes = max_pendientes
+        # (tipo, id) -> último aviso, en el orden en que llegaron
+        self.pendientes = {}
+        self.desbordada = False
+        self.cerrada = False
+        self._hay_avisos = asyncio.Event()
+
+    def publicar(self, evento):
+        if self.desbordada or not self.filtro(evento):
+            return
+        clave = (evento['tipo'], evento['id'])
+        # Del mismo producto o pedido solo importa el último
+        self.pendientes.pop(clave, None)
+        if len(self.pendientes) >= self.max_pendientes:
+            self.desbordada = True
+            self.pendientes.clear()
+        else:
+            self.pendientes[clave] = evento
+        self._hay_avisos.set()
+
+    def cerrar(self):
+        self.cerrada = True
+        self._hay_avisos.set()
+
+    async def siguientes(self, espera):
+        """Los avisos pendientes, esperando hasta 'espera' segundos a que haya alguno."""
+        try:
+            await asyncio.wait_for(self._hay_avisos.wait(), espera)
+        except asyncio.TimeoutError:
+            return []
+        self._hay_avisos.clear()
+        eventos = list(self.pendientes.values())
+        self.pendientes.clear()
+        return eventos
+
+
+def _conectar():
+    # Una conexión propia, fuera de las de Django: queda abierta y en LISTEN
+    base = connections['default']
+    conexion = base.get_new_connection(base.get_connection_params())
+    conexion.autocommit = True
+    with conexion.cursor() as cursor:
+        cursor.execute(f'LISTEN {CANAL}')
+    return conexion
+
+
+def _avisos(conexion):
+    if hasattr(conexion, 'poll'):
+        conexion.poll()
+        avisos = [aviso.payload for aviso in conexion.notifies]
+        del conexion.notifies[:]
+        return avisos
+    # psycopg 3 (con el pool de conexiones, ver core/settings.py)
+    return [aviso.payload for aviso in conexion.notifies(timeout=0)]
+
+
+class Difusor:
+    """La conexión que escucha CANAL y reparte los avisos entre las suscripciones."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.suscripciones = set()
+        self.conexion = None
+        self._abriendo = asyncio.Lock()
+
+    async def suscribir(self, filtro):
+        suscripcion = Suscripcion(filtro)
+        async with self._abriendo:
+            if self.conexion is None:
+                self.conexion = await asyncio.to_thread(_conectar)
+                self.loop.add_reader(self.conexion.fileno(), self._recibir)
+            self.suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        self.suscripciones.discard(suscripcion)
+        if not self.suscripciones:
+            self._cerrar_conexion()
+
+    def _recibir(self):
+        try:
+            avisos = _avisos(self.conexion)
+        except Exception:
+            # Sin conexión se cierran los flujos; los navegadores se reconectan
+            logger.exception('Se perdió la conexión que escucha %s', CANAL)
+            self._cerrar_conexion()
+            for suscripcion in self.suscripciones:
+                suscripcion.cerrar()
+            self.suscripciones.clear()
+            return
+        for aviso in avisos:
+            evento = json.loads(aviso)
+            for suscripcion in self.suscripciones:
+                suscripcion.publicar(evento)
+
+    def _cerrar_conexion(self):
+        if self.conexion is None:
+            return
+        self.loop.remove_reader(self.conexion.fileno())
+        try:
+            self.conexion.close()
+        except Exception:
+            pass
+        self.conexion = None
+
+
+_difusores = weakref.WeakKeyDictionary()
+
+
+def difusor():
+    """El Difusor del bucle de eventos en curso."""
+    loop = asyncio.get_running_loop()
+    if loop not in _difusores:
+        _difusores[loop] = Difusor(loop)
+    return _difusores[loop]
+
+
+async def flujo_de_eventos(usuario):
+    """
+    El cuerpo de la respuesta text/event-stream de 'usuario': los avisos que
+    puede ver, un latido cada LATIDO segundos sin avisos y 'desbordado' si
+    no da abasto.
+    """
+    difusion = difusor()
+    suscripcion = await difusion.suscribir(filtro_de(usuario))
+    try:
+        yield f'retry: {REINTENTO_MS}\n\n'
+        while not suscripcion.cerrada:
+            eventos = await suscripcion.siguientes(LATIDO)
+            if suscripcion.desbordada:
+                yield 'event: desbordado\ndata: {}\n\n'
+                break
+            if not eventos:
+                yield ': latido\n\n'
+                continue
+            yield ''.join(f"event: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n" for evento in eventos)
+    finally:
+        difusion.cancelar(suscripcion)
@@ -0,0 +1,139 @@
+"""
+Exportación de pedidos, líneas y devoluciones en CSV o NDJSON.
+
+El listado paginado no sirve para sacar un mes entero de pedidos, y armar la
+lista completa en memoria para serializarla tumba al worker. La acción
+'exportar' (ExportacionMixin) recorre la consulta con un cursor del servidor
+(QuerySet.iterator()) y escribe cada fila en la respuesta a medida que llega:
+
+- la memoria del worker no depende de cuántas filas haya (un lote de
+  CHUNK filas cada vez);
+- el cursor se abre dentro de una transacción, así que no es WITH HOLD y
+  PostgreSQL entrega las primeras filas sin terminar la consulta: los
+  primeros bytes salen enseguida;
+- con el worker ASGI, Django convierte los iteradores síncronos en una lista
+  (sync_to_async(list)) antes de enviar nada, así que allí la respuesta es un
+  iterador asíncrono que lee CHUNK filas por cada salto al hilo de la
+  petición (el de su conexión a la base de datos).
+
+Se exporta el mismo queryset que el listado (get_queryset(), con el filtro
+por rol), con los mismos filtros (?estado=, ?desde=, ?hasta=..., ver
+quicknotes.filtros).
+"""
+import csv
+import itertools
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.decorators import action
+
+from .serializers import ExportacionSerializer
+
+# Filas que se piden al cursor en cada viaje a la base de datos
+CHUNK = 2000
+
+TIPOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Linea:
+    """Buffer para csv.writer: devuelve la línea en lugar de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _celda(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def _filas(queryset):
+    # La base de datos (primaria o réplica, ver quicknotes.replicas) se elige
+    # ya: la respuesta se envía después de que termine la vista
+    return _recorrer(queryset.using(queryset.db))
+
+
+def _recorrer(queryset):
+    # Sin transacción, Django declara el cursor WITH HOLD y PostgreSQL
+    # materializa el resultado entero antes de devolver la primera fila
+    with transaction.atomic(using=queryset.db):
+        yield from queryset.iterator(chunk_size=CHUNK)
+
+
+def _csv(cabeceras, filas):
+    escritor = csv.writer(_Linea())
+    yield escritor.writerow(cabeceras)
+    for fila in filas:
+        yield escritor.writerow([_celda(valor) for valor in fila])
+
+
+def _ndjson(cabeceras, filas):
+    for fila in filas:
+        yield json.dumps(dict(zip(cabeceras, fila)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _bloque(contenido):
+    # Ninguna fila es una línea vacía: '' es que no quedan
+    return ''.join(itertools.islice(contenido, CHUNK))
+
+
+async def _asincrono(contenido):
+    # thread_sensitive: todas las lecturas en el hilo de la petición, el
+    # de la transacción y el cursor abiertos
+    siguiente = sync_to_async(_bloque, thread_sensitive=True)
+    try:
+        while bloque := await siguiente(contenido):
+            yield bloque
+    finally:
+        # Si el navegador se va, cierra el cursor y la transacción
+        await sync_to_async(contenido.close, thread_sensitive=True)()
+
+
+class ExportacionMixin:
+    """
+    Añade GET <recurso>/exportar/?formato=csv|ndjson y los filtros del listado.
+
+    - columnas_exportacion: lista de (cabecera, campo o lookup para values_list()).
+    """
+    columnas_exportacion = []
+
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """
+        Descarga todas las filas visibles para el usuario en CSV (por defecto)
+        o NDJSON ('formato'), con los filtros del listado ('desde', 'hasta',
+        'estado'...). La respuesta se envía mientras se lee, sin paginar.
+        """
+        consulta = ExportacionSerializer(data=request.query_params)
+        consulta.is_valid(raise_exception=True)
+        parametros = consulta.validated_data
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        cabeceras = [cabecera for cabecera, _ in self.columnas_exportacion]
+        # Sin el prefetch del listado: los JOIN que hagan falta salen de los
+        # lookups de las columnas
+        filas = _filas(queryset.prefetch_related(None).values_list(
+            *[campo for _, campo in self.columnas_exportacion]
+        ).order_by('id'))
+
+        formato = parametros['formato']
+        contenido = _csv(cabeceras, filas) if formato == 'csv' else _ndjson(cabeceras, filas)
+        if isinstance(request._request, ASGIRequest):
+            contenido = _asincrono(contenido)
+        response = StreamingHttpResponse(contenido, content_type=TIPOS[formato])
+        nombre = f'{self.basename}-{timezone.now():%Y%m%d-%H%M%S}.{formato}'
+        response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+        return response
@@ -0,0 +1,237 @@
+"""
+Filtros y ordenamiento de los listados de pedidos, líneas y devoluciones.
+
+Cada ViewSet declara sus filtros con una subclase de Filtros (más abajo):
+un atributo por parámetro de la query string, con el campo de serializer
+que lo valida y la condición que añade a la consulta. FiltrosBackend los
+aplica en filter_queryset(), así que sirven igual para el listado (también
+en la lectura rápida), el detalle y la exportación.
+
+- ?estado=pendiente,enviado: uno o varios valores separados por comas;
+- ?fecha_pedido=: el instante exacto, tal como lo devuelve el listado;
+- ?desde= y ?hasta=: días incluidos, comparando con el instante (no con
+  __date, que no puede usar los índices de la fecha);
+- ?total_min= y ?total_max=: rangos incluidos;
+- ?ordenar=total o ?ordenar=-total: solo los campos de 'ordenables', con el
+  id como desempate para la paginación por cursor. Sin él, el ordenamiento
+  de la paginación.
+
+Un valor que no se puede convertir, un rango al revés o un campo que no se
+puede ordenar responden 400. Cada filtro y cada ordenamiento tiene un índice
+(migración 0013) que lo resuelve sin recorrer la tabla.
+"""
+import copy
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def inicio_del_dia(dia):
+    # Se compara con el instante y no con __date, que no puede usar los índices de la fecha
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+class ListaField(serializers.Field):
+    """Valores separados por comas, cada uno validado con 'child'."""
+
+    def __init__(self, child, **kwargs):
+        self.child = child
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        valores = [valor.strip() for valor in str(data).split(',') if valor.strip()]
+        if not valores:
+            raise serializers.ValidationError('Indica al menos un valor.')
+        return [self.child.run_validation(valor) for valor in valores]
+
+
+class Filtro:
+    """
+    Un parámetro de la query string: 'campo' (de serializer) valida su valor
+    y condicion() devuelve el Q con que se filtra 'campo_modelo'.
+    """
+    lookup = 'exact'
+    # Límite inferior ('min') o superior ('max') de un rango, para rechazar los rangos al revés
+    extremo = None
+    comparacion = 'mayor que'
+
+    def __init__(self, campo_modelo, campo):
+        self.campo_modelo = campo_modelo
+        self.campo = campo
+
+    def valor(self, valor):
+        return valor
+
+    def condicion(self, valor):
+        return Q(**{f'{self.campo_modelo}__{self.lookup}': self.valor(valor)})
+
+
+class Igual(Filtro):
+    pass
+
+
+class EnLista(Filtro):
+    lookup = 'in'
+
+    def __init__(self, campo_modelo, child):
+        super().__init__(campo_modelo, ListaField(child))
+
+
+class Desde(Filtro):
+    """Desde el principio del día indicado."""
+    lookup = 'gte'
+    extremo = 'min'
+    comparacion = 'posterior a'
+
+    def __init__(self, campo_modelo):
+        super().__init__(campo_modelo, serializers.DateField())
+
+    def valor(self, valor):
+        return inicio_del_dia(valor)
+
+
+class Hasta(Filtro):
+    """Hasta el final del día indicado."""
+    lookup = 'lt'
+    extremo = 'max'
+
+    def __init__(self, campo_modelo):
+        super().__init__(campo_modelo, serializers.DateField())
+
+    def valor(self, valor):
+        return inicio_del_dia(valor + timedelta(days=1))
+
+
+class Minimo(Filtro):
+    lookup = 'gte'
+    extremo = 'min'
+
+
+class Maximo(Filtro):
+    lookup = 'lte'
+    extremo = 'max'
+
+
+class Filtros:
+    """
+    Filtros de un listado: los atributos de tipo Filtro, más 'ordenables'
+    (campos que admite ?ordenar=, que no pueden ser nulos).
+    """
+    ordenables = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.declarados = {
+            nombre: filtro for base in reversed(cls.__mro__) for nombre, filtro in vars(base).items()
+            if isinstance(filtro, Filtro)
+        }
+        cls.serializer_class = type(f'{cls.__name__}Serializer', (serializers.Serializer,), {
+            nombre: _opcional(filtro.campo) for nombre, filtro in cls.declarados.items()
+        })
+
+    @classmethod
+    def filtrar(cls, queryset, parametros):
+        """El queryset con los filtros de 'parametros' (los query_params de la petición)."""
+        presentes = {nombre: parametros[nombre] for nombre in cls.declarados if nombre in parametros}
+        if not presentes:
+            return queryset
+        consulta = cls.serializer_class(data=presentes)
+        consulta.is_valid(raise_exception=True)
+        valores = consulta.validated_data
+        cls._comprobar_rangos(valores)
+        for nombre, valor in valores.items():
+            queryset = queryset.filter(cls.declarados[nombre].condicion(valor))
+        return queryset
+
+    @classmethod
+    def _comprobar_rangos(cls, valores):
+        minimos = {cls.declarados[nombre].campo_modelo: nombre for nombre in valores
+                   if cls.declarados[nombre].extremo == 'min'}
+        for nombre in valores:
+            filtro = cls.declarados[nombre]
+            minimo = minimos.get(filtro.campo_modelo)
+            if filtro.extremo == 'max' and minimo is not None and valores[minimo] > valores[nombre]:
+                comparacion = cls.declarados[minimo].comparacion
+                raise ValidationError({minimo: [f"'{minimo}' no puede ser {comparacion} '{nombre}'."]})
+
+    @classmethod
+    def ordenamiento(cls, parametros):
+        """El ordenamiento pedido con ?ordenar=, con el id de desempate; None si no se pide."""
+        valor = parametros.get('ordenar')
+        if not valor:
+            return None
+        campo = valor.strip()
+        signo = '-' if campo.startswith('-') else ''
+        campo = campo.lstrip('-')
+        if campo not in cls.ordenables:
+            raise ValidationError({'ordenar': [
+                f"No se puede ordenar por '{campo}'. Disponibles: {', '.join(cls.ordenables)}."
+            ]})
+        if campo == 'id':
+            return (signo + 'id',)
+        return (signo + campo, signo + 'id')
+
+
+def _opcional(campo):
+    # Una copia del campo (como hace DRF con los campos declarados), sin 'required'
+    return type(campo)(*copy.deepcopy(campo._args), **{**copy.deepcopy(campo._kwargs), 'required': False})
+
+
+class FiltrosBackend(BaseFilterBackend):
+    """Aplica los Filtros del atributo 'filtros' del ViewSet y su ?ordenar=."""
+
+    def filter_queryset(self, request, queryset, view):
+        filtros = getattr(view, 'filtros', None)
+        if filtros is None:
+            return queryset
+        return filtros.filtrar(queryset, request.query_params)
+
+    def get_ordering(self, request, queryset, view):
+        # La paginación por cursor lo llama para ordenar (None: el suyo)
+        filtros = getattr(view, 'filtros', None)
+        if filtros is None or request is None:
+            return None
+        return filtros.ordenamiento(request.query_params)
+
+
+# --- Filtros de los ViewSets ---
+
+ESTADO = serializers.CharField(max_length=50)
+DINERO = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+ID = serializers.IntegerField(min_value=1)
+
+
+class PedidoFiltros(Filtros):
+    estado = EnLista('estado', ESTADO)
+    cliente = Igual('cliente_id', ID)
+    # La fecha exacta del pedido: el detalle solo busca en la partición de su mes
+    fecha_pedido = Igual('fecha_pedido', serializers.DateTimeField())
+    desde = Desde('fecha_pedido')
+    hasta = Hasta('fecha_pedido')
+    total_min = Minimo('total', DINERO)
+    total_max = Maximo('total', DINERO)
+    ordenables = ('fecha_pedido', 'total', 'id')
+
+
+class DetallePedidoFiltros(Filtros):
+    pedido = Igual('pedido_id', ID)
+    producto = Igual('producto_id', ID)
+    # La fecha y el estado son los del pedido
+    estado = EnLista('pedido__estado', ESTADO)
+    desde = Desde('pedido__fecha_pedido')
+    hasta = Hasta('pedido__fecha_pedido')
+    ordenables = ('id',)
+
+
+class DevolucionFiltros(Filtros):
+    estado = EnLista('estado', ESTADO)
+    pedido = Igual('pedido_id', ID)
+    producto = Igual('producto_id', ID)
+    desde = Desde('fecha_devolucion')
+    hasta = Hasta('fecha_devolucion')
+    ordenables = ('fecha_devolucion', 'id')
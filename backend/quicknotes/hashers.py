@@ -0,0 +1,22 @@
+"""
+Cifrado de contraseñas con coste configurable.
+
+El coste de PBKDF2 (settings.PASSWORD_PBKDF2_ITERACIONES) decide cuántos
+logins por segundo aguanta cada núcleo: ver manage.py bench_login antes de
+cambiarlo. Al cambiarlo no hay que migrar nada: check_password() detecta que
+el hash guardado usa otro número de iteraciones y lo vuelve a calcular con
+el nuevo la próxima vez que el usuario inicia sesión.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    El PBKDF2-SHA256 de Django con las iteraciones de la configuración. Usa
+    el mismo algoritmo ('pbkdf2_sha256'), así que valida los hashes existentes.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERACIONES
@@ -0,0 +1,256 @@
+"""
+Importación masiva de productos y clientes desde CSV.
+
+Dar de alta un catálogo de proveedor producto a producto por la API (una
+petición y una validación por fila) lleva horas. importar_productos() e
+importar_clientes() lo hacen en una transacción y con sentencias por
+conjuntos:
+
+1. El CSV entra tal cual con COPY en una tabla temporal de texto (con el
+   número de fila), así que ningún valor mal escrito hace fallar la carga.
+2. Una consulta apunta las filas que no cumplen las reglas de los
+   serializers (campos obligatorios, longitudes, precio y stock no
+   negativos...) y otra las que repiten la clave de una fila anterior del
+   archivo. Solo se escriben las rechazadas.
+3. Un UPDATE ... FROM actualiza y un INSERT inserta las filas válidas según
+   su clave natural: el sku en productos y el email en clientes. Las filas
+   que no cambian nada no se reescriben (ni recalculan la búsqueda ni los
+   cupos de stock).
+
+El resultado cuenta las filas insertadas, actualizadas, sin cambios y
+rechazadas, y detalla las primeras MAX_RECHAZOS_INFORMADOS rechazadas con su
+número de fila (la primera después de la cabecera es la 1) y el motivo.
+"""
+import csv
+import io
+
+from django.db import connection, transaction
+
+from .cache import invalidar_catalogo
+
+MAX_RECHAZOS_INFORMADOS = 1000
+
+# Bytes del archivo que se envían en cada escritura del COPY (psycopg 3)
+BLOQUE_COPY = 1 << 20
+
+
+class ErrorDeImportacion(ValueError):
+    """El archivo no se puede importar (cabecera incorrecta)."""
+
+
+# Qué se importa en cada tabla:
+# - obligatorias / opcionales: columnas del CSV;
+# - reglas: CASE con el motivo del rechazo de una fila (NULL si es válida);
+# - valores: expresión de cada columna de la tabla a partir del texto del CSV;
+# - actualizables: columnas que se actualizan si el registro ya existe (solo
+#   las que vienen en el archivo).
+PRODUCTOS = {
+    'tabla': 'productos',
+    'clave': 'sku',
+    'obligatorias': ['sku', 'nombre', 'precio'],
+    'opcionales': ['descripcion', 'stock', 'activo'],
+    'reglas': r"""
+        CASE
+            WHEN COALESCE(btrim(sku), '') = '' THEN 'Falta el sku.'
+            WHEN length(btrim(sku)) > 64 THEN 'El sku no puede tener más de 64 caracteres.'
+            WHEN COALESCE(btrim(nombre), '') = '' THEN 'Falta el nombre.'
+            WHEN length(btrim(nombre)) > 150 THEN 'El nombre no puede tener más de 150 caracteres.'
+            WHEN btrim(precio) ~ '^-\d+(\.\d+)?$' THEN 'El precio no puede ser negativo.'
+            WHEN COALESCE(btrim(precio), '') !~ '^\d{1,8}(\.\d{1,2})?$'
+                THEN 'El precio debe ser un número con hasta 8 enteros y 2 decimales.'
+            WHEN btrim(stock) ~ '^-\d+$' THEN 'El stock no puede ser un número negativo.'
+            WHEN COALESCE(btrim(stock), '') !~ '^\d{0,9}$' THEN 'El stock debe ser un número entero.'
+            WHEN lower(COALESCE(btrim(activo), '')) NOT IN ('', 'true', 'false', '1', '0', 'si', 'sí', 'no')
+                THEN 'activo debe ser true o false.'
+        END
+    """,
+    'valores': {
+        'sku': 'btrim(sku)',
+        'nombre': 'btrim(nombre)',
+        'descripcion': "NULLIF(descripcion, '')",
+        'precio': 'btrim(precio)::numeric',
+        'stock': "COALESCE(NULLIF(btrim(stock), '')::integer, 0)",
+        'activo': "lower(COALESCE(btrim(activo), '')) NOT IN ('false', '0', 'no')",
+        'fecha_creacion': 'CURRENT_TIMESTAMP',
+    },
+    'actualizables': ['nombre', 'descripcion', 'precio', 'stock', 'activo'],
+}
+
+CLIENTES = {
+    'tabla': 'clientes',
+    'clave': 'email',
+    'obligatorias': ['email', 'nombre', 'apellido'],
+    'opcionales': ['direccion', 'telefono'],
+    'reglas': r"""
+        CASE
+            WHEN COALESCE(btrim(email), '') = '' THEN 'Falta el email.'
+            WHEN length(btrim(email)) > 254 OR btrim(email) !~ '^[^@\s]+@[^@\s]+\.[^@\s]+$'
+                THEN 'El email no es válido.'
+            WHEN COALESCE(btrim(nombre), '') = '' THEN 'Falta el nombre.'
+            WHEN length(btrim(nombre)) > 100 THEN 'El nombre no puede tener más de 100 caracteres.'
+            WHEN COALESCE(btrim(apellido), '') = '' THEN 'Falta el apellido.'
+            WHEN length(btrim(apellido)) > 100 THEN 'El apellido no puede tener más de 100 caracteres.'
+            WHEN length(direccion) > 255 THEN 'La dirección no puede tener más de 255 caracteres.'
+            WHEN length(btrim(telefono)) > 20 THEN 'El teléfono no puede tener más de 20 caracteres.'
+        END
+    """,
+    'valores': {
+        'email': 'btrim(email)',
+        'nombre': 'btrim(nombre)',
+        'apellido': 'btrim(apellido)',
+        'direccion': "NULLIF(btrim(direccion), '')",
+        'telefono': "NULLIF(btrim(telefono), '')",
+    },
+    'actualizables': ['nombre', 'apellido', 'direccion', 'telefono'],
+}
+
+
+def importar_productos(archivo):
+    """
+    Inserta o actualiza (por sku) los productos de un CSV con cabecera:
+    sku, nombre y precio obligatorios; descripcion, stock y activo opcionales
+    (las columnas que falten no se tocan en los productos que ya existen).
+    'archivo' es un fichero abierto en modo binario.
+    """
+    resultado = _importar(PRODUCTOS, archivo)
+    if resultado['insertados'] or resultado['actualizados']:
+        invalidar_catalogo()
+    return resultado
+
+
+def importar_clientes(archivo):
+    """
+    Inserta o actualiza (por email) los clientes de un CSV con cabecera:
+    email, nombre y apellido obligatorios; direccion y telefono opcionales.
+    """
+    return _importar(CLIENTES, archivo)
+
+
+def _importar(spec, archivo):
+    with transaction.atomic(), connection.cursor() as cursor:
+        columnas = _cargar(cursor, archivo, spec['obligatorias'], spec['opcionales'])
+        _rechazar(cursor, spec['reglas'], spec['clave'])
+        actualizar = [c for c in spec['actualizables'] if c in columnas]
+        return _insertar_o_actualizar(cursor, spec['tabla'], spec['clave'], spec['valores'], actualizar)
+
+
+def _cargar(cursor, archivo, obligatorias, opcionales):
+    """
+    Lee la cabecera, crea la tabla temporal 'importacion' y copia en ella el
+    resto del archivo con COPY. Devuelve las columnas del archivo.
+    """
+    cabecera = archivo.readline()
+    if isinstance(cabecera, bytes):
+        cabecera = cabecera.decode('utf-8-sig')
+    columnas = [columna.strip().lower() for columna in next(csv.reader(io.StringIO(cabecera)), [])]
+
+    faltan = [c for c in obligatorias if c not in columnas]
+    desconocidas = [c for c in columnas if c not in obligatorias + opcionales]
+    if faltan or desconocidas or len(set(columnas)) != len(columnas):
+        raise ErrorDeImportacion(
+            f'Cabecera no válida. Obligatorias: {", ".join(obligatorias)}; '
+            f'opcionales: {", ".join(opcionales)}.'
+        )
+
+    # Todas las columnas del CSV como texto; las que no vienen quedan en NULL.
+    # 'fila' numera las filas en el orden del archivo
+    cursor.execute(
+        "CREATE TEMP TABLE importacion (fila BIGINT GENERATED ALWAYS AS IDENTITY, {}) "
+        "ON COMMIT DROP".format(', '.join(f'{c} TEXT' for c in obligatorias + opcionales))
+    )
+    copy = "COPY importacion ({}) FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')".format(', '.join(columnas))
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(copy, archivo)
+    else:
+        # psycopg 3 (con el pool de conexiones, ver core/settings.py)
+        with cursor.copy(copy) as entrada:
+            while bloque := archivo.read(BLOQUE_COPY):
+                entrada.write(bloque)
+    return columnas
+
+
+def _rechazar(cursor, reglas, clave):
+    """Apunta en 'importacion_rechazo' las filas que no se importan y por qué."""
+    cursor.execute(
+        f"""
+        CREATE TEMP TABLE importacion_rechazo ON COMMIT DROP AS
+        SELECT fila, error FROM (SELECT fila, {reglas} AS error FROM importacion) r
+        WHERE error IS NOT NULL
+        """
+    )
+    # De cada clave repetida cuenta la primera fila válida; las siguientes se rechazan
+    cursor.execute(
+        f"""
+        WITH validas AS (
+            SELECT fila, btrim({clave}) AS clave FROM importacion i
+            WHERE NOT EXISTS (SELECT 1 FROM importacion_rechazo r WHERE r.fila = i.fila)
+        )
+        INSERT INTO importacion_rechazo (fila, error)
+        SELECT v.fila, format('%s repetido en el archivo (fila %s).', '{clave}', d.primera)
+        FROM validas v
+        JOIN (SELECT clave, min(fila) AS primera FROM validas GROUP BY clave HAVING count(*) > 1) d
+            ON d.clave = v.clave
+        WHERE v.fila <> d.primera
+        """
+    )
+
+
+def _insertar_o_actualizar(cursor, tabla, clave, valores, actualizar):
+    # Las filas válidas, ya con los tipos de la tabla
+    cursor.execute(
+        "CREATE TEMP TABLE importacion_valida ON COMMIT DROP AS SELECT fila, {} FROM importacion i "
+        "WHERE NOT EXISTS (SELECT 1 FROM importacion_rechazo r WHERE r.fila = i.fila)".format(
+            ', '.join(f'{expresion} AS {columna}' for columna, expresion in valores.items())
+        )
+    )
+    cursor.execute("ANALYZE importacion_valida")
+
+    # Con JOIN y no con ON CONFLICT ... DO UPDATE: este bloquea y compara
+    # fila a fila incluso las que no cambian, que al reimportar un catálogo
+    # son casi todas. Las que no cambian no se reescriben.
+    cursor.execute(
+        """
+        UPDATE {tabla} t SET {asignaciones}
+        FROM importacion_valida v
+        WHERE t.{clave} = v.{clave} AND ({actuales}) IS DISTINCT FROM ({nuevos})
+        """.format(
+            tabla=tabla, clave=clave,
+            asignaciones=', '.join(f'{c} = v.{c}' for c in actualizar),
+            actuales=', '.join(f't.{c}' for c in actualizar),
+            nuevos=', '.join(f'v.{c}' for c in actualizar),
+        )
+    )
+    actualizados = cursor.rowcount
+
+    # Si otra sesión inserta la misma clave mientras tanto, la suya se queda
+    cursor.execute(
+        """
+        INSERT INTO {tabla} ({columnas})
+        SELECT {columnas} FROM importacion_valida v
+        WHERE NOT EXISTS (SELECT 1 FROM {tabla} t WHERE t.{clave} = v.{clave})
+        ORDER BY fila
+        ON CONFLICT ({clave}) DO NOTHING
+        """.format(tabla=tabla, clave=clave, columnas=', '.join(valores))
+    )
+    insertados = cursor.rowcount
+
+    cursor.execute("SELECT (SELECT count(*) FROM importacion_valida), (SELECT count(*) FROM importacion_rechazo)")
+    validos, rechazados = cursor.fetchone()
+
+    cursor.execute(
+        f"""
+        SELECT r.fila, btrim(i.{clave}), r.error
+        FROM importacion_rechazo r
+        JOIN importacion i ON i.fila = r.fila
+        ORDER BY r.fila
+        LIMIT %s
+        """,
+        [MAX_RECHAZOS_INFORMADOS]
+    )
+    return {
+        'insertados': insertados,
+        'actualizados': actualizados,
+        'sin_cambios': validos - insertados - actualizados,
+        'rechazados': rechazados,
+        'errores': [{'fila': fila, clave: valor, 'error': error} for fila, valor, error in cursor.fetchall()],
+    }
@@ -0,0 +1,248 @@
+"""
+Lectura rápida de los listados y los detalles (list y retrieve).
+
+En un listado de pedidos casi toda la CPU se va en crear las instancias de
+los modelos y en la maquinaria de los campos de DRF (get_attribute y
+to_representation por campo y fila), no en PostgreSQL. LecturaRapidaMixin
+responde list y retrieve con las filas de values(), sin instanciar modelos:
+
+- las columnas salen de los campos del serializer que se devuelven (con
+  ?fields= y ?expand=, ver quicknotes.campos);
+- los enteros, textos y booleanos se copian tal cual; los decimales y las
+  fechas pasan por el to_representation de su campo;
+- una relación anidada de muchos objetos (las líneas de los pedidos) se lee
+  con otra consulta values() para toda la página, con el queryset de su
+  Prefetch (mismo orden y columnas), y se agrupa en Python.
+
+La respuesta es la misma, byte a byte, que con el serializer. Si algún
+campo no se sabe leer así (un SerializerMethodField, una propiedad del
+modelo, un to_representation propio...), se usa el serializer como
+siempre; con LECTURA_RAPIDA = False, también.
+"""
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from rest_framework import permissions, serializers
+from rest_framework.fields import empty
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .pagination import ordenamiento_de
+
+# Campos cuyo valor en values() ya es su representación
+IDENTIDAD = {
+    serializers.IntegerField, serializers.CharField, serializers.EmailField, serializers.BooleanField,
+}
+# Campos que se convierten con su to_representation (BigIntegerField, el de
+# los id, devuelve texto con COERCE_BIGINT_TO_STRING)
+CONVERTIR = {
+    serializers.BigIntegerField, serializers.DecimalField, serializers.DateTimeField, serializers.DateField,
+}
+
+VALOR, OBJETO, LISTA = 'valor', 'objeto', 'lista'
+
+
+def _decimal(campo):
+    """
+    DecimalField.to_representation redondea cada valor con un contexto
+    nuevo. Si el valor ya tiene los decimales del campo (sale de una columna
+    numeric con los mismos), el redondeo no lo cambia y basta con str().
+    """
+    if (not getattr(campo, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or campo.localize
+            or campo.normalize_output or not campo.decimal_places or campo.max_digits is None):
+        return campo.to_representation
+    decimales, digitos = campo.decimal_places, campo.max_digits
+
+    def conversor(valor):
+        if type(valor) is Decimal:
+            texto = str(valor)
+            punto = texto.find('.')
+            if (punto != -1 and len(texto) - punto - 1 == decimales and 'E' not in texto
+                    and len(texto) - 1 - (texto[0] == '-') <= digitos):
+                return texto
+        return campo.to_representation(valor)
+    return conversor
+
+
+class Plan:
+    """
+    Cómo leer con values() lo que devuelve un serializer: las columnas y,
+    por cada campo (en el orden del serializer), de dónde sale su valor:
+
+    - (VALOR, nombre, columna, conversor, relación): si la relación es nula
+      el campo se omite, como hace DRF con 'cliente.nombre' sin cliente;
+    - (OBJETO, nombre, Plan, relación): objeto anidado, None si no hay;
+    - (LISTA, nombre, Plan, relación inversa): objetos anidados de otra tabla.
+    """
+
+    def __init__(self, columnas, campos):
+        self.columnas = columnas
+        self.campos = campos
+        self.listas = [campo for campo in campos if campo[0] == LISTA]
+
+    def fila(self, fila):
+        ret = {}
+        for tipo, nombre, fuente, conversor, relacion in self.campos:
+            if tipo == VALOR:
+                if relacion is not None and fila[relacion] is None:
+                    continue
+                valor = fila[fuente]
+                ret[nombre] = valor if valor is None or conversor is None else conversor(valor)
+            elif tipo == OBJETO:
+                ret[nombre] = None if fila[relacion] is None else fuente.fila(fila)
+            else:
+                # Se rellena en filas(), pero la clave va ya en su sitio
+                ret[nombre] = None
+        return ret
+
+    def filas(self, filas, prefetch):
+        """Las filas de values() convertidas; 'prefetch' son los Prefetch del queryset."""
+        datos = [self.fila(fila) for fila in filas]
+        for _, nombre, plan, _, relacion in self.listas:
+            hijas = {fila['id']: [] for fila in filas}
+            if not hijas:
+                continue
+            base = prefetch.get(relacion.get_accessor_name())
+            base = base.queryset if base is not None else relacion.related_model._default_manager.all()
+            clave = relacion.field.attname
+            base = base.filter(**{clave + '__in': list(hijas)})
+            # Las líneas de los pedidos, solo de las particiones de sus meses
+            if hasattr(base, 'de_las_fechas') and all('fecha_pedido' in fila for fila in filas):
+                base = base.de_las_fechas(fila['fecha_pedido'] for fila in filas)
+            for hija in base.values(*dict.fromkeys(plan.columnas + [clave])):
+                hijas[hija[clave]].append(hija)
+            for fila, dato in zip(filas, datos):
+                dato[nombre] = [plan.fila(hija) for hija in hijas[fila['id']]]
+        return datos
+
+
+def _plan(serializer, prefijo=''):
+    """El Plan del serializer, o None si algún campo no se puede leer con values()."""
+    if type(serializer).to_representation is not serializers.Serializer.to_representation:
+        return None
+    modelo = serializer.Meta.model
+    columnas, campos = [prefijo + 'id'], []
+    for campo in serializer.fields.values():
+        if campo.write_only:
+            continue
+        if campo.source == '*' or campo.default is not empty:
+            return None
+        partes = campo.source.split('.')
+
+        if isinstance(campo, serializers.ListSerializer):
+            relacion = next((r for r in modelo._meta.related_objects
+                             if r.one_to_many and r.get_accessor_name() == campo.source), None)
+            # Solo en el primer nivel: las líneas de los pedidos, no las de un objeto anidado
+            hijo = _plan(campo.child) if relacion is not None and not prefijo else None
+            if hijo is None or hijo.listas:
+                return None
+            campos.append((LISTA, campo.field_name, hijo, None, relacion))
+            continue
+
+        try:
+            relacion = modelo._meta.get_field(partes[0])
+        except FieldDoesNotExist:
+            return None
+        if len(partes) > 2 or not relacion.concrete or relacion.many_to_many:
+            return None
+
+        if isinstance(campo, serializers.ModelSerializer):
+            # Objeto anidado (a uno): sus columnas en el mismo JOIN
+            plan = _plan(campo, f'{prefijo}{relacion.name}__') if len(partes) == 1 else None
+            if plan is None or not relacion.is_relation or plan.listas:
+                return None
+            columnas += [prefijo + relacion.attname] + plan.columnas
+            campos.append((OBJETO, campo.field_name, plan, None, prefijo + relacion.attname))
+            continue
+
+        if len(partes) == 2:
+            # 'cliente.nombre': si no hay cliente, DRF omite el campo
+            if not relacion.is_relation or campo.allow_null:
+                return None
+            columna, nula = f'{prefijo}{relacion.name}__{partes[1]}', prefijo + relacion.attname
+            columnas.append(nula)
+        else:
+            columna, nula = prefijo + relacion.attname, None
+
+        if relacion.is_relation and partes == [relacion.name]:
+            # La columna de la clave foránea es el pk que devuelve PrimaryKeyRelatedField
+            # ('pedido_id', en cambio, es un entero como cualquier otro)
+            if type(campo) is not serializers.PrimaryKeyRelatedField or campo.pk_field is not None:
+                return None
+            conversor = None
+        elif type(campo) in IDENTIDAD:
+            conversor = None
+        elif type(campo) is serializers.DecimalField:
+            conversor = _decimal(campo)
+        elif type(campo) in CONVERTIR:
+            conversor = campo.to_representation
+        else:
+            return None
+        columnas.append(columna)
+        campos.append((VALOR, campo.field_name, columna, conversor, nula))
+
+    return Plan(list(dict.fromkeys(columnas)), campos)
+
+
+@lru_cache(maxsize=None)
+def plan_de(serializer_class, campos=None):
+    """El Plan (o None) de serializer_class con esos campos (None: todos)."""
+    return _plan(serializer_class(campos=list(campos) if campos is not None else None))
+
+
+class LecturaRapidaMixin:
+    """
+    list y retrieve con values() en lugar de instancias y serializer (ver
+    arriba). Va detrás de CamposMixin y de CatalogoCacheMixin.
+    """
+
+    def _plan_rapido(self):
+        # La API navegable usa el serializer para sus formularios
+        if not settings.LECTURA_RAPIDA or self.request.accepted_renderer.format != 'json':
+            return None
+        campos = self.campos()
+        return plan_de(self.get_serializer_class(), tuple(campos) if campos is not None else None)
+
+    def _values(self, queryset, plan):
+        """values() con las columnas del plan y las del ordenamiento de la paginación."""
+        ordenamiento = [campo.lstrip('-') for campo in ordenamiento_de(self)]
+        columnas = plan.columnas + [campo for campo in ordenamiento if _es_columna(queryset.model, campo)]
+        return queryset.prefetch_related(None).values(*dict.fromkeys(columnas))
+
+    def list(self, request, *args, **kwargs):
+        plan = self._plan_rapido()
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        filas = self._values(queryset, plan)
+        pagina = self.paginate_queryset(filas)
+        if pagina is not None:
+            return self.get_paginated_response(plan.filas(pagina, _prefetch(queryset)))
+        return Response(plan.filas(list(filas), _prefetch(queryset)))
+
+    def retrieve(self, request, *args, **kwargs):
+        plan = self._plan_rapido()
+        # Los permisos por objeto necesitan la instancia
+        if plan is None or any(type(permiso).has_object_permission is not permissions.BasePermission.has_object_permission
+                               for permiso in self.get_permissions()):
+            return super().retrieve(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        fila = get_object_or_404(self._values(queryset, plan), **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(plan.filas([fila], _prefetch(queryset))[0])
+
+
+def _prefetch(queryset):
+    return {lookup.prefetch_to: lookup for lookup in queryset._prefetch_related_lookups
+            if isinstance(lookup, Prefetch)}
+
+
+def _es_columna(modelo, nombre):
+    try:
+        return modelo._meta.get_field(nombre).concrete
+    except FieldDoesNotExist:
+        return False
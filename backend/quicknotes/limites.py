@@ -0,0 +1,340 @@
+"""
+Control de admisión: límites por usuario y por rol, y peticiones a la vez
+de las acciones caras.
+
+En las promociones, las ráfagas de 'registrar-nuevo-pedido' y de /api/token/
+saturaban la base de datos (y los núcleos, con PBKDF2) y la latencia subía
+para todos, también en el catálogo. Cada vista declara en su atributo
+'limites' (LimitesMixin) un Limite por acción (o por método, en las vistas
+que no son ViewSets), y se comprueba después de la autenticación y los
+permisos, antes de la vista:
+
+- por_usuario={'cliente': '10/min', ...}: un cubo de tokens por usuario (o
+  por lo que devuelva identidad_limites(), p. ej. la IP), con la tasa de su
+  rol. '10/min' es un cubo de 10 tokens que se rellena a 10 por minuto:
+  admite ráfagas de 10 y 10 por minuto sostenidos. Sin tokens, 429.
+- por_ip={'anonimo': '60/min'}: un cubo por IP del cliente, con la tasa de
+  su rol (p. ej. para que una IP no pruebe contraseñas en muchas cuentas).
+- por_rol={'cliente': '3000/min'}: un cubo compartido por todos los
+  usuarios del rol. Sin tokens, 429.
+- concurrentes=N: como mucho N peticiones de la acción a la vez, entre todos
+  los procesos. La siguiente no espera en la cola: 503.
+
+Las respuestas 429 y 503 llevan Retry-After. Los roles que no aparecen en un
+Limite no tienen ese límite; los usuarios sin sesión tienen el rol 'anonimo'.
+
+El estado vive en la caché compartida (Redis, con REDIS_URL), y cada
+comprobación es un script Lua: atómica y con una sola ida y vuelta. Con la
+caché en memoria del proceso (LocMemCache), o mientras Redis no responde,
+se usa un estado en memoria del proceso: los límites pasan a ser por
+proceso (con 3 workers, el triple).
+
+Lo que tarda la comprobación sale en Server-Timing ('lim') y lo resume
+manage.py bench_api. LIMITES_ACTIVOS=false los desactiva.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+from .metricas import medicion_en_curso
+
+logger = logging.getLogger('quicknotes.limites')
+
+PERIODOS = {'s': 1, 'min': 60, 'h': 3600}
+
+# Segundos tras los que se da por terminada una petición que ocupa una plaza
+# (por si el proceso muere sin liberarla)
+PLAZA_CADUCA = 120
+
+# Retry-After de las respuestas 503: las acciones limitadas duran menos
+REINTENTO_SATURADO = 1
+
+# Segundos sin intentar Redis después de un fallo
+PAUSA_TRAS_FALLO = 5
+
+# Cubos en memoria a partir de los que se descartan los que están llenos
+MAX_CUBOS_EN_MEMORIA = 100_000
+
+
+class Limitado(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_code = 'limitado'
+
+    def __init__(self, espera):
+        self.wait = max(1, math.ceil(espera))
+        super().__init__(f'Demasiadas peticiones: vuelve a intentarlo en {self.wait} s.')
+
+
+class Saturado(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_code = 'saturado'
+
+    def __init__(self):
+        self.wait = REINTENTO_SATURADO
+        super().__init__(f'El servidor está ocupado: vuelve a intentarlo en {self.wait} s.')
+
+
+def _tasa(texto):
+    """'10/min' -> (capacidad, tokens por segundo)."""
+    cantidad, _, periodo = texto.partition('/')
+    if not cantidad.strip().isdigit() or int(cantidad) < 1 or periodo.strip() not in PERIODOS:
+        raise ImproperlyConfigured(f"Tasa '{texto}' no válida: se espera 'N/s', 'N/min' o 'N/h'.")
+    return int(cantidad), int(cantidad) / PERIODOS[periodo.strip()]
+
+
+class Limite:
+    """Los límites de una acción (ver el docstring del módulo)."""
+
+    def __init__(self, por_usuario=None, por_ip=None, por_rol=None, concurrentes=None):
+        self.por_usuario = {rol: _tasa(tasa) for rol, tasa in (por_usuario or {}).items()}
+        self.por_ip = {rol: _tasa(tasa) for rol, tasa in (por_ip or {}).items()}
+        self.por_rol = {rol: _tasa(tasa) for rol, tasa in (por_rol or {}).items()}
+        self.concurrentes = concurrentes
+
+    def admitir(self, alcance, identidad, rol, ip=None):
+        """
+        Consume un token de los cubos del usuario, de su IP y de su rol y
+        ocupa una plaza. Devuelve la Plaza a liberar al terminar (o None), o
+        lanza Limitado o Saturado.
+        """
+        cubos = []
+        if rol in self.por_usuario:
+            cubos.append((f'limite:{alcance}:{identidad}', *self.por_usuario[rol]))
+        if rol in self.por_ip:
+            cubos.append((f'limite:{alcance}:ip:{ip}', *self.por_ip[rol]))
+        if rol in self.por_rol:
+            cubos.append((f'limite:{alcance}:rol:{rol}', *self.por_rol[rol]))
+        almacen = _almacen()
+        for clave, capacidad, por_segundo in cubos:
+            espera = almacen.tomar(clave, capacidad, por_segundo)
+            if espera:
+                raise Limitado(espera)
+        if self.concurrentes is None:
+            return None
+        plaza = almacen.ocupar(f'concurrencia:{alcance}', self.concurrentes)
+        if plaza is None:
+            raise Saturado()
+        return plaza
+
+
+class Plaza:
+    """Una petición en curso de una acción con 'concurrentes'."""
+
+    def __init__(self, almacen, clave, ficha):
+        self.almacen, self.clave, self.ficha = almacen, clave, ficha
+
+    def liberar(self):
+        self.almacen.liberar(self.clave, self.ficha)
+
+
+class EnMemoria:
+    """Cubos y plazas en memoria del proceso."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # clave -> (tokens, instante, instante en que vuelve a estar lleno)
+        self.cubos = {}
+        # clave -> fichas de las peticiones en curso
+        self.plazas = {}
+
+    def tomar(self, clave, capacidad, por_segundo):
+        """Consume un token. Devuelve 0, o los segundos hasta que haya uno."""
+        ahora = time.monotonic()
+        with self.lock:
+            tokens, antes, _ = self.cubos.get(clave, (capacidad, ahora, ahora))
+            tokens = min(capacidad, tokens + (ahora - antes) * por_segundo)
+            espera = 0 if tokens >= 1 else (1 - tokens) / por_segundo
+            if not espera:
+                tokens -= 1
+            if len(self.cubos) >= MAX_CUBOS_EN_MEMORIA:
+                # Un cubo lleno es igual que uno que no existe
+                self.cubos = {c: cubo for c, cubo in self.cubos.items() if cubo[2] > ahora}
+            self.cubos[clave] = (tokens, ahora, ahora + (capacidad - tokens) / por_segundo)
+        return espera
+
+    def ocupar(self, clave, maximo):
+        ahora = time.monotonic()
+        with self.lock:
+            plazas = self.plazas.setdefault(clave, {})
+            for ficha in [ficha for ficha, caduca in plazas.items() if caduca <= ahora]:
+                del plazas[ficha]
+            if len(plazas) >= maximo:
+                return None
+            ficha = uuid.uuid4().hex
+            plazas[ficha] = ahora + PLAZA_CADUCA
+        return Plaza(self, clave, ficha)
+
+    def liberar(self, clave, ficha):
+        with self.lock:
+            self.plazas.get(clave, {}).pop(ficha, None)
+
+    def vaciar(self):
+        with self.lock:
+            self.cubos.clear()
+            self.plazas.clear()
+
+
+# El cubo en un hash (tokens, instante), con el reloj de Redis para que todos
+# los procesos usen el mismo. Devuelve la espera como texto: los números de
+# Lua se devuelven truncados a enteros.
+TOMAR = """
+local reloj = redis.call('TIME')
+local ahora = tonumber(reloj[1]) + tonumber(reloj[2]) / 1000000
+local capacidad, por_segundo = tonumber(ARGV[1]), tonumber(ARGV[2])
+local cubo = redis.call('HMGET', KEYS[1], 'tokens', 'instante')
+local tokens = tonumber(cubo[1]) or capacidad
+local antes = tonumber(cubo[2]) or ahora
+tokens = math.min(capacidad, tokens + math.max(0, ahora - antes) * por_segundo)
+local espera = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    espera = (1 - tokens) / por_segundo
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'instante', tostring(ahora))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacidad - tokens) / por_segundo * 1000) + 1000)
+return tostring(espera)
+"""
+
+# Las plazas en un sorted set: ficha -> instante en que caduca
+OCUPAR = """
+local reloj = redis.call('TIME')
+local ahora = tonumber(reloj[1]) + tonumber(reloj[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ahora)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ahora + tonumber(ARGV[3]), ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class EnRedis:
+    """Cubos y plazas en el Redis de la caché 'default'."""
+
+    def __init__(self):
+        self._tomar = self._ocupar = None
+
+    def _cliente(self):
+        # El cliente de redis-py de la caché de Django (con su pool de conexiones)
+        cliente = caches['default']._cache.get_client(write=True)
+        if self._tomar is None:
+            self._tomar = cliente.register_script(TOMAR)
+            self._ocupar = cliente.register_script(OCUPAR)
+        return cliente
+
+    @staticmethod
+    def _clave(clave):
+        return caches['default'].make_and_validate_key(clave)
+
+    def tomar(self, clave, capacidad, por_segundo):
+        cliente = self._cliente()
+        return float(self._tomar(keys=[self._clave(clave)], args=[capacidad, repr(por_segundo)], client=cliente))
+
+    def ocupar(self, clave, maximo):
+        cliente = self._cliente()
+        ficha = uuid.uuid4().hex
+        if not self._ocupar(keys=[self._clave(clave)], args=[maximo, ficha, PLAZA_CADUCA], client=cliente):
+            return None
+        return Plaza(self, clave, ficha)
+
+    def liberar(self, clave, ficha):
+        try:
+            self._cliente().zrem(self._clave(clave), ficha)
+        except Exception:
+            # La plaza caduca sola pasados PLAZA_CADUCA segundos
+            logger.warning('No se pudo liberar una plaza de %s', clave, exc_info=True)
+
+
+class ConRespaldo:
+    """
+    El almacén compartido y, mientras falla, el de memoria. Tras un fallo no
+    vuelve a probar el compartido hasta pasados PAUSA_TRAS_FALLO segundos,
+    para no sumar un timeout a cada petición. Cada Plaza se libera en el
+    almacén que la dio.
+    """
+
+    def __init__(self, compartido, respaldo):
+        self.compartido, self.respaldo = compartido, respaldo
+        self.caido_hasta = 0.0
+
+    def _llamar(self, metodo, *args):
+        if time.monotonic() >= self.caido_hasta:
+            try:
+                return getattr(self.compartido, metodo)(*args)
+            except Exception:
+                logger.warning('Límites en memoria del proceso durante %s s: falló la caché compartida',
+                               PAUSA_TRAS_FALLO, exc_info=True)
+                self.caido_hasta = time.monotonic() + PAUSA_TRAS_FALLO
+        return getattr(self.respaldo, metodo)(*args)
+
+    def tomar(self, clave, capacidad, por_segundo):
+        return self._llamar('tomar', clave, capacidad, por_segundo)
+
+    def ocupar(self, clave, maximo):
+        return self._llamar('ocupar', clave, maximo)
+
+
+memoria = EnMemoria()
+compartido = ConRespaldo(EnRedis(), memoria)
+
+
+def _almacen():
+    return compartido if isinstance(caches['default'], RedisCache) else memoria
+
+
+class LimitesMixin:
+    """
+    Aplica a las vistas de DRF los Limite de su atributo 'limites': acción
+    (o método HTTP, fuera de los ViewSets) -> Limite.
+    """
+    limites = {}
+
+    def identidad_limites(self, request):
+        """Quién es el usuario para su cubo: su id o, sin sesión, su IP."""
+        if request.user and request.user.is_authenticated:
+            return f'usuario:{request.user.pk}'
+        return f'ip:{ip_de(request)}'
+
+    def check_throttles(self, request):
+        super().check_throttles(request)
+        accion = getattr(self, 'action', None) or request.method.lower()
+        limite = self.limites.get(accion)
+        if limite is None or not settings.LIMITES_ACTIVOS:
+            return
+        inicio = time.perf_counter()
+        rol = request.user.rol if request.user.is_authenticated else 'anonimo'
+        try:
+            self._plaza = limite.admitir(f'{type(self).__name__}.{accion}', self.identidad_limites(request), rol,
+                                         ip_de(request))
+        finally:
+            medicion = medicion_en_curso()
+            if medicion is not None:
+                medicion.lim = time.perf_counter() - inicio
+
+    def dispatch(self, request, *args, **kwargs):
+        # La plaza se libera también si la vista lanza un error sin manejar
+        # (500): si no, quedaría ocupada hasta PLAZA_CADUCA
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            plaza = getattr(self, '_plaza', None)
+            if plaza is not None:
+                self._plaza = None
+                plaza.liberar()
+
+
+def ip_de(request):
+    """La IP del cliente, como la ven los throttles de DRF (NUM_PROXIES)."""
+    return BaseThrottle().get_ident(request)
@@ -0,0 +1,350 @@
+import http.client
+import json
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quicknotes.datos_prueba import CONTRASENA, PREFIJO, NOMBRES
+from quicknotes.models import Cliente, Producto, Usuario
+
+# Operación -> peso en la mezcla (se puede cambiar con --mezcla)
+MEZCLA = {
+    'login': 2,
+    'catalogo': 30,
+    'producto': 15,
+    'buscar': 10,
+    'historial': 18,
+    'pedido': 8,
+    'registrar_pedido': 12,
+    'ventas': 5,
+}
+
+BUSQUEDAS = [nombre.lower() for nombre in NOMBRES] + ['lapt', 'tecl', 'auric', 'monitr', 'silla pro', 'gamer']
+AGRUPACIONES = ['dia', 'mes', 'producto', 'cliente']
+
+
+def percentil(tiempos, p):
+    """Percentil p (de 0 a 1) de una lista de tiempos ordenada."""
+    return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))]
+
+
+def resumen(tiempos, errores, segundos, rechazadas=0, limites=()):
+    """
+    Peticiones, errores y latencias. 'rechazadas' son las respuestas 429 y 503
+    de los límites de peticiones, y 'limites' lo que tardó su comprobación en
+    el servidor (Server-Timing 'lim').
+    """
+    tiempos = sorted(tiempos)
+    datos = {'peticiones': len(tiempos), 'errores': errores, 'rechazadas': rechazadas,
+             'por_segundo': round(len(tiempos) / segundos, 2)}
+    if tiempos:
+        datos.update({
+            'p50_ms': round(statistics.median(tiempos), 1),
+            'p95_ms': round(percentil(tiempos, 0.95), 1),
+            'p99_ms': round(percentil(tiempos, 0.99), 1),
+            'max_ms': round(tiempos[-1], 1),
+        })
+    if limites:
+        limites = sorted(limites)
+        datos.update({
+            'limites_p50_ms': round(statistics.median(limites), 3),
+            'limites_p99_ms': round(percentil(limites, 0.99), 3),
+        })
+    return datos
+
+
+class Sesion:
+    """Un cliente de la tienda navegando con su propia conexión (keep-alive)."""
+
+    def __init__(self, servidor, cliente_id, username, datos):
+        partes = urlsplit(servidor)
+        self.host, self.puerto = partes.hostname, partes.port or 80
+        self.cliente_id, self.username, self.datos = cliente_id, username, datos
+        self.conexion = None
+        self.token = None
+        # Lo que tardó en el servidor la comprobación de los límites de la última respuesta
+        self.limites_ms = None
+        self.siguiente_catalogo = None
+        self.pedidos = []
+
+    def peticion(self, metodo, ruta, cuerpo=None, token=None):
+        """Envía la petición y lee la respuesta entera: (código, JSON o None)."""
+        cabeceras = {'Accept': 'application/json'}
+        if cuerpo is not None:
+            cuerpo = json.dumps(cuerpo)
+            cabeceras['Content-Type'] = 'application/json'
+        if token or self.token:
+            cabeceras['Authorization'] = f'Bearer {token or self.token}'
+        try:
+            if self.conexion is None:
+                self.conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=60)
+            self.conexion.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+            respuesta = self.conexion.getresponse()
+            contenido = respuesta.read()
+        except (OSError, http.client.HTTPException):
+            self.cerrar()
+            return 0, None
+        if respuesta.will_close:
+            self.cerrar()
+        self.limites_ms = self.tiempo_limites(respuesta.getheader('Server-Timing', ''))
+        try:
+            return respuesta.status, json.loads(contenido) if contenido else None
+        except ValueError:
+            return respuesta.status, None
+
+    @staticmethod
+    def tiempo_limites(server_timing):
+        for parte in server_timing.split(','):
+            nombre, _, parametros = parte.strip().partition(';')
+            if nombre == 'lim' and parametros.startswith('dur='):
+                return float(parametros[4:].split(';')[0])
+        return None
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+
+    def login(self):
+        estado, datos = self.peticion('POST', '/api/token/', {'username': self.username, 'password': CONTRASENA})
+        if estado == 200:
+            self.token = datos['access']
+        return estado
+
+    def catalogo(self):
+        # Pasa a la página siguiente o vuelve a la primera
+        ruta = '/api/productos/'
+        if self.siguiente_catalogo and random.random() < 0.5:
+            ruta = urlsplit(self.siguiente_catalogo)._replace(scheme='', netloc='').geturl()
+        estado, datos = self.peticion('GET', ruta)
+        self.siguiente_catalogo = datos.get('next') if estado == 200 else None
+        return estado
+
+    def producto(self):
+        producto_id, _ = self.datos.producto()
+        return self.peticion('GET', f'/api/productos/{producto_id}/')[0]
+
+    def buscar(self):
+        return self.peticion('GET', '/api/productos/buscar/?' + urlencode({'q': random.choice(BUSQUEDAS)}))[0]
+
+    def historial(self):
+        estado, datos = self.peticion('GET', '/api/pedidos/?page_size=20')
+        if estado == 200:
+            self.pedidos = [pedido['id'] for pedido in datos['results']]
+        return estado
+
+    def pedido(self):
+        if not self.pedidos:
+            return self.historial()
+        return self.peticion('GET', f'/api/pedidos/{random.choice(self.pedidos)}/')[0]
+
+    def registrar_pedido(self):
+        productos = []
+        for _ in range(random.randint(1, 3)):
+            producto_id, precio = self.datos.producto()
+            productos.append({'producto_id': producto_id, 'cantidad': random.randint(1, 3),
+                              'precio_unitario': str(precio)})
+        return self.peticion('POST', '/api/pedidos/registrar-nuevo-pedido/',
+                             {'cliente_id': self.cliente_id, 'productos': productos})[0]
+
+    def ventas(self):
+        # Informe de un empleado: últimos 30, 90 o 365 días
+        parametros = {'desde': (date.today() - timedelta(days=random.choice([30, 90, 365]))).isoformat(),
+                      'agrupar': random.choice(AGRUPACIONES)}
+        return self.peticion('GET', '/api/pedidos/ventas-totales/?' + urlencode(parametros),
+                             token=self.datos.token_empleado)[0]
+
+
+class Datos:
+    """Clientes y productos de los datos generados, elegidos con sesgo hacia los primeros."""
+
+    def __init__(self, clientes, productos, token_empleado=None):
+        self.clientes, self.productos, self.token_empleado = clientes, productos, token_empleado
+
+    @staticmethod
+    def elegir(lista):
+        return lista[int(len(lista) * random.random() ** 2)]
+
+    def cliente(self):
+        return self.elegir(self.clientes)
+
+    def producto(self):
+        return self.elegir(self.productos)
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el servidor ya arrancado con una mezcla realista de operaciones (login, catálogo, '
+        'búsqueda, historial de pedidos, registro de pedidos e informes de ventas) sobre los datos '
+        'de manage.py generar_datos, y guarda peticiones/s y latencias p50/p95/p99 en un JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servidor', default='http://localhost:8000')
+        parser.add_argument('--concurrencia', type=int, default=16, help='Clientes navegando a la vez.')
+        parser.add_argument('--segundos', type=float, default=60)
+        parser.add_argument('--calentamiento', type=float, default=5,
+                            help='Segundos iniciales que no cuentan.')
+        parser.add_argument('--mezcla', default='',
+                            help='Pesos que cambian la mezcla, p. ej. "registrar_pedido=30,ventas=0".')
+        parser.add_argument('--semilla', type=int, help='Semilla de las elecciones al azar.')
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, bench_api_<fecha>.json).')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior con el que comparar.')
+
+    def handle(self, *args, **options):
+        mezcla = self.mezcla(options['mezcla'])
+        random.seed(options['semilla'])
+        datos = self.preparar(options['servidor'])
+
+        resultados = {operacion: ([], 0, 0, []) for operacion in mezcla}
+        bloqueo = threading.Lock()
+        inicio = time.perf_counter()
+        medir_desde = inicio + options['calentamiento']
+        fin = medir_desde + options['segundos']
+
+        def navegar():
+            tiempos = {operacion: [] for operacion in mezcla}
+            errores = dict.fromkeys(mezcla, 0)
+            rechazadas = dict.fromkeys(mezcla, 0)
+            limites = {operacion: [] for operacion in mezcla}
+            sesion = Sesion(options['servidor'], *datos.cliente(), datos)
+            sesion.login()
+            operaciones, pesos = list(mezcla), list(mezcla.values())
+            while (ahora := time.perf_counter()) < fin:
+                operacion = random.choices(operaciones, pesos)[0]
+                sesion.limites_ms = None
+                estado = getattr(sesion, operacion)()
+                if ahora < medir_desde:
+                    continue
+                if sesion.limites_ms is not None:
+                    limites[operacion].append(sesion.limites_ms)
+                if 200 <= estado < 400:
+                    tiempos[operacion].append((time.perf_counter() - ahora) * 1000)
+                elif estado in (429, 503):
+                    rechazadas[operacion] += 1
+                else:
+                    errores[operacion] += 1
+            sesion.cerrar()
+            with bloqueo:
+                for operacion in mezcla:
+                    anteriores, fallidas, rechazos, comprobaciones = resultados[operacion]
+                    resultados[operacion] = (anteriores + tiempos[operacion], fallidas + errores[operacion],
+                                             rechazos + rechazadas[operacion],
+                                             comprobaciones + limites[operacion])
+
+        hilos = [threading.Thread(target=navegar) for _ in range(options['concurrencia'])]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        informe = self.informe(resultados, options, mezcla)
+        self.mostrar(informe)
+        salida = options['salida'] or f"bench_api_{datetime.now():%Y%m%d_%H%M%S}.json"
+        with open(salida, 'w') as archivo:
+            json.dump(informe, archivo, indent=2, ensure_ascii=False)
+        self.stdout.write(f'\nResultados en {salida}')
+        if options['comparar']:
+            self.comparar(informe, options['comparar'])
+
+    def mezcla(self, cambios):
+        mezcla = dict(MEZCLA)
+        for cambio in filter(None, cambios.split(',')):
+            operacion, _, peso = cambio.partition('=')
+            if operacion.strip() not in MEZCLA or not peso.strip().isdigit():
+                raise CommandError(f'--mezcla: "{cambio}" no es operación=peso ({", ".join(MEZCLA)}).')
+            mezcla[operacion.strip()] = int(peso)
+        mezcla = {operacion: peso for operacion, peso in mezcla.items() if peso}
+        if not mezcla:
+            raise CommandError('--mezcla: todos los pesos son 0.')
+        return mezcla
+
+    def preparar(self, servidor):
+        """Clientes, productos y un empleado de generar_datos (la misma base de datos que el servidor)."""
+        clientes = list(
+            Cliente.objects.filter(usuario__username__startswith=f'{PREFIJO}_cliente_')
+            .order_by('id').values_list('id', 'usuario__username')[:10_000]
+        )
+        productos = list(
+            Producto.objects.filter(activo=True, sku__startswith=f'{PREFIJO}-', stock__gte=1000)
+            .order_by('id').values_list('id', 'precio')[:10_000]
+        )
+        empleado = Usuario.objects.filter(username__startswith=f'{PREFIJO}_empleado_').order_by('id').first()
+        if not clientes or not productos or empleado is None:
+            raise CommandError('No hay datos generados: ejecuta antes manage.py generar_datos.')
+        random.shuffle(clientes)
+        random.shuffle(productos)
+
+        datos = Datos(clientes, productos)
+        sesion = Sesion(servidor, None, empleado.username, datos)
+        estado = sesion.login()
+        sesion.cerrar()
+        if estado != 200:
+            raise CommandError(f'No se pudo hacer login en {servidor} (código {estado}).')
+        datos.token_empleado = sesion.token
+        return datos
+
+    def informe(self, resultados, options, mezcla):
+        segundos = options['segundos']
+        todos = [t for tiempos, *_ in resultados.values() for t in tiempos]
+        try:
+            revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                      text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            revision = None
+        return {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'revision': revision,
+            'maquina': platform.node(),
+            'servidor': options['servidor'],
+            'concurrencia': options['concurrencia'],
+            'segundos': segundos,
+            'mezcla': mezcla,
+            'total': resumen(todos, sum(e for _, e, _, _ in resultados.values()), segundos,
+                             sum(r for _, _, r, _ in resultados.values()),
+                             [t for _, _, _, limites in resultados.values() for t in limites]),
+            'operaciones': {operacion: resumen(tiempos, errores, segundos, rechazadas, limites)
+                            for operacion, (tiempos, errores, rechazadas, limites) in resultados.items()},
+        }
+
+    def mostrar(self, informe):
+        self.stdout.write(f"\n{'operación':<18} {'peticiones':>10} {'errores':>8} {'429/503':>8} {'pet/s':>8} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'lím. p50':>9} {'lím. p99':>9}")
+        for operacion, datos in [*informe['operaciones'].items(), ('total', informe['total'])]:
+            limites = ' '.join(f"{datos[clave]:>9.3f}" if clave in datos else f"{'-':>9}"
+                               for clave in ('limites_p50_ms', 'limites_p99_ms'))
+            self.stdout.write(
+                f"{operacion:<18} {datos['peticiones']:>10} {datos['errores']:>8} {datos['rechazadas']:>8} "
+                f"{datos['por_segundo']:>8.1f} "
+                + ' '.join(f"{datos.get(clave, 0):>8.1f}" for clave in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+                + f' {limites}'
+            )
+
+    def comparar(self, informe, archivo):
+        try:
+            with open(archivo) as entrada:
+                anterior = json.load(entrada)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'No se pudo leer {archivo}: {e}')
+
+        def cambio(antes, ahora):
+            return f'{(ahora - antes) / antes * 100:+.0f} %' if antes else '-'
+
+        self.stdout.write(f"\nFrente a {archivo} ({anterior.get('revision') or anterior['fecha']}):")
+        self.stdout.write(f"{'operación':<18} {'pet/s':>10} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for operacion, datos in [*informe['operaciones'].items(), ('total', informe['total'])]:
+            antes = anterior['total'] if operacion == 'total' else anterior['operaciones'].get(operacion)
+            if not antes:
+                continue
+            self.stdout.write(
+                f"{operacion:<18} {cambio(antes['por_segundo'], datos['por_segundo']):>10} "
+                + ' '.join(f"{cambio(antes.get(clave, 0), datos.get(clave, 0)):>8}"
+                           for clave in ('p50_ms', 'p95_ms', 'p99_ms'))
+            )
@@ -0,0 +1,92 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from quicknotes.busqueda import buscar_productos, trigramas_disponibles
+
+NOMBRES = ['Laptop', 'Mouse', 'Teclado', 'Monitor', 'Auriculares', 'Silla', 'Cámara', 'Impresora', 'Router', 'Tablet']
+MODELOS = ['Gamer', 'Pro', 'Ultra', 'Básico', 'Inalámbrico', 'Compacto', 'Ergonómico', 'Portátil']
+DETALLES = ['con garantía extendida', 'de aluminio', 'para oficina', 'recargable', 'con luz RGB', 'plegable']
+
+# (parámetros de buscar_productos, descripción)
+CONSULTAS = [
+    ({'q': 'lapt'}, 'prefijo'),
+    ({'q': 'teclado ergo'}, 'dos prefijos'),
+    ({'q': 'auriculares inalámbrico', 'precio_max': 100}, 'con filtro de precio'),
+    ({'q': 'monitr'}, 'error de escritura'),
+    ({'q': 'laptop aluminio'}, 'nombre y descripción'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Carga productos de prueba (1M por defecto) y mide la latencia de la búsqueda de '
+        'productos (primera página, ordenada por relevancia).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=1_000_000)
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--conservar', action='store_true',
+                            help='No borra los productos de prueba al terminar.')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM productos")
+            ultimo_id = cursor.fetchone()[0]
+
+        try:
+            self.cargar(options['productos'])
+            if not trigramas_disponibles():
+                self.stdout.write(self.style.WARNING('pg_trgm no está instalado: sin tolerancia a errores.'))
+            self.stdout.write(f"\n{'consulta':<32} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8} {'filas':>6}")
+            for parametros, descripcion in CONSULTAS:
+                self.medir(parametros, descripcion, options['repeticiones'])
+
+            productos = buscar_productos(**CONSULTAS[0][0]).order_by('-relevancia', 'id')[:51]
+            self.stdout.write('\nPlan de la primera consulta:\n' + productos.explain(analyze=True))
+        finally:
+            if not options['conservar']:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute("DELETE FROM productos WHERE id > %s", [ultimo_id])
+
+    def cargar(self, total, lote=100_000):
+        inicio = time.monotonic()
+        for desde in range(0, total, lote):
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Son productos que no se venden: no hace falta repartir su stock en cupos
+                cursor.execute("SET LOCAL quicknotes.liquidando = 'on'")
+                cursor.execute(
+                    """
+                    INSERT INTO productos (nombre, descripcion, precio, stock, fecha_creacion, activo)
+                    SELECT (%(nombres)s::text[])[1 + (g %% cardinality(%(nombres)s::text[]))]
+                               || ' ' || (%(modelos)s::text[])[1 + floor(random() * cardinality(%(modelos)s::text[]))::int]
+                               || ' ' || g,
+                           'Modelo ' || left(md5(g::text), 8) || ' '
+                               || (%(detalles)s::text[])[1 + floor(random() * cardinality(%(detalles)s::text[]))::int],
+                           round((random() * 2000)::numeric, 2),
+                           100,
+                           CURRENT_TIMESTAMP,
+                           random() > 0.05
+                    FROM generate_series(%(desde)s, %(hasta)s) AS g
+                    """,
+                    {'nombres': NOMBRES, 'modelos': MODELOS, 'detalles': DETALLES,
+                     'desde': desde + 1, 'hasta': min(desde + lote, total)}
+                )
+            self.stdout.write(f'{min(desde + lote, total)} productos cargados')
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE productos")
+        self.stdout.write(f'Carga: {time.monotonic() - inicio:.1f} s')
+
+    def medir(self, parametros, descripcion, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            filas = list(buscar_productos(**parametros).order_by('-relevancia', 'id')[:51])
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+        self.stdout.write(f'{descripcion:<32} {statistics.median(tiempos):>8.1f} {p95:>8.1f} '
+                          f'{tiempos[-1]:>8.1f} {len(filas):>6}')
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el servidor ya arrancado (runserver, gunicorn...) con clientes concurrentes '
+        'que repiten peticiones a una URL: peticiones por segundo y latencia p50/p90/p99.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servidor', default='http://localhost:8000')
+        parser.add_argument('--ruta', default='/api/pedidos/')
+        parser.add_argument('--concurrencia', type=int, default=16,
+                            help='Clientes que envían peticiones a la vez (cada uno con su conexión).')
+        parser.add_argument('--segundos', type=float, default=20)
+        parser.add_argument('--calentamiento', type=float, default=2,
+                            help='Segundos iniciales que no cuentan (arranque de workers y conexiones).')
+        parser.add_argument('--sin-keepalive', action='store_true',
+                            help='Una conexión nueva por petición.')
+        parser.add_argument('--lentos', type=int, default=0,
+                            help='Conexiones aparte que envían su petición byte a byte durante toda '
+                                 'la medición (clientes lentos o de red móvil).')
+        parser.add_argument('--usuario', help='Hace login con este usuario y envía el token.')
+        parser.add_argument('--contrasena')
+
+    def handle(self, *args, **options):
+        cabeceras = {}
+        if options['usuario']:
+            cabeceras['Authorization'] = f"Bearer {self.login(options)}"
+        url = urljoin(options['servidor'], options['ruta'])
+
+        tiempos, errores = asyncio.run(self.medir(url, cabeceras, options))
+        if not tiempos:
+            self.stdout.write(self.style.ERROR(
+                f'Ninguna petición respondió a tiempo en {options["segundos"]:.0f} s ({errores} errores).'
+            ))
+            return
+        tiempos.sort()
+
+        def percentil(p):
+            return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))]
+
+        self.stdout.write(
+            f"{url} con {options['concurrencia']} clientes durante {options['segundos']:.0f} s\n"
+            f"{len(tiempos)} peticiones ({errores} errores): "
+            f"{len(tiempos) / options['segundos']:.1f} peticiones/s\n"
+            f"p50 {statistics.median(tiempos):.1f} ms · p90 {percentil(0.90):.1f} ms · "
+            f"p99 {percentil(0.99):.1f} ms · máx {tiempos[-1]:.1f} ms"
+        )
+
+    def login(self, options):
+        datos = json.dumps({'username': options['usuario'], 'password': options['contrasena']}).encode()
+        peticion = urllib.request.Request(
+            urljoin(options['servidor'], '/api/token/'), data=datos,
+            headers={'Content-Type': 'application/json'},
+        )
+        try:
+            with urllib.request.urlopen(peticion) as respuesta:
+                return json.load(respuesta)['access']
+        except urllib.error.URLError as e:
+            raise CommandError(f'No se pudo hacer login: {e}')
+
+    async def medir(self, url, cabeceras, options):
+        # Clientes con asyncio y no con hilos: miles de conexiones abiertas a
+        # la vez no caben en hilos de un solo proceso
+        partes = urlsplit(url)
+        ruta = partes.path + (f'?{partes.query}' if partes.query else '')
+        peticion = ''.join(
+            [f'GET {ruta} HTTP/1.1\r\nHost: {partes.netloc}\r\n']
+            + [f'{nombre}: {valor}\r\n' for nombre, valor in cabeceras.items()]
+            + ['Connection: close\r\n' if options['sin_keepalive'] else '', '\r\n']
+        ).encode()
+
+        inicio = time.perf_counter()
+        medir_desde = inicio + options['calentamiento']
+        fin = medir_desde + options['segundos']
+        lentos = [
+            asyncio.create_task(self.cliente_lento(partes.hostname, partes.port or 80, peticion, fin))
+            for _ in range(options['lentos'])
+        ]
+        resultados = await asyncio.gather(*[
+            self.cliente(partes.hostname, partes.port or 80, peticion, medir_desde, fin)
+            for _ in range(options['concurrencia'])
+        ])
+        await asyncio.gather(*lentos)
+        return [t for tiempos, _ in resultados for t in tiempos], sum(e for _, e in resultados)
+
+    async def cliente(self, host, puerto, peticion, medir_desde, fin):
+        tiempos, errores, conexion = [], 0, None
+        while (ahora := time.perf_counter()) < fin:
+            try:
+                if conexion is None:
+                    conexion = await asyncio.open_connection(host, puerto)
+                lector, escritor = conexion
+                escritor.write(peticion)
+                estado, cerrar = await self.respuesta(lector)
+                ok = estado < 400
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                ok, cerrar = False, True
+            # El servidor cierra la conexión si no admite keep-alive (gunicorn sync)
+            if cerrar and conexion is not None:
+                conexion[1].close()
+                conexion = None
+            if ahora >= medir_desde:
+                if ok:
+                    tiempos.append((time.perf_counter() - ahora) * 1000)
+                else:
+                    errores += 1
+        if conexion is not None:
+            conexion[1].close()
+        return tiempos, errores
+
+    async def cliente_lento(self, host, puerto, peticion, fin, intervalo=0.5):
+        # Mientras no termina de llegar la petición, un worker síncrono no
+        # atiende otra; el bucle de eventos del worker ASGI, sí
+        try:
+            _, escritor = await asyncio.open_connection(host, puerto)
+        except OSError:
+            return
+        for byte in peticion[:-2]:
+            if time.perf_counter() >= fin:
+                break
+            escritor.write(bytes([byte]))
+            await asyncio.sleep(intervalo)
+        escritor.close()
+
+    @staticmethod
+    async def respuesta(lector):
+        """Lee una respuesta HTTP/1.1 entera: (código de estado, si hay que cerrar la conexión)."""
+        cabecera = (await lector.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        version, estado = cabecera[0].split(' ')[:2]
+        campos = {}
+        for linea in cabecera[1:]:
+            if ':' in linea:
+                nombre, valor = linea.split(':', 1)
+                campos[nombre.strip().lower()] = valor.strip().lower()
+
+        if 'content-length' in campos:
+            await lector.readexactly(int(campos['content-length']))
+        elif campos.get('transfer-encoding') == 'chunked':
+            while tamano := int((await lector.readuntil(b'\r\n')).split(b';')[0], 16):
+                await lector.readexactly(tamano + 2)
+            await lector.readuntil(b'\r\n')
+        elif int(estado) not in (204, 304):
+            # Sin longitud: el cuerpo termina al cerrar la conexión
+            await lector.read()
+            return int(estado), True
+        return int(estado), campos.get('connection') == 'close' or version == 'HTTP/1.0'
@@ -0,0 +1,97 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from quicknotes.authentication import EmailBackend
+
+CONTRASENA = 'bench-login-123'
+
+
+class Command(BaseCommand):
+    help = (
+        'Carga usuarios de prueba (1M por defecto) y mide cuántos logins por segundo '
+        'resuelve un núcleo con EmailBackend (búsqueda + verificación de la contraseña).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=1_000_000)
+        parser.add_argument('--segundos', type=float, default=10)
+        parser.add_argument('--iteraciones', type=int,
+                            help='Iteraciones de PBKDF2 (por defecto, PASSWORD_PBKDF2_ITERACIONES).')
+        parser.add_argument('--conservar', action='store_true',
+                            help='No borra los usuarios de prueba al terminar.')
+
+    def handle(self, *args, **options):
+        iteraciones = options['iteraciones'] or settings.PASSWORD_PBKDF2_ITERACIONES
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM usuarios")
+            ultimo_id = cursor.fetchone()[0]
+
+        try:
+            with override_settings(PASSWORD_PBKDF2_ITERACIONES=iteraciones):
+                self.cargar(options['usuarios'], ultimo_id)
+                self.medir(options['usuarios'], options['segundos'], iteraciones)
+        finally:
+            if not options['conservar']:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute("DELETE FROM usuarios WHERE id > %s", [ultimo_id])
+
+    def cargar(self, total, ultimo_id, lote=100_000):
+        inicio = time.monotonic()
+        # Todos con la misma contraseña (y el mismo hash): cifrar un millón
+        # de contraseñas distintas llevaría horas
+        hash_ = make_password(CONTRASENA)
+        for desde in range(0, total, lote):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO usuarios (password, is_superuser, username, first_name, last_name,
+                                          email, is_staff, is_active, date_joined, rol)
+                    SELECT %(hash)s, false, 'bench_' || (%(base)s + g), '', '',
+                           'Bench.' || (%(base)s + g) || '@Example.com', false, true, CURRENT_TIMESTAMP, 'cliente'
+                    FROM generate_series(%(desde)s, %(hasta)s) AS g
+                    """,
+                    {'hash': hash_, 'base': ultimo_id, 'desde': desde + 1, 'hasta': min(desde + lote, total)}
+                )
+            self.stdout.write(f'{min(desde + lote, total)} usuarios cargados')
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE usuarios")
+        self.stdout.write(f'Carga: {time.monotonic() - inicio:.1f} s')
+        self._base = ultimo_id
+
+    def credencial(self, total):
+        # La mitad por username y la mitad por email, con otras mayúsculas
+        n = self._base + random.randint(1, total)
+        return f'BENCH_{n}' if random.random() < 0.5 else f'bench.{n}@example.COM'
+
+    def medir(self, total, segundos, iteraciones):
+        backend = EmailBackend()
+
+        # Solo el cifrado, para separar su coste del de la búsqueda
+        inicio = time.perf_counter()
+        make_password(CONTRASENA)
+        hash_ms = (time.perf_counter() - inicio) * 1000
+
+        logins = fallidos = 0
+        inicio = time.perf_counter()
+        while time.perf_counter() - inicio < segundos:
+            if backend.authenticate(None, username=self.credencial(total), password=CONTRASENA) is None:
+                fallidos += 1
+            logins += 1
+        transcurrido = time.perf_counter() - inicio
+
+        self.stdout.write(
+            f'\nPBKDF2 con {iteraciones} iteraciones: {hash_ms:.1f} ms por hash\n'
+            f'{logins} logins en {transcurrido:.1f} s ({fallidos} fallidos): '
+            f'{logins / transcurrido:.1f} logins/s por núcleo, '
+            f'{transcurrido / logins * 1000:.1f} ms por login'
+        )
+
+        # El plan de la búsqueda: debe usar los índices lower() y no recorrer la tabla
+        usuarios = backend.usuarios_con_login(self.credencial(total))[:1]
+        self.stdout.write('\nPlan de la búsqueda:\n' + usuarios.explain(analyze=True))
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from quicknotes.models import Cliente, Pedido, Producto, ReservaStock
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide cuántos checkouts por segundo admite un único producto según el número de '
+        'trabajadores concurrentes, con reservas en cupos o con el UPDATE directo de antes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trabajadores', default='1,2,4,8,16',
+                            help='Lista de niveles de concurrencia (por defecto 1,2,4,8,16).')
+        parser.add_argument('--segundos', type=float, default=5.0,
+                            help='Duración de cada medición.')
+        parser.add_argument('--modo', choices=['reservas', 'directo', 'ambos'], default='ambos')
+
+    def handle(self, *args, **options):
+        niveles = [int(n) for n in options['trabajadores'].split(',')]
+        modos = ['directo', 'reservas'] if options['modo'] == 'ambos' else [options['modo']]
+
+        cliente = Cliente.objects.create(nombre='Bench', apellido='Reservas',
+                                         email=f'bench-reservas-{time.time()}@example.com')
+        producto = Producto.objects.create(nombre='bench-reservas', precio=1, stock=10 ** 9)
+        try:
+            for modo in modos:
+                self.stdout.write(f'\nModo: {modo}')
+                self.stdout.write(f"{'trabajadores':>12} {'pedidos/s':>12} {'escala':>8}")
+                base = None
+                for n in niveles:
+                    por_segundo = self.medir(modo, n, options['segundos'], cliente.id, producto.id)
+                    base = base or por_segundo
+                    self.stdout.write(f'{n:>12} {por_segundo:>12.1f} {por_segundo / base:>7.2f}x')
+        finally:
+            pedidos = Pedido.objects.filter(cliente=cliente)
+            ReservaStock.objects.filter(pedido__in=pedidos).delete()
+            pedidos.delete()
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("DELETE FROM reservas_stock WHERE producto_id = %s", [producto.id])
+                cursor.execute("DELETE FROM stock_cupos WHERE producto_id = %s", [producto.id])
+                cursor.execute("DELETE FROM productos WHERE id = %s", [producto.id])
+            cliente.delete()
+
+    def medir(self, modo, trabajadores, segundos, cliente_id, producto_id):
+        fin = time.monotonic() + segundos
+        contadores = [0] * trabajadores
+        checkout = self.checkout_reservas if modo == 'reservas' else self.checkout_directo
+
+        def trabajar(i):
+            try:
+                while time.monotonic() < fin:
+                    checkout(cliente_id, producto_id)
+                    contadores[i] += 1
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar, args=(i,)) for i in range(trabajadores)]
+        inicio = time.monotonic()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return sum(contadores) / (time.monotonic() - inicio)
+
+    @staticmethod
+    def checkout_reservas(cliente_id, producto_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CALL registrar_pedido(%s, 'pendiente', %s::integer[], %s::integer[], %s::numeric[])",
+                [cliente_id, [producto_id], [1], [1]]
+            )
+
+    @staticmethod
+    def checkout_directo(cliente_id, producto_id):
+        # Lo que hacía registrar_pedido antes: el UPDATE sobre la fila del
+        # producto mantiene el bloqueo hasta el commit.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL quicknotes.liquidando = 'on'")
+            cursor.execute("UPDATE productos SET stock = stock - 1 WHERE id = %s", [producto_id])
+            cursor.execute(
+                "INSERT INTO pedidos (cliente_id, estado, total, fecha_pedido) "
+                "VALUES (%s, 'pendiente', 1, CURRENT_TIMESTAMP)",
+                [cliente_id]
+            )
@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from quicknotes.models import Pedido, Usuario
+from quicknotes.renderers import JSONRapidoRenderer
+from quicknotes.views import ClienteViewSet, DevolucionViewSet, PedidoViewSet, ProductoViewSet
+
+# (descripción, ViewSet, parámetros del listado)
+LISTADOS = [
+    ('pedidos con sus líneas', PedidoViewSet, {'expand': 'detalle_pedidos'}),
+    ('pedidos (compacto)', PedidoViewSet, {}),
+    ('productos', ProductoViewSet, {'expand': 'descripcion,fecha_creacion'}),
+    ('clientes con su usuario', ClienteViewSet, {'expand': 'usuario,direccion,telefono'}),
+    ('devoluciones', DevolucionViewSet, {}),
+]
+
+# (descripción, LECTURA_RAPIDA, renderer)
+MODOS = [
+    ('serializer + json', False, JSONRenderer),
+    ('serializer + orjson', False, JSONRapidoRenderer),
+    ('values() + orjson', True, JSONRapidoRenderer),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide cuántas filas por segundo sirven los listados de la API (página de 200, en el '
+        'proceso, sin HTTP) con el serializer y con la lectura rápida de '
+        'quicknotes/lectura_rapida.py. Usa los datos que haya (ver generar_datos).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=5, help='Por listado y modo.')
+        parser.add_argument('--page-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if not Pedido.objects.exists():
+            raise CommandError('No hay pedidos: cárgalos antes con "manage.py generar_datos".')
+        # Sin guardar: basta para los permisos y para ver todos los pedidos
+        admin = Usuario(username='bench', rol='administrador')
+        fabrica = APIRequestFactory()
+
+        self.stdout.write(f"{'listado':<26}" + ''.join(f'{modo:>22}' for modo, _, _ in MODOS) + f"{'mejora':>9}")
+        # Sin la caché del catálogo, que respondería sin leer ni serializar
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            for descripcion, viewset, parametros in LISTADOS:
+                resultados = []
+                for _, rapida, renderer in MODOS:
+                    vista = viewset.as_view({'get': 'list'}, renderer_classes=[renderer])
+                    with override_settings(LECTURA_RAPIDA=rapida):
+                        resultados.append(self.medir(vista, fabrica, admin, {
+                            **parametros, 'page_size': options['page_size'],
+                        }, options['segundos']))
+                self.stdout.write(f'{descripcion:<26}' + ''.join(f'{filas:>16,.0f} fil/s' for filas in resultados)
+                                  + f'{resultados[-1] / resultados[0]:>8.1f}x')
+
+    def medir(self, vista, fabrica, usuario, parametros, segundos):
+        filas = 0
+        inicio = time.perf_counter()
+        while time.perf_counter() - inicio < segundos:
+            request = fabrica.get('/api/', parametros)
+            force_authenticate(request, user=usuario)
+            response = vista(request)
+            response.render()
+            if response.status_code != 200:
+                raise CommandError(f'{response.status_code}: {response.content[:200]!r}')
+            filas += len(response.data['results'])
+        return filas / (time.perf_counter() - inicio)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quicknotes.datos_prueba import CONTRASENA, PREFIJO, generar_datos
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera datos de prueba con sesgo realista (clientes y productos populares, más pedidos '
+        'recientes): usuarios, clientes, productos, pedidos con sus líneas y devoluciones. Se '
+        'añaden a los que ya hay. Ver quicknotes/datos_prueba.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=10_000,
+                            help='Clientes, cada uno con su usuario.')
+        parser.add_argument('--empleados', type=int, default=10)
+        parser.add_argument('--productos', type=int, default=10_000)
+        parser.add_argument('--pedidos', type=int, default=1_000_000)
+        parser.add_argument('--lineas-por-pedido', type=int, default=3, help='Media de líneas por pedido.')
+        parser.add_argument('--devoluciones', type=float, default=0.02,
+                            help='Fracción de las líneas que se devuelven.')
+        parser.add_argument('--dias', type=int, default=365, help='Días de historial de pedidos.')
+        parser.add_argument('--sesgo', type=float, default=2.0,
+                            help='Concentración de los pedidos en pocos clientes y productos (1 = uniforme).')
+        parser.add_argument('--lote', type=int, default=50_000, help='Pedidos por transacción.')
+        parser.add_argument('--semilla', type=float,
+                            help='Semilla de random() de PostgreSQL (de -1 a 1), para repetir los mismos datos.')
+
+    def handle(self, *args, **options):
+        if options['lineas_por_pedido'] < 1 or options['sesgo'] < 1 or options['lote'] < 1:
+            raise CommandError('--lineas-por-pedido, --sesgo y --lote deben ser al menos 1.')
+        if options['semilla'] is not None and not -1 <= options['semilla'] <= 1:
+            raise CommandError('--semilla debe estar entre -1 y 1.')
+        try:
+            insertados = generar_datos(
+                clientes=options['clientes'], empleados=options['empleados'], productos=options['productos'],
+                pedidos=options['pedidos'], lineas_por_pedido=options['lineas_por_pedido'],
+                devoluciones=options['devoluciones'], dias=options['dias'], sesgo=options['sesgo'],
+                lote=options['lote'], semilla=options['semilla'], progreso=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        for tabla, cantidad in insertados.items():
+            self.stdout.write(f'{tabla:<16} {cantidad:>12}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Usuarios {PREFIJO}_cliente_<id> y {PREFIJO}_empleado_<id> con la contraseña '{CONTRASENA}'"
+        ))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DataError
+
+from quicknotes.importacion import ErrorDeImportacion, importar_clientes, importar_productos
+
+IMPORTADORES = {
+    'productos': importar_productos,
+    'clientes': importar_clientes,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa productos (por sku) o clientes (por email) desde un CSV con cabecera, '
+        'con COPY y sentencias por conjuntos. Informa de las filas rechazadas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=sorted(IMPORTADORES))
+        parser.add_argument('archivo', help='Ruta del CSV (UTF-8).')
+        parser.add_argument('--errores', type=int, default=20,
+                            help='Filas rechazadas que se muestran (todas cuentan en el total).')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        try:
+            with open(options['archivo'], 'rb') as archivo:
+                resultado = IMPORTADORES[options['tipo']](archivo)
+        except OSError as e:
+            raise CommandError(str(e))
+        except (ErrorDeImportacion, DataError) as e:
+            raise CommandError(str(e).splitlines()[0])
+        transcurrido = time.monotonic() - inicio
+
+        filas = resultado['insertados'] + resultado['actualizados'] + resultado['sin_cambios'] + resultado['rechazados']
+        for error in resultado['errores'][:options['errores']]:
+            self.stderr.write(f"fila {error['fila']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['insertados']} insertados, {resultado['actualizados']} actualizados, "
+            f"{resultado['sin_cambios']} sin cambios, {resultado['rechazados']} rechazados "
+            f"({filas} filas en {transcurrido:.1f} s, {filas / max(transcurrido, 1e-9):.0f} filas/s)"
+        ))
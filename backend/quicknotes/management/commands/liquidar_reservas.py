@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quicknotes.reservas import liquidar_reservas
+
+
+class Command(BaseCommand):
+    help = 'Vuelca las reservas de stock pendientes en productos.stock, por lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=10000,
+                            help='Reservas por transacción (por defecto 10000).')
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help='Segundos de espera cuando no queda nada pendiente.')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Liquida todo lo pendiente y termina.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            liquidadas = liquidar_reservas(options['lote'])
+            total += liquidadas
+            if liquidadas:
+                self.stdout.write(f'{liquidadas} reservas liquidadas')
+                continue
+            if options['una_vez']:
+                break
+            time.sleep(options['intervalo'])
+        self.stdout.write(self.style.SUCCESS(f'Total liquidadas: {total}'))
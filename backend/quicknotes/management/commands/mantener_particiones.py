@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from quicknotes.particiones import MESES_POR_ADELANTADO, archivar_particiones, crear_particiones, particiones
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea por adelantado las particiones mensuales de pedidos, detalle_pedidos y devoluciones '
+        'y, si se pide, archiva las antiguas en el esquema "archivo". Pensado para ejecutarse a diario.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, default=MESES_POR_ADELANTADO,
+                            help=f'Meses por delante del actual con partición (por defecto {MESES_POR_ADELANTADO}).')
+        parser.add_argument('--archivar-meses', type=int, default=None, metavar='N',
+                            help='Archiva las particiones anteriores a los últimos N meses completos.')
+        parser.add_argument('--listar', action='store_true',
+                            help='Muestra las particiones y sus filas (estimadas) al terminar.')
+
+    def handle(self, *args, **options):
+        for nombre in crear_particiones(options['meses']):
+            self.stdout.write(f'Creada {nombre}')
+        if options['archivar_meses'] is not None:
+            for nombre in archivar_particiones(options['archivar_meses']):
+                self.stdout.write(f'Archivada {nombre}')
+        if options['listar']:
+            for particion in particiones():
+                self.stdout.write(
+                    f"{particion['particion']:<32}{particion['rango']:<80}{particion['filas']:>12}"
+                )
+        self.stdout.write(self.style.SUCCESS('Particiones al día'))
@@ -0,0 +1,82 @@
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from quicknotes.tareas import MANEJADORES, procesar_lote, reintentar_fallidas
+
+
+class Command(BaseCommand):
+    help = (
+        'Procesa la cola de tareas en segundo plano (quicknotes.tareas) por lotes. '
+        'Con --hilos N trabajan N hilos, cada uno con su conexión; también se pueden '
+        'arrancar varios procesos: se reparten las tareas sin repetirlas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', action='append', choices=sorted(MANEJADORES),
+                            help='Solo las tareas de este tipo (se puede repetir). Por defecto, todas.')
+        parser.add_argument('--lote', type=int, default=None,
+                            help='Tareas por transacción (por defecto, el lote de cada tipo).')
+        parser.add_argument('--hilos', type=int, default=1,
+                            help='Hilos que procesan tareas a la vez (por defecto 1).')
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help='Segundos de espera cuando no queda nada pendiente.')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesa todo lo pendiente y termina.')
+        parser.add_argument('--reintentar-fallidas', action='store_true',
+                            help='Antes de empezar, devuelve a la cola las tareas fallidas.')
+
+    def handle(self, *args, **options):
+        if options['hilos'] < 1:
+            raise CommandError('--hilos debe ser al menos 1')
+        tipos = options['tipo'] or sorted(MANEJADORES)
+        if options['reintentar_fallidas']:
+            self.stdout.write(f'{reintentar_fallidas(tipos)} tareas fallidas devueltas a la cola')
+
+        parar = threading.Event()
+        totales = []
+        if options['hilos'] == 1:
+            totales.append(self.trabajar(tipos, options, parar))
+        else:
+            hilos = [
+                threading.Thread(target=self.trabajar_en_hilo, args=(tipos, options, parar, totales))
+                for _ in range(options['hilos'])
+            ]
+            for hilo in hilos:
+                hilo.start()
+            try:
+                for hilo in hilos:
+                    while hilo.is_alive():
+                        hilo.join(0.5)
+            except KeyboardInterrupt:
+                # Cada hilo termina el lote que tenga entre manos
+                parar.set()
+                for hilo in hilos:
+                    hilo.join()
+        hechas = sum(h for h, _ in totales)
+        fallidas = sum(f for _, f in totales)
+        self.stdout.write(self.style.SUCCESS(f'Total hechas: {hechas}, fallidas: {fallidas}'))
+
+    def trabajar_en_hilo(self, tipos, options, parar, totales):
+        try:
+            totales.append(self.trabajar(tipos, options, parar))
+        finally:
+            # Cada hilo abre su propia conexión
+            connection.close()
+
+    def trabajar(self, tipos, options, parar):
+        hechas = fallidas = 0
+        while not parar.is_set():
+            procesadas = 0
+            for tipo in tipos:
+                h, f = procesar_lote(tipo, options['lote'])
+                hechas, fallidas, procesadas = hechas + h, fallidas + f, procesadas + h + f
+                if h or f:
+                    self.stdout.write(f'{tipo}: {h} hechas, {f} fallidas')
+            if procesadas:
+                continue
+            if options['una_vez']:
+                break
+            parar.wait(options['intervalo'])
+        return hechas, fallidas
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from quicknotes.cambios import purgar_cambios
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra los cambios antiguos de la sincronización incremental (tabla cambios). '
+        'Pensado para ejecutarse a diario.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=settings.CAMBIOS_RETENCION_DIAS,
+                            help=f'Días que se guardan (por defecto {settings.CAMBIOS_RETENCION_DIAS}, '
+                                 'CAMBIOS_RETENCION_DIAS).')
+
+    def handle(self, *args, **options):
+        borrados = purgar_cambios(options['dias'])
+        self.stdout.write(self.style.SUCCESS(f'{borrados} cambios borrados'))
@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quicknotes.ventas import reconstruir_ventas
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los acumulados de ventas (ventas_diarias, ventas_producto_diarias y '
+        'ventas_cliente_diarias) desde pedidos, líneas y devoluciones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=date.fromisoformat,
+                            help='Primer día a recalcular (AAAA-MM-DD). Sin rango se recalcula todo.')
+        parser.add_argument('--hasta', type=date.fromisoformat,
+                            help='Último día a recalcular (por defecto, hoy).')
+        parser.add_argument('--dias-por-lote', type=int, default=31,
+                            help='Días recalculados por transacción cuando se indica un rango.')
+
+    def handle(self, *args, **options):
+        desde, hasta = options['desde'], options['hasta']
+        if not desde:
+            if hasta:
+                raise CommandError('--hasta requiere --desde.')
+            reconstruir_ventas()
+            self.stdout.write(self.style.SUCCESS('Acumulados de ventas recalculados.'))
+            return
+
+        hasta = hasta or date.today()
+        if desde > hasta:
+            raise CommandError('--desde no puede ser posterior a --hasta.')
+
+        # Por tramos, para no bloquear las escrituras de los acumulados durante todo el rango
+        paso = timedelta(days=options['dias_por_lote'])
+        inicio = desde
+        while inicio <= hasta:
+            fin = min(inicio + paso - timedelta(days=1), hasta)
+            reconstruir_ventas(inicio, fin)
+            self.stdout.write(f'{inicio} a {fin} recalculado')
+            inicio = fin + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS('Acumulados de ventas recalculados.'))
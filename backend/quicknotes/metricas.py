@@ -0,0 +1,369 @@
+"""
+Métricas de cada petición: tiempo total, consultas SQL y serialización.
+
+metricas_middleware (el primero de MIDDLEWARE) mide cada petición:
+
+- total: hasta que la vista devuelve la respuesta (en las exportaciones,
+  antes de generar el archivo);
+- db: número de consultas y tiempo en ellas. Lo apunta un execute wrapper
+  que se instala en cada conexión a la base de datos al abrirla;
+- auth y ser, en las vistas de DRF con MetricasMixin: autenticación y
+  permisos, y el resto de la vista sin contar el SQL (serializers,
+  paginación y render del JSON);
+- lim, en las acciones con límites de peticiones: su comprobación (ya
+  incluida en auth, ver quicknotes/limites.py).
+
+Con METRICAS_SERVER_TIMING (por defecto, solo con DEBUG) cada respuesta
+lleva la medida en la cabecera Server-Timing (la muestran las herramientas
+de desarrollo del navegador). La medida se acumula en histogramas
+por vista y acción (PedidoViewSet / list) que GET /api/metricas/ publica en
+el formato de Prometheus (solo administradores). Con varios workers de
+gunicorn, cada proceso escribe las suyas cada METRICAS_VOLCAR_CADA segundos
+en METRICAS_DIR y la publicación las suma; sin METRICAS_DIR solo se ven las
+del proceso que atiende la petición. Cuando un worker termina, gunicorn
+suma las suyas a las de los workers anteriores (retirar_proceso).
+
+Las consultas que tardan METRICAS_SQL_LENTA_MS o más, en una petición o
+fuera de ella (comandos, liquidador), se registran en el logger
+'quicknotes.sql_lenta' con su SQL (sin los parámetros) y la línea de
+nuestro código que la lanzó.
+
+El coste es el de medir el tiempo dos veces por consulta y sumar en unos
+contadores por petición: se puede dejar activo en producción.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.response import Response
+
+logger = logging.getLogger('quicknotes.sql_lenta')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# nombre -> (descripción, límites de los buckets)
+HISTOGRAMAS = {
+    'quicknotes_peticion_segundos': ('Duración de la petición hasta que la vista responde.', BUCKETS_SEGUNDOS),
+    'quicknotes_sql_segundos': ('Tiempo en consultas SQL por petición.', BUCKETS_SEGUNDOS),
+    'quicknotes_sql_consultas': ('Consultas SQL por petición.', BUCKETS_CONSULTAS),
+    'quicknotes_serializacion_segundos': (
+        'Tiempo de la vista de DRF sin el SQL: serializers, paginación y render.', BUCKETS_SEGUNDOS
+    ),
+}
+CONTADORES = {
+    'quicknotes_peticiones_total': 'Peticiones por código de respuesta.',
+    'quicknotes_sql_lentas_total': 'Consultas más lentas que METRICAS_SQL_LENTA_MS.',
+}
+
+# Otros métodos se cuentan juntos: el método lo elige el cliente
+METODOS = {'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+_medicion = ContextVar('quicknotes_metricas_medicion', default=None)
+
+
+class Registro:
+    """Histogramas y contadores del proceso, por nombre y etiquetas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (nombre, etiquetas) -> [peticiones de cada bucket..., las de +Inf, suma]
+        self.histogramas = {}
+        self.contadores = {}
+        self.volcado = 0.0
+
+    def observar(self, nombre, etiquetas, valor):
+        limites = HISTOGRAMAS[nombre][1]
+        with self.lock:
+            datos = self.histogramas.get((nombre, etiquetas))
+            if datos is None:
+                datos = self.histogramas[(nombre, etiquetas)] = [0] * (len(limites) + 2)
+            datos[bisect.bisect_left(limites, valor)] += 1
+            datos[-1] += valor
+
+    def sumar(self, nombre, etiquetas, cantidad=1):
+        with self.lock:
+            self.contadores[(nombre, etiquetas)] = self.contadores.get((nombre, etiquetas), 0) + cantidad
+
+    def foto(self):
+        with self.lock:
+            return {
+                'histogramas': [[nombre, etiquetas, list(datos)] for (nombre, etiquetas), datos in self.histogramas.items()],
+                'contadores': [[nombre, etiquetas, valor] for (nombre, etiquetas), valor in self.contadores.items()],
+            }
+
+    def volcar(self):
+        """Escribe las métricas del proceso en METRICAS_DIR, como mucho cada METRICAS_VOLCAR_CADA segundos."""
+        if not settings.METRICAS_DIR or time.monotonic() - self.volcado < settings.METRICAS_VOLCAR_CADA:
+            return
+        self.volcado = time.monotonic()
+        _escribir(Path(settings.METRICAS_DIR) / f'{os.getpid()}.json', self.foto())
+
+
+def _escribir(archivo, foto):
+    temporal = archivo.with_suffix('.tmp')
+    temporal.write_text(json.dumps(foto))
+    # Quien lea el archivo lo ve entero, antes o después de escribirlo
+    os.replace(temporal, archivo)
+
+
+registro = Registro()
+
+
+class Medicion:
+    """Lo medido en la petición en curso (segundos)."""
+
+    def __init__(self, request):
+        self.request = request
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.sql = 0.0
+        self.auth = None
+        self.ser = None
+        # Comprobación de los límites de peticiones (ver quicknotes/limites.py)
+        self.lim = None
+        self._vista = None
+
+    def empezar_vista(self):
+        self._vista = (time.perf_counter(), self.sql)
+
+    def terminar_vista(self):
+        if self._vista is not None:
+            inicio, sql = self._vista
+            self.ser = max(0.0, time.perf_counter() - inicio - (self.sql - sql))
+            self._vista = None
+
+
+def medicion_en_curso():
+    """La Medicion de la petición en curso, o None fuera de una petición."""
+    return _medicion.get()
+
+
+def _etiquetas(request):
+    """(vista, acción, método): el ViewSet y su acción, o el nombre de la URL."""
+    metodo = request.method if request.method in METODOS else 'otro'
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ('vista', 'ninguna'), ('accion', ''), ('metodo', metodo)
+    cls = getattr(match.func, 'cls', None)
+    if cls is not None:
+        acciones = getattr(match.func, 'actions', None) or {}
+        return ('vista', cls.__name__), ('accion', acciones.get(metodo.lower(), '')), ('metodo', metodo)
+    return ('vista', match.view_name or match._func_path), ('accion', ''), ('metodo', metodo)
+
+
+def _origen():
+    """La última línea de nuestro código en la pila (no de Django ni de DRF)."""
+    for marco in reversed(traceback.extract_stack()[:-3]):
+        if marco.filename.startswith(str(settings.BASE_DIR)) and 'site-packages' not in marco.filename:
+            return f'{os.path.relpath(marco.filename, settings.BASE_DIR)}:{marco.lineno} ({marco.name})'
+    return 'desconocido'
+
+
+def _consulta_lenta(sql, duracion, medicion):
+    vista = dict(_etiquetas(medicion.request))['vista'] if medicion else 'fuera de una petición'
+    registro.sumar('quicknotes_sql_lentas_total', (('vista', vista),))
+    logger.warning('Consulta lenta (%.0f ms) en %s, desde %s: %s', duracion * 1000, vista, _origen(), sql)
+
+
+def _medir_sql(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = time.perf_counter() - inicio
+        if medicion is not None:
+            medicion.consultas += 1
+            medicion.sql += duracion
+        if duracion * 1000 >= settings.METRICAS_SQL_LENTA_MS:
+            _consulta_lenta(sql, duracion, medicion)
+
+
+@receiver(connection_created)
+def instalar_medicion_sql(sender, connection, **kwargs):
+    # Se vuelve a llamar cada vez que la conexión se reabre
+    if _medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_sql)
+
+
+def _registrar(medicion, response):
+    total = time.perf_counter() - medicion.inicio
+    etiquetas = _etiquetas(medicion.request)
+    registro.observar('quicknotes_peticion_segundos', etiquetas, total)
+    registro.observar('quicknotes_sql_segundos', etiquetas, medicion.sql)
+    registro.observar('quicknotes_sql_consultas', etiquetas, medicion.consultas)
+    if medicion.ser is not None:
+        registro.observar('quicknotes_serializacion_segundos', etiquetas, medicion.ser)
+    registro.sumar('quicknotes_peticiones_total', etiquetas + (('codigo', str(response.status_code)),))
+
+    if settings.METRICAS_SERVER_TIMING:
+        partes = [f'total;dur={total * 1000:.1f}',
+                  f'db;dur={medicion.sql * 1000:.1f};desc="{medicion.consultas} consultas"']
+        if medicion.auth is not None:
+            partes.append(f'auth;dur={medicion.auth * 1000:.1f}')
+        if medicion.ser is not None:
+            partes.append(f'ser;dur={medicion.ser * 1000:.1f}')
+        if medicion.lim is not None:
+            partes.append(f'lim;dur={medicion.lim * 1000:.2f}')
+        response['Server-Timing'] = ', '.join(partes)
+    registro.volcar()
+
+
+@sync_and_async_middleware
+def metricas_middleware(get_response):
+    """Mide cada petición y la suma a las métricas del proceso."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            medicion = Medicion(request)
+            token = _medicion.set(medicion)
+            try:
+                response = await get_response(request)
+            finally:
+                _medicion.reset(token)
+            _registrar(medicion, response)
+            return response
+    else:
+        def middleware(request):
+            medicion = Medicion(request)
+            token = _medicion.set(medicion)
+            try:
+                response = get_response(request)
+            finally:
+                _medicion.reset(token)
+            _registrar(medicion, response)
+            return response
+    return middleware
+
+
+class MetricasMixin:
+    """
+    Para los ViewSets: separa en las métricas la autenticación (con los
+    permisos) del resto de la vista. La respuesta se renderiza aquí para
+    contar el JSON dentro de la serialización.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        medicion = _medicion.get()
+        if medicion is None:
+            return super().initial(request, *args, **kwargs)
+        inicio = time.perf_counter()
+        try:
+            super().initial(request, *args, **kwargs)
+        finally:
+            medicion.auth = time.perf_counter() - inicio
+        medicion.empezar_vista()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        medicion = _medicion.get()
+        if medicion is not None:
+            if isinstance(response, Response) and not response.is_rendered:
+                response.render()
+            medicion.terminar_vista()
+        return response
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _linea(nombre, etiquetas, valor):
+    if not etiquetas:
+        return f'{nombre} {valor}'
+    texto = ','.join('%s="%s"' % (clave, _escapar(v)) for clave, v in etiquetas)
+    return f'{nombre}{{{texto}}} {valor}'
+
+
+def _fotos():
+    """Las métricas de este proceso y, con METRICAS_DIR, las que volcaron los demás."""
+    fotos = [registro.foto()]
+    if settings.METRICAS_DIR:
+        for archivo in Path(settings.METRICAS_DIR).glob('*.json'):
+            if archivo.stem == str(os.getpid()):
+                continue
+            try:
+                fotos.append(json.loads(archivo.read_text()))
+            except (OSError, ValueError):
+                continue
+    return fotos
+
+
+# Métricas de los workers que ya terminaron, en METRICAS_DIR
+TERMINADOS = 'terminados.json'
+
+
+def retirar_proceso(directorio, pid):
+    """
+    Suma las métricas que volcó un proceso que ha terminado a las de
+    TERMINADOS y borra su archivo: los contadores no bajan, los archivos no se
+    acumulan y un proceso nuevo con el mismo PID no hereda sus métricas. Lo
+    llama el proceso maestro de gunicorn (child_exit en gunicorn.conf.py).
+    """
+    directorio = Path(directorio)
+    archivo = directorio / f'{pid}.json'
+    try:
+        foto = json.loads(archivo.read_text())
+    except (OSError, ValueError):
+        foto = None
+    if foto is not None:
+        fotos = [foto]
+        try:
+            fotos.append(json.loads((directorio / TERMINADOS).read_text()))
+        except (OSError, ValueError):
+            pass
+        histogramas, contadores = _sumar(fotos)
+        _escribir(directorio / TERMINADOS, {
+            'histogramas': [[nombre, etiquetas, datos] for (nombre, etiquetas), datos in histogramas.items()],
+            'contadores': [[nombre, etiquetas, valor] for (nombre, etiquetas), valor in contadores.items()],
+        })
+    archivo.unlink(missing_ok=True)
+    archivo.with_suffix('.tmp').unlink(missing_ok=True)
+
+
+def _sumar(fotos):
+    histogramas, contadores = {}, {}
+    for foto in fotos:
+        for nombre, etiquetas, datos in foto['histogramas']:
+            clave = (nombre, tuple(map(tuple, etiquetas)))
+            acumulado = histogramas.setdefault(clave, [0] * len(datos))
+            histogramas[clave] = [a + b for a, b in zip(acumulado, datos)]
+        for nombre, etiquetas, valor in foto['contadores']:
+            clave = (nombre, tuple(map(tuple, etiquetas)))
+            contadores[clave] = contadores.get(clave, 0) + valor
+    return histogramas, contadores
+
+
+def exposicion():
+    """Texto de las métricas en el formato de Prometheus, sumando los procesos."""
+    histogramas, contadores = _sumar(_fotos())
+    lineas = []
+    for nombre, (descripcion, limites) in HISTOGRAMAS.items():
+        lineas += [f'# HELP {nombre} {descripcion}', f'# TYPE {nombre} histogram']
+        for (nombre_serie, etiquetas), datos in sorted(histogramas.items()):
+            if nombre_serie != nombre:
+                continue
+            acumulado = 0
+            for limite, cantidad in zip([*limites, '+Inf'], datos[:-1]):
+                acumulado += cantidad
+                lineas.append(_linea(f'{nombre}_bucket', etiquetas + (('le', limite),), acumulado))
+            lineas.append(_linea(f'{nombre}_sum', etiquetas, round(datos[-1], 6)))
+            lineas.append(_linea(f'{nombre}_count', etiquetas, acumulado))
+    for nombre, descripcion in CONTADORES.items():
+        lineas += [f'# HELP {nombre} {descripcion}', f'# TYPE {nombre} counter']
+        lineas += [_linea(nombre, etiquetas, valor)
+                   for (nombre_serie, etiquetas), valor in sorted(contadores.items()) if nombre_serie == nombre]
+    return '\n'.join(lineas) + '\n'
@@ -14,6 +14,11 @@ class Migration(migrations.Migration):
         ('quicknotes', '0001_initial'),
     ]
 
+    # Usuario es AUTH_USER_MODEL: la tabla del log del admin le apunta
+    run_before = [
+        ('admin', '0001_initial'),
+    ]
+
     operations = [
         migrations.CreateModel(
             name='Cliente',
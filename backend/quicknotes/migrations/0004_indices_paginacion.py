@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0003_alter_cliente_table_alter_detallepedido_table_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['nombre', 'id'], name='clientes_nombre_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='devolucion',
+            index=models.Index(fields=['-fecha_devolucion', '-id'], name='devoluciones_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['-fecha_pedido', '-id'], name='pedidos_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', '-fecha_pedido', '-id'], name='pedidos_cliente_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['nombre', 'id'], name='productos_nombre_id_idx'),
+        ),
+    ]
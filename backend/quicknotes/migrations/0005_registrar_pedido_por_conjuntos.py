@@ -0,0 +1,80 @@
+# Las rutinas de postgres.sql pasan a versionarse también con las migraciones,
+# para que cualquier base creada con `migrate` (incluida la de tests) las tenga.
+
+from django.db import migrations
+
+
+REGISTRAR_PEDIDO = """
+CREATE OR REPLACE PROCEDURE registrar_pedido(
+    p_cliente_id INTEGER,
+    p_estado VARCHAR(50),
+    p_productos_ids INTEGER[],
+    p_cantidades INTEGER[],
+    p_precios_unitarios DECIMAL(10, 2)[]
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_pedido_id BIGINT;
+BEGIN
+    -- El total se calcula de una vez sobre todas las líneas
+    INSERT INTO pedidos (cliente_id, estado, total, fecha_pedido)
+    SELECT p_cliente_id, p_estado, COALESCE(SUM(l.cantidad * l.precio_unitario), 0), CURRENT_TIMESTAMP
+    FROM unnest(p_cantidades, p_precios_unitarios) AS l(cantidad, precio_unitario)
+    RETURNING id INTO v_pedido_id;
+
+    -- Todas las líneas en un solo INSERT. El stock lo descuenta el trigger
+    -- actualizar_stock, una sola vez por producto.
+    INSERT INTO detalle_pedidos (pedido_id, producto_id, cantidad, precio_unitario, subtotal)
+    SELECT v_pedido_id, l.producto_id, l.cantidad, l.precio_unitario, l.cantidad * l.precio_unitario
+    FROM unnest(p_productos_ids, p_cantidades, p_precios_unitarios) AS l(producto_id, cantidad, precio_unitario);
+END;
+$$;
+"""
+
+ACTUALIZAR_STOCK = """
+CREATE OR REPLACE FUNCTION fn_actualizar_stock_al_vender()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Bloqueamos los productos siempre en orden de id para no provocar deadlocks
+    PERFORM 1 FROM productos
+    WHERE id IN (SELECT producto_id FROM lineas_nuevas)
+    ORDER BY id
+    FOR UPDATE;
+
+    UPDATE productos p
+    SET stock = p.stock - v.cantidad
+    FROM (
+        SELECT producto_id, SUM(cantidad) AS cantidad
+        FROM lineas_nuevas
+        GROUP BY producto_id
+    ) v
+    WHERE p.id = v.producto_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS actualizar_stock ON detalle_pedidos;
+CREATE TRIGGER actualizar_stock
+AFTER INSERT ON detalle_pedidos
+REFERENCING NEW TABLE AS lineas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_actualizar_stock_al_vender();
+"""
+
+ELIMINAR = """
+DROP TRIGGER IF EXISTS actualizar_stock ON detalle_pedidos;
+DROP FUNCTION IF EXISTS fn_actualizar_stock_al_vender();
+DROP PROCEDURE IF EXISTS registrar_pedido(INTEGER, VARCHAR, INTEGER[], INTEGER[], DECIMAL[]);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0004_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(REGISTRAR_PEDIDO + ACTUALIZAR_STOCK, reverse_sql=ELIMINAR),
+    ]
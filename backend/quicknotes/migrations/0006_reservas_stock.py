@@ -0,0 +1,294 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Número de cupos en que se reparte el stock de cada producto
+CUPOS_POR_PRODUCTO = 8
+
+RUTINAS = '''
+CREATE OR REPLACE FUNCTION repartir_cupos(p_productos_ids BIGINT[])
+RETURNS VOID AS $$
+BEGIN
+    PERFORM set_config('quicknotes.liquidando', 'on', true);
+
+    -- Siempre se bloquean primero los productos, en orden de id
+    PERFORM 1 FROM productos WHERE id = ANY(p_productos_ids) ORDER BY id FOR UPDATE;
+
+    -- Espera a que terminen los checkouts que estén usando estos cupos
+    DELETE FROM stock_cupos WHERE producto_id = ANY(p_productos_ids);
+
+    -- Lo reservado y aún no liquidado se descuenta antes de repartir el stock
+    WITH pendientes AS (
+        UPDATE reservas_stock
+        SET fecha_liquidacion = CURRENT_TIMESTAMP
+        WHERE producto_id = ANY(p_productos_ids) AND fecha_liquidacion IS NULL
+        RETURNING producto_id, cantidad
+    )
+    UPDATE productos p
+    SET stock = p.stock - r.cantidad
+    FROM (SELECT producto_id, SUM(cantidad) AS cantidad FROM pendientes GROUP BY producto_id) r
+    WHERE p.id = r.producto_id;
+
+    INSERT INTO stock_cupos (producto_id, disponible)
+    SELECT p.id,
+           GREATEST(p.stock, 0) / %(cupos)s
+           + CASE WHEN g <= GREATEST(p.stock, 0) %% %(cupos)s THEN 1 ELSE 0 END
+    FROM productos p
+    CROSS JOIN generate_series(1, %(cupos)s) AS g
+    WHERE p.id = ANY(p_productos_ids);
+
+    PERFORM set_config('quicknotes.liquidando', 'off', true);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reservar_stock(p_producto_id BIGINT, p_cantidad INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_cupo BIGINT;
+    v_total INTEGER;
+    v_cupos INTEGER;
+    v_resta INTEGER := p_cantidad;
+    v_tomado INTEGER;
+    c RECORD;
+BEGIN
+    FOR intento IN 1..3 LOOP
+        -- Camino rápido: cualquier cupo con saldo suficiente que nadie tenga bloqueado
+        UPDATE stock_cupos
+        SET disponible = disponible - p_cantidad
+        WHERE id = (
+            SELECT id FROM stock_cupos
+            WHERE producto_id = p_producto_id AND disponible >= p_cantidad
+            ORDER BY random()
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id INTO v_cupo;
+
+        IF v_cupo IS NOT NULL THEN
+            RETURN;
+        END IF;
+
+        -- Camino lento (poco stock o todos los cupos ocupados): se bloquean
+        -- todos los cupos del producto en orden de id y se toma de varios
+        SELECT COALESCE(SUM(disponible), 0), COUNT(*) INTO v_total, v_cupos
+        FROM (
+            SELECT disponible FROM stock_cupos
+            WHERE producto_id = p_producto_id
+            ORDER BY id
+            FOR UPDATE
+        ) bloqueados;
+
+        -- Sin cupos: repartir_cupos los está recreando, se vuelve a intentar
+        CONTINUE WHEN v_cupos = 0;
+
+        IF v_total < p_cantidad THEN
+            RAISE EXCEPTION 'Stock insuficiente para el producto %%', p_producto_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+
+        FOR c IN
+            SELECT id, disponible FROM stock_cupos
+            WHERE producto_id = p_producto_id AND disponible > 0
+            ORDER BY id
+        LOOP
+            v_tomado := LEAST(c.disponible, v_resta);
+            UPDATE stock_cupos SET disponible = disponible - v_tomado WHERE id = c.id;
+            v_resta := v_resta - v_tomado;
+            EXIT WHEN v_resta = 0;
+        END LOOP;
+        RETURN;
+    END LOOP;
+
+    RAISE EXCEPTION 'Stock insuficiente para el producto %%', p_producto_id
+        USING ERRCODE = 'check_violation';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION liquidar_reservas(p_limite INTEGER DEFAULT 10000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_productos BIGINT[];
+    v_ids BIGINT[];
+BEGIN
+    PERFORM set_config('quicknotes.liquidando', 'on', true);
+
+    SELECT array_agg(DISTINCT producto_id) INTO v_productos
+    FROM (
+        SELECT producto_id FROM reservas_stock
+        WHERE fecha_liquidacion IS NULL
+        ORDER BY id
+        LIMIT p_limite
+    ) candidatas;
+
+    IF v_productos IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Mismo orden de bloqueo que repartir_cupos: productos primero, por id
+    PERFORM 1 FROM productos WHERE id = ANY(v_productos) ORDER BY id FOR UPDATE;
+
+    SELECT array_agg(id) INTO v_ids
+    FROM (
+        SELECT id FROM reservas_stock
+        WHERE fecha_liquidacion IS NULL AND producto_id = ANY(v_productos)
+        ORDER BY id
+        LIMIT p_limite
+        FOR UPDATE SKIP LOCKED
+    ) lote;
+
+    IF v_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    UPDATE productos p
+    SET stock = p.stock - r.cantidad
+    FROM (
+        SELECT producto_id, SUM(cantidad) AS cantidad
+        FROM reservas_stock
+        WHERE id = ANY(v_ids)
+        GROUP BY producto_id
+    ) r
+    WHERE p.id = r.producto_id;
+
+    UPDATE reservas_stock SET fecha_liquidacion = CURRENT_TIMESTAMP WHERE id = ANY(v_ids);
+
+    PERFORM set_config('quicknotes.liquidando', 'off', true);
+    RETURN array_length(v_ids, 1);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las ventas ya no tocan productos.stock: reservan en los cupos y apuntan la
+-- reserva en el libro. Se mantiene el nombre del trigger (actualizar_stock).
+CREATE OR REPLACE FUNCTION fn_actualizar_stock_al_vender()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN
+        SELECT producto_id, SUM(cantidad)::INTEGER AS cantidad
+        FROM lineas_nuevas
+        GROUP BY producto_id
+        ORDER BY producto_id
+    LOOP
+        PERFORM reservar_stock(r.producto_id, r.cantidad);
+    END LOOP;
+
+    INSERT INTO reservas_stock (producto_id, pedido_id, cantidad, fecha_reserva)
+    SELECT producto_id, pedido_id, SUM(cantidad), CURRENT_TIMESTAMP
+    FROM lineas_nuevas
+    GROUP BY pedido_id, producto_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cualquier cambio de stock hecho fuera del liquidador (altas, ediciones del
+-- administrador, reposiciones) vuelve a repartir los cupos del producto.
+CREATE OR REPLACE FUNCTION fn_repartir_cupos_al_cambiar_stock()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_ids BIGINT[];
+BEGIN
+    IF current_setting('quicknotes.liquidando', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(id) INTO v_ids FROM productos_nuevos;
+    ELSE
+        SELECT array_agg(n.id) INTO v_ids
+        FROM productos_nuevos n
+        JOIN productos_anteriores a ON a.id = n.id
+        WHERE n.stock IS DISTINCT FROM a.stock;
+    END IF;
+
+    IF v_ids IS NOT NULL THEN
+        PERFORM repartir_cupos(v_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER repartir_cupos_alta
+AFTER INSERT ON productos
+REFERENCING NEW TABLE AS productos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_repartir_cupos_al_cambiar_stock();
+
+CREATE TRIGGER repartir_cupos_cambio
+AFTER UPDATE ON productos
+REFERENCING OLD TABLE AS productos_anteriores NEW TABLE AS productos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_repartir_cupos_al_cambiar_stock();
+
+-- Cupos para los productos que ya existían
+SELECT repartir_cupos(array_agg(id)) FROM productos;
+''' % {'cupos': CUPOS_POR_PRODUCTO}
+
+ELIMINAR_RUTINAS = '''
+DROP TRIGGER IF EXISTS repartir_cupos_cambio ON productos;
+DROP TRIGGER IF EXISTS repartir_cupos_alta ON productos;
+DROP FUNCTION IF EXISTS fn_repartir_cupos_al_cambiar_stock();
+DROP FUNCTION IF EXISTS liquidar_reservas(INTEGER);
+DROP FUNCTION IF EXISTS reservar_stock(BIGINT, INTEGER);
+DROP FUNCTION IF EXISTS repartir_cupos(BIGINT[]);
+
+-- Vuelve al descuento directo sobre productos.stock
+CREATE OR REPLACE FUNCTION fn_actualizar_stock_al_vender()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM 1 FROM productos
+    WHERE id IN (SELECT producto_id FROM lineas_nuevas)
+    ORDER BY id
+    FOR UPDATE;
+
+    UPDATE productos p
+    SET stock = p.stock - v.cantidad
+    FROM (
+        SELECT producto_id, SUM(cantidad) AS cantidad
+        FROM lineas_nuevas
+        GROUP BY producto_id
+    ) v
+    WHERE p.id = v.producto_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0005_registrar_pedido_por_conjuntos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCupo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disponible', models.IntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quicknotes.producto')),
+            ],
+            options={
+                'db_table': 'stock_cupos',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReservaStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.IntegerField()),
+                ('fecha_reserva', models.DateTimeField(auto_now_add=True)),
+                ('fecha_liquidacion', models.DateTimeField(blank=True, null=True)),
+                ('pedido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='quicknotes.pedido')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, to='quicknotes.producto')),
+            ],
+            options={
+                'db_table': 'reservas_stock',
+                'indexes': [models.Index(condition=models.Q(('fecha_liquidacion__isnull', True)), fields=['id'], name='reservas_pendientes_idx'), models.Index(condition=models.Q(('fecha_liquidacion__isnull', True)), fields=['producto', 'id'], name='reservas_pendientes_prod_idx')],
+            },
+        ),
+        migrations.RunSQL(RUTINAS, reverse_sql=ELIMINAR_RUTINAS),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:53
+#
+# Pensada para aplicarse con la tienda en marcha: la columna se añade sin valor
+# por defecto (no reescribe la tabla), se rellena por lotes y los índices se
+# crean con CONCURRENTLY, así que la migración no es atómica.
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, transaction
+
+# Filas por transacción al rellenar productos.busqueda
+LOTE = 10000
+
+BUSQUEDA = '''
+CREATE OR REPLACE FUNCTION producto_busqueda(p_nombre TEXT, p_descripcion TEXT)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('spanish', COALESCE(p_nombre, '')), 'A')
+        || setweight(to_tsvector('spanish', COALESCE(p_descripcion, '')), 'B');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION fn_busqueda_producto()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.busqueda := producto_busqueda(NEW.nombre, NEW.descripcion);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER busqueda_producto
+BEFORE INSERT OR UPDATE OF nombre, descripcion ON productos
+FOR EACH ROW EXECUTE FUNCTION fn_busqueda_producto();
+'''
+
+ELIMINAR_BUSQUEDA = '''
+DROP TRIGGER IF EXISTS busqueda_producto ON productos;
+DROP FUNCTION IF EXISTS fn_busqueda_producto();
+DROP FUNCTION IF EXISTS producto_busqueda(TEXT, TEXT);
+'''
+
+
+def rellenar_busqueda(apps, schema_editor):
+    connection = schema_editor.connection
+    ultimo_id = 0
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # No cambia el stock: que no se vuelvan a repartir los cupos
+            cursor.execute("SET LOCAL quicknotes.liquidando = 'on'")
+            cursor.execute(
+                """
+                WITH lote AS (
+                    SELECT id FROM productos WHERE id > %s ORDER BY id LIMIT %s
+                )
+                UPDATE productos p
+                SET busqueda = producto_busqueda(p.nombre, p.descripcion)
+                FROM lote
+                WHERE p.id = lote.id
+                RETURNING p.id
+                """,
+                [ultimo_id, LOTE]
+            )
+            ids = [fila[0] for fila in cursor.fetchall()]
+        if not ids:
+            return
+        ultimo_id = max(ids)
+
+
+def crear_indice_trigramas(apps, schema_editor):
+    # pg_trgm es parte de contrib: si el servidor no lo incluye, la búsqueda
+    # se queda sin tolerancia a errores de escritura (ver quicknotes/busqueda.py)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+        if not cursor.fetchone()[0]:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS productos_nombre_trgm_idx "
+        "ON productos USING gin (nombre gin_trgm_ops)"
+    )
+
+
+def eliminar_indice_trigramas(apps, schema_editor):
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS productos_nombre_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('quicknotes', '0007_ventas_acumuladas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='busqueda',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Primero el trigger, para que las filas que cambien durante el
+        # relleno ya queden calculadas
+        migrations.RunSQL(BUSQUEDA, reverse_sql=ELIMINAR_BUSQUEDA),
+        migrations.RunPython(rellenar_busqueda, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='producto',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busqueda'], name='productos_busqueda_idx'),
+        ),
+        migrations.RunPython(crear_indice_trigramas, eliminar_indice_trigramas),
+    ]
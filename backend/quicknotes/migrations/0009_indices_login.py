@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+#
+# Como en 0008, los índices se crean con CONCURRENTLY para no bloquear los
+# logins mientras se construyen.
+
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('quicknotes', '0008_busqueda_productos'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='usuario',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='usuarios_username_lower_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usuario',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='usuarios_email_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0009_indices_login'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
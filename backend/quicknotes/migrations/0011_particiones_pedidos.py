@@ -0,0 +1,630 @@
+# Particiona pedidos, detalle_pedidos y devoluciones por meses de la fecha
+# del pedido (ver quicknotes/particiones.py).
+#
+# Pensada para aplicarse con la tienda en marcha, como la 0008: no copia las
+# tablas. Cada tabla actual pasa a ser la partición "<tabla>_historico" de una
+# tabla particionada nueva con el mismo nombre, y los meses siguientes van a
+# particiones nuevas. Lo lento (rellenar la columna nueva, crear los índices
+# únicos, validar el rango de la partición histórica) se hace por lotes, con
+# CONCURRENTLY o sin bloquear las escrituras; los bloqueos exclusivos solo
+# duran lo que tarda el cambio de nombres. Lo único que recorre datos con las
+# escrituras bloqueadas es la validación de las claves foráneas nuevas de las
+# líneas y devoluciones. Por eso no es atómica, y tampoco tiene vuelta atrás.
+
+from datetime import datetime, timedelta, timezone as tz
+
+from django.db import migrations, transaction
+from django.utils import timezone
+
+# Filas por transacción al rellenar la fecha del pedido de líneas y devoluciones
+LOTE = 50000
+
+# Meses con partición propia por delante del actual
+MESES_POR_ADELANTADO = 3
+
+# En una base de datos vacía (instalación nueva, tests), meses hacia atrás
+# que ya tienen partición propia en lugar de ir a la histórica
+MESES_HACIA_ATRAS = 12
+
+HIJAS = ('detalle_pedidos', 'devoluciones')
+
+COLUMNAS = '''
+-- Las líneas y las devoluciones llevan la fecha de su pedido, que es por la
+-- que se particionan. '-infinity' es "aún sin asignar" (lo que inserta el ORM,
+-- que no conoce la columna; ver fn_asignar_fecha_pedido).
+ALTER TABLE detalle_pedidos ADD COLUMN IF NOT EXISTS fecha_pedido TIMESTAMPTZ NOT NULL DEFAULT '-infinity';
+ALTER TABLE devoluciones ADD COLUMN IF NOT EXISTS fecha_pedido TIMESTAMPTZ NOT NULL DEFAULT '-infinity';
+'''
+
+RUTINAS = '''
+-- Fecha del pedido de una línea o devolución: la suya o, si aún no la tiene,
+-- la de su pedido
+CREATE OR REPLACE FUNCTION fecha_de_pedido(p_pedido_id BIGINT, p_fecha TIMESTAMPTZ)
+RETURNS TIMESTAMPTZ AS $$
+    SELECT CASE WHEN p_fecha = '-infinity'
+                THEN (SELECT fecha_pedido FROM pedidos WHERE id = p_pedido_id)
+                ELSE p_fecha END;
+$$ LANGUAGE sql STABLE;
+
+-- Una línea o devolución que cambia de pedido toma la fecha del nuevo (y,
+-- con ella, pasa a su partición). Mientras las tablas no están
+-- particionadas, también rellena la fecha de las que se insertan sin ella.
+CREATE OR REPLACE FUNCTION fn_fecha_del_pedido()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF (TG_OP = 'INSERT' AND NEW.fecha_pedido = '-infinity')
+       OR (TG_OP = 'UPDATE' AND NEW.pedido_id IS DISTINCT FROM OLD.pedido_id) THEN
+        NEW.fecha_pedido := COALESCE((SELECT fecha_pedido FROM pedidos WHERE id = NEW.pedido_id), '-infinity');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las filas que llegan sin fecha del pedido caen en la partición
+-- "<tabla>_por_asignar" (un BEFORE INSERT no puede cambiarlas de partición).
+-- Este trigger, en esa partición, las mueve a la de su mes. Si el pedido no
+-- existe, la fila se queda y la clave foránea falla al confirmar, como antes.
+CREATE OR REPLACE FUNCTION fn_asignar_fecha_pedido()
+RETURNS TRIGGER AS $$
+BEGIN
+    EXECUTE format(
+        'UPDATE %I t SET fecha_pedido = p.fecha_pedido FROM pedidos p '
+        'WHERE p.id = $1 AND t.id = $2 AND t.fecha_pedido = ''-infinity''::timestamptz',
+        TG_ARGV[0]
+    ) USING NEW.pedido_id, NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Al borrar pedidos se descuenta también lo que todavía les cuelga. Es de
+-- sentencia: un BEFORE DELETE por fila también se dispara cuando un UPDATE
+-- de la fecha mueve el pedido a otra partición.
+CREATE OR REPLACE FUNCTION fn_ventas_al_borrar_pedidos()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM acumular_ventas(ARRAY(
+        SELECT ROW(dia_venta(b.fecha_pedido), NULL, b.cliente_id, -1, 0, 0, 0, 0)::venta_delta
+        FROM pedidos_borrados b
+        UNION ALL
+        SELECT ROW(dia_venta(b.fecha_pedido), l.producto_id, b.cliente_id,
+                   0, -l.cantidad, -l.subtotal, 0, 0)::venta_delta
+        FROM pedidos_borrados b
+        JOIN detalle_pedidos l ON l.pedido_id = b.id AND l.fecha_pedido = b.fecha_pedido
+        UNION ALL
+        SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, b.cliente_id,
+                   0, 0, 0, -d.cantidad, -d.importe)::venta_delta
+        FROM pedidos_borrados b
+        JOIN devoluciones d ON d.pedido_id = b.id AND d.fecha_pedido = b.fecha_pedido AND d.estado = 'aprobada'
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Líneas: unidades e importe, en el día y el cliente de su pedido. El pedido
+-- se busca por id y fecha, así que solo se lee su partición. Una edición
+-- solo cuenta si cambia algo de lo que se suma (no cuando la línea solo
+-- cambia de partición).
+CREATE OR REPLACE FUNCTION fn_ventas_por_lineas()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(p.fecha_pedido), l.producto_id, p.cliente_id,
+                       0, l.cantidad, l.subtotal, 0, 0)::venta_delta
+            FROM lineas_nuevas l
+            JOIN pedidos p ON p.id = l.pedido_id AND p.fecha_pedido = fecha_de_pedido(l.pedido_id, l.fecha_pedido)
+        ));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(p.fecha_pedido), l.producto_id, p.cliente_id,
+                       0, -l.cantidad, -l.subtotal, 0, 0)::venta_delta
+            FROM lineas_anteriores l
+            JOIN pedidos p ON p.id = l.pedido_id AND p.fecha_pedido = fecha_de_pedido(l.pedido_id, l.fecha_pedido)
+        ));
+    ELSE
+        PERFORM acumular_ventas(ARRAY(
+            WITH cambiadas AS (
+                SELECT a.pedido_id AS pedido_anterior, a.fecha_pedido AS fecha_anterior,
+                       a.producto_id AS producto_anterior, a.cantidad AS cantidad_anterior,
+                       a.subtotal AS subtotal_anterior,
+                       n.pedido_id, n.fecha_pedido, n.producto_id, n.cantidad, n.subtotal
+                FROM lineas_anteriores a
+                JOIN lineas_nuevas n ON n.id = a.id
+                WHERE (a.pedido_id, a.producto_id, a.cantidad, a.subtotal)
+                      IS DISTINCT FROM (n.pedido_id, n.producto_id, n.cantidad, n.subtotal)
+            )
+            SELECT ROW(dia_venta(p.fecha_pedido), c.producto_anterior, p.cliente_id,
+                       0, -c.cantidad_anterior, -c.subtotal_anterior, 0, 0)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_anterior
+                          AND p.fecha_pedido = fecha_de_pedido(c.pedido_anterior, c.fecha_anterior)
+            UNION ALL
+            SELECT ROW(dia_venta(p.fecha_pedido), c.producto_id, p.cliente_id,
+                       0, c.cantidad, c.subtotal, 0, 0)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_id AND p.fecha_pedido = fecha_de_pedido(c.pedido_id, c.fecha_pedido)
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Devoluciones: solo cuentan las aprobadas, en el día de la devolución
+CREATE OR REPLACE FUNCTION fn_ventas_por_devoluciones()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, p.cliente_id,
+                       0, 0, 0, d.cantidad, d.importe)::venta_delta
+            FROM devoluciones_nuevas d
+            JOIN pedidos p ON p.id = d.pedido_id AND p.fecha_pedido = fecha_de_pedido(d.pedido_id, d.fecha_pedido)
+            WHERE d.estado = 'aprobada'
+        ));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, p.cliente_id,
+                       0, 0, 0, -d.cantidad, -d.importe)::venta_delta
+            FROM devoluciones_anteriores d
+            JOIN pedidos p ON p.id = d.pedido_id AND p.fecha_pedido = fecha_de_pedido(d.pedido_id, d.fecha_pedido)
+            WHERE d.estado = 'aprobada'
+        ));
+    ELSE
+        PERFORM acumular_ventas(ARRAY(
+            WITH cambiadas AS (
+                SELECT a.*, n.pedido_id AS pedido_nuevo, n.fecha_pedido AS fecha_nueva,
+                       n.producto_id AS producto_nuevo, n.cantidad AS cantidad_nueva,
+                       n.importe AS importe_nuevo, n.estado AS estado_nuevo,
+                       n.fecha_devolucion AS fecha_devolucion_nueva
+                FROM devoluciones_anteriores a
+                JOIN devoluciones_nuevas n ON n.id = a.id
+                WHERE (a.pedido_id, a.producto_id, a.cantidad, a.importe, a.estado, a.fecha_devolucion)
+                      IS DISTINCT FROM (n.pedido_id, n.producto_id, n.cantidad, n.importe, n.estado, n.fecha_devolucion)
+            )
+            SELECT ROW(dia_venta(c.fecha_devolucion), c.producto_id, p.cliente_id,
+                       0, 0, 0, -c.cantidad, -c.importe)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_id AND p.fecha_pedido = fecha_de_pedido(c.pedido_id, c.fecha_pedido)
+            WHERE c.estado = 'aprobada'
+            UNION ALL
+            SELECT ROW(dia_venta(c.fecha_devolucion_nueva), c.producto_nuevo, p.cliente_id,
+                       0, 0, 0, c.cantidad_nueva, c.importe_nuevo)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_nuevo AND p.fecha_pedido = fecha_de_pedido(c.pedido_nuevo, c.fecha_nueva)
+            WHERE c.estado_nuevo = 'aprobada'
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- El importe de la devolución se fija al registrarla, para descontar
+-- siempre lo mismo que se sumó aunque luego cambien las líneas (ni cuando la
+-- devolución cambia de partición, que es un INSERT en la nueva)
+CREATE OR REPLACE FUNCTION fn_valorar_devolucion()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.importe IS NULL
+       OR (TG_OP = 'UPDATE' AND (NEW.pedido_id IS DISTINCT FROM OLD.pedido_id
+                                 OR NEW.producto_id IS DISTINCT FROM OLD.producto_id
+                                 OR NEW.cantidad IS DISTINCT FROM OLD.cantidad)) THEN
+        NEW.importe := importe_devolucion(NEW.pedido_id, NEW.producto_id, NEW.cantidad);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las líneas llevan la fecha del pedido: van directamente a su partición
+CREATE OR REPLACE PROCEDURE registrar_pedido(
+    p_cliente_id INTEGER,
+    p_estado VARCHAR(50),
+    p_productos_ids INTEGER[],
+    p_cantidades INTEGER[],
+    p_precios_unitarios DECIMAL(10, 2)[]
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_pedido_id BIGINT;
+    v_fecha TIMESTAMPTZ := CURRENT_TIMESTAMP;
+BEGIN
+    -- El total se calcula de una vez sobre todas las líneas
+    INSERT INTO pedidos (cliente_id, estado, total, fecha_pedido)
+    SELECT p_cliente_id, p_estado, COALESCE(SUM(l.cantidad * l.precio_unitario), 0), v_fecha
+    FROM unnest(p_cantidades, p_precios_unitarios) AS l(cantidad, precio_unitario)
+    RETURNING id INTO v_pedido_id;
+
+    -- Todas las líneas en un solo INSERT. El stock lo descuenta el trigger
+    -- actualizar_stock, una sola vez por producto.
+    INSERT INTO detalle_pedidos (pedido_id, fecha_pedido, producto_id, cantidad, precio_unitario, subtotal)
+    SELECT v_pedido_id, v_fecha, l.producto_id, l.cantidad, l.precio_unitario, l.cantidad * l.precio_unitario
+    FROM unnest(p_productos_ids, p_cantidades, p_precios_unitarios) AS l(producto_id, cantidad, precio_unitario);
+END;
+$$;
+
+-- Como en la 0007, pero las líneas se unen con su pedido por id y fecha: con
+-- un rango de días solo se leen las particiones de esos meses
+CREATE OR REPLACE FUNCTION reconstruir_ventas(p_desde DATE DEFAULT NULL, p_hasta DATE DEFAULT NULL)
+RETURNS VOID AS $$
+DECLARE
+    v_desde DATE := COALESCE(p_desde, '-infinity'::date);
+    v_hasta DATE := COALESCE(p_hasta, 'infinity'::date);
+    v_inicio TIMESTAMPTZ := COALESCE(p_desde::timestamp AT TIME ZONE 'UTC', '-infinity');
+    v_fin TIMESTAMPTZ := COALESCE((p_hasta + 1)::timestamp AT TIME ZONE 'UTC', 'infinity');
+BEGIN
+    LOCK TABLE ventas_diarias, ventas_producto_diarias, ventas_cliente_diarias IN EXCLUSIVE MODE;
+
+    DELETE FROM ventas_diarias WHERE dia BETWEEN v_desde AND v_hasta;
+    DELETE FROM ventas_producto_diarias WHERE dia BETWEEN v_desde AND v_hasta;
+    DELETE FROM ventas_cliente_diarias WHERE dia BETWEEN v_desde AND v_hasta;
+
+    WITH fuentes AS (
+        SELECT dia_venta(p.fecha_pedido) AS dia, NULL::BIGINT AS producto_id, p.cliente_id,
+               COUNT(*)::INTEGER AS pedidos, 0 AS unidades, 0::NUMERIC AS importe,
+               0 AS unidades_devueltas, 0::NUMERIC AS importe_devuelto
+        FROM pedidos p
+        WHERE p.fecha_pedido >= v_inicio AND p.fecha_pedido < v_fin
+        GROUP BY 1, 3
+        UNION ALL
+        SELECT dia_venta(p.fecha_pedido), l.producto_id, p.cliente_id,
+               0, SUM(l.cantidad)::INTEGER, SUM(l.subtotal), 0, 0
+        FROM detalle_pedidos l JOIN pedidos p ON p.id = l.pedido_id AND p.fecha_pedido = l.fecha_pedido
+        WHERE l.fecha_pedido >= v_inicio AND l.fecha_pedido < v_fin
+        GROUP BY 1, 2, 3
+        UNION ALL
+        SELECT dia_venta(d.fecha_devolucion), d.producto_id, p.cliente_id,
+               0, 0, 0, SUM(d.cantidad)::INTEGER, SUM(d.importe)
+        FROM devoluciones d JOIN pedidos p ON p.id = d.pedido_id AND p.fecha_pedido = d.fecha_pedido
+        WHERE d.estado = 'aprobada' AND d.fecha_devolucion >= v_inicio AND d.fecha_devolucion < v_fin
+        GROUP BY 1, 2, 3
+    ),
+    por_dia AS (
+        INSERT INTO ventas_diarias
+            (dia, fragmento, pedidos, unidades, importe, unidades_devueltas, importe_devuelto)
+        SELECT dia, 0, SUM(pedidos), SUM(unidades), SUM(importe), SUM(unidades_devueltas), SUM(importe_devuelto)
+        FROM fuentes
+        GROUP BY dia
+    ),
+    por_producto AS (
+        INSERT INTO ventas_producto_diarias
+            (dia, producto_id, fragmento, unidades, importe, unidades_devueltas, importe_devuelto)
+        SELECT dia, producto_id, 0, SUM(unidades), SUM(importe), SUM(unidades_devueltas), SUM(importe_devuelto)
+        FROM fuentes
+        WHERE producto_id IS NOT NULL
+        GROUP BY dia, producto_id
+    )
+    INSERT INTO ventas_cliente_diarias
+        (dia, cliente_id, fragmento, pedidos, unidades, importe, unidades_devueltas, importe_devuelto)
+    SELECT dia, cliente_id, 0, SUM(pedidos), SUM(unidades), SUM(importe), SUM(unidades_devueltas), SUM(importe_devuelto)
+    FROM fuentes
+    GROUP BY dia, cliente_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Límite superior de una partición (NULL si va hasta MAXVALUE)
+CREATE OR REPLACE FUNCTION fin_de_particion(p_particion REGCLASS)
+RETURNS TIMESTAMPTZ AS $$
+    SELECT substring(pg_get_expr(relpartbound, oid) FROM 'TO \\(''([^'']+)''\\)')::timestamptz
+    FROM pg_class
+    WHERE oid = p_particion;
+$$ LANGUAGE sql STABLE;
+
+-- Crea las particiones mensuales (meses UTC, como dia_venta) de pedidos,
+-- detalle_pedidos y devoluciones que falten hasta el mes de p_hasta
+-- incluido, a continuación de la última. Cada una se crea vacía y se engancha
+-- con ATTACH PARTITION, que no bloquea las lecturas ni las escrituras de la
+-- tabla particionada. Devuelve los nombres de las creadas.
+CREATE OR REPLACE FUNCTION crear_particiones_pedidos(p_hasta DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_tabla TEXT;
+    v_desde TIMESTAMPTZ;
+    v_hasta TIMESTAMPTZ;
+    v_nombre TEXT;
+BEGIN
+    FOREACH v_tabla IN ARRAY ARRAY['pedidos', 'detalle_pedidos', 'devoluciones'] LOOP
+        -- Durante la migración 0011, las que aún no están particionadas
+        CONTINUE WHEN (SELECT relkind FROM pg_class WHERE oid = v_tabla::regclass) <> 'p';
+        SELECT max(fin_de_particion(inhrelid)) INTO v_desde FROM pg_inherits WHERE inhparent = v_tabla::regclass;
+        WHILE v_desde IS NOT NULL AND v_desde <= p_hasta::timestamp AT TIME ZONE 'UTC' LOOP
+            v_hasta := ((v_desde AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC';
+            v_nombre := v_tabla || '_' || to_char(v_desde AT TIME ZONE 'UTC', 'YYYY_MM');
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', v_nombre, v_tabla);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           v_tabla, v_nombre, v_desde, v_hasta);
+            RETURN NEXT v_nombre;
+            v_desde := v_hasta;
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Desengancha las particiones de pedidos que terminan antes de p_antes_de,
+-- junto con las de sus líneas y devoluciones (mismos límites y sufijo), y
+-- las pasa al esquema archivo sin sus claves foráneas. Los acumulados de
+-- ventas no cambian. Devuelve los nombres de las archivadas.
+CREATE OR REPLACE FUNCTION archivar_particiones_pedidos(p_antes_de DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_particion RECORD;
+    v_nombre TEXT;
+    v_tabla TEXT;
+    v_fk TEXT;
+BEGIN
+    FOR v_particion IN
+        SELECT c.relname AS nombre, fin_de_particion(c.oid) AS hasta
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'pedidos'::regclass
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN v_particion.hasta IS NULL
+                   OR v_particion.hasta > p_antes_de::timestamp AT TIME ZONE 'UTC';
+        -- Primero las hijas: su clave foránea no deja desenganchar el pedido
+        FOREACH v_tabla IN ARRAY ARRAY['detalle_pedidos', 'devoluciones', 'pedidos'] LOOP
+            v_nombre := v_tabla || substring(v_particion.nombre FROM length('pedidos') + 1);
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', v_tabla, v_nombre);
+            FOR v_fk IN
+                SELECT conname FROM pg_constraint WHERE conrelid = v_nombre::regclass AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', v_nombre, v_fk);
+            END LOOP;
+            EXECUTE format('ALTER TABLE %I SET SCHEMA archivo', v_nombre);
+            RETURN NEXT 'archivo.' || v_nombre;
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE SCHEMA IF NOT EXISTS archivo;
+'''
+
+TRIGGERS = '''
+DROP TRIGGER IF EXISTS fecha_del_pedido ON detalle_pedidos;
+CREATE TRIGGER fecha_del_pedido
+BEFORE INSERT OR UPDATE ON detalle_pedidos
+FOR EACH ROW EXECUTE FUNCTION fn_fecha_del_pedido();
+
+DROP TRIGGER IF EXISTS fecha_del_pedido ON devoluciones;
+CREATE TRIGGER fecha_del_pedido
+BEFORE INSERT OR UPDATE ON devoluciones
+FOR EACH ROW EXECUTE FUNCTION fn_fecha_del_pedido();
+
+DROP TRIGGER IF EXISTS ventas_pedidos_baja ON pedidos;
+CREATE TRIGGER ventas_pedidos_baja
+AFTER DELETE ON pedidos
+REFERENCING OLD TABLE AS pedidos_borrados
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_al_borrar_pedidos();
+DROP FUNCTION IF EXISTS fn_ventas_al_borrar_pedido();
+'''
+
+
+def rellenar_fechas(apps, schema_editor):
+    """Copia la fecha del pedido en las líneas y devoluciones existentes, por lotes."""
+    connection = schema_editor.connection
+    for tabla in HIJAS:
+        ultimo_id = 0
+        while True:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    WITH lote AS (
+                        SELECT id FROM {tabla} WHERE id > %s ORDER BY id LIMIT %s
+                    ),
+                    rellenadas AS (
+                        UPDATE {tabla} t
+                        SET fecha_pedido = p.fecha_pedido
+                        FROM lote, pedidos p
+                        WHERE t.id = lote.id AND p.id = t.pedido_id AND t.fecha_pedido = '-infinity'
+                    )
+                    SELECT max(id) FROM lote
+                    """,
+                    [ultimo_id, LOTE]
+                )
+                ultimo_id = cursor.fetchone()[0]
+            if ultimo_id is None:
+                break
+
+
+def _primer_dia_del_mes(momento, meses=0):
+    """Comienzo (en UTC) del mes de 'momento' más 'meses'."""
+    mes = momento.year * 12 + momento.month - 1 + meses
+    return datetime(mes // 12, mes % 12 + 1, 1, tzinfo=tz.utc)
+
+
+def _limite_historico(cursor):
+    """
+    Fecha a partir de la cual empiezan las particiones mensuales: el mes
+    siguiente al último pedido (y a mañana, por los que lleguen mientras
+    tanto). Sin pedidos, hace MESES_HACIA_ATRAS meses.
+    """
+    cursor.execute("SELECT max(fecha_pedido) FROM pedidos")
+    ultimo = cursor.fetchone()[0]
+    ahora = timezone.now().astimezone(tz.utc)
+    if ultimo is None:
+        return _primer_dia_del_mes(ahora, -MESES_HACIA_ATRAS)
+    return _primer_dia_del_mes(max(ultimo.astimezone(tz.utc), ahora + timedelta(days=1)), 1)
+
+
+def _definiciones(cursor, tabla):
+    """
+    Índices, restricciones CHECK, claves foráneas y triggers de la tabla,
+    para recrearlos en la particionada (sin la clave primaria ni lo que crea
+    esta migración para el cambio).
+    """
+    cursor.execute(
+        """
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary AND i.indexrelid <> %s::regclass
+        """,
+        [tabla, f'{tabla}_id_fecha_idx']
+    )
+    indices = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'c' AND conname <> %s
+        """,
+        [tabla, f'{tabla}_historico_rango']
+    )
+    checks = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f' AND conparentid = 0
+        """,
+        [tabla]
+    )
+    claves = cursor.fetchall()
+    cursor.execute(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal",
+        [tabla]
+    )
+    triggers = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+        [tabla]
+    )
+    clave_primaria = cursor.fetchone()[0]
+    return indices, checks, claves, triggers, clave_primaria
+
+
+def _convertir(cursor, tabla, desde, hasta):
+    """
+    Convierte 'tabla' en una tabla particionada por fecha_pedido con la
+    tabla actual como partición "<tabla>_historico" (de 'desde' a 'hasta').
+    Va en una transacción con la tabla bloqueada; no copia filas.
+    """
+    historico = f'{tabla}_historico'
+    indices, checks, claves, triggers, clave_primaria = _definiciones(cursor, tabla)
+
+    for nombre, _ in triggers:
+        cursor.execute(f'DROP TRIGGER {nombre} ON {tabla}')
+    cursor.execute(f'ALTER TABLE {tabla} RENAME TO {historico}')
+    for nombre, _ in indices:
+        cursor.execute(f'ALTER INDEX {nombre} RENAME TO {nombre[:52]}_historico')
+    # La clave primaria incluye la fecha (la columna de partición); el índice
+    # ya está creado
+    cursor.execute(
+        f'ALTER TABLE {historico} DROP CONSTRAINT {clave_primaria}, '
+        f'ADD CONSTRAINT {historico}_pkey PRIMARY KEY USING INDEX {tabla}_id_fecha_idx'
+    )
+
+    cursor.execute(
+        f'CREATE TABLE {tabla} (LIKE {historico} INCLUDING DEFAULTS INCLUDING IDENTITY, '
+        f'CONSTRAINT {clave_primaria} PRIMARY KEY (id, fecha_pedido)) PARTITION BY RANGE (fecha_pedido)'
+    )
+    # ATTACH PARTITION exige que la partición tenga las mismas CHECK
+    for nombre, definicion in checks:
+        cursor.execute(f'ALTER TABLE {tabla} ADD CONSTRAINT {nombre} {definicion}')
+    # Los ids siguen donde iban, con la secuencia de siempre
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id'), pg_get_serial_sequence(%s, 'id')", [historico, tabla])
+    secuencia, nueva = cursor.fetchone()
+    cursor.execute(f'SELECT last_value, is_called FROM {secuencia}')
+    cursor.execute('SELECT setval(%s, %s, %s)', [nueva, *cursor.fetchone()])
+    cursor.execute(f'ALTER TABLE {historico} ALTER COLUMN id DROP IDENTITY')
+    cursor.execute(f"ALTER SEQUENCE {nueva} RENAME TO {secuencia.split('.')[-1]}")
+
+    cursor.execute(f"ALTER TABLE {tabla} ATTACH PARTITION {historico} FOR VALUES FROM ({desde}) TO (%s)", [hasta])
+    cursor.execute(f'ALTER TABLE {historico} DROP CONSTRAINT {historico}_rango')
+
+    # Los índices y las claves de la tabla particionada adoptan los de la
+    # partición, que son iguales, sin volver a crearlos ni validarlos
+    for _, definicion in indices:
+        cursor.execute(definicion)
+    for nombre, definicion in claves:
+        cursor.execute(f'ALTER TABLE {tabla} ADD CONSTRAINT {nombre} {definicion}')
+    for nombre, definicion in triggers:
+        if nombre == 'fecha_del_pedido':
+            # Un BEFORE INSERT no puede cambiar la fila de partición: las que
+            # llegan sin fecha las mueve fn_asignar_fecha_pedido
+            definicion = definicion.replace('BEFORE INSERT OR UPDATE', 'BEFORE UPDATE')
+        cursor.execute(definicion)
+
+
+def convertir_tablas(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        limite = _limite_historico(cursor)
+        hasta = _primer_dia_del_mes(timezone.now(), MESES_POR_ADELANTADO)
+
+        # Índices únicos para las claves primarias (id, fecha_pedido) y las
+        # restricciones que anticipan el rango de la partición histórica, para
+        # que ATTACH PARTITION no tenga que recorrer la tabla con ella bloqueada
+        for tabla in ('pedidos',) + HIJAS:
+            cursor.execute(
+                f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {tabla}_id_fecha_idx ON {tabla} (id, fecha_pedido)'
+            )
+            minimo = "fecha_pedido >= '0001-01-01' AND " if tabla in HIJAS else ''
+            cursor.execute(f'ALTER TABLE {tabla} DROP CONSTRAINT IF EXISTS {tabla}_historico_rango')
+            cursor.execute(
+                f'ALTER TABLE {tabla} ADD CONSTRAINT {tabla}_historico_rango '
+                f'CHECK (fecha_pedido IS NOT NULL AND {minimo}fecha_pedido < %s) NOT VALID',
+                [limite]
+            )
+            cursor.execute(f'ALTER TABLE {tabla} VALIDATE CONSTRAINT {tabla}_historico_rango')
+
+        # 1. pedidos. Sus claves foráneas entrantes (a pedidos.id) se quitan
+        # y vuelven al final sobre (pedido_id, fecha_pedido). reservas_stock no
+        # tiene la fecha: se queda sin clave foránea (el ORM sigue borrando en
+        # cascada sus reservas).
+        with transaction.atomic(using=connection.alias):
+            cursor.execute('LOCK TABLE pedidos, detalle_pedidos, devoluciones, reservas_stock IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(
+                "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                "WHERE confrelid = 'pedidos'::regclass AND contype = 'f'"
+            )
+            entrantes = cursor.fetchall()
+            for tabla, nombre in entrantes:
+                cursor.execute(f'ALTER TABLE {tabla} DROP CONSTRAINT {nombre}')
+            _convertir(cursor, 'pedidos', 'MINVALUE', limite)
+            cursor.execute('SELECT crear_particiones_pedidos(%s)', [hasta.date()])
+
+        # 2. Líneas y devoluciones, con su partición para las filas sin fecha
+        with transaction.atomic(using=connection.alias):
+            cursor.execute('LOCK TABLE detalle_pedidos, devoluciones IN ACCESS EXCLUSIVE MODE')
+            for tabla in HIJAS:
+                _convertir(cursor, tabla, "'0001-01-01'", limite)
+                cursor.execute(
+                    f"CREATE TABLE {tabla}_por_asignar PARTITION OF {tabla} FOR VALUES FROM (MINVALUE) TO ('0001-01-01')"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER asignar_fecha_pedido AFTER INSERT ON {tabla}_por_asignar "
+                    f"FOR EACH ROW EXECUTE FUNCTION fn_asignar_fecha_pedido('{tabla}')"
+                )
+            cursor.execute('SELECT crear_particiones_pedidos(%s)', [hasta.date()])
+
+        # 3. Las claves foráneas a pedidos, ya entre tablas particionadas. Se
+        # validan al crearlas (en PostgreSQL 16 una tabla particionada no
+        # admite NOT VALID, y enganchar la de cada partición deja el catálogo
+        # mal al desengancharlas luego): bloquea las escrituras, no las
+        # lecturas, mientras recorre las líneas y devoluciones.
+        with transaction.atomic(using=connection.alias):
+            for tabla, nombre in entrantes:
+                if tabla in HIJAS:
+                    cursor.execute(
+                        f'ALTER TABLE {tabla} ADD CONSTRAINT {nombre} '
+                        f'FOREIGN KEY (pedido_id, fecha_pedido) REFERENCES pedidos (id, fecha_pedido) '
+                        f'ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED'
+                    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('quicknotes', '0010_producto_sku'),
+    ]
+
+    operations = [
+        migrations.RunSQL(COLUMNAS),
+        # Primero los triggers, para que las filas que lleguen durante el
+        # relleno ya traigan la fecha
+        migrations.RunSQL(RUTINAS + TRIGGERS),
+        migrations.RunPython(rellenar_fechas),
+        migrations.RunPython(convertir_tablas),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:20
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+RUTINAS = '''
+-- Repone el stock y descuenta del total del pedido las devoluciones
+-- aprobadas de p_ids que aún no se habían procesado. Una sola actualización
+-- por producto y por pedido; los productos se bloquean en orden de id, como
+-- en el liquidador. Devuelve cuántas devoluciones procesó.
+CREATE OR REPLACE FUNCTION procesar_devoluciones(p_ids BIGINT[])
+RETURNS INTEGER AS $$
+DECLARE
+    v_procesadas INTEGER;
+BEGIN
+    PERFORM 1 FROM productos
+    WHERE id IN (SELECT producto_id FROM devoluciones WHERE id = ANY(p_ids))
+    ORDER BY id
+    FOR UPDATE;
+
+    WITH procesadas AS (
+        -- fecha_reposicion hace que repetir la tarea no reponga dos veces
+        UPDATE devoluciones
+        SET fecha_reposicion = CURRENT_TIMESTAMP
+        WHERE id = ANY(p_ids) AND estado = 'aprobada' AND fecha_reposicion IS NULL
+        RETURNING pedido_id, fecha_pedido, producto_id, cantidad, COALESCE(importe, 0) AS importe
+    ), stock AS (
+        -- Vuelve a repartir los cupos (trigger repartir_cupos_cambio)
+        UPDATE productos p
+        SET stock = p.stock + r.cantidad
+        FROM (SELECT producto_id, SUM(cantidad) AS cantidad FROM procesadas GROUP BY producto_id) r
+        WHERE p.id = r.producto_id
+    ), totales AS (
+        UPDATE pedidos p
+        SET total = GREATEST(p.total - r.importe, 0)
+        FROM (SELECT pedido_id, fecha_pedido, SUM(importe) AS importe FROM procesadas GROUP BY 1, 2) r
+        WHERE p.id = r.pedido_id AND p.fecha_pedido = r.fecha_pedido
+    )
+    SELECT count(*) INTO v_procesadas FROM procesadas;
+
+    RETURN v_procesadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Encola una tarea por cada devolución que pasa a 'aprobada', en la misma
+-- transacción que la aprueba (desde la API, el admin o SQL)
+CREATE OR REPLACE FUNCTION fn_encolar_devoluciones_aprobadas()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tareas (tipo, clave, datos)
+        SELECT 'devolucion_aprobada', 'devolucion:' || id, jsonb_build_object('devolucion_id', id)
+        FROM devoluciones_nuevas
+        WHERE estado = 'aprobada' AND fecha_reposicion IS NULL
+        ON CONFLICT (clave) DO NOTHING;
+    ELSE
+        INSERT INTO tareas (tipo, clave, datos)
+        SELECT 'devolucion_aprobada', 'devolucion:' || n.id, jsonb_build_object('devolucion_id', n.id)
+        FROM devoluciones_nuevas n
+        JOIN devoluciones_anteriores a ON a.id = n.id
+        WHERE n.estado = 'aprobada' AND a.estado IS DISTINCT FROM 'aprobada' AND n.fecha_reposicion IS NULL
+        ON CONFLICT (clave) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER encolar_devoluciones_alta
+AFTER INSERT ON devoluciones
+REFERENCING NEW TABLE AS devoluciones_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_encolar_devoluciones_aprobadas();
+
+CREATE TRIGGER encolar_devoluciones_cambio
+AFTER UPDATE ON devoluciones
+REFERENCING OLD TABLE AS devoluciones_anteriores NEW TABLE AS devoluciones_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_encolar_devoluciones_aprobadas();
+'''
+
+ELIMINAR_RUTINAS = '''
+DROP TRIGGER IF EXISTS encolar_devoluciones_cambio ON devoluciones;
+DROP TRIGGER IF EXISTS encolar_devoluciones_alta ON devoluciones;
+DROP FUNCTION IF EXISTS fn_encolar_devoluciones_aprobadas();
+DROP FUNCTION IF EXISTS procesar_devoluciones(BIGINT[]);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0011_particiones_pedidos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('clave', models.CharField(blank=True, max_length=200, null=True, unique=True)),
+                ('datos', models.JSONField(default=dict)),
+                ('estado', models.CharField(db_default='pendiente', max_length=20)),
+                ('intentos', models.IntegerField(db_default=0)),
+                ('max_intentos', models.IntegerField(db_default=5)),
+                ('disponible_desde', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+                ('error', models.TextField(blank=True, null=True)),
+                ('fecha_creacion', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+            ],
+            options={
+                'db_table': 'tareas',
+                'indexes': [models.Index(condition=models.Q(('estado', 'pendiente')), fields=['tipo', 'disponible_desde', 'id'], name='tareas_pendientes_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='devolucion',
+            name='fecha_reposicion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL(RUTINAS, reverse_sql=ELIMINAR_RUTINAS),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+#
+# Índices de los filtros y ordenamientos de los listados (quicknotes.filtros).
+# pedidos, detalle_pedidos y devoluciones están particionadas, y CREATE INDEX
+# CONCURRENTLY no admite tablas particionadas: el índice se crea vacío en la
+# tabla particionada (ON ONLY, inválido hasta tener el de cada partición), se
+# construye CONCURRENTLY en cada partición y se engancha. Ninguna escritura
+# queda bloqueada mientras se construyen. Las particiones que se creen después
+# reciben el índice al engancharse.
+
+from django.db import migrations, models
+
+# (tabla, nombre, columnas, condición)
+INDICES = [
+    ('pedidos', 'pedidos_pendientes_idx', 'fecha_pedido DESC, id DESC', "estado = 'pendiente'"),
+    ('pedidos', 'pedidos_total_id_idx', 'total, id', None),
+    ('detalle_pedidos', 'detalle_producto_id_idx', 'producto_id, id DESC', None),
+    ('devoluciones', 'devoluciones_solicitadas_idx', 'fecha_devolucion DESC, id DESC', "estado = 'solicitada'"),
+    ('devoluciones', 'devoluciones_prod_fecha_idx', 'producto_id, fecha_devolucion DESC, id DESC', None),
+]
+
+
+def crear_indices(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for tabla, nombre, columnas, condicion in INDICES:
+            donde = f' WHERE {condicion}' if condicion else ''
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {nombre} ON ONLY {tabla} ({columnas}){donde}')
+            cursor.execute(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = %s::regclass
+                ORDER BY 1
+                """,
+                [tabla]
+            )
+            for (particion,) in cursor.fetchall():
+                indice = f'{particion}_{nombre.removeprefix(tabla + "_")}'[:63]
+                cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {indice} ON {particion} ({columnas}){donde}')
+                cursor.execute(
+                    "SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass AND inhparent = %s::regclass",
+                    [indice, nombre]
+                )
+                if cursor.fetchone() is None:
+                    cursor.execute(f'ALTER INDEX {nombre} ATTACH PARTITION {indice}')
+
+
+def eliminar_indices(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for _, nombre, _, _ in INDICES:
+            cursor.execute(f'DROP INDEX IF EXISTS {nombre}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('quicknotes', '0012_tareas'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(crear_indices, eliminar_indices),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='pedido',
+                    index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['-fecha_pedido', '-id'], name='pedidos_pendientes_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='pedido',
+                    index=models.Index(fields=['total', 'id'], name='pedidos_total_id_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='detallepedido',
+                    index=models.Index(fields=['producto', '-id'], name='detalle_producto_id_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='devolucion',
+                    index=models.Index(condition=models.Q(('estado', 'solicitada')), fields=['-fecha_devolucion', '-id'], name='devoluciones_solicitadas_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='devolucion',
+                    index=models.Index(fields=['producto', '-fecha_devolucion', '-id'], name='devoluciones_prod_fecha_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+VERSION = '''
+-- Cualquier cambio de un producto (API, admin, importación, ventas,
+-- devoluciones) incrementa su versión. Se parte de la anterior y no de la
+-- que se escribe: un save() con una instancia vieja no la hace retroceder.
+CREATE OR REPLACE FUNCTION fn_version_producto()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las actualizaciones que no cambian nada no cuentan
+CREATE TRIGGER version_producto
+BEFORE UPDATE ON productos
+FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+EXECUTE FUNCTION fn_version_producto();
+'''
+
+ELIMINAR_VERSION = '''
+DROP TRIGGER IF EXISTS version_producto ON productos;
+DROP FUNCTION IF EXISTS fn_version_producto();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0013_indices_filtros'),
+    ]
+
+    operations = [
+        # Con un valor constante por defecto, añadir la columna no reescribe la tabla
+        migrations.AddField(
+            model_name='producto',
+            name='version',
+            field=models.IntegerField(db_default=1, editable=False),
+        ),
+        migrations.RunSQL(VERSION, reverse_sql=ELIMINAR_VERSION),
+    ]
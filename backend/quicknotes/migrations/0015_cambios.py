@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:57
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+TABLAS = ['productos', 'pedidos', 'detalle_pedidos', 'devoluciones']
+
+# Una fila en cambios por registro dado de alta, modificado o borrado en
+# cada sentencia, con la transacción que lo hizo. Las actualizaciones que no
+# cambian nada no se registran.
+REGISTRO = '''
+CREATE OR REPLACE FUNCTION fn_registrar_cambios()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_transaccion BIGINT := pg_current_xact_id()::text::bigint;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO cambios (transaccion, tabla, registro_id)
+        SELECT v_transaccion, TG_TABLE_NAME, id FROM filas_nuevas;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO cambios (transaccion, tabla, registro_id)
+        SELECT v_transaccion, TG_TABLE_NAME, n.id
+        FROM filas_nuevas n
+        JOIN filas_anteriores a ON a.id = n.id
+        WHERE n IS DISTINCT FROM a;
+    ELSE
+        INSERT INTO cambios (transaccion, tabla, registro_id)
+        SELECT v_transaccion, TG_TABLE_NAME, id FROM filas_anteriores;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+''' + ''.join(f'''
+CREATE TRIGGER registrar_cambios_alta
+AFTER INSERT ON {tabla}
+REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_cambio
+AFTER UPDATE ON {tabla}
+REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_baja
+AFTER DELETE ON {tabla}
+REFERENCING OLD TABLE AS filas_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+''' for tabla in TABLAS)
+
+ELIMINAR_REGISTRO = ''.join(f'''
+DROP TRIGGER IF EXISTS registrar_cambios_baja ON {tabla};
+DROP TRIGGER IF EXISTS registrar_cambios_cambio ON {tabla};
+DROP TRIGGER IF EXISTS registrar_cambios_alta ON {tabla};
+''' for tabla in TABLAS) + '''
+DROP FUNCTION IF EXISTS fn_registrar_cambios();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0014_producto_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cambio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaccion', models.BigIntegerField()),
+                ('tabla', models.CharField(max_length=30)),
+                ('registro_id', models.BigIntegerField()),
+                ('fecha', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+            ],
+            options={
+                'db_table': 'cambios',
+                'indexes': [models.Index(fields=['tabla', 'transaccion', 'id'], name='cambios_tabla_txid_idx'), django.contrib.postgres.indexes.BrinIndex(fields=['fecha'], name='cambios_fecha_brin')],
+            },
+        ),
+        migrations.RunSQL(REGISTRO, reverse_sql=ELIMINAR_REGISTRO),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:10
+
+from django.db import migrations
+
+
+# Un aviso por cada producto cuyo stock cambia y por cada pedido cuyo estado
+# cambia, en el canal de quicknotes.eventos. NOTIFY los entrega al confirmar
+# la transacción, y nunca si se deshace.
+AVISOS = '''
+CREATE OR REPLACE FUNCTION fn_avisar_stock()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('quicknotes_eventos', json_build_object('tipo', 'stock', 'id', n.id, 'stock', n.stock)::text)
+    FROM productos_nuevos n
+    JOIN productos_anteriores a ON a.id = n.id
+    WHERE n.stock IS DISTINCT FROM a.stock;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER avisar_stock
+AFTER UPDATE ON productos
+REFERENCING OLD TABLE AS productos_anteriores NEW TABLE AS productos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_avisar_stock();
+
+CREATE OR REPLACE FUNCTION fn_avisar_estado_pedido()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('quicknotes_eventos', json_build_object(
+        'tipo', 'pedido', 'id', n.id, 'cliente_id', n.cliente_id, 'estado', n.estado
+    )::text)
+    FROM pedidos_nuevos n
+    JOIN pedidos_anteriores a ON a.id = n.id
+    WHERE n.estado IS DISTINCT FROM a.estado;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER avisar_estado_pedido
+AFTER UPDATE ON pedidos
+REFERENCING OLD TABLE AS pedidos_anteriores NEW TABLE AS pedidos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_avisar_estado_pedido();
+'''
+
+ELIMINAR_AVISOS = '''
+DROP TRIGGER IF EXISTS avisar_estado_pedido ON pedidos;
+DROP FUNCTION IF EXISTS fn_avisar_estado_pedido();
+DROP TRIGGER IF EXISTS avisar_stock ON productos;
+DROP FUNCTION IF EXISTS fn_avisar_stock();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0015_cambios'),
+    ]
+
+    operations = [
+        migrations.RunSQL(AVISOS, reverse_sql=ELIMINAR_AVISOS),
+    ]
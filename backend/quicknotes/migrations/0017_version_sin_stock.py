@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations
+
+
+# La versión solo cambia con las columnas que edita el administrador. El
+# stock lo mueven también las ventas, la liquidación de reservas y las
+# devoluciones: si contara, cada venta haría fallar por conflicto los cambios
+# de precio enviados con la versión que se acababa de leer.
+VERSION_SIN_STOCK = '''
+DROP TRIGGER IF EXISTS version_producto ON productos;
+CREATE TRIGGER version_producto
+BEFORE UPDATE ON productos
+FOR EACH ROW WHEN ((OLD.sku, OLD.nombre, OLD.descripcion, OLD.precio, OLD.activo)
+                   IS DISTINCT FROM (NEW.sku, NEW.nombre, NEW.descripcion, NEW.precio, NEW.activo))
+EXECUTE FUNCTION fn_version_producto();
+'''
+
+VERSION_CON_STOCK = '''
+DROP TRIGGER IF EXISTS version_producto ON productos;
+CREATE TRIGGER version_producto
+BEFORE UPDATE ON productos
+FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+EXECUTE FUNCTION fn_version_producto();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quicknotes', '0016_eventos'),
+    ]
+
+    operations = [
+        migrations.RunSQL(VERSION_SIN_STOCK, reverse_sql=VERSION_CON_STOCK),
+    ]
@@ -1,5 +1,9 @@
 # backend/quicknotes/models.py
+from django.contrib.postgres.indexes import BrinIndex, GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.functions import Lower, Now
 from django.contrib.auth.models import AbstractUser
 
 class Usuario(AbstractUser):
@@ -25,6 +29,11 @@ class Usuario(AbstractUser):
         db_table = 'usuarios'
         verbose_name = 'Usuario'
         verbose_name_plural = 'Usuarios'
+        indexes = [
+            # Login sin distinguir mayúsculas (EmailBackend)
+            models.Index(Lower('username'), name='usuarios_username_lower_idx'),
+            models.Index(Lower('email'), name='usuarios_email_lower_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -39,32 +48,105 @@ class Cliente(models.Model):
 
     class Meta:
         db_table = 'clientes'  # <-- ¡AÑADIR ESTO!
+        indexes = [
+            # Orden del listado (ClienteViewSet), con el id como desempate del cursor
+            models.Index(fields=['nombre', 'id'], name='clientes_nombre_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} {self.apellido}"
 
 class Producto(models.Model):
+    # Código del proveedor: clave de la importación de catálogos (quicknotes/importacion.py)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     nombre = models.CharField(max_length=150)
     descripcion = models.TextField(null=True, blank=True)
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     activo = models.BooleanField(default=True)
+    # La incrementa un trigger en cada cambio del producto salvo los del
+    # stock: concurrencia optimista de la actualización en lote (ver
+    # quicknotes/productos.py)
+    version = models.IntegerField(db_default=1, editable=False)
+    # Nombre (peso A) y descripción (peso B) para la búsqueda por texto; lo
+    # calcula un trigger de la base de datos (ver quicknotes/busqueda.py)
+    busqueda = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'productos'  # <-- ¡AÑADIR ESTO!
+        indexes = [
+            models.Index(fields=['nombre', 'id'], name='productos_nombre_id_idx'),
+            GinIndex(fields=['busqueda'], name='productos_busqueda_idx'),
+        ]
 
     def __str__(self):
         return self.nombre
 
+class PedidoQuerySet(models.QuerySet):
+    """
+    Pedidos que precargan sus líneas (detallepedido_set) solo de las
+    particiones de los meses de sus fechas: sin la fecha, la consulta de las
+    líneas busca por índice en todas las particiones de detalle_pedidos.
+    """
+
+    def _prefetch_related_objects(self):
+        pedidos = self._result_cache
+        if all(isinstance(pedido, Pedido) and 'fecha_pedido' not in pedido.get_deferred_fields()
+               for pedido in pedidos):
+            fechas = [pedido.fecha_pedido for pedido in pedidos]
+            lookups = [_lineas_de_las_fechas(lookup, fechas) for lookup in self._prefetch_related_lookups]
+        else:
+            lookups = self._prefetch_related_lookups
+        prefetch_related_objects(pedidos, *lookups)
+        self._prefetch_done = True
+
+
+def _lineas_de_las_fechas(lookup, fechas):
+    """El lookup de las líneas de los pedidos, acotado a las particiones de 'fechas'."""
+    if isinstance(lookup, str):
+        if lookup != 'detallepedido_set':
+            return lookup
+        lookup = Prefetch(lookup)
+    if lookup.prefetch_through != 'detallepedido_set':
+        return lookup
+    lineas = lookup.queryset if lookup.queryset is not None else DetallePedido.objects.all()
+    return Prefetch(lookup.prefetch_through, queryset=lineas.de_las_fechas(fechas), to_attr=lookup.to_attr)
+
+
+class DetallePedidoQuerySet(models.QuerySet):
+    def de_las_fechas(self, fechas):
+        """
+        Solo las líneas de pedidos con esas fechas, por la columna fecha_pedido
+        que el ORM no conoce (ver quicknotes/particiones.py): la consulta solo
+        lee las particiones de esos meses.
+        """
+        return self.extra(where=['"detalle_pedidos"."fecha_pedido" = ANY(%s)'],
+                          params=[list(dict.fromkeys(fechas))])
+
+
 class Pedido(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.SET_NULL, null=True, blank=True)
     fecha_pedido = models.DateTimeField(auto_now_add=True)
     estado = models.CharField(max_length=50, default='pendiente')
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    objects = PedidoQuerySet.as_manager()
+
     class Meta:
         db_table = 'pedidos'  # <-- ¡AÑADIR ESTO!
+        indexes = [
+            # Listado de empleados/administradores
+            models.Index(fields=['-fecha_pedido', '-id'], name='pedidos_fecha_id_idx'),
+            # Listado de un cliente: solo sus pedidos, en el mismo orden
+            models.Index(fields=['cliente', '-fecha_pedido', '-id'], name='pedidos_cliente_fecha_id_idx'),
+            # Pedidos abiertos (?estado=pendiente): pocos. Los demás estados son
+            # la mayoría de los pedidos y se leen bien por pedidos_fecha_id_idx
+            models.Index(fields=['-fecha_pedido', '-id'], condition=models.Q(estado='pendiente'),
+                         name='pedidos_pendientes_idx'),
+            # ?total_min=, ?total_max= y ?ordenar=total
+            models.Index(fields=['total', 'id'], name='pedidos_total_id_idx'),
+        ]
 
     def __str__(self):
         return f"Pedido #{self.id}"
@@ -76,8 +158,14 @@ class DetallePedido(models.Model):
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
 
+    objects = DetallePedidoQuerySet.as_manager()
+
     class Meta:
         db_table = 'detalle_pedidos'  # <-- ¡AÑADIR ESTO!
+        indexes = [
+            # ?producto= en el orden del listado
+            models.Index(fields=['producto', '-id'], name='detalle_producto_id_idx'),
+        ]
 
     def __str__(self):
         return f"Detalle {self.id} - Pedido {self.pedido.id}"
@@ -89,9 +177,178 @@ class Devolucion(models.Model):
     fecha_devolucion = models.DateTimeField(auto_now_add=True)
     motivo = models.TextField(null=True, blank=True)
     estado = models.CharField(max_length=50, default='solicitada')
+    # Lo calcula la base de datos al registrar la devolución (precio de la línea x cantidad)
+    importe = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Cuándo se repuso el stock y se descontó del pedido (tarea devolucion_aprobada)
+    fecha_reposicion = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'devoluciones'  # <-- ¡AÑADIR ESTO!
+        indexes = [
+            models.Index(fields=['-fecha_devolucion', '-id'], name='devoluciones_fecha_id_idx'),
+            # Devoluciones por revisar (?estado=solicitada)
+            models.Index(fields=['-fecha_devolucion', '-id'], condition=models.Q(estado='solicitada'),
+                         name='devoluciones_solicitadas_idx'),
+            # ?producto= en el orden del listado
+            models.Index(fields=['producto', '-fecha_devolucion', '-id'], name='devoluciones_prod_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"Devolución #{self.id}"
+
+class StockCupo(models.Model):
+    """
+    Porción del stock disponible de un producto. El stock de cada producto se
+    reparte en varios cupos para que los checkouts concurrentes del mismo
+    producto bloqueen filas distintas en lugar de hacer cola sobre una sola.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    disponible = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'stock_cupos'
+
+    def __str__(self):
+        return f"Cupo {self.id} - Producto {self.producto_id}"
+
+class ReservaStock(models.Model):
+    """
+    Libro de reservas: cada venta añade una fila aquí en lugar de actualizar
+    productos.stock. El liquidador (manage.py liquidar_reservas) las vuelca
+    por lotes en productos.stock.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.RESTRICT)
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, null=True, blank=True)
+    cantidad = models.IntegerField()
+    fecha_reserva = models.DateTimeField(auto_now_add=True)
+    fecha_liquidacion = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'reservas_stock'
+        indexes = [
+            # Solo las reservas pendientes de liquidar, que son pocas
+            models.Index(fields=['id'], condition=models.Q(fecha_liquidacion__isnull=True),
+                         name='reservas_pendientes_idx'),
+            models.Index(fields=['producto', 'id'], condition=models.Q(fecha_liquidacion__isnull=True),
+                         name='reservas_pendientes_prod_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reserva {self.id} - Producto {self.producto_id}"
+
+class VentaDiaria(models.Model):
+    """
+    Acumulado de ventas por día. Lo mantienen los triggers de pedidos,
+    detalle_pedidos y devoluciones (ver quicknotes.ventas); cada día se reparte
+    en varios fragmentos para que los checkouts simultáneos no actualicen la
+    misma fila.
+    """
+    dia = models.DateField()
+    fragmento = models.SmallIntegerField(default=0)
+    pedidos = models.IntegerField(default=0)
+    unidades = models.IntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unidades_devueltas = models.IntegerField(default=0)
+    importe_devuelto = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'ventas_diarias'
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'fragmento'], name='ventas_diarias_dia_fragmento_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Ventas {self.dia} ({self.fragmento})"
+
+class VentaProductoDiaria(models.Model):
+    dia = models.DateField()
+    # Sin restricción de clave foránea: el acumulado no debe impedir borrar filas
+    producto = models.ForeignKey(Producto, on_delete=models.DO_NOTHING, db_constraint=False)
+    fragmento = models.SmallIntegerField(default=0)
+    unidades = models.IntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unidades_devueltas = models.IntegerField(default=0)
+    importe_devuelto = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'ventas_producto_diarias'
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'producto', 'fragmento'],
+                                    name='ventas_producto_dia_fragmento_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Ventas {self.dia} - Producto {self.producto_id}"
+
+class VentaClienteDiaria(models.Model):
+    dia = models.DateField()
+    # Los pedidos sin cliente se acumulan con cliente NULL
+    cliente = models.ForeignKey(Cliente, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    fragmento = models.SmallIntegerField(default=0)
+    pedidos = models.IntegerField(default=0)
+    unidades = models.IntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unidades_devueltas = models.IntegerField(default=0)
+    importe_devuelto = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'ventas_cliente_diarias'
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'cliente', 'fragmento'], nulls_distinct=False,
+                                    name='ventas_cliente_dia_fragmento_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Ventas {self.dia} - Cliente {self.cliente_id}"
+
+class Tarea(models.Model):
+    """
+    Tarea de la cola de trabajos en segundo plano (ver quicknotes.tareas).
+    Las hechas se borran; las que agotan sus intentos quedan como 'fallida'.
+    """
+    tipo = models.CharField(max_length=50)
+    # Una tarea con la misma clave no se encola dos veces
+    clave = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    datos = models.JSONField(default=dict)
+    estado = models.CharField(max_length=20, db_default='pendiente')
+    intentos = models.IntegerField(db_default=0)
+    max_intentos = models.IntegerField(db_default=5)
+    disponible_desde = models.DateTimeField(db_default=Now())
+    error = models.TextField(null=True, blank=True)
+    fecha_creacion = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        db_table = 'tareas'
+        indexes = [
+            # Solo las pendientes, en el orden en que se toman
+            models.Index(fields=['tipo', 'disponible_desde', 'id'], condition=models.Q(estado='pendiente'),
+                         name='tareas_pendientes_idx'),
+        ]
+
+    def __str__(self):
+        return f"Tarea {self.id} - {self.tipo}"
+
+
+class Cambio(models.Model):
+    """
+    Registro de cambios de productos, pedidos, líneas y devoluciones para la
+    sincronización incremental (ver quicknotes.cambios). Lo rellenan los
+    triggers de esas tablas: una fila por registro y sentencia.
+    """
+    # Transacción que hizo el cambio (pg_current_xact_id()): ordena el registro
+    transaccion = models.BigIntegerField()
+    tabla = models.CharField(max_length=30)
+    registro_id = models.BigIntegerField()
+    fecha = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        db_table = 'cambios'
+        indexes = [
+            # Cada consulta del feed es un rango de este índice
+            models.Index(fields=['tabla', 'transaccion', 'id'], name='cambios_tabla_txid_idx'),
+            # Para purgar lo antiguo: las filas llegan en orden de fecha
+            BrinIndex(fields=['fecha'], name='cambios_fecha_brin'),
+        ]
 
     def __str__(self):
-        return f"Devolución #{self.id}"
\ No newline at end of file
+        return f"Cambio {self.id} - {self.tabla} {self.registro_id}"
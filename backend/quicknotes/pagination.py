@@ -0,0 +1,201 @@
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) sobre un ordenamiento compuesto.
+
+    A diferencia de CursorPagination, la posición del cursor guarda el valor de
+    TODOS los campos del ordenamiento (el último siempre es el 'id'), así que
+    cada posición es única y la página siguiente se obtiene con un rango sobre
+    el índice compuesto, sin OFFSET, sin importar lo profundo que se esté.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self._consulta_de_pagina(queryset, request, view)
+        if queryset is None:
+            return None
+        return self._paginar(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Como paginate_queryset(), con la consulta asíncrona (ver quicknotes.asincronas)."""
+        queryset = self._consulta_de_pagina(queryset, request, view)
+        if queryset is None:
+            return None
+        return self._paginar([objeto async for objeto in queryset[:self.page_size + 1]])
+
+    def _consulta_de_pagina(self, queryset, request, view):
+        """Ordena y filtra el queryset desde la posición del cursor (sin ejecutarlo)."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (reverse, current_position) = (False, None)
+        else:
+            (_, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_invertir(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            valores = self._decodificar_posicion(queryset.model, current_position)
+            queryset = queryset.filter(_filtro_keyset(self.ordering, valores, reverse))
+        return queryset
+
+    def _paginar(self, results):
+        """Calcula la página y sus posiciones a partir de page_size + 1 filas."""
+        current_position = None if self.cursor is None else self.cursor.position
+        reverse = self.cursor is not None and self.cursor.reverse
+        self.page = list(results[:self.page_size])
+
+        # La posición siguiente es la del último elemento de la página; como es
+        # única, nunca hace falta el 'offset' del cursor de DRF.
+        has_following_position = len(results) > len(self.page)
+        following_position = None
+        if has_following_position:
+            following_position = self._get_position_from_instance(self.page[-1], self.ordering)
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.next_position
+        if self.page and self.cursor and self.cursor.reverse:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.previous_position
+        if self.page and not (self.cursor and self.cursor.reverse):
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        valores = []
+        for campo in ordering:
+            nombre = campo.lstrip('-')
+            valor = instance[nombre] if isinstance(instance, dict) else getattr(instance, nombre)
+            valores.append(valor if isinstance(valor, (int, float, str)) or valor is None else str(valor))
+        return json.dumps(valores, separators=(',', ':'))
+
+    def _decodificar_posicion(self, model, position):
+        try:
+            valores = json.loads(position)
+            if not isinstance(valores, list) or len(valores) != len(self.ordering):
+                raise ValueError
+            return [self._convertir(model, campo.lstrip('-'), valor) for campo, valor in zip(self.ordering, valores)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _convertir(model, nombre, valor):
+        try:
+            return model._meta.get_field(nombre).to_python(valor)
+        except FieldDoesNotExist:
+            # Campo anotado (p. ej. la relevancia de una búsqueda): solo números
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                raise ValueError
+            return valor
+
+
+def ordenamiento_de(vista):
+    """
+    El ordenamiento con que se pagina la petición en curso de 'vista' (el de
+    ?ordenar= si sus filtros lo admiten, ver quicknotes.filtros).
+    """
+    if not hasattr(vista.pagination_class, 'ordering'):
+        return ()
+    return vista.paginator.get_ordering(vista.request, None, vista)
+
+
+def _invertir(ordering):
+    return tuple(campo[1:] if campo.startswith('-') else '-' + campo for campo in ordering)
+
+
+def _filtro_keyset(ordering, valores, reverse):
+    """
+    Construye "(a, b) > (x, y)" respetando la dirección de cada campo.
+
+    Se repite la condición "a >= x" fuera del OR para que PostgreSQL la use
+    como condición de acceso al índice (a, b) en lugar de filtrar la tabla.
+    """
+    condiciones = []
+    for i, campo in enumerate(ordering):
+        nombre = campo.lstrip('-')
+        descendente = campo.startswith('-') != reverse
+        lookup = '__lt' if descendente else '__gt'
+        iguales = {ordering[j].lstrip('-'): valores[j] for j in range(i)}
+        condiciones.append(Q(**iguales, **{nombre + lookup: valores[i]}))
+
+    filtro = condiciones[0]
+    for condicion in condiciones[1:]:
+        filtro |= condicion
+
+    primero = ordering[0].lstrip('-')
+    descendente = ordering[0].startswith('-') != reverse
+    return Q(**{primero + ('__lte' if descendente else '__gte'): valores[0]}) & filtro
+
+
+class PedidoPagination(KeysetPagination):
+    ordering = ('-fecha_pedido', '-id')
+
+
+class DevolucionPagination(KeysetPagination):
+    ordering = ('-fecha_devolucion', '-id')
+
+
+class NombrePagination(KeysetPagination):
+    """Para Producto y Cliente, que se listan por nombre."""
+    ordering = ('nombre', 'id')
+
+
+class UsuarioPagination(KeysetPagination):
+    # 'username' ya es único, no necesita desempate por id
+    ordering = ('username',)
+
+
+class DetallePedidoPagination(KeysetPagination):
+    ordering = ('-id',)
+
+
+class BusquedaPagination(KeysetPagination):
+    # Por relevancia (anotada en la consulta) y, a igual relevancia, por id
+    ordering = ('-relevancia', 'id')
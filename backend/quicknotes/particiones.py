@@ -0,0 +1,74 @@
+"""
+Particiones mensuales de pedidos, líneas y devoluciones.
+
+pedidos, detalle_pedidos y devoluciones están particionadas por la fecha del
+pedido (migración 0011 y postgres.sql), con una partición por mes UTC
+(pedidos_2026_11, detalle_pedidos_2026_11...) y una "<tabla>_historico" con
+todo lo anterior a la migración. Las líneas y las devoluciones llevan copiada
+la fecha de su pedido (columna fecha_pedido, que el ORM no conoce: la
+rellenan los triggers), así que un pedido y todo lo que le cuelga están
+siempre en particiones del mismo mes.
+
+- Las consultas con la fecha del pedido (el listado de pedidos, que pagina
+  por fecha, los informes por rango, reconstruir_ventas con rango) solo leen
+  las particiones de esos meses.
+- Las particiones se crean por adelantado: crear_particiones() (manage.py
+  mantener_particiones, a diario desde cron) deja creadas las de los
+  próximos MESES_POR_ADELANTADO meses. Un pedido de un mes sin partición
+  falla, así que conviene no quedarse sin margen.
+- archivar_particiones() desengancha las particiones antiguas (el pedido, sus
+  líneas y sus devoluciones a la vez) y las pasa al esquema "archivo": salen
+  de la API y de las consultas al instante, sin borrar filas. Los acumulados
+  de ventas no cambian, pero reconstruir_ventas ya no las ve.
+"""
+from django.db import connection, transaction
+
+# Meses con partición propia por delante del actual
+MESES_POR_ADELANTADO = 3
+
+
+def crear_particiones(meses=MESES_POR_ADELANTADO):
+    """Crea las particiones que falten hasta dentro de 'meses' meses. Devuelve sus nombres."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT crear_particiones_pedidos((CURRENT_DATE + make_interval(months => %s))::date)",
+            [meses]
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def archivar_particiones(meses_a_conservar):
+    """
+    Archiva las particiones de los meses anteriores a los últimos
+    'meses_a_conservar' meses completos (el actual siempre se conserva).
+    Devuelve los nombres de las archivadas.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT archivar_particiones_pedidos(
+                (date_trunc('month', now() AT TIME ZONE 'UTC') - make_interval(months => %s))::date
+            )
+            """,
+            [meses_a_conservar]
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def particiones():
+    """Particiones de pedidos, detalle_pedidos y devoluciones, con su rango y sus filas (estimadas)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT i.inhparent::regclass::text, c.relname,
+                   pg_get_expr(c.relpartbound, c.oid), GREATEST(c.reltuples, 0)::bigint
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent IN ('pedidos'::regclass, 'detalle_pedidos'::regclass, 'devoluciones'::regclass)
+            ORDER BY 1, fin_de_particion(c.oid)
+            """
+        )
+        return [
+            {'tabla': tabla, 'particion': particion, 'rango': rango, 'filas': filas}
+            for tabla, particion, rango, filas in cursor.fetchall()
+        ]
@@ -0,0 +1,177 @@
+"""
+Registro de pedidos en lote.
+
+Recibe cientos de pedidos en una sola petición y los inserta con sentencias
+por conjuntos (unnest) dentro de una única transacción:
+
+- un INSERT para todos los pedidos y otro para todas las líneas;
+- el stock se reserva una sola vez por producto (trigger actualizar_stock,
+  que suma las cantidades de toda la sentencia y las apunta en el libro de
+  reservas; ver quicknotes.reservas).
+
+Cada pedido se valida por separado y el resultado se informa pedido a pedido:
+los pedidos inválidos o que dejarían un producto sin stock se rechazan sin
+afectar a los demás.
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Prefetch
+
+from .authentication import UsuarioToken
+from .models import DetallePedido, Pedido
+from .serializers import PedidoLoteSerializer
+
+MAX_PEDIDOS_POR_LOTE = 1000
+
+
+def registrar_pedidos_lote(pedidos_data):
+    """
+    Registra una lista de pedidos con el formato de 'registrar-nuevo-pedido'
+    y devuelve una lista de resultados en el mismo orden:
+    {'indice', 'ok', 'pedido_id'} o {'indice', 'ok', 'errores'}.
+    """
+    resultados = [None] * len(pedidos_data)
+    validos = []
+    for indice, data in enumerate(pedidos_data):
+        serializer = PedidoLoteSerializer(data=data)
+        if serializer.is_valid():
+            validos.append((indice, serializer.validated_data))
+        else:
+            resultados[indice] = {'indice': indice, 'ok': False, 'errores': serializer.errors}
+
+    if not validos:
+        return resultados
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        aceptados = _asignar_stock(cursor, validos, resultados)
+        if aceptados:
+            _insertar(cursor, aceptados, resultados)
+
+    return resultados
+
+
+def _asignar_stock(cursor, validos, resultados):
+    """
+    Bloquea (en orden de producto e id) los cupos de stock de los productos
+    del lote y reparte lo disponible entre los pedidos en el orden recibido.
+    Devuelve los pedidos aceptados.
+    """
+    clientes_ids = {pedido['cliente_id'] for _, pedido in validos}
+    productos_ids = {linea['producto_id'] for _, pedido in validos for linea in pedido['productos']}
+
+    cursor.execute("SELECT id FROM clientes WHERE id = ANY(%s)", [list(clientes_ids)])
+    clientes_existentes = {fila[0] for fila in cursor.fetchall()}
+
+    cursor.execute(
+        """
+        SELECT producto_id, SUM(disponible) FROM (
+            SELECT producto_id, disponible FROM stock_cupos
+            WHERE producto_id = ANY(%s)
+            ORDER BY producto_id, id
+            FOR UPDATE
+        ) cupos
+        GROUP BY producto_id
+        """,
+        [list(productos_ids)]
+    )
+    stock_disponible = dict(cursor.fetchall())
+
+    aceptados = []
+    for indice, pedido in validos:
+        cantidades = Counter()
+        for linea in pedido['productos']:
+            cantidades[linea['producto_id']] += linea['cantidad']
+
+        errores = []
+        if pedido['cliente_id'] not in clientes_existentes:
+            errores.append(f"El cliente {pedido['cliente_id']} no existe.")
+        for producto_id, cantidad in sorted(cantidades.items()):
+            if producto_id not in stock_disponible:
+                errores.append(f"El producto {producto_id} no existe.")
+            elif stock_disponible[producto_id] < cantidad:
+                errores.append(f"Stock insuficiente para el producto {producto_id}.")
+
+        if errores:
+            resultados[indice] = {'indice': indice, 'ok': False, 'errores': errores}
+            continue
+
+        for producto_id, cantidad in cantidades.items():
+            stock_disponible[producto_id] -= cantidad
+        aceptados.append((indice, pedido))
+    return aceptados
+
+
+def _insertar(cursor, aceptados, resultados):
+    # Reservamos los ids de antemano para saber qué id corresponde a cada pedido
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence('pedidos', 'id')) FROM generate_series(1, %s)",
+        [len(aceptados)]
+    )
+    pedidos_ids = [fila[0] for fila in cursor.fetchall()]
+
+    columnas_pedidos = ([], [], [], [])
+    columnas_lineas = ([], [], [], [], [])
+    for pedido_id, (indice, pedido) in zip(pedidos_ids, aceptados):
+        total = 0
+        for linea in pedido['productos']:
+            subtotal = linea['cantidad'] * linea['precio_unitario']
+            total += subtotal
+            for columna, valor in zip(columnas_lineas, (pedido_id, linea['producto_id'], linea['cantidad'],
+                                                         linea['precio_unitario'], subtotal)):
+                columna.append(valor)
+        for columna, valor in zip(columnas_pedidos, (pedido_id, pedido['cliente_id'], pedido['estado'], total)):
+            columna.append(valor)
+        resultados[indice] = {'indice': indice, 'ok': True, 'pedido_id': pedido_id}
+
+    cursor.execute(
+        """
+        INSERT INTO pedidos (id, cliente_id, estado, total, fecha_pedido)
+        SELECT id, cliente_id, estado, total, CURRENT_TIMESTAMP
+        FROM unnest(%s::bigint[], %s::bigint[], %s::varchar[], %s::numeric[])
+            AS p(id, cliente_id, estado, total)
+        """,
+        columnas_pedidos
+    )
+    # Con la fecha del pedido, las líneas van directamente a su partición
+    cursor.execute(
+        """
+        INSERT INTO detalle_pedidos (pedido_id, producto_id, cantidad, precio_unitario, subtotal, fecha_pedido)
+        SELECT *, CURRENT_TIMESTAMP
+        FROM unnest(%s::bigint[], %s::bigint[], %s::integer[], %s::numeric[], %s::numeric[])
+        """,
+        columnas_lineas
+    )
+
+
+# --- Pedidos visibles para un usuario ---
+
+def pedidos_visibles(usuario):
+    """
+    Pedidos que puede ver el usuario, con su cliente y sus líneas: todos
+    para empleados y administradores, solo los suyos para un cliente. Lo
+    usan PedidoViewSet y las vistas asíncronas (quicknotes.asincronas).
+    """
+    pedidos = Pedido.objects.select_related('cliente').only(
+        'id', 'cliente_id', 'fecha_pedido', 'estado', 'total', 'cliente__nombre'
+    ).prefetch_related(
+        # Todas las líneas de la página en una sola consulta, con el nombre del
+        # producto y solo de las particiones de sus meses (ver PedidoQuerySet)
+        Prefetch('detallepedido_set', queryset=DetallePedido.objects.select_related('producto').only(
+            'id', 'pedido_id', 'producto_id', 'cantidad', 'precio_unitario', 'subtotal', 'producto__nombre'
+        ).order_by('id'))
+    ).order_by('-fecha_pedido')
+
+    if usuario.rol in ['administrador', 'empleado']:
+        return pedidos
+
+    if isinstance(usuario, UsuarioToken):
+        # El token ya dice qué cliente es: no hace falta el JOIN
+        if usuario.cliente_id is None:
+            return pedidos.none()
+        return pedidos.filter(cliente_id=usuario.cliente_id)
+
+    # Para los clientes, filtramos por el cliente asociado a su usuario.
+    # El JOIN con clientes evita una consulta aparte para buscar el Cliente;
+    # si el usuario no tiene perfil de cliente, simplemente no devuelve nada.
+    return pedidos.filter(cliente__usuario=usuario)
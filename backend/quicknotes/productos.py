@@ -0,0 +1,118 @@
+"""
+Actualización de precios, stock y estado de muchos productos a la vez.
+
+Las sincronizaciones de precios e inventario cambian miles de productos; con
+un PATCH por producto cada uno es una petición, una validación y una
+transacción. actualizar_productos_lote() valida cada elemento con las reglas
+de ProductoSerializer y aplica los válidos por bloques de
+PRODUCTOS_POR_SENTENCIA, con un UPDATE ... FROM (VALUES ...) por bloque:
+
+- los productos del bloque se bloquean primero, en orden de id (el mismo
+  orden que repartir_cupos y las ventas);
+- las filas que no cambian nada no se reescriben;
+- el trigger de los cupos corre una vez por bloque, no una por producto;
+- el catálogo cacheado se invalida una sola vez al final.
+
+Concurrencia optimista: cada producto tiene una versión que un trigger
+incrementa cuando cambian sku, nombre, descripción, precio o activo
+(migraciones 0014 y 0017), venga de donde venga. El stock no cuenta: las
+ventas y las devoluciones lo cambian continuamente. Un elemento que trae
+'version' solo se aplica si el producto sigue en esa versión; si no, se
+informa como conflicto con la versión actual.
+"""
+from django.db import connection, transaction
+from rest_framework import serializers
+
+from .cache import invalidar_catalogo
+from .serializers import ProductoLoteSerializer
+
+MAX_PRODUCTOS_POR_LOTE = 10000
+
+# Productos por UPDATE (y por transacción)
+PRODUCTOS_POR_SENTENCIA = 1000
+
+
+def actualizar_productos_lote(productos_data):
+    """
+    Aplica una lista de {id, version?, precio?, stock?, activo?} y devuelve
+    una lista de resultados en el mismo orden, como registrar_pedidos_lote:
+    {'indice', 'ok', 'id', 'actualizado', 'version'} o
+    {'indice', 'ok', 'id', 'errores'} (con 'version' si es un conflicto).
+    """
+    resultados = [None] * len(productos_data)
+    validos = []
+    vistos = {}
+    serializer = ProductoLoteSerializer()
+    for indice, data in enumerate(productos_data):
+        try:
+            producto = serializer.run_validation(data)
+        except serializers.ValidationError as e:
+            resultados[indice] = {'indice': indice, 'ok': False, 'errores': e.detail}
+            continue
+        # Dos cambios del mismo producto en un UPDATE: solo se aplicaría uno
+        if producto['id'] in vistos:
+            resultados[indice] = {'indice': indice, 'ok': False, 'id': producto['id'], 'errores': [
+                f"El producto {producto['id']} está repetido en el lote (elemento {vistos[producto['id']]})."
+            ]}
+            continue
+        vistos[producto['id']] = indice
+        validos.append((indice, producto))
+
+    actualizados = 0
+    for inicio in range(0, len(validos), PRODUCTOS_POR_SENTENCIA):
+        actualizados += _actualizar(validos[inicio:inicio + PRODUCTOS_POR_SENTENCIA], resultados)
+    if actualizados:
+        invalidar_catalogo()
+    return resultados
+
+
+def _actualizar(bloque, resultados):
+    """Aplica un bloque de productos validados en una transacción. Devuelve cuántos cambiaron."""
+    filas = []
+    for indice, producto in bloque:
+        filas.extend([indice, producto['id'], producto.get('version'), producto.get('precio'),
+                      producto.get('stock'), producto.get('activo')])
+    valores = ', '.join(['(%s::integer, %s::bigint, %s::integer, %s::numeric, %s::integer, %s::boolean)'] * len(bloque))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM productos WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+                       [[producto['id'] for _, producto in bloque]])
+        # La consulta final ve los productos como estaban antes del UPDATE: la
+        # versión nueva de los cambiados sale de RETURNING
+        cursor.execute(
+            f"""
+            WITH cambios (indice, id, version, precio, stock, activo) AS (VALUES {valores}),
+            actualizados AS (
+                UPDATE productos p SET
+                    precio = COALESCE(c.precio, p.precio),
+                    stock = COALESCE(c.stock, p.stock),
+                    activo = COALESCE(c.activo, p.activo)
+                FROM cambios c
+                WHERE p.id = c.id
+                  AND (c.version IS NULL OR p.version = c.version)
+                  AND (p.precio, p.stock, p.activo)
+                      IS DISTINCT FROM (COALESCE(c.precio, p.precio), COALESCE(c.stock, p.stock),
+                                        COALESCE(c.activo, p.activo))
+                RETURNING p.id, p.version
+            )
+            SELECT c.indice, c.id, p.id IS NOT NULL, a.id IS NOT NULL, COALESCE(a.version, p.version),
+                   c.version IS NULL OR c.version = p.version
+            FROM cambios c
+            LEFT JOIN productos p ON p.id = c.id
+            LEFT JOIN actualizados a ON a.id = c.id
+            """,
+            filas
+        )
+        actualizados = 0
+        for indice, producto_id, existe, actualizado, version, al_dia in cursor.fetchall():
+            if not existe:
+                resultados[indice] = {'indice': indice, 'ok': False, 'id': producto_id,
+                                      'errores': [f'El producto {producto_id} no existe.']}
+            elif not al_dia:
+                resultados[indice] = {'indice': indice, 'ok': False, 'id': producto_id, 'version': version,
+                                      'errores': [f'El producto {producto_id} cambió: su versión actual es {version}.']}
+            else:
+                actualizados += actualizado
+                resultados[indice] = {'indice': indice, 'ok': True, 'id': producto_id,
+                                      'actualizado': actualizado, 'version': version}
+    return actualizados
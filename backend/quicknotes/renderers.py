@@ -0,0 +1,36 @@
+"""
+JSONRenderer de DRF con orjson.
+
+json.dumps con el JSONEncoder de DRF es, después de los serializers, lo que
+más CPU gasta en un listado grande. orjson escribe el mismo JSON (compacto,
+UTF-8 sin escapar y con \\u2028 y \\u2029 escapados) varias veces más rápido.
+Lo que orjson no sabe escribir (Decimal, fechas, UUID, QuerySet...) pasa por
+el JSONEncoder de DRF, así que sale igual que antes.
+
+Solo cambia la forma de algunos floats muy grandes o muy pequeños (1e16 en
+lugar de 1e+16), que los serializers no devuelven: sus decimales son texto.
+Si orjson no está instalado, o se pide el JSON con sangría
+('application/json; indent=4'), se usa el JSONRenderer de DRF.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+OPCIONES = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+
+
+class JSONRapidoRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=OPCIONES)
+        except orjson.JSONEncodeError:
+            # Claves que no son texto, enteros de más de 64 bits...
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
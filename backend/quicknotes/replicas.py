@@ -0,0 +1,188 @@
+"""
+Réplicas de lectura.
+
+Con DB_REPLICAS (core/settings.py) las lecturas de las peticiones GET se
+reparten entre las réplicas y así no compiten en la primaria con los pedidos
+que se están registrando. ReplicaRouter decide a qué base de datos va cada
+consulta:
+
+- Las escrituras van siempre a la primaria ('default'), y también todo lo
+  que se lee en una petición que escribe (POST, PUT, PATCH, DELETE), dentro
+  de una transacción de la primaria o fuera de una petición (comandos,
+  liquidador, tests).
+- Cada petición GET lee de una sola réplica, elegida al azar entre las que
+  están al día, así que sus consultas (página y líneas...) ven los mismos
+  datos.
+- Leer tus propias escrituras: tras una escritura que termina bien, las
+  lecturas de ese usuario van a la primaria durante REPLICA_FIJAR_SEGUNDOS
+  (lo apunta primaria_tras_escribir_middleware en la caché, que debe ser
+  compartida entre procesos). Es el margen para que la réplica lo reciba.
+- Cada REPLICA_COMPROBAR_CADA segundos se mide el retraso de cada réplica;
+  si pasa de REPLICA_MAX_RETRASO, o no responde, deja de usarse hasta la
+  siguiente comprobación. Sin réplicas sanas, todo va a la primaria.
+- Lo que se guarda en la caché del catálogo se lee de la primaria
+  (leer_de_la_primaria()).
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import LazyObject, empty
+
+METODOS_SEGUROS = ('GET', 'HEAD', 'OPTIONS')
+
+# Segundos que la réplica va por detrás de la primaria. Si ya aplicó todo lo
+# que recibió, 0 (en una primaria sin escrituras el último commit aplicado
+# puede ser antiguo sin que haya retraso); en un servidor que no es réplica,
+# también 0
+RETRASO_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_peticion = ContextVar('quicknotes_replicas_peticion', default=None)
+
+
+def _clave_primaria(usuario_id):
+    return f'replicas:primaria:{usuario_id}'
+
+
+def _usuario_id(request):
+    """
+    El id del usuario de la petición si ya se autenticó: DRF lo deja en
+    request.user al autenticar el token, y el de sesión es perezoso (cargarlo
+    aquí lanzaría una consulta desde el propio router).
+    """
+    usuario = request.__dict__.get('user')
+    if isinstance(usuario, LazyObject):
+        usuario = None if usuario._wrapped is empty else usuario._wrapped
+    if usuario is None or not usuario.is_authenticated:
+        return None
+    return usuario.pk
+
+
+def leer_de_la_primaria():
+    """
+    Manda a la primaria el resto de lecturas de la petición en curso. Para lo
+    que se guarda en una caché: lo que se lea de una réplica atrasada quedaría
+    guardado como si fuera actual.
+    """
+    peticion = _peticion.get()
+    if peticion is not None:
+        peticion.primaria = True
+
+
+def retraso_de_replica(alias):
+    """Retraso de la réplica en segundos, o None si no responde."""
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(RETRASO_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        return None
+
+
+class _Peticion:
+    """Lo que el router sabe de la petición en curso."""
+
+    def __init__(self, request, transacciones=0):
+        self.request = request
+        self.primaria = request.method not in METODOS_SEGUROS
+        self.replica = None
+        self.usuario_comprobado = None
+        # Transacciones de la primaria ya abiertas al empezar la petición (la
+        # de cada test): solo las que abre la petición mandan leer de la primaria
+        self.transacciones = transacciones
+
+    def usar_primaria(self):
+        if len(connections[DEFAULT_DB_ALIAS].atomic_blocks) > self.transacciones:
+            return True
+        if not self.primaria:
+            # Se comprueba una vez, en cuanto se sabe quién es el usuario
+            usuario_id = _usuario_id(self.request)
+            if usuario_id is not None and usuario_id != self.usuario_comprobado:
+                self.usuario_comprobado = usuario_id
+                self.primaria = bool(cache.get(_clave_primaria(usuario_id)))
+        return self.primaria
+
+
+class ReplicaRouter:
+    def __init__(self):
+        # alias -> (cuándo se comprobó, si está sana), por proceso
+        self.estado_replicas = {}
+
+    def db_for_read(self, model, **hints):
+        peticion = _peticion.get()
+        if not settings.DATABASE_REPLICAS or peticion is None or peticion.usar_primaria():
+            return DEFAULT_DB_ALIAS
+        if peticion.replica is None:
+            peticion.replica = random.choice(self.replicas_sanas() or [DEFAULT_DB_ALIAS])
+        return peticion.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las réplicas tienen los mismos datos que la primaria
+        bases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        return obj1._state.db in bases and obj2._state.db in bases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las réplicas reciben el esquema de la primaria
+        return db not in settings.DATABASE_REPLICAS
+
+    def replicas_sanas(self):
+        ahora = time.monotonic()
+        sanas = []
+        for alias in settings.DATABASE_REPLICAS:
+            comprobada, sana = self.estado_replicas.get(alias, (None, False))
+            if comprobada is None or ahora - comprobada >= settings.REPLICA_COMPROBAR_CADA:
+                retraso = retraso_de_replica(alias)
+                sana = retraso is not None and retraso <= settings.REPLICA_MAX_RETRASO
+                self.estado_replicas[alias] = (ahora, sana)
+            if sana:
+                sanas.append(alias)
+        return sanas
+
+
+def _fijar_primaria(request, response):
+    # Solo si escribió: una petición rechazada no cambia nada
+    if request.method in METODOS_SEGUROS or response.status_code >= 400 or not settings.DATABASE_REPLICAS:
+        return
+    usuario_id = _usuario_id(request)
+    if usuario_id is not None:
+        cache.set(_clave_primaria(usuario_id), True, settings.REPLICA_FIJAR_SEGUNDOS)
+
+
+@sync_and_async_middleware
+def primaria_tras_escribir_middleware(get_response):
+    """
+    Da a conocer la petición en curso a ReplicaRouter y, tras una escritura,
+    manda a la primaria las lecturas del usuario durante REPLICA_FIJAR_SEGUNDOS.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _peticion.set(_Peticion(request))
+            try:
+                response = await get_response(request)
+            finally:
+                _peticion.reset(token)
+            await sync_to_async(_fijar_primaria)(request, response)
+            return response
+    else:
+        def middleware(request):
+            token = _peticion.set(_Peticion(request, len(connections[DEFAULT_DB_ALIAS].atomic_blocks)))
+            try:
+                response = get_response(request)
+            finally:
+                _peticion.reset(token)
+            _fijar_primaria(request, response)
+            return response
+    return middleware
@@ -0,0 +1,47 @@
+"""
+Reserva de stock sin contención para productos muy demandados.
+
+Antes, cada venta hacía UPDATE sobre la fila del producto (dos veces: en
+registrar_pedido y en el trigger), así que todos los checkouts del mismo
+producto hacían cola sobre ese bloqueo hasta el commit. Ahora:
+
+- El stock vendible de cada producto está repartido en varios cupos
+  (tabla stock_cupos). Un checkout descuenta de un cupo libre elegido al
+  azar (FOR UPDATE SKIP LOCKED), así que N checkouts del mismo producto
+  bloquean N filas distintas. Si no queda ningún cupo con saldo suficiente se
+  bloquean todos en orden de id y se comprueba el total: nunca se vende más
+  de lo que hay.
+- Cada venta añade una fila al libro de reservas (reservas_stock) sin tocar
+  productos.
+- El liquidador (manage.py liquidar_reservas) vuelca periódicamente las
+  reservas pendientes en productos.stock, con una sola actualización por
+  producto y bloqueando los productos siempre en orden de id.
+
+Todo esto vive en PostgreSQL (migración 0006 y postgres.sql): el trigger
+actualizar_stock llama a reservar_stock() por cada producto vendido y un
+cambio de stock hecho a mano vuelve a repartir los cupos con repartir_cupos().
+"""
+from django.db import connection, transaction
+
+from .cache import invalidar_catalogo
+
+
+def liquidar_reservas(limite=10000):
+    """Vuelca en productos.stock un lote de reservas pendientes. Devuelve cuántas liquidó."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT liquidar_reservas(%s)", [limite])
+        liquidadas = cursor.fetchone()[0]
+        if liquidadas:
+            # productos.stock cambió: el catálogo cacheado ya no vale
+            invalidar_catalogo()
+        return liquidadas
+
+
+def stock_disponible(producto_id):
+    """Stock que todavía se puede vender: la suma de los cupos del producto."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(disponible), 0) FROM stock_cupos WHERE producto_id = %s",
+            [producto_id]
+        )
+        return cursor.fetchone()[0]
@@ -1,25 +1,33 @@
 from rest_framework import serializers
 from .models import Usuario, Cliente, Producto, Pedido, DetallePedido, Devolucion
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .authentication import claims_de_usuario
+from .campos import CamposSerializerMixin
 
 # --- Serializadores de Modelos Principales ---
+# Aceptan ?fields= y ?expand= (ver quicknotes/campos.py); campos_lista son
+# los campos de los listados
 
-class UsuarioSerializer(serializers.ModelSerializer):
+class UsuarioSerializer(CamposSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Usuario
         fields = ['id', 'username', 'email', 'rol', 'first_name', 'last_name']
 
-class ClienteSerializer(serializers.ModelSerializer):
+class ClienteSerializer(CamposSerializerMixin, serializers.ModelSerializer):
     usuario = UsuarioSerializer(read_only=True)
     class Meta:
         model = Cliente
         fields = '__all__'
+        campos_lista = ['id', 'nombre', 'apellido', 'email']
 
-class ProductoSerializer(serializers.ModelSerializer):
+class ProductoSerializer(CamposSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Producto
-        fields = '__all__'
+        exclude = ['busqueda']
         read_only_fields = ['id', 'fecha_creacion']
+        campos_lista = ['id', 'sku', 'nombre', 'precio', 'stock', 'activo', 'version']
 
     def validate_precio(self, value):
         if value < 0:
@@ -31,28 +39,99 @@ class ProductoSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("El stock no puede ser un número negativo.")
         return value
 
-class DetallePedidoSerializer(serializers.ModelSerializer):
+class DetallePedidoSerializer(CamposSerializerMixin, serializers.ModelSerializer):
     producto_nombre = serializers.CharField(source='producto.nombre', read_only=True)
     class Meta:
         model = DetallePedido
         fields = ['id', 'pedido', 'producto', 'producto_nombre', 'cantidad', 'precio_unitario', 'subtotal']
         read_only_fields = ['id', 'subtotal']
 
-class PedidoSerializer(serializers.ModelSerializer):
+class PedidoSerializer(CamposSerializerMixin, serializers.ModelSerializer):
     detalle_pedidos = DetallePedidoSerializer(many=True, read_only=True, source='detallepedido_set')
     cliente_nombre = serializers.CharField(source='cliente.nombre', read_only=True)
     class Meta:
         model = Pedido
         fields = ['id', 'cliente', 'cliente_nombre', 'fecha_pedido', 'estado', 'total', 'detalle_pedidos']
         read_only_fields = ['id', 'fecha_pedido', 'total']
+        # Las líneas, solo en el detalle o con ?expand=detalle_pedidos
+        campos_lista = ['id', 'cliente', 'cliente_nombre', 'fecha_pedido', 'estado', 'total']
 
-class DevolucionSerializer(serializers.ModelSerializer):
+class DevolucionSerializer(CamposSerializerMixin, serializers.ModelSerializer):
     producto_nombre = serializers.CharField(source='producto.nombre', read_only=True)
-    pedido_id = serializers.IntegerField(source='pedido.id', read_only=True)
+    # Se lee de la columna pedido_id, sin cargar el Pedido completo
+    pedido_id = serializers.IntegerField(read_only=True)
     class Meta:
         model = Devolucion
         fields = '__all__'
-        read_only_fields = ['id', 'fecha_devolucion']
+        read_only_fields = ['id', 'fecha_devolucion', 'importe', 'fecha_reposicion']
+        campos_lista = ['id', 'pedido_id', 'producto', 'producto_nombre', 'cantidad', 'fecha_devolucion',
+                        'estado', 'importe']
+
+# --- Serializadores de Registro de Pedidos en Lote ---
+
+class LineaPedidoLoteSerializer(serializers.Serializer):
+    producto_id = serializers.IntegerField(min_value=1)
+    cantidad = serializers.IntegerField(min_value=1)
+    precio_unitario = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+
+class PedidoLoteSerializer(serializers.Serializer):
+    cliente_id = serializers.IntegerField(min_value=1)
+    estado = serializers.CharField(max_length=50, default='pendiente')
+    productos = LineaPedidoLoteSerializer(many=True, allow_empty=False)
+
+# --- Serializadores de Actualización de Productos en Lote ---
+
+class ProductoLoteSerializer(ProductoSerializer):
+    """
+    Un elemento de 'productos/actualizar-lote': el id, la versión que se leyó
+    (opcional) y los campos que cambian, con las reglas de ProductoSerializer.
+    """
+    id = serializers.IntegerField(min_value=1)
+    version = serializers.IntegerField(min_value=1, required=False)
+
+    class Meta(ProductoSerializer.Meta):
+        exclude = None
+        fields = ['id', 'version', 'precio', 'stock', 'activo']
+        extra_kwargs = {'precio': {'required': False}}
+
+    def validate(self, attrs):
+        if not {'precio', 'stock', 'activo'} & set(attrs):
+            raise serializers.ValidationError('Indica al menos uno de precio, stock o activo.')
+        return attrs
+
+# --- Serializadores de Búsqueda ---
+
+class BusquedaProductoSerializer(serializers.Serializer):
+    """Parámetros de 'productos/buscar' (en la query string)."""
+    q = serializers.CharField(max_length=200)
+    activo = serializers.BooleanField(default=True)
+    precio_min = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    precio_max = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+
+    def validate(self, attrs):
+        if 'precio_min' in attrs and 'precio_max' in attrs and attrs['precio_min'] > attrs['precio_max']:
+            raise serializers.ValidationError("'precio_min' no puede ser mayor que 'precio_max'.")
+        return attrs
+
+# --- Serializadores de Informes ---
+
+class VentasConsultaSerializer(serializers.Serializer):
+    """Parámetros de 'ventas-totales' (en la query string)."""
+    desde = serializers.DateField(required=False)
+    hasta = serializers.DateField(required=False)
+    agrupar = serializers.ChoiceField(choices=['dia', 'mes', 'producto', 'cliente'], required=False)
+    limite = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+    def validate(self, attrs):
+        if attrs.get('desde') and attrs.get('hasta') and attrs['desde'] > attrs['hasta']:
+            raise serializers.ValidationError("'desde' no puede ser posterior a 'hasta'.")
+        return attrs
+
+class ExportacionSerializer(serializers.Serializer):
+    """Parámetros de las acciones 'exportar' (en la query string)."""
+    # No puede llamarse 'format': DRF lo usa para elegir el renderer
+    # Los filtros son los del listado (ver quicknotes.filtros)
+    formato = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
 
 # --- Serializadores de Autenticación ---
 
@@ -94,11 +173,20 @@ def create(self, validated_data):
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
     Serializador de token personalizado para depurar y traducir mensajes.
+    Los tokens llevan el rol y el cliente del usuario (ver TokenUsuarioAuthentication).
     """
     default_error_messages = {
         'no_active_account': 'No se encontró ninguna cuenta activa con las credenciales proporcionadas.'
     }
 
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # También deja los datos del usuario en la caché para sus próximas peticiones
+        for claim, valor in claims_de_usuario(user.pk).items():
+            token[claim] = valor
+        return token
+
     def validate(self, attrs):
         # --- PUNTO DE DEPURACIÓN DEL BACKEND ---
         print("--- DEBUG (Login): Datos recibidos por el serializador ---")
@@ -109,4 +197,22 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         data = super().validate(attrs)
         
         print("--- DEBUG (Login): La validación fue exitosa, generando tokens ---")
-        return data
\ No newline at end of file
+        return data
+
+
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Renueva el token de acceso con el rol y el cliente actuales del usuario,
+    no con los que tenía al iniciar sesión.
+    """
+
+    def validate(self, attrs):
+        # Antes que la librería, que responde 500 si el usuario ya no existe:
+        # uno borrado o desactivado recibe 401
+        claims = claims_de_usuario(RefreshToken(attrs['refresh'])[api_settings.USER_ID_CLAIM])
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        for claim, valor in claims.items():
+            access[claim] = valor
+        data['access'] = str(access)
+        return data
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import olvidar_usuario
+from .cache import invalidar_catalogo
+from .models import Cliente, Producto, Usuario
+
+
+# Cubre la API, el admin y cualquier cambio hecho con el ORM. Los cambios de
+# stock hechos en SQL (ventas, liquidador) invalidan el catálogo por su cuenta.
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def producto_modificado(sender, **kwargs):
+    invalidar_catalogo()
+
+
+# Rol, estado y cliente de los claims del token: si cambian, los tokens
+# emitidos antes dejan de valer. Si un cliente pasa a otro usuario, el anterior
+# lo conserva como mucho AUTH_CACHE_TTL segundos.
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def usuario_modificado(sender, instance, **kwargs):
+    olvidar_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_delete, sender=Cliente)
+def cliente_modificado(sender, instance, **kwargs):
+    if instance.usuario_id:
+        olvidar_usuario(instance.usuario_id)
@@ -0,0 +1,138 @@
+"""
+Cola de tareas en segundo plano, en PostgreSQL y sin broker externo.
+
+Lo que no hace falta hacer dentro de la petición (reponer el stock de una
+devolución aprobada, descontarla del pedido...) se apunta en la tabla tareas
+y lo hace después el worker (manage.py procesar_tareas):
+
+- encolar() añade la tarea en la misma transacción que el cambio que la
+  origina: si esa transacción se deshace, la tarea tampoco existe. Las
+  tareas con clave no se duplican mientras sigan en la tabla (ON CONFLICT DO
+  NOTHING). También se pueden encolar desde un trigger, como las de las
+  devoluciones aprobadas (migración 0012).
+- Cada worker toma un lote de tareas pendientes del mismo tipo con
+  SELECT ... FOR UPDATE SKIP LOCKED: varios workers, o varios hilos del
+  mismo, se reparten las tareas sin esperarse ni repetirlas.
+- El manejador de cada tipo recibe el lote entero, y lo que hace se confirma
+  en la misma transacción que el borrado de sus tareas. Si falla, se repite
+  tarea a tarea para aislar la que falla; esa se reprograma con espera
+  exponencial y, agotados sus intentos, queda como 'fallida'.
+- Un worker que muere a mitad de lote no confirma nada: las tareas se liberan
+  y las toma otro. Aun así, los manejadores deben ser idempotentes (procesar
+  dos veces la misma tarea no debe hacer nada la segunda).
+"""
+import json
+import logging
+
+from django.db import connection, transaction
+
+logger = logging.getLogger('quicknotes.tareas')
+
+# Segundos de espera antes del primer reintento; se dobla en cada uno
+ESPERA_REINTENTO = 10
+ESPERA_MAXIMA = 3600
+
+# tipo -> (función que procesa una lista de datos, tamaño del lote)
+MANEJADORES = {}
+
+
+def manejador(tipo, lote=100):
+    """
+    Registra la función que procesa las tareas de 'tipo'. La función recibe
+    los datos de hasta 'lote' tareas y corre dentro de la transacción que las
+    da por hechas.
+    """
+    def registrar(funcion):
+        MANEJADORES[tipo] = (funcion, lote)
+        return funcion
+    return registrar
+
+
+def encolar(tipo, datos, clave=None, retraso=0, max_intentos=5):
+    """
+    Encola una tarea que podrá procesarse dentro de 'retraso' segundos.
+    Devuelve su id, o None si ya había una con la misma clave.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO tareas (tipo, clave, datos, max_intentos, disponible_desde)
+            VALUES (%s, %s, %s::jsonb, %s, statement_timestamp() + make_interval(secs => %s))
+            ON CONFLICT (clave) DO NOTHING
+            RETURNING id
+            """,
+            [tipo, clave, json.dumps(datos), max_intentos, retraso]
+        )
+        fila = cursor.fetchone()
+        return fila[0] if fila else None
+
+
+def procesar_lote(tipo, limite=None):
+    """
+    Toma y procesa un lote de tareas pendientes de 'tipo' (como mucho
+    'limite', por defecto el lote de su manejador). Devuelve (hechas, fallidas).
+    """
+    funcion, lote = MANEJADORES[tipo]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT id, datos::text FROM tareas
+            WHERE tipo = %s AND estado = 'pendiente' AND disponible_desde <= statement_timestamp()
+            ORDER BY disponible_desde, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            [tipo, limite or lote]
+        )
+        tareas = [(tarea_id, json.loads(datos)) for tarea_id, datos in cursor.fetchall()]
+        if not tareas:
+            return 0, 0
+
+        fallidas = []
+        try:
+            with transaction.atomic():
+                funcion([datos for _, datos in tareas])
+        except Exception as error:
+            if len(tareas) == 1:
+                fallidas.append((tareas[0][0], error))
+            else:
+                # Una a una, para que una tarea que falla no retenga a las demás
+                for tarea_id, datos in tareas:
+                    try:
+                        with transaction.atomic():
+                            funcion([datos])
+                    except Exception as error_tarea:
+                        fallidas.append((tarea_id, error_tarea))
+
+        ids_fallidas = {tarea_id for tarea_id, _ in fallidas}
+        cursor.execute("DELETE FROM tareas WHERE id = ANY(%s)",
+                       [[tarea_id for tarea_id, _ in tareas if tarea_id not in ids_fallidas]])
+        for tarea_id, error in fallidas:
+            logger.warning('Tarea %s (%s) fallida: %r', tarea_id, tipo, error)
+            cursor.execute(
+                """
+                UPDATE tareas
+                SET intentos = intentos + 1,
+                    error = %s,
+                    estado = CASE WHEN intentos + 1 >= max_intentos THEN 'fallida' ELSE estado END,
+                    disponible_desde = statement_timestamp()
+                        + make_interval(secs => LEAST(%s * power(2, intentos), %s))
+                WHERE id = %s
+                """,
+                [repr(error), ESPERA_REINTENTO, ESPERA_MAXIMA, tarea_id]
+            )
+        return len(tareas) - len(fallidas), len(fallidas)
+
+
+def reintentar_fallidas(tipos=None):
+    """Devuelve a la cola las tareas fallidas (de 'tipos', o todas). Devuelve cuántas."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE tareas
+            SET estado = 'pendiente', intentos = 0, disponible_desde = statement_timestamp()
+            WHERE estado = 'fallida' AND (%s::text[] IS NULL OR tipo = ANY(%s::text[]))
+            """,
+            [tipos, tipos]
+        )
+        return cursor.rowcount
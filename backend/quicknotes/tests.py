@@ -1,3 +1,1771 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.contrib.auth import authenticate
+from django.db import connections
+from django.db.models import Sum
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from .models import (
+    Usuario, Cliente, Producto, Pedido, DetallePedido, Devolucion, StockCupo, ReservaStock,
+    VentaDiaria, VentaProductoDiaria, VentaClienteDiaria, Tarea, Cambio
+)
+from .reservas import liquidar_reservas, stock_disponible
+from .ventas import reconstruir_ventas
+from .busqueda import trigramas_disponibles
+from .serializers import (
+    MyTokenObtainPairSerializer, UsuarioSerializer, ClienteSerializer, ProductoSerializer, PedidoSerializer,
+    DetallePedidoSerializer, DevolucionSerializer
+)
+from .lectura_rapida import plan_de
+from .replicas import ReplicaRouter
+from .datos_prueba import generar_datos
+from .renderers import JSONRapidoRenderer
+from .particiones import archivar_particiones, crear_particiones
+from .tareas import MANEJADORES, encolar, manejador, procesar_lote, reintentar_fallidas
+from .devoluciones import procesar_devoluciones
+from .filtros import PedidoFiltros, DetallePedidoFiltros, DevolucionFiltros
+from . import productos as productos_lote
+from .cambios import _codificar, purgar_cambios
+from .eventos import Suscripcion, difusor, flujo_de_eventos
+from .authentication import UsuarioToken
+from . import limites, metricas
+from .views import MyTokenObtainPairView, PedidoViewSet
+
+
+def crear_usuario(username, rol='cliente'):
+    return Usuario.objects.create_user(username=username, email=f'{username}@example.com',
+                                       password='secreta123', rol=rol)
+
+
+class PaginacionPorCursorTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = crear_usuario('admin', rol='administrador')
+        self.client.force_authenticate(self.admin)
+
+    def recorrer(self, url):
+        """Sigue los enlaces 'next' y devuelve todos los ids en orden."""
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def test_pedidos_con_la_misma_fecha_no_se_repiten_ni_se_pierden(self):
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        pedidos = [Pedido.objects.create(cliente=cliente, total=Decimal('1.00')) for _ in range(7)]
+        # Todos con la misma fecha: solo el id desempata
+        misma_fecha = timezone.now() - timedelta(days=1)
+        Pedido.objects.update(fecha_pedido=misma_fecha)
+
+        ids = self.recorrer('/api/pedidos/?page_size=2')
+
+        self.assertEqual(ids, sorted((p.id for p in pedidos), reverse=True))
+
+    def test_productos_por_nombre_y_pagina_anterior(self):
+        for nombre in ['Mouse', 'Laptop', 'Mouse', 'Teclado', 'Laptop']:
+            Producto.objects.create(nombre=nombre, precio=Decimal('10.00'), stock=1)
+        esperado = list(Producto.objects.order_by('nombre', 'id').values_list('id', flat=True))
+
+        self.assertEqual(self.recorrer('/api/productos/?page_size=2'), esperado)
+
+        # Las respuestas del catálogo pueden venir de la caché: se lee el JSON
+        segunda = self.client.get(self.client.get('/api/productos/?page_size=2').json()['next'])
+        anterior = self.client.get(segunda.json()['previous'])
+        self.assertEqual([p['id'] for p in anterior.json()['results']], esperado[:2])
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/productos/?cursor=basura')
+        self.assertEqual(response.status_code, 404)
+
+
+class PresupuestoDeConsultasTests(APITestCase):
+    """
+    Cada listado debe costar un número fijo de consultas, sin importar
+    cuántas filas (ni relaciones anidadas) tenga la página. Si alguien
+    introduce un N+1, estos tests fallan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = crear_usuario('admin', rol='administrador')
+        cls.usuario_cliente = crear_usuario('cliente0')
+        productos = [Producto.objects.create(nombre=f'Producto {i}', precio=Decimal('5.00'), stock=100)
+                     for i in range(5)]
+        for i in range(5):
+            usuario = cls.usuario_cliente if i == 0 else crear_usuario(f'cliente{i}')
+            cliente = Cliente.objects.create(usuario=usuario, nombre=f'Cliente {i}', apellido='X',
+                                             email=f'c{i}@example.com')
+            for _ in range(3):
+                pedido = Pedido.objects.create(cliente=cliente, total=Decimal('10.00'))
+                for producto in productos[:3]:
+                    DetallePedido.objects.create(pedido=pedido, producto=producto, cantidad=1,
+                                                 precio_unitario=Decimal('5.00'), subtotal=Decimal('5.00'))
+                Devolucion.objects.create(pedido=pedido, producto=productos[0], cantidad=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertConsultas(self, url, esperadas, usuario=None):
+        self.client.force_authenticate(usuario or self.admin)
+        with self.assertNumQueries(esperadas):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'])
+
+    def test_usuarios(self):
+        self.assertConsultas('/api/usuarios/', 1)
+
+    def test_clientes_con_usuario_anidado(self):
+        self.assertConsultas('/api/clientes/', 1)
+
+    def test_productos(self):
+        self.assertConsultas('/api/productos/', 1)
+
+    def test_pedidos(self):
+        # El listado compacto no lleva las líneas: pedidos + cliente en un JOIN
+        self.assertConsultas('/api/pedidos/', 1)
+
+    def test_pedidos_con_lineas_anidadas(self):
+        # Y todas las líneas + producto en otro
+        self.assertConsultas('/api/pedidos/?expand=detalle_pedidos', 2)
+
+    def test_pedidos_de_un_cliente(self):
+        self.assertConsultas('/api/pedidos/?expand=detalle_pedidos', 2, usuario=self.usuario_cliente)
+
+    def test_detalle_pedidos(self):
+        self.assertConsultas('/api/detalle-pedidos/', 1)
+
+    def test_devoluciones(self):
+        self.assertConsultas('/api/devoluciones/', 1)
+
+
+class SeleccionDeCamposTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = crear_usuario('admin', rol='administrador')
+        self.client.force_authenticate(self.admin)
+        cliente = Cliente.objects.create(usuario=crear_usuario('ana'), nombre='Ana', apellido='Diaz',
+                                         email='ana@example.com')
+        self.producto = Producto.objects.create(nombre='Laptop', descripcion='Gamer', precio=Decimal('500.00'),
+                                                stock=10)
+        self.pedido = Pedido.objects.create(cliente=cliente, total=Decimal('500.00'))
+        DetallePedido.objects.create(pedido=self.pedido, producto=self.producto, cantidad=1,
+                                     precio_unitario=Decimal('500.00'), subtotal=Decimal('500.00'))
+
+    def test_listados_compactos_y_detalle_completo(self):
+        pedido = self.client.get('/api/pedidos/').json()['results'][0]
+        self.assertNotIn('detalle_pedidos', pedido)
+        self.assertEqual(pedido['cliente_nombre'], 'Ana')
+
+        pedido = self.client.get('/api/pedidos/?expand=detalle_pedidos').json()['results'][0]
+        self.assertEqual(pedido['detalle_pedidos'][0]['producto_nombre'], 'Laptop')
+        self.assertIn('detalle_pedidos', self.client.get(f'/api/pedidos/{self.pedido.id}/').json())
+
+        producto = self.client.get('/api/productos/').json()['results'][0]
+        self.assertNotIn('descripcion', producto)
+        self.assertEqual(self.client.get('/api/productos/?expand=descripcion').json()['results'][0]['descripcion'],
+                         'Gamer')
+
+        self.assertEqual(set(self.client.get('/api/clientes/').json()['results'][0]),
+                         {'id', 'nombre', 'apellido', 'email'})
+        cliente = self.client.get('/api/clientes/?expand=usuario').json()['results'][0]
+        self.assertEqual(cliente['usuario']['username'], 'ana')
+
+    def test_fields_recorta_el_json_y_las_columnas(self):
+        with self.assertNumQueries(1) as consultas:
+            response = self.client.get('/api/pedidos/?fields=id,total')
+        self.assertEqual(response.json()['results'], [{'id': self.pedido.id, 'total': '500.00'}])
+        # Sin el JOIN con clientes; la fecha se lee para el cursor
+        sql = consultas[0]['sql']
+        self.assertNotIn('"clientes"', sql)
+        self.assertNotIn('"estado"', sql)
+        self.assertIn('"fecha_pedido"', sql)
+
+        with self.assertNumQueries(1) as consultas:
+            response = self.client.get('/api/productos/?fields=id,nombre')
+        self.assertEqual(response.json()['results'], [{'id': self.producto.id, 'nombre': 'Laptop'}])
+        self.assertNotIn('"descripcion"', consultas[0]['sql'])
+
+        detalle = self.client.get(f'/api/pedidos/{self.pedido.id}/?fields=id,estado')
+        self.assertEqual(detalle.json(), {'id': self.pedido.id, 'estado': 'pendiente'})
+
+    def test_campo_desconocido(self):
+        response = self.client.get('/api/pedidos/?fields=id,contrasena')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'contrasena'", response.json()['fields'][0])
+        self.assertEqual(self.client.get('/api/devoluciones/?expand=nada').status_code, 400)
+
+
+class LecturaRapidaTests(APITestCase):
+    """La lectura con values() responde lo mismo, byte a byte, que los serializers."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = crear_usuario('admin', rol='administrador')
+        self.client.force_authenticate(self.admin)
+        ana = Cliente.objects.create(usuario=crear_usuario('ana'), nombre='Ana "la de\u2028Sevilla"',
+                                     apellido='Díaz', email='ana@example.com')
+        Cliente.objects.create(nombre='Sin usuario', apellido='X', email='sin@example.com', telefono='555')
+        laptop = Producto.objects.create(sku='L-1', nombre='Laptop ñ', descripcion='Línea 1\nLínea 2',
+                                         precio=Decimal('1500.50'), stock=10)
+        mouse = Producto.objects.create(nombre='Mouse', precio=Decimal('0.00'), stock=5, activo=False)
+        self.pedido = Pedido.objects.create(cliente=ana, total=Decimal('1520.50'))
+        for producto, precio in [(laptop, Decimal('1500.50')), (mouse, Decimal('20.00'))]:
+            DetallePedido.objects.create(pedido=self.pedido, producto=producto, cantidad=1,
+                                         precio_unitario=precio, subtotal=precio)
+        # Un pedido sin cliente (SET_NULL) ni líneas
+        Pedido.objects.create(cliente=None, total=Decimal('0.00'))
+        Devolucion.objects.create(pedido=self.pedido, producto=laptop, cantidad=1, motivo='Llegó roto')
+
+    def assertIgual(self, url):
+        cache.clear()
+        rapida = self.client.get(url)
+        cache.clear()
+        with override_settings(LECTURA_RAPIDA=False):
+            lenta = self.client.get(url)
+        self.assertEqual(rapida.status_code, 200, rapida.content)
+        self.assertEqual(rapida.content, lenta.content)
+        return rapida
+
+    def test_mismas_respuestas_que_los_serializers(self):
+        for url in ['/api/usuarios/', '/api/clientes/', '/api/clientes/?expand=usuario,telefono',
+                    '/api/productos/', '/api/productos/?expand=descripcion,fecha_creacion',
+                    '/api/pedidos/', '/api/pedidos/?expand=detalle_pedidos', '/api/pedidos/?fields=id,cliente_nombre',
+                    '/api/pedidos/?fields=total,detalle_pedidos&page_size=1', '/api/detalle-pedidos/',
+                    '/api/devoluciones/', '/api/devoluciones/?expand=motivo,pedido',
+                    f'/api/pedidos/{self.pedido.id}/', f'/api/productos/{self.pedido.detallepedido_set.first().producto_id}/',
+                    f'/api/clientes/{self.pedido.cliente_id}/']:
+            with self.subTest(url=url):
+                self.assertIgual(url)
+
+        # Todos los serializers de las vistas se pueden leer con values()
+        for serializer in [UsuarioSerializer, ClienteSerializer, ProductoSerializer, PedidoSerializer,
+                           DetallePedidoSerializer, DevolucionSerializer]:
+            self.assertIsNotNone(plan_de(serializer), serializer.__name__)
+
+        # Y con las mismas consultas: pedidos y, para toda la página, sus líneas
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/pedidos/?expand=detalle_pedidos')
+        self.assertEqual([len(p['detalle_pedidos']) for p in response.json()['results']], [0, 2])
+        self.assertEqual(self.client.get('/api/pedidos/999999/').status_code, 404)
+
+    def test_renderer_como_el_de_drf(self):
+        datos = {'texto': 'a\u2028b\u2029"\\\x00\x1f ñ 😀', 'decimal': Decimal('10.50'), 'fecha': timezone.now(),
+                 'dia': timezone.now().date(), 'lista': (1, None, True), 'anidado': {'x': [1.5, -2]}}
+        self.assertEqual(JSONRapidoRenderer().render(datos), JSONRenderer().render(datos))
+        # Claves que orjson no acepta: lo escribe json.dumps
+        self.assertEqual(JSONRapidoRenderer().render({1: 'a'}), b'{"1":"a"}')
+        self.assertEqual(JSONRapidoRenderer().render(datos, 'application/json; indent=2'),
+                         JSONRenderer().render(datos, 'application/json; indent=2'))
+
+
+class RegistroDePedidosTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.laptop = Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=10)
+        self.mouse = Producto.objects.create(nombre='Mouse', precio=Decimal('300.00'), stock=5)
+
+    def pedido(self, *lineas, cliente_id=None):
+        return {
+            'cliente_id': cliente_id or self.cliente.id,
+            'productos': [{'producto_id': p.id, 'cantidad': c, 'precio_unitario': str(p.precio)}
+                          for p, c in lineas],
+        }
+
+    def test_registrar_nuevo_pedido_descuenta_el_stock_una_sola_vez(self):
+        response = self.client.post('/api/pedidos/registrar-nuevo-pedido/',
+                                    self.pedido((self.laptop, 2), (self.mouse, 1)), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        pedido = Pedido.objects.get()
+        self.assertEqual(pedido.total, Decimal('1300.00'))
+        self.assertEqual(pedido.detallepedido_set.count(), 2)
+        liquidar_reservas()
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 8)
+
+    def test_sin_stock_es_409_y_datos_incorrectos_400(self):
+        url = '/api/pedidos/registrar-nuevo-pedido/'
+        response = self.client.post(url, self.pedido((self.mouse, 6)), format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Stock insuficiente', response.data['error'])
+
+        response = self.client.post(url, self.pedido((self.laptop, 1), cliente_id=999999), format='json')
+        self.assertEqual(response.status_code, 400)
+        pedido = self.pedido((self.laptop, 1))
+        pedido['productos'][0]['producto_id'] = 999999
+        self.assertEqual(self.client.post(url, pedido, format='json').status_code, 400)
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_lote_informa_el_resultado_de_cada_pedido(self):
+        pedidos = [
+            self.pedido((self.laptop, 3), (self.mouse, 2)),
+            self.pedido((self.mouse, 4)),               # ya no queda stock de Mouse
+            self.pedido((self.laptop, 1), cliente_id=999999),
+            {'cliente_id': self.cliente.id, 'productos': []},
+            self.pedido((self.laptop, 2), (self.laptop, 1)),
+        ]
+
+        with self.assertNumQueries(7):  # incluye SAVEPOINT/RELEASE de la transacción
+            response = self.client.post('/api/pedidos/registrar-pedidos-lote/', {'pedidos': pedidos},
+                                        format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['registrados'], 2)
+        self.assertEqual([r['ok'] for r in response.data['resultados']], [True, False, False, False, True])
+        self.assertIn('Stock insuficiente', response.data['resultados'][1]['errores'][0])
+
+        primero = Pedido.objects.get(id=response.data['resultados'][0]['pedido_id'])
+        self.assertEqual(primero.total, Decimal('2100.00'))
+        liquidar_reservas()
+        self.laptop.refresh_from_db()
+        self.mouse.refresh_from_db()
+        self.assertEqual((self.laptop.stock, self.mouse.stock), (4, 3))
+
+    def test_lote_solo_para_empleados(self):
+        self.client.force_authenticate(crear_usuario('juan'))
+        response = self.client.post('/api/pedidos/registrar-pedidos-lote/',
+                                    {'pedidos': [self.pedido((self.laptop, 1))]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ReservaDeStockTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.producto = Producto.objects.create(nombre='Consola', precio=Decimal('100.00'), stock=10)
+
+    def comprar(self, cantidad):
+        return self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': self.cliente.id,
+            'productos': [{'producto_id': self.producto.id, 'cantidad': cantidad, 'precio_unitario': '100.00'}],
+        }, format='json')
+
+    def test_la_venta_reserva_sin_tocar_el_producto_hasta_liquidar(self):
+        self.assertEqual(self.comprar(3).status_code, 201)
+        self.assertEqual(self.comprar(4).status_code, 201)
+
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 10)
+        self.assertEqual(stock_disponible(self.producto.id), 3)
+        self.assertEqual(ReservaStock.objects.filter(fecha_liquidacion__isnull=True).count(), 2)
+
+        self.assertEqual(liquidar_reservas(), 2)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 3)
+        self.assertEqual(liquidar_reservas(), 0)
+
+    def test_no_se_vende_mas_de_lo_que_hay(self):
+        # 10 unidades repartidas en 8 cupos: ningún cupo tiene 5, pero el total sí
+        self.assertEqual(self.comprar(5).status_code, 201)
+        self.assertEqual(self.comprar(5).status_code, 201)
+
+        response = self.comprar(1)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Stock insuficiente', response.data['error'])
+        self.assertEqual(Pedido.objects.count(), 2)
+
+    def test_editar_el_stock_vuelve_a_repartir_los_cupos(self):
+        self.comprar(4)
+        self.producto.stock = 50
+        self.producto.save()
+
+        # Lo reservado se descuenta del nuevo stock y se reparte el resto
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 46)
+        self.assertEqual(stock_disponible(self.producto.id), 46)
+        self.assertEqual(StockCupo.objects.filter(producto=self.producto).count(), 8)
+
+
+class VentasAcumuladasTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.ana = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.luis = Cliente.objects.create(nombre='Luis', apellido='Paz', email='luis@example.com')
+        self.laptop = Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=100)
+        self.mouse = Producto.objects.create(nombre='Mouse', precio=Decimal('20.00'), stock=100)
+
+    def comprar(self, cliente, *lineas):
+        response = self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': cliente.id,
+            'productos': [{'producto_id': p.id, 'cantidad': c, 'precio_unitario': str(p.precio)} for p, c in lineas],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Pedido.objects.latest('id')
+
+    def ventas(self, **parametros):
+        response = self.client.get('/api/pedidos/ventas-totales/', parametros)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def acumulados(self):
+        """Contenido de los acumulados sumando los fragmentos (sin las filas que quedan a cero)."""
+        resultado = []
+        for model, claves in [(VentaDiaria, ['dia']), (VentaProductoDiaria, ['dia', 'producto_id']),
+                              (VentaClienteDiaria, ['dia', 'cliente_id'])]:
+            metricas = ['unidades', 'importe', 'unidades_devueltas', 'importe_devuelto']
+            if model is not VentaProductoDiaria:
+                metricas.append('pedidos')
+            filas = model.objects.values(*claves).annotate(**{f'suma_{m}': Sum(m) for m in metricas})
+            resultado.append(sorted(
+                tuple(fila.values()) for fila in filas
+                if any(fila[f'suma_{m}'] for m in metricas)
+            ))
+        return resultado
+
+    def test_los_pedidos_y_devoluciones_aprobadas_actualizan_los_acumulados(self):
+        pedido = self.comprar(self.ana, (self.laptop, 2), (self.mouse, 5))
+        self.comprar(self.luis, (self.mouse, 1))
+        devolucion = Devolucion.objects.create(pedido=pedido, producto=self.mouse, cantidad=2)
+
+        # Las devoluciones solicitadas todavía no restan
+        self.assertEqual(self.ventas()['ventas_totales'], Decimal('1120.00'))
+
+        devolucion.estado = 'aprobada'
+        devolucion.save()
+
+        datos = self.ventas(agrupar='producto')
+        self.assertEqual((datos['pedidos'], datos['unidades'], datos['unidades_devueltas']), (2, 8, 2))
+        self.assertEqual(datos['ventas_totales'], Decimal('1080.00'))
+        self.assertEqual([(r['producto_nombre'], r['neto']) for r in datos['resultados']],
+                         [('Laptop', Decimal('1000.00')), ('Mouse', Decimal('80.00'))])
+
+        por_cliente = self.ventas(agrupar='cliente')['resultados']
+        self.assertEqual([(r['cliente_nombre'], r['pedidos'], r['neto']) for r in por_cliente],
+                         [('Ana', 1, Decimal('1060.00')), ('Luis', 1, Decimal('20.00'))])
+
+    def test_rango_de_fechas_y_agrupacion_por_dia(self):
+        ayer = timezone.now() - timedelta(days=1)
+        antiguo = self.comprar(self.ana, (self.laptop, 1))
+        Pedido.objects.filter(id=antiguo.id).update(fecha_pedido=ayer)
+        self.comprar(self.ana, (self.mouse, 3))
+        hoy = timezone.now().date()
+
+        self.assertEqual(self.ventas(desde=hoy)['ventas_totales'], Decimal('60.00'))
+        self.assertEqual(self.ventas(hasta=ayer.date())['ventas_totales'], Decimal('500.00'))
+
+        with self.assertNumQueries(2):
+            datos = self.ventas(agrupar='dia')
+        self.assertEqual([(r['dia'], r['pedidos'], r['unidades']) for r in datos['resultados']],
+                         [(ayer.date(), 1, 1), (hoy, 1, 3)])
+
+    def test_parametros_invalidos(self):
+        response = self.client.get('/api/pedidos/ventas-totales/', {'desde': '2024-02-01', 'hasta': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/pedidos/ventas-totales/', {'agrupar': 'semana'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reconstruir_da_lo_mismo_que_los_triggers(self):
+        pedido = self.comprar(self.ana, (self.laptop, 2), (self.mouse, 5))
+        otro = self.comprar(self.luis, (self.mouse, 1), (self.laptop, 1))
+        Devolucion.objects.create(pedido=pedido, producto=self.laptop, cantidad=1, estado='aprobada')
+        Devolucion.objects.create(pedido=otro, producto=self.mouse, cantidad=1, estado='aprobada')
+        # Ediciones y bajas también se reflejan
+        Pedido.objects.filter(id=pedido.id).update(cliente=self.luis,
+                                                   fecha_pedido=timezone.now() - timedelta(days=3))
+        DetallePedido.objects.filter(pedido=pedido, producto=self.mouse).update(cantidad=4, subtotal=Decimal('80.00'))
+        otro.delete()
+
+        incremental = self.acumulados()
+        reconstruir_ventas()
+
+        self.assertEqual(self.acumulados(), incremental)
+        self.assertEqual(self.ventas()['ventas_totales'], Decimal('580.00'))
+
+
+class CatalogoCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = crear_usuario('admin', rol='administrador')
+        self.client.force_authenticate(self.admin)
+        self.producto = Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=10)
+
+    def test_la_segunda_peticion_no_consulta_la_base_de_datos(self):
+        primera = self.client.get('/api/productos/')
+        etag = primera['ETag']
+
+        with self.assertNumQueries(0):
+            segunda = self.client.get('/api/productos/')
+            no_modificada = self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(segunda.content, primera.content)
+        self.assertEqual(segunda['ETag'], etag)
+        self.assertEqual(no_modificada.status_code, 304)
+        self.assertEqual(no_modificada.content, b'')
+
+    def test_cada_url_tiene_su_etag(self):
+        lista = self.client.get('/api/productos/')
+        detalle = self.client.get(f'/api/productos/{self.producto.id}/')
+        self.assertEqual(detalle.json()['nombre'], 'Laptop')
+        self.assertNotEqual(lista['ETag'], detalle['ETag'])
+        self.assertNotIn('ETag', self.client.get('/api/productos/999999/'))
+
+    def test_editar_un_producto_invalida_la_cache(self):
+        etag = self.client.get('/api/productos/')['ETag']
+
+        self.client.patch(f'/api/productos/{self.producto.id}/', {'precio': '450.00'}, format='json')
+
+        response = self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['precio'], '450.00')
+
+    def test_la_liquidacion_invalida_la_cache(self):
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        etag = self.client.get('/api/productos/')['ETag']
+
+        # Vender no cambia productos.stock: el catálogo cacheado sigue valiendo
+        self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': cliente.id,
+            'productos': [{'producto_id': self.producto.id, 'cantidad': 3, 'precio_unitario': '500.00'}],
+        }, format='json')
+        self.assertEqual(self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        liquidar_reservas()
+        response = self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['stock'], 7)
+
+
+class BusquedaDeProductosTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(crear_usuario('juan'))
+        crear = Producto.objects.create
+        self.laptop = crear(nombre='Laptop Gamer', descripcion='Pantalla de 15 pulgadas', precio=Decimal('900.00'))
+        self.funda = crear(nombre='Funda', descripcion='Funda acolchada para laptop', precio=Decimal('20.00'))
+        self.vieja = crear(nombre='Laptop antigua', precio=Decimal('100.00'), activo=False)
+        self.mouse = crear(nombre='Mouse inalámbrico', descripcion='Ideal para gamers', precio=Decimal('25.00'))
+
+    def buscar(self, **parametros):
+        response = self.client.get('/api/productos/buscar/', parametros)
+        self.assertEqual(response.status_code, 200)
+        return [p['id'] for p in response.json()['results']]
+
+    def test_prefijos_y_relevancia(self):
+        # El nombre pesa más que la descripción; los inactivos no salen por defecto
+        self.assertEqual(self.buscar(q='lapt'), [self.laptop.id, self.funda.id])
+        self.assertEqual(self.buscar(q='laptop gam'), [self.laptop.id])
+        self.assertEqual(self.buscar(q='LAPTOP', activo='false'), [self.vieja.id])
+
+    def test_filtro_de_precio_y_paginacion(self):
+        self.assertEqual(self.buscar(q='laptop', precio_max='50'), [self.funda.id])
+
+        primera = self.client.get('/api/productos/buscar/', {'q': 'lapt', 'page_size': 1}).json()
+        segunda = self.client.get(primera['next']).json()
+        self.assertEqual([p['id'] for p in primera['results'] + segunda['results']],
+                         [self.laptop.id, self.funda.id])
+        self.assertIsNone(segunda['next'])
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get('/api/productos/buscar/').status_code, 400)
+        response = self.client.get('/api/productos/buscar/', {'q': 'x', 'precio_min': '10', 'precio_max': '5'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.buscar(q='!!!'), [])
+
+    def test_tolera_errores_de_escritura(self):
+        if not trigramas_disponibles():
+            self.skipTest('pg_trgm no está instalado en este servidor')
+        self.assertEqual(self.buscar(q='lpatop')[0], self.laptop.id)
+
+
+class AutenticacionPorTokenTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = crear_usuario('juan')
+        self.cliente = Cliente.objects.create(usuario=self.usuario, nombre='Juan', apellido='Perez',
+                                              email='juan.cliente@example.com')
+        otro = Cliente.objects.create(nombre='Otro', apellido='X', email='otro@example.com')
+        self.pedido = Pedido.objects.create(cliente=self.cliente, total=Decimal('10.00'))
+        Pedido.objects.create(cliente=otro, total=Decimal('20.00'))
+
+    def iniciar_sesion(self, username='juan'):
+        response = self.client.post('/api/token/', {'username': username, 'password': 'secreta123'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.data
+
+    def test_claims_y_listado_sin_consultas_de_autenticacion(self):
+        self.iniciar_sesion()
+        # Solo las dos consultas del listado (pedidos y sus líneas): ni el
+        # usuario ni su cliente se leen de la base de datos
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/pedidos/?expand=detalle_pedidos')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in response.data['results']], [self.pedido.id])
+
+        # Sin caché (otro proceso, o caducada) basta una consulta para validarlo
+        cache.clear()
+        with self.assertNumQueries(3):
+            self.client.get('/api/pedidos/?expand=detalle_pedidos')
+
+    def test_cambio_de_rol_revoca_el_token(self):
+        tokens = self.iniciar_sesion()
+        self.assertEqual(self.client.get('/api/detalle-pedidos/').status_code, 403)
+
+        self.usuario.rol = 'empleado'
+        self.usuario.save()
+        self.assertEqual(self.client.get('/api/pedidos/').status_code, 401)
+
+        # El token renovado ya lleva el rol nuevo
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get('/api/detalle-pedidos/').status_code, 200)
+        self.assertEqual(len(self.client.get('/api/pedidos/').data['results']), 2)
+
+    def test_usuario_desactivado(self):
+        tokens = self.iniciar_sesion()
+        self.usuario.is_active = False
+        self.usuario.save()
+        self.assertEqual(self.client.get('/api/pedidos/').status_code, 401)
+        # Tampoco renueva el token ni pide tickets de eventos
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('access', response.data)
+        self.client.force_authenticate(self.usuario)
+        self.assertEqual(self.client.post('/api/async/eventos/ticket/').status_code, 401)
+
+    def test_usuario_borrado_no_renueva_el_token(self):
+        tokens = self.iniciar_sesion()
+        self.usuario.delete()
+        response = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('access', response.data)
+
+
+class LoginTests(APITestCase):
+    def setUp(self):
+        self.usuario = crear_usuario('Juan')
+
+    def test_username_o_email_sin_distinguir_mayusculas(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(username='JUAN', password='secreta123'), self.usuario)
+        self.assertEqual(authenticate(username='juan@EXAMPLE.com', password='secreta123'), self.usuario)
+        self.assertIsNone(authenticate(username='juan', password='otra'))
+        self.assertIsNone(authenticate(username='nadie', password='secreta123'))
+
+    def test_prioriza_el_username_y_comprueba_la_contrasena(self):
+        # El email de 'otro' es el username de Juan
+        otro = Usuario.objects.create_user(username='otro', email='juan', password='otra123')
+        self.assertEqual(authenticate(username='juan', password='secreta123'), self.usuario)
+        self.assertIsNone(authenticate(username='juan', password='otra123'))
+        self.assertEqual(authenticate(username='OTRO', password='otra123'), otro)
+
+    @override_settings(PASSWORD_PBKDF2_ITERACIONES=1000)
+    def test_recifra_la_contrasena_al_cambiar_el_coste(self):
+        self.assertNotIn('$1000$', self.usuario.password)
+        self.assertEqual(authenticate(username='juan', password='secreta123'), self.usuario)
+        self.usuario.refresh_from_db()
+        self.assertTrue(self.usuario.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(authenticate(username='juan', password='secreta123'), self.usuario)
+
+
+class ExportacionTests(APITestCase):
+    def setUp(self):
+        self.usuario = crear_usuario('juan')
+        self.cliente = Cliente.objects.create(usuario=self.usuario, nombre='Juan', apellido='Perez',
+                                              email='juan.cliente@example.com')
+        otro = Cliente.objects.create(nombre='Otro', apellido='X', email='otro@example.com')
+        self.producto = Producto.objects.create(nombre='Mouse, inalámbrico', precio=Decimal('5.00'), stock=10)
+        self.pedidos = []
+        for dia, cliente, estado in [(1, self.cliente, 'pendiente'), (2, otro, 'enviado'), (3, self.cliente, 'enviado')]:
+            pedido = Pedido.objects.create(cliente=cliente, total=Decimal('5.00'), estado=estado)
+            Pedido.objects.filter(pk=pedido.pk).update(fecha_pedido=datetime(2026, 3, dia, 12, tzinfo=dt_timezone.utc))
+            DetallePedido.objects.create(pedido=pedido, producto=self.producto, cantidad=1,
+                                         precio_unitario=Decimal('5.00'), subtotal=Decimal('5.00'))
+            self.pedidos.append(pedido)
+
+    def exportar(self, url, **parametros):
+        response = self.client.get(url, parametros)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_con_filtros(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        filas = list(csv.reader(io.StringIO(self.exportar('/api/pedidos/exportar/', estado='enviado'))))
+        self.assertEqual(filas[0], ['id', 'cliente_id', 'cliente', 'fecha_pedido', 'estado', 'total'])
+        self.assertEqual([int(fila[0]) for fila in filas[1:]], [self.pedidos[1].id, self.pedidos[2].id])
+        self.assertEqual(filas[1][3], '2026-03-02T12:00:00+00:00')
+
+        filas = list(csv.reader(io.StringIO(
+            self.exportar('/api/detalle-pedidos/exportar/', desde='2026-03-02', hasta='2026-03-02')
+        )))
+        self.assertEqual(len(filas), 2)
+        self.assertEqual(filas[1][1:], [str(self.pedidos[1].id), '2026-03-02T12:00:00+00:00',
+                                        str(self.producto.id), 'Mouse, inalámbrico', '1', '5.00', '5.00'])
+
+    def test_ndjson_solo_los_pedidos_del_cliente(self):
+        self.client.force_authenticate(self.usuario)
+        lineas = self.exportar('/api/pedidos/exportar/', formato='ndjson').splitlines()
+        pedidos = [json.loads(linea) for linea in lineas]
+        self.assertEqual([p['id'] for p in pedidos], [self.pedidos[0].id, self.pedidos[2].id])
+        self.assertEqual(pedidos[0]['total'], '5.00')
+
+        # Las líneas de todos los pedidos siguen siendo solo para empleados
+        self.assertEqual(self.client.get('/api/detalle-pedidos/exportar/').status_code, 403)
+
+    async def test_con_asgi_envia_las_filas_por_bloques(self):
+        token = str((await sync_to_async(MyTokenObtainPairSerializer.get_token)(self.usuario)).access_token)
+        # Un bloque por fila: sin el iterador asíncrono, Django lo juntaría todo antes de enviar
+        with mock.patch('quicknotes.exportacion.CHUNK', 1):
+            response = await self.async_client.get('/api/pedidos/exportar/', {'formato': 'ndjson'},
+                                                   headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            bloques = [bloque async for bloque in response.streaming_content]
+        self.assertEqual([json.loads(bloque)['id'] for bloque in bloques], [self.pedidos[0].id, self.pedidos[2].id])
+
+    def test_parametros_invalidos(self):
+        self.client.force_authenticate(self.usuario)
+        self.assertEqual(self.client.get('/api/pedidos/exportar/', {'formato': 'xml'}).status_code, 400)
+        response = self.client.get('/api/pedidos/exportar/', {'desde': '2026-03-02', 'hasta': '2026-03-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportacionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(crear_usuario('admin', rol='administrador'))
+        self.existente = Producto.objects.create(sku='A-1', nombre='Viejo', precio=Decimal('1.00'), stock=5)
+
+    def importar(self, url, contenido):
+        archivo = SimpleUploadedFile('datos.csv', contenido.encode(), content_type='text/csv')
+        return self.client.post(url, {'archivo': archivo}, format='multipart')
+
+    def test_productos_con_rechazos(self):
+        response = self.importar('/api/productos/importar/', (
+            'SKU,nombre,precio,stock\n'
+            'A-1,Mouse nuevo,12.50,7\n'
+            'B-2,"Teclado, USB",30,\n'
+            'C-3,Monitor,-4,1\n'
+            'D-4,,10,1\n'
+            'B-2,Teclado repetido,31,1\n'
+            'E-5,Cable,1.999,1\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['insertados'], response.data['actualizados'], response.data['rechazados']),
+                         (1, 1, 4))
+        self.assertEqual([(e['fila'], e['error']) for e in response.data['errores']], [
+            (3, 'El precio no puede ser negativo.'),
+            (4, 'Falta el nombre.'),
+            (5, 'sku repetido en el archivo (fila 2).'),
+            (6, 'El precio debe ser un número con hasta 8 enteros y 2 decimales.'),
+        ])
+
+        self.existente.refresh_from_db()
+        self.assertEqual((self.existente.nombre, self.existente.precio, self.existente.stock),
+                         ('Mouse nuevo', Decimal('12.50'), 7))
+        nuevo = Producto.objects.get(sku='B-2')
+        self.assertEqual((nuevo.nombre, nuevo.stock, nuevo.activo), ('Teclado, USB', 0, True))
+        # Los triggers de la tabla se aplican igual: búsqueda y cupos de stock
+        self.assertEqual(stock_disponible(self.existente.id), 7)
+        self.client.force_authenticate(crear_usuario('juan'))
+        ids = [p['id'] for p in self.client.get('/api/productos/buscar/', {'q': 'teclado'}).json()['results']]
+        self.assertEqual(ids, [nuevo.id])
+
+    def test_reimportar_no_reescribe_lo_que_no_cambia(self):
+        contenido = 'sku,nombre,precio\nA-1,Viejo,1.00\n'
+        self.assertEqual(self.importar('/api/productos/importar/', contenido).data['sin_cambios'], 1)
+
+    def test_clientes_y_permisos(self):
+        contenido = ('email,nombre,apellido,telefono\n'
+                     'ana@example.com,Ana,Diaz,555\n'
+                     'correo-malo,Luis,Paz,\n')
+        response = self.importar('/api/clientes/importar/', contenido)
+        self.assertEqual((response.data['insertados'], response.data['rechazados']), (1, 1))
+        self.assertEqual(response.data['errores'][0]['error'], 'El email no es válido.')
+        self.assertEqual(Cliente.objects.get(email='ana@example.com').telefono, '555')
+
+        self.assertEqual(self.importar('/api/clientes/importar/', 'email,nombre\n').status_code, 400)
+
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.assertEqual(self.importar('/api/clientes/importar/', contenido).status_code, 403)
+
+
+class ActualizacionEnLoteTests(APITestCase):
+    url = '/api/productos/actualizar-lote/'
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(crear_usuario('admin', rol='administrador'))
+        self.mouse = Producto.objects.create(nombre='Mouse', precio=Decimal('10.00'), stock=5)
+        self.teclado = Producto.objects.create(nombre='Teclado', precio=Decimal('30.00'), stock=2)
+
+    def test_resultados_por_producto(self):
+        etag = self.client.get('/api/productos/')['ETag']
+        response = self.client.post(self.url, {'productos': [
+            {'id': self.mouse.id, 'precio': '12.50', 'stock': 9},
+            {'id': self.teclado.id, 'precio': '30.00'},
+            {'id': 999999, 'stock': 1},
+            {'id': self.teclado.id, 'precio': '-1'},
+            {'id': self.teclado.id},
+            {'id': self.mouse.id, 'activo': False},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['actualizados'], response.data['sin_cambios'], response.data['rechazados']),
+                         (1, 1, 4))
+        resultados = response.data['resultados']
+        self.assertEqual([r['indice'] for r in resultados], list(range(6)))
+        self.assertEqual((resultados[0]['actualizado'], resultados[0]['version']), (True, 2))
+        self.assertEqual((resultados[1]['actualizado'], resultados[1]['version']), (False, 1))
+        self.assertEqual(resultados[2]['errores'], ['El producto 999999 no existe.'])
+        self.assertIn('precio', resultados[3]['errores'])
+        self.assertIn('non_field_errors', resultados[4]['errores'])
+        self.assertIn('repetido', resultados[5]['errores'][0])
+
+        self.mouse.refresh_from_db()
+        self.assertEqual((self.mouse.precio, self.mouse.stock, self.mouse.activo, self.mouse.version),
+                         (Decimal('12.50'), 9, True, 2))
+        # Los cupos se reparten de nuevo y el catálogo cacheado se invalida
+        self.assertEqual(stock_disponible(self.mouse.id), 9)
+        self.assertEqual(self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_concurrencia_optimista(self):
+        # Otro cambio (aquí, un PATCH) incrementa la versión
+        self.client.patch(f'/api/productos/{self.mouse.id}/', {'precio': '11.00'}, format='json')
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.version, 2)
+
+        response = self.client.post(self.url, {'productos': [
+            {'id': self.mouse.id, 'version': 1, 'stock': 0},
+            {'id': self.teclado.id, 'version': 1, 'stock': 0},
+        ]}, format='json')
+        conflicto, aplicado = response.data['resultados']
+        self.assertEqual((conflicto['ok'], conflicto['version']), (False, 2))
+        # Cambiar solo el stock no cambia la versión
+        self.assertEqual((aplicado['ok'], aplicado['version']), (True, 1))
+        self.assertEqual(Producto.objects.get(pk=self.mouse.pk).stock, 5)
+        self.assertEqual(Producto.objects.get(pk=self.teclado.pk).stock, 0)
+
+    def test_las_ventas_no_cambian_la_version(self):
+        cliente = Cliente.objects.create(usuario=crear_usuario('ana'), nombre='Ana', apellido='Diaz',
+                                         email='ana@example.com')
+        response = self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': cliente.id,
+            'productos': [{'producto_id': self.mouse.id, 'cantidad': 2, 'precio_unitario': '10.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        liquidar_reservas()
+        self.mouse.refresh_from_db()
+        self.assertEqual((self.mouse.stock, self.mouse.version), (3, 1))
+
+        # El cambio de precio leído antes de la venta se aplica sin conflicto
+        response = self.client.post(self.url, {'productos': [{'id': self.mouse.id, 'version': 1, 'precio': '11.00'}]},
+                                    format='json')
+        self.assertEqual((response.data['resultados'][0]['ok'], response.data['resultados'][0]['version']), (True, 2))
+
+    def test_un_update_por_bloque(self):
+        productos = Producto.objects.bulk_create(
+            Producto(nombre=f'P{i}', precio=Decimal('1.00'), stock=1) for i in range(5)
+        )
+        cambios = [{'id': producto.id, 'precio': '2.00'} for producto in productos]
+        original = productos_lote.PRODUCTOS_POR_SENTENCIA
+        productos_lote.PRODUCTOS_POR_SENTENCIA = 2
+        try:
+            # Por bloque: savepoint, bloqueo, UPDATE y fin del savepoint
+            with self.assertNumQueries(3 * 4):
+                response = self.client.post(self.url, {'productos': cambios}, format='json')
+        finally:
+            productos_lote.PRODUCTOS_POR_SENTENCIA = original
+        self.assertEqual(response.data['actualizados'], 5)
+        self.assertEqual(Producto.objects.filter(precio=Decimal('2.00')).count(), 5)
+
+    def test_peticiones_invalidas_y_permisos(self):
+        self.assertEqual(self.client.post(self.url, {'productos': []}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'productos': {'id': 1}}, format='json').status_code, 400)
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        response = self.client.post(self.url, {'productos': [{'id': self.mouse.id, 'stock': 1}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class VistasAsincronasTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = crear_usuario('juan')
+        self.cliente = Cliente.objects.create(usuario=self.usuario, nombre='Juan', apellido='Perez',
+                                              email='juan.cliente@example.com')
+        otro = Cliente.objects.create(nombre='Otro', apellido='X', email='otro@example.com')
+        self.producto = Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=10)
+        Producto.objects.create(nombre='Mouse', precio=Decimal('20.00'), stock=10)
+        Producto.objects.create(nombre='Teclado', precio=Decimal('30.00'), stock=10)
+        self.pedido = Pedido.objects.create(cliente=self.cliente, total=Decimal('500.00'))
+        DetallePedido.objects.create(pedido=self.pedido, producto=self.producto, cantidad=1,
+                                     precio_unitario=Decimal('500.00'), subtotal=Decimal('500.00'))
+        self.ajeno = Pedido.objects.create(cliente=otro, total=Decimal('20.00'))
+        self.token = str(MyTokenObtainPairSerializer.get_token(self.usuario).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def get_async(self, url, **headers):
+        return async_to_sync(self.async_client.get)(url, headers={'Authorization': f'Bearer {self.token}', **headers})
+
+    def test_productos_como_la_vista_sincrona(self):
+        pagina = self.get_async('/api/async/productos/?page_size=2')
+        self.assertEqual(pagina.status_code, 200)
+        self.assertEqual(pagina.json()['results'], self.client.get('/api/productos/?page_size=2').json()['results'])
+
+        # El cursor lleva a la página siguiente de las vistas asíncronas
+        self.assertIn('/api/async/productos/', pagina.json()['next'])
+        siguiente = self.get_async(pagina.json()['next'])
+        self.assertEqual([p['nombre'] for p in siguiente.json()['results']], ['Teclado'])
+
+        detalle = self.get_async(f'/api/async/productos/{self.producto.id}/')
+        self.assertEqual(detalle.json(), self.client.get(f'/api/productos/{self.producto.id}/').json())
+        self.assertEqual(self.get_async('/api/async/productos/999999/').status_code, 404)
+
+        # También desde la caché del catálogo, con ETag
+        with self.assertNumQueries(0):
+            repetida = self.get_async('/api/async/productos/?page_size=2', **{'If-None-Match': pagina['ETag']})
+        self.assertEqual(repetida.status_code, 304)
+
+    def test_un_cliente_solo_ve_sus_pedidos(self):
+        # Las mismas dos consultas que PedidoViewSet: pedidos y sus líneas
+        with self.assertNumQueries(2):
+            response = self.get_async('/api/async/pedidos/?expand=detalle_pedidos')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'],
+                         self.client.get('/api/pedidos/?expand=detalle_pedidos').json()['results'])
+        self.assertEqual([p['id'] for p in response.json()['results']], [self.pedido.id])
+
+        detalle = self.get_async(f'/api/async/pedidos/{self.pedido.id}/')
+        self.assertEqual(detalle.json()['detalle_pedidos'][0]['producto_nombre'], 'Laptop')
+        self.assertEqual(self.get_async(f'/api/async/pedidos/{self.ajeno.id}/').status_code, 404)
+
+    def test_sin_token_o_con_token_revocado(self):
+        response = async_to_sync(self.async_client.get)('/api/async/pedidos/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        self.usuario.is_active = False
+        self.usuario.save()
+        self.assertEqual(self.get_async('/api/async/productos/').status_code, 401)
+        self.assertEqual(async_to_sync(self.async_client.post)('/api/async/pedidos/').status_code, 405)
+
+
+# Una segunda conexión a la base de datos de prueba hace de réplica: no ve lo
+# que cada test escribe en la primaria sin confirmar, como una réplica atrasada
+REPLICA = 'replica_prueba'
+# Y una réplica que no responde
+REPLICA_CAIDA = 'replica_caida'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], REPLICA_COMPROBAR_CADA=0)
+class ReplicasTests(APITestCase):
+    # Las conexiones se añaden después de que el test runner prepare las
+    # bases de datos, y se permiten en cada test después de abrir su
+    # transacción en 'default': en ellas no se abre ninguna
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        primaria = connections['default'].settings_dict
+        espejo = {**primaria['TEST'], 'MIRROR': 'default'}
+        connections.settings[REPLICA] = {**primaria, 'TEST': espejo}
+        connections.settings[REPLICA_CAIDA] = {**primaria, 'PORT': '1', 'TEST': espejo}
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in (REPLICA, REPLICA_CAIDA):
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        super().tearDownClass()
+
+    def setUp(self):
+        type(self).databases = self.databases | {REPLICA, REPLICA_CAIDA}
+        cache.clear()
+        self.admin = crear_usuario('admin', rol='administrador')
+        self.client.force_authenticate(self.admin)
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.pedido = Pedido.objects.create(cliente=cliente, total=Decimal('10.00'))
+
+    def tearDown(self):
+        type(self).databases = self.databases - {REPLICA, REPLICA_CAIDA}
+
+    def test_las_lecturas_van_a_la_replica_hasta_que_el_usuario_escribe(self):
+        # La réplica aún no tiene el pedido
+        self.assertEqual(self.client.get('/api/pedidos/').data['results'], [])
+        exportacion = self.client.get('/api/pedidos/exportar/')
+        self.assertEqual(len(b''.join(exportacion.streaming_content).decode().splitlines()), 1)
+
+        # Lo que se guarda en la caché del catálogo se lee de la primaria
+        Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=10)
+        self.assertEqual(len(self.client.get('/api/productos/').data['results']), 1)
+
+        response = self.client.patch(f'/api/pedidos/{self.pedido.id}/', {'estado': 'enviado'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Quien escribió lee de la primaria durante REPLICA_FIJAR_SEGUNDOS; los demás, de la réplica
+        self.assertEqual([p['estado'] for p in self.client.get('/api/pedidos/').data['results']], ['enviado'])
+        self.client.force_authenticate(crear_usuario('otro', rol='administrador'))
+        self.assertEqual(self.client.get('/api/pedidos/').data['results'], [])
+
+        # Fuera de una petición (comandos, liquidador) se lee de la primaria
+        self.assertEqual(Pedido.objects.all().db, 'default')
+
+    def test_las_replicas_atrasadas_o_caidas_no_reciben_lecturas(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.replicas_sanas(), [REPLICA])
+
+        # Cualquier retraso, también 0, es demasiado
+        with override_settings(REPLICA_MAX_RETRASO=-1):
+            self.assertEqual(router.replicas_sanas(), [])
+            self.assertEqual(len(self.client.get('/api/pedidos/').data['results']), 1)
+
+        with override_settings(DATABASE_REPLICAS=[REPLICA_CAIDA, REPLICA]):
+            self.assertEqual(router.replicas_sanas(), [REPLICA])
+
+
+class GeneradorDeDatosTests(APITestCase):
+    def test_genera_un_historial_coherente_con_los_acumulados(self):
+        insertados = generar_datos(clientes=20, empleados=1, productos=30, pedidos=500, lote=200,
+                                   devoluciones=0.1, dias=30)
+
+        self.assertEqual((insertados['usuarios'], insertados['clientes'], insertados['productos'],
+                          insertados['pedidos']), (21, 20, 30, 500))
+        self.assertEqual(Pedido.objects.aggregate(Sum('total'))['total__sum'],
+                         DetallePedido.objects.aggregate(Sum('subtotal'))['subtotal__sum'])
+        # Los acumulados de ventas se reconstruyeron y el historial no reservó stock
+        devuelto = Devolucion.objects.filter(estado='aprobada').aggregate(Sum('importe'))['importe__sum'] or 0
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.assertEqual(self.client.get('/api/pedidos/ventas-totales/').data['ventas_totales'],
+                         Pedido.objects.aggregate(Sum('total'))['total__sum'] - devuelto)
+        self.assertFalse(ReservaStock.objects.exists())
+
+        # Los triggers vuelven a estar activos: un pedido nuevo reserva stock
+        cliente = Cliente.objects.filter(usuario__username__startswith='datos_cliente_').first()
+        producto = Producto.objects.filter(activo=True).first()
+        response = self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': cliente.id,
+            'productos': [{'producto_id': producto.id, 'cantidad': 1, 'precio_unitario': str(producto.precio)}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ReservaStock.objects.count(), 1)
+
+
+class MetricasTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = crear_usuario('admin', rol='administrador')
+        self.client.force_authenticate(self.admin)
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        Pedido.objects.create(cliente=cliente, total=Decimal('10.00'))
+
+    def contador(self, texto, serie):
+        coincidencia = re.search(rf'^{re.escape(serie)} (\S+)$', texto, re.MULTILINE)
+        return float(coincidencia.group(1)) if coincidencia else 0
+
+    def test_server_timing_y_metricas_por_vista_y_accion(self):
+        serie = 'quicknotes_peticion_segundos_count{vista="PedidoViewSet",accion="list",metodo="GET"}'
+        antes = self.contador(self.client.get('/api/metricas/').content.decode(), serie)
+
+        with self.assertNumQueries(1) as consultas:
+            response = self.client.get('/api/pedidos/')
+        tiempos = dict(parte.split(';', 1) for parte in response['Server-Timing'].split(', '))
+        self.assertEqual(set(tiempos), {'total', 'db', 'auth', 'ser'})
+        self.assertIn(f'desc="{len(consultas)} consultas"', tiempos['db'])
+
+        response = self.client.get('/api/metricas/')
+        self.assertEqual(response['Content-Type'], metricas.CONTENT_TYPE)
+        texto = response.content.decode()
+        self.assertEqual(self.contador(texto, serie), antes + 1)
+        self.assertIn('# TYPE quicknotes_sql_consultas histogram', texto)
+        self.assertIn('quicknotes_sql_consultas_bucket{vista="PedidoViewSet",accion="list",metodo="GET",le="2"}',
+                      texto)
+        self.assertIn('quicknotes_peticiones_total{vista="PedidoViewSet",accion="list",metodo="GET",codigo="200"}',
+                      texto)
+
+        # Solo administradores
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.assertEqual(self.client.get('/api/metricas/').status_code, 403)
+
+    @override_settings(METRICAS_SQL_LENTA_MS=0)
+    def test_registra_las_consultas_lentas_con_su_origen(self):
+        with self.assertLogs('quicknotes.sql_lenta', 'WARNING') as registros:
+            self.client.get('/api/pedidos/')
+        self.assertIn('en PedidoViewSet, desde quicknotes/', registros.output[0])
+        self.assertIn('FROM "pedidos"', '\n'.join(registros.output))
+
+    def test_suma_las_metricas_volcadas_por_otros_procesos(self):
+        self.client.get('/api/pedidos/')
+        serie = 'quicknotes_peticiones_total{vista="PedidoViewSet",accion="list",metodo="GET",codigo="200"}'
+        propias = self.contador(metricas.exposicion(), serie)
+        with tempfile.TemporaryDirectory() as directorio, override_settings(METRICAS_DIR=directorio):
+            otro = {'histogramas': [], 'contadores': [
+                ['quicknotes_peticiones_total',
+                 [['vista', 'PedidoViewSet'], ['accion', 'list'], ['metodo', 'GET'], ['codigo', '200']], 5],
+            ]}
+            with open(os.path.join(directorio, '1.json'), 'w') as archivo:
+                json.dump(otro, archivo)
+            self.assertEqual(self.contador(metricas.exposicion(), serie), propias + 5)
+
+            # Al terminar, las de cada proceso pasan a las de los terminados
+            metricas.retirar_proceso(directorio, 1)
+            with open(os.path.join(directorio, '2.json'), 'w') as archivo:
+                json.dump(otro, archivo)
+            metricas.retirar_proceso(directorio, 2)
+            self.assertEqual(os.listdir(directorio), [metricas.TERMINADOS])
+            self.assertEqual(self.contador(metricas.exposicion(), serie), propias + 10)
+
+
+class LimitesTests(APITestCase):
+    def setUp(self):
+        limites.memoria.vaciar()
+        self.ana = crear_usuario('ana')
+        self.cliente = Cliente.objects.create(usuario=self.ana, nombre='Ana', apellido='Diaz',
+                                              email='ana.cliente@example.com')
+        self.laptop = Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=100)
+        self.client.force_authenticate(self.ana)
+
+    def registrar(self):
+        return self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': self.cliente.id,
+            'productos': [{'producto_id': self.laptop.id, 'cantidad': 1, 'precio_unitario': '500.00'}],
+        }, format='json')
+
+    def limitar(self, vista, accion, **kwargs):
+        return mock.patch.dict(vista.limites, {accion: limites.Limite(**kwargs)})
+
+    def test_cubo_por_usuario_con_retry_after(self):
+        with self.limitar(PedidoViewSet, 'registrar_nuevo_pedido', por_usuario={'cliente': '2/min'}):
+            self.assertEqual([self.registrar().status_code for _ in range(2)], [201, 201])
+            response = self.registrar()
+            self.assertEqual(response.status_code, 429)
+            # Un token cada 30 s
+            self.assertEqual(response['Retry-After'], '30')
+
+            # Los demás usuarios tienen su propio cubo
+            self.client.force_authenticate(crear_usuario('luis'))
+            response = self.registrar()
+            self.assertEqual(response.status_code, 201)
+            self.assertIn('lim;dur=', response['Server-Timing'])
+
+            with override_settings(LIMITES_ACTIVOS=False):
+                self.client.force_authenticate(self.ana)
+                self.assertEqual(self.registrar().status_code, 201)
+        self.assertEqual(Pedido.objects.count(), 4)
+
+    def test_cubo_compartido_por_rol(self):
+        with self.limitar(PedidoViewSet, 'registrar_nuevo_pedido', por_rol={'cliente': '1/min'}):
+            self.assertEqual(self.registrar().status_code, 201)
+            self.client.force_authenticate(crear_usuario('luis'))
+            self.assertEqual(self.registrar().status_code, 429)
+            # Otro rol, otro cubo (sin límite)
+            self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+            self.assertEqual(self.registrar().status_code, 201)
+
+    def test_concurrencia_responde_503_sin_esperar(self):
+        with self.limitar(PedidoViewSet, 'registrar_nuevo_pedido', concurrentes=1):
+            # Otra petición en curso ocupa la única plaza
+            plaza = limites.memoria.ocupar('concurrencia:PedidoViewSet.registrar_nuevo_pedido', 1)
+            response = self.registrar()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertFalse(Pedido.objects.exists())
+
+            plaza.liberar()
+            # Cada petición libera su plaza al responder
+            self.assertEqual([self.registrar().status_code for _ in range(2)], [201, 201])
+
+    def test_login_limitado_por_cuenta_e_ip(self):
+        self.client.force_authenticate(None)
+        with self.limitar(MyTokenObtainPairView, 'post', por_usuario={'anonimo': '2/min'}):
+            for _ in range(2):
+                self.assertEqual(self.client.post('/api/token/', {'username': 'ana', 'password': 'x'}).status_code,
+                                 401)
+            self.assertEqual(self.client.post('/api/token/', {'username': 'ANA', 'password': 'x'}).status_code, 429)
+            self.assertEqual(self.client.post('/api/token/', {'username': 'otro', 'password': 'x'}).status_code, 401)
+            # Los intentos de otra IP no bloquean a la dueña de la cuenta
+            response = self.client.post('/api/token/', {'username': 'ana', 'password': 'secreta123'},
+                                        REMOTE_ADDR='10.0.0.7')
+            self.assertEqual(response.status_code, 200)
+
+    def test_login_limitado_por_ip(self):
+        self.client.force_authenticate(None)
+        with self.limitar(MyTokenObtainPairView, 'post', por_ip={'anonimo': '2/min'}):
+            for username in ('ana', 'luis'):
+                self.assertEqual(self.client.post('/api/token/', {'username': username, 'password': 'x'}).status_code,
+                                 401)
+            self.assertEqual(self.client.post('/api/token/', {'username': 'eva', 'password': 'x'}).status_code, 429)
+            response = self.client.post('/api/token/', {'username': 'eva', 'password': 'x'}, REMOTE_ADDR='10.0.0.7')
+            self.assertEqual(response.status_code, 401)
+
+    def test_un_error_sin_manejar_libera_la_plaza(self):
+        with self.limitar(PedidoViewSet, 'registrar_nuevo_pedido', concurrentes=1):
+            with mock.patch.object(PedidoViewSet, 'registrar_nuevo_pedido', side_effect=RuntimeError('fallo')):
+                with self.assertRaises(RuntimeError):
+                    self.registrar()
+            self.assertEqual(limites.memoria.plazas['concurrencia:PedidoViewSet.registrar_nuevo_pedido'], {})
+            self.assertEqual(self.registrar().status_code, 201)
+
+    def test_en_memoria_mientras_falla_la_cache_compartida(self):
+        class Caida:
+            llamadas = 0
+
+            def tomar(self, *args):
+                Caida.llamadas += 1
+                raise ConnectionError('sin Redis')
+
+        almacen = limites.ConRespaldo(Caida(), limites.EnMemoria())
+        with self.assertLogs('quicknotes.limites', 'WARNING'):
+            esperas = [almacen.tomar('limite:prueba', 2, 1 / 60) for _ in range(3)]
+        self.assertEqual(esperas[:2], [0, 0])
+        self.assertGreater(esperas[2], 59)
+        # No lo vuelve a intentar hasta pasados PAUSA_TRAS_FALLO segundos
+        self.assertEqual(Caida.llamadas, 1)
+
+
+class ParticionesTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.producto = Producto.objects.create(nombre='Mouse', precio=Decimal('20.00'), stock=100)
+
+    def comprar(self):
+        response = self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': self.cliente.id,
+            'productos': [{'producto_id': self.producto.id, 'cantidad': 2, 'precio_unitario': '20.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Pedido.objects.latest('id')
+
+    def particion(self, tabla, id):
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {tabla} WHERE id = %s", [id])
+            return cursor.fetchone()[0]
+
+    def test_lineas_y_devoluciones_van_con_su_pedido(self):
+        pedido = self.comprar()
+        linea = DetallePedido.objects.create(pedido=pedido, producto=self.producto, cantidad=1,
+                                             precio_unitario=Decimal('20.00'), subtotal=Decimal('20.00'))
+        devolucion = Devolucion.objects.create(pedido=pedido, producto=self.producto, cantidad=1, estado='aprobada')
+        mes = f'{pedido.fecha_pedido.astimezone(dt_timezone.utc):%Y_%m}'
+        self.assertEqual(self.particion('pedidos', pedido.id), f'pedidos_{mes}')
+        for linea_id in DetallePedido.objects.filter(pedido=pedido).values_list('id', flat=True):
+            self.assertEqual(self.particion('detalle_pedidos', linea_id), f'detalle_pedidos_{mes}')
+        self.assertEqual(self.particion('devoluciones', devolucion.id), f'devoluciones_{mes}')
+        devolucion.refresh_from_db()
+        self.assertEqual(devolucion.importe, Decimal('20.00'))
+
+        # Si el pedido cambia de mes, se lleva sus líneas y devoluciones
+        antes = timezone.now() - timedelta(days=100)
+        Pedido.objects.filter(id=pedido.id).update(fecha_pedido=antes)
+        mes = f'{antes.astimezone(dt_timezone.utc):%Y_%m}'
+        self.assertEqual(self.particion('detalle_pedidos', linea.id), f'detalle_pedidos_{mes}')
+        self.assertEqual(self.particion('devoluciones', devolucion.id), f'devoluciones_{mes}')
+
+        # Las ventas pasan a ese día; la devolución se queda en el suyo
+        datos = self.client.get('/api/pedidos/ventas-totales/', {'agrupar': 'dia'}).data
+        self.assertEqual([(r['dia'], r['unidades'], r['unidades_devueltas']) for r in datos['resultados']],
+                         [(antes.date(), 3, 0), (timezone.now().date(), 0, 1)])
+        self.assertEqual(datos['ventas_totales'], Decimal('40.00'))
+
+    def test_el_listado_por_fecha_solo_lee_sus_particiones(self):
+        # Lo que filtra la paginación por cursor a partir de la segunda página
+        hasta = timezone.now() - timedelta(days=120)
+        plan = Pedido.objects.filter(fecha_pedido__lte=hasta).order_by('-fecha_pedido', '-id')[:20].explain()
+        meses = set(re.findall(r'pedidos_(\d{4}_\d{2})', plan))
+        self.assertEqual(max(meses), f'{hasta.astimezone(dt_timezone.utc):%Y_%m}')
+        self.assertNotIn(f'{timezone.now().astimezone(dt_timezone.utc):%Y_%m}', meses)
+
+    def test_el_detalle_y_sus_lineas_solo_leen_la_particion_de_su_mes(self):
+        pedido = self.comprar()
+        antiguo = self.comprar()
+        hace_100_dias = timezone.now() - timedelta(days=100)
+        Pedido.objects.filter(id=antiguo.id).update(fecha_pedido=hace_100_dias)
+        meses = {f'{fecha.astimezone(dt_timezone.utc):%Y_%m}' for fecha in (pedido.fecha_pedido, hace_100_dias)}
+        mes = f'{pedido.fecha_pedido.astimezone(dt_timezone.utc):%Y_%m}'
+        fecha = self.client.get('/api/pedidos/').data['results'][0]['fecha_pedido']
+
+        # El detalle con ?fecha_pedido= y las líneas de una página del listado
+        # (la primera página del listado sí recorre todos los meses, por orden)
+        casos = ((f'/api/pedidos/{pedido.id}/', {'fecha_pedido': fecha}, ('FROM "pedidos"', 'FROM "detalle_pedidos"'), {mes}),
+                 ('/api/pedidos/', {'expand': 'detalle_pedidos'}, ('FROM "detalle_pedidos"',), meses))
+        for lectura_rapida in (True, False):
+            for url, parametros, tablas, esperados in casos:
+                with self.subTest(url=url, lectura_rapida=lectura_rapida), \
+                        override_settings(LECTURA_RAPIDA=lectura_rapida), \
+                        CaptureQueriesContext(connections['default']) as consultas:
+                    response = self.client.get(url, parametros)
+                    self.assertEqual(response.status_code, 200)
+                    detalle = response.data if 'results' not in response.data else response.data['results'][0]
+                    self.assertEqual(len(detalle['detalle_pedidos']), 1)
+                    for consulta in consultas.captured_queries:
+                        if not any(tabla in consulta['sql'] for tabla in tablas):
+                            continue
+                        with connections['default'].cursor() as cursor:
+                            cursor.execute('EXPLAIN ' + consulta['sql'])
+                            plan = '\n'.join(fila[0] for fila in cursor.fetchall())
+                        self.assertEqual(set(re.findall(r'(?:pedidos|detalle_pedidos)_(\d{4}_\d{2}|historico)', plan)),
+                                         esperados, consulta['sql'])
+
+    def test_crear_y_archivar_particiones(self):
+        antiguo = self.comprar()
+        Pedido.objects.filter(id=antiguo.id).update(fecha_pedido=timezone.now() - timedelta(days=200))
+        reciente = self.comprar()
+
+        creadas = crear_particiones(meses=5)
+        self.assertEqual(len(creadas), 6)
+        self.assertEqual(crear_particiones(meses=5), [])
+
+        with connections['default'].cursor() as cursor:
+            # Las comprobaciones pendientes de las claves foráneas no dejan desenganchar
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        archivadas = archivar_particiones(meses_a_conservar=3)
+        self.assertIn('archivo.pedidos_historico', archivadas)
+        self.assertEqual(len(archivadas) % 3, 0)
+        self.assertEqual(list(Pedido.objects.values_list('id', flat=True)), [reciente.id])
+        self.assertEqual([p['id'] for p in self.client.get('/api/pedidos/').data['results']], [reciente.id])
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM archivo.detalle_pedidos_{timezone.now() - timedelta(days=200):%Y_%m} "
+                "WHERE pedido_id = %s",
+                [antiguo.id]
+            )
+            self.assertEqual(cursor.fetchone()[0], 1)
+        # Los acumulados de ventas no cambian
+        self.assertEqual(self.client.get('/api/pedidos/ventas-totales/').data['ventas_totales'], Decimal('80.00'))
+
+
+class TareasTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.cliente = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.producto = Producto.objects.create(nombre='Teclado', precio=Decimal('20.00'), stock=10)
+
+    def tearDown(self):
+        MANEJADORES.pop('prueba', None)
+
+    def test_aprobar_devoluciones_repone_el_stock_y_el_total_por_lotes(self):
+        response = self.client.post('/api/pedidos/registrar-nuevo-pedido/', {
+            'cliente_id': self.cliente.id,
+            'productos': [{'producto_id': self.producto.id, 'cantidad': 4, 'precio_unitario': '20.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        pedido = Pedido.objects.latest('id')
+        solicitada = self.client.post('/api/devoluciones/', {
+            'pedido': pedido.id, 'producto': self.producto.id, 'cantidad': 1,
+        }, format='json').data
+        Devolucion.objects.create(pedido=pedido, producto=self.producto, cantidad=2, estado='aprobada')
+        self.assertEqual(Tarea.objects.count(), 1)
+
+        # Aprobar solo encola: la respuesta no toca el stock ni el pedido
+        response = self.client.patch(f"/api/devoluciones/{solicitada['id']}/", {'estado': 'aprobada'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Tarea.objects.filter(tipo='devolucion_aprobada').count(), 2)
+        self.assertEqual(stock_disponible(self.producto.id), 6)
+
+        call_command('procesar_tareas', '--una-vez', stdout=io.StringIO())
+
+        self.assertFalse(Tarea.objects.exists())
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 9)
+        self.assertEqual(stock_disponible(self.producto.id), 9)
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.total, Decimal('20.00'))
+        self.assertFalse(Devolucion.objects.filter(fecha_reposicion__isnull=True).exists())
+
+        # Repetir la tarea o volver a aprobar no repone dos veces
+        self.assertEqual(procesar_devoluciones([{'devolucion_id': solicitada['id']}]), 0)
+        Devolucion.objects.filter(id=solicitada['id']).update(estado='rechazada')
+        Devolucion.objects.filter(id=solicitada['id']).update(estado='aprobada')
+        self.assertFalse(Tarea.objects.exists())
+
+    def test_una_tarea_que_falla_se_reintenta_sin_retener_al_resto(self):
+        procesadas = []
+
+        @manejador('prueba', lote=10)
+        def prueba(lote):
+            if any(datos['falla'] for datos in lote):
+                raise ValueError('falla')
+            procesadas.extend(datos['n'] for datos in lote)
+
+        for n in range(3):
+            encolar('prueba', {'n': n, 'falla': n == 1}, clave=f'prueba:{n}', max_intentos=2)
+        self.assertIsNone(encolar('prueba', {'n': 0, 'falla': False}, clave='prueba:0'))
+
+        with self.assertLogs('quicknotes.tareas', 'WARNING'):
+            self.assertEqual(procesar_lote('prueba'), (2, 1))
+        self.assertEqual(procesadas, [0, 2])
+        tarea = Tarea.objects.get()
+        self.assertEqual((tarea.estado, tarea.intentos), ('pendiente', 1))
+        self.assertIn('falla', tarea.error)
+        # Espera antes de reintentar
+        self.assertEqual(procesar_lote('prueba'), (0, 0))
+
+        Tarea.objects.update(disponible_desde=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('quicknotes.tareas', 'WARNING'):
+            self.assertEqual(procesar_lote('prueba'), (0, 1))
+        self.assertEqual(Tarea.objects.get().estado, 'fallida')
+
+        self.assertEqual(reintentar_fallidas(['prueba']), 1)
+        self.assertEqual(Tarea.objects.get().estado, 'pendiente')
+
+
+class DevolucionesTests(APITestCase):
+    def setUp(self):
+        self.usuario = crear_usuario('juan')
+        cliente = Cliente.objects.create(usuario=self.usuario, nombre='Juan', apellido='Perez',
+                                         email='juan.cliente@example.com')
+        otro = Cliente.objects.create(nombre='Otro', apellido='X', email='otro@example.com')
+        self.producto = Producto.objects.create(nombre='Teclado', precio=Decimal('20.00'), stock=10)
+        self.pedido = Pedido.objects.create(cliente=cliente, total=Decimal('20.00'))
+        self.ajeno = Pedido.objects.create(cliente=otro, total=Decimal('20.00'))
+        self.suya = Devolucion.objects.create(pedido=self.pedido, producto=self.producto, cantidad=1)
+        self.otra = Devolucion.objects.create(pedido=self.ajeno, producto=self.producto, cantidad=1)
+
+    def test_el_cliente_solo_ve_y_exporta_las_de_sus_pedidos(self):
+        self.client.force_authenticate(self.usuario)
+        response = self.client.get('/api/devoluciones/')
+        self.assertEqual([fila['id'] for fila in response.data['results']], [self.suya.id])
+        self.assertEqual(self.client.get(f'/api/devoluciones/{self.otra.id}/').status_code, 404)
+        filas = list(csv.DictReader(io.StringIO(
+            b''.join(self.client.get('/api/devoluciones/exportar/').streaming_content).decode())))
+        self.assertEqual([int(fila['id']) for fila in filas], [self.suya.id])
+
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        response = self.client.get('/api/devoluciones/')
+        self.assertEqual({fila['id'] for fila in response.data['results']}, {self.suya.id, self.otra.id})
+
+    def test_el_cliente_solicita_pero_no_aprueba(self):
+        self.client.force_authenticate(self.usuario)
+        response = self.client.post('/api/devoluciones/', {
+            'pedido': self.pedido.id, 'producto': self.producto.id, 'cantidad': 1, 'estado': 'aprobada',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['estado'], 'solicitada')
+        self.assertFalse(Tarea.objects.filter(tipo='devolucion_aprobada').exists())
+
+        response = self.client.post('/api/devoluciones/', {
+            'pedido': self.ajeno.id, 'producto': self.producto.id, 'cantidad': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pedido', response.data)
+
+        url = f'/api/devoluciones/{self.suya.id}/'
+        self.assertEqual(self.client.patch(url, {'estado': 'aprobada'}, format='json').status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        self.suya.refresh_from_db()
+        self.assertEqual(self.suya.estado, 'solicitada')
+
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.assertEqual(self.client.patch(url, {'estado': 'aprobada'}, format='json').status_code, 200)
+        self.assertTrue(Tarea.objects.filter(tipo='devolucion_aprobada').exists())
+
+
+class FiltrosTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('empleado', rol='empleado'))
+        self.ana = Cliente.objects.create(nombre='Ana', apellido='Diaz', email='ana@example.com')
+        self.luis = Cliente.objects.create(nombre='Luis', apellido='Gil', email='luis@example.com')
+        self.mouse = Producto.objects.create(nombre='Mouse', precio=Decimal('10.00'), stock=100)
+        self.teclado = Producto.objects.create(nombre='Teclado', precio=Decimal('30.00'), stock=100)
+        self.pedidos = []
+        for dia, cliente, estado, total in [(1, self.ana, 'pendiente', '10.00'), (2, self.luis, 'enviado', '60.00'),
+                                            (3, self.ana, 'enviado', '30.00'), (4, self.ana, 'entregado', '90.00')]:
+            pedido = Pedido.objects.create(cliente=cliente, total=Decimal(total), estado=estado)
+            Pedido.objects.filter(pk=pedido.pk).update(fecha_pedido=datetime(2026, 3, dia, 12, tzinfo=dt_timezone.utc))
+            self.pedidos.append(pedido)
+
+    def ids(self, url, **parametros):
+        response = self.client.get(url, parametros)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [int(fila['id']) for fila in response.data['results']]
+
+    def test_filtros_de_pedidos(self):
+        p = [pedido.id for pedido in self.pedidos]
+        self.assertEqual(self.ids('/api/pedidos/', estado='pendiente'), [p[0]])
+        self.assertEqual(self.ids('/api/pedidos/', estado='enviado,entregado', cliente=self.ana.id), [p[3], p[2]])
+        self.assertEqual(self.ids('/api/pedidos/', desde='2026-03-02', hasta='2026-03-03'), [p[2], p[1]])
+        self.assertEqual(self.ids('/api/pedidos/', total_min='30', total_max='60'), [p[2], p[1]])
+        # También en la exportación
+        filas = b''.join(self.client.get('/api/pedidos/exportar/', {'cliente': self.luis.id}).streaming_content)
+        self.assertEqual(len(filas.decode().splitlines()), 2)
+
+    def test_ordenar_y_paginar(self):
+        p = [pedido.id for pedido in self.pedidos]
+        # Por total, de dos en dos: el cursor guarda el total y el id
+        response = self.client.get('/api/pedidos/', {'ordenar': '-total', 'page_size': 2, 'fields': 'id'})
+        self.assertEqual([int(fila['id']) for fila in response.data['results']], [p[3], p[1]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([int(fila['id']) for fila in response.data['results']], [p[2], p[0]])
+        self.assertEqual(self.ids('/api/pedidos/', ordenar='total', estado='enviado'), [p[2], p[1]])
+        self.assertEqual(self.ids('/api/pedidos/', ordenar='id'), p)
+
+    def test_filtros_de_lineas_y_devoluciones(self):
+        pedido = self.pedidos[1]
+        DetallePedido.objects.create(pedido=pedido, producto=self.mouse, cantidad=3,
+                                     precio_unitario=Decimal('10.00'), subtotal=Decimal('30.00'))
+        linea = DetallePedido.objects.create(pedido=pedido, producto=self.teclado, cantidad=1,
+                                             precio_unitario=Decimal('30.00'), subtotal=Decimal('30.00'))
+        solicitada = Devolucion.objects.create(pedido=pedido, producto=self.teclado, cantidad=1)
+        rechazada = Devolucion.objects.create(pedido=pedido, producto=self.mouse, cantidad=1, estado='rechazada')
+
+        self.assertEqual(self.ids('/api/detalle-pedidos/', producto=self.teclado.id), [linea.id])
+        self.assertEqual(self.ids('/api/detalle-pedidos/', estado='pendiente'), [])
+        self.assertEqual(self.ids('/api/devoluciones/', estado='solicitada'), [solicitada.id])
+        self.assertEqual(self.ids('/api/devoluciones/', pedido=pedido.id, producto=self.mouse.id), [rechazada.id])
+        self.assertEqual(self.ids('/api/devoluciones/', ordenar='id'), [solicitada.id, rechazada.id])
+
+    def test_parametros_invalidos(self):
+        for parametros in [{'ordenar': 'cliente'}, {'cliente': 'ana'}, {'estado': ','},
+                           {'total_min': '50', 'total_max': '10'}, {'desde': '2026-03-02', 'hasta': '2026-03-01'},
+                           {'fecha_pedido': '2026-03-02 ayer'}]:
+            response = self.client.get('/api/pedidos/', parametros)
+            self.assertEqual(response.status_code, 400, parametros)
+        self.assertEqual(self.client.get('/api/devoluciones/', {'ordenar': 'importe'}).status_code, 400)
+
+    def test_cada_combinacion_de_filtros_usa_un_indice(self):
+        valores = {
+            'estado': 'pendiente', 'cliente': '1', 'pedido': '1', 'producto': '1',
+            'desde': '2026-03-01', 'hasta': '2026-03-31', 'total_min': '10', 'total_max': '100',
+            'fecha_pedido': '2026-03-10T12:00:00Z',
+        }
+        paginaciones = {PedidoFiltros: ('-fecha_pedido', '-id'), DetallePedidoFiltros: ('-id',),
+                        DevolucionFiltros: ('-fecha_devolucion', '-id')}
+        modelos = {PedidoFiltros: Pedido, DetallePedidoFiltros: DetallePedido, DevolucionFiltros: Devolucion}
+        with connections['default'].cursor() as cursor:
+            # Con tablas tan pequeñas, recorrerlas sería lo más barato
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        for filtros, modelo in modelos.items():
+            ordenamientos = [paginaciones[filtros]] + [
+                filtros.ordenamiento({'ordenar': signo + campo}) for campo in filtros.ordenables for signo in ('', '-')
+            ]
+            nombres = list(filtros.declarados)
+            for n in range(len(nombres) + 1):
+                for combinacion in itertools.combinations(nombres, n):
+                    consulta = filtros.filtrar(modelo.objects.all(), {nombre: valores[nombre] for nombre in combinacion})
+                    for ordenamiento in ordenamientos:
+                        plan = consulta.order_by(*ordenamiento)[:51].explain()
+                        self.assertNotIn('Seq Scan', plan, (filtros.__name__, combinacion, ordenamiento))
+
+        # Los filtros más selectivos van por su propio índice
+        for consulta, indice in [
+            (Pedido.objects.filter(estado='pendiente').order_by('-fecha_pedido', '-id'), 'pendientes_idx'),
+            (Pedido.objects.filter(total__gte=50).order_by('total', 'id'), 'total_id_idx'),
+            (Devolucion.objects.filter(estado='solicitada').order_by('-fecha_devolucion', '-id'), 'solicitadas_idx'),
+            (Devolucion.objects.filter(producto_id=1).order_by('-fecha_devolucion', '-id'), 'prod_fecha_idx'),
+            (DetallePedido.objects.filter(producto_id=1).order_by('-id'), 'producto_id_idx'),
+        ]:
+            self.assertIn(indice, consulta[:51].explain())
+
+
+# El feed solo devuelve transacciones terminadas: hace falta confirmar de verdad
+class CambiosTests(APITransactionTestCase):
+    def setUp(self):
+        self.client.force_authenticate(crear_usuario('admin', rol='administrador'))
+        self.mouse = Producto.objects.create(nombre='Mouse', precio=Decimal('10.00'), stock=5)
+        self.teclado = Producto.objects.create(nombre='Teclado', precio=Decimal('30.00'), stock=2)
+
+    def cambios(self, url, desde=None, **parametros):
+        if desde is not None:
+            parametros['desde'] = desde
+        response = self.client.get(url, parametros)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_altas_cambios_y_bajas(self):
+        cursor = self.cambios('/api/productos/cambios/')['siguiente']
+        monitor = Producto.objects.create(nombre='Monitor', precio=Decimal('99.00'), stock=1)
+        self.client.patch(f'/api/productos/{self.mouse.id}/', {'precio': '11.00'}, format='json')
+        self.client.patch(f'/api/productos/{self.mouse.id}/', {'stock': 6}, format='json')
+        teclado_id = self.teclado.id
+        self.teclado.delete()
+        # Guardar sin cambiar nada no cuenta
+        monitor.save()
+
+        respuesta = self.cambios('/api/productos/cambios/', cursor)
+        self.assertFalse(respuesta['hay_mas'])
+        self.assertEqual([(c['id'], c['baja']) for c in respuesta['cambios']],
+                         [(monitor.id, False), (self.mouse.id, False), (teclado_id, True)])
+        self.assertEqual(respuesta['cambios'][1]['datos']['precio'], '11.00')
+        self.assertEqual(respuesta['cambios'][1]['datos']['stock'], 6)
+        self.assertEqual(self.cambios('/api/productos/cambios/', respuesta['siguiente'])['cambios'], [])
+
+        # Cada tabla tiene su feed
+        cursor = self.cambios('/api/pedidos/cambios/')['siguiente']
+        cursor_lineas = self.cambios('/api/detalle-pedidos/cambios/')['siguiente']
+        pedido = Pedido.objects.create(total=Decimal('11.00'))
+        linea = DetallePedido.objects.create(pedido=pedido, producto=self.mouse, cantidad=1,
+                                             precio_unitario=Decimal('11.00'), subtotal=Decimal('11.00'))
+        self.assertEqual([c['id'] for c in self.cambios('/api/pedidos/cambios/', cursor)['cambios']], [pedido.id])
+        self.assertEqual([c['id'] for c in self.cambios('/api/detalle-pedidos/cambios/', cursor_lineas)['cambios']],
+                         [linea.id])
+
+    def test_una_transaccion_abierta_retiene_el_cursor(self):
+        cursor = self.cambios('/api/productos/cambios/')['siguiente']
+        otra = connections['default'].copy()
+        try:
+            otra.set_autocommit(False)
+            with otra.cursor() as sql:
+                sql.execute("UPDATE productos SET precio = 12 WHERE id = %s", [self.mouse.id])
+            # Confirma después otra transacción, posterior a la que sigue abierta
+            Producto.objects.filter(pk=self.teclado.pk).update(stock=3)
+            respuesta = self.cambios('/api/productos/cambios/', cursor)
+            self.assertEqual(respuesta['cambios'], [])
+            otra.commit()
+        finally:
+            otra.close()
+        respuesta = self.cambios('/api/productos/cambios/', respuesta['siguiente'])
+        self.assertEqual([c['id'] for c in respuesta['cambios']], [self.mouse.id, self.teclado.id])
+
+    def test_paginas_cursores_y_purga(self):
+        cursor = self.cambios('/api/productos/cambios/')['siguiente']
+        for precio in ('1.00', '2.00', '3.00'):
+            Producto.objects.create(nombre=f'P{precio}', precio=Decimal(precio), stock=1)
+        primera = self.cambios('/api/productos/cambios/', cursor, limite=2)
+        self.assertTrue(primera['hay_mas'])
+        segunda = self.cambios('/api/productos/cambios/', primera['siguiente'], limite=2)
+        self.assertFalse(segunda['hay_mas'])
+        self.assertEqual(len(primera['cambios']) + len(segunda['cambios']), 3)
+
+        self.assertEqual(self.client.get('/api/productos/cambios/', {'desde': 'no-vale'}).status_code, 400)
+        caducado = _codificar(0, 0, timezone.now() - timedelta(days=31))
+        self.assertEqual(self.client.get('/api/productos/cambios/', {'desde': caducado}).status_code, 410)
+
+        Cambio.objects.update(fecha=timezone.now() - timedelta(days=40))
+        Producto.objects.filter(pk=self.mouse.pk).update(stock=9)
+        self.assertEqual(purgar_cambios(30), 5)
+        self.assertEqual(Cambio.objects.count(), 1)
+
+        # Cada consulta es un rango del índice, ya en orden
+        with connections['default'].cursor() as sql:
+            sql.execute('SET enable_seqscan = off')
+            try:
+                sql.execute(
+                    "EXPLAIN SELECT transaccion, id, registro_id, fecha FROM cambios "
+                    "WHERE tabla = 'productos' AND (transaccion, id) > (1, 1) AND transaccion < 100 "
+                    "ORDER BY transaccion, id LIMIT 500"
+                )
+                plan = '\n'.join(fila[0] for fila in sql.fetchall())
+            finally:
+                sql.execute('RESET enable_seqscan')
+        self.assertIn('cambios_tabla_txid_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_permisos(self):
+        self.client.force_authenticate(crear_usuario('juan'))
+        self.assertEqual(self.client.get('/api/productos/cambios/').status_code, 200)
+        self.assertEqual(self.client.get('/api/pedidos/cambios/').status_code, 403)
+        self.assertEqual(self.client.get('/api/devoluciones/cambios/').status_code, 403)
+
+
+class EventosTests(APITransactionTestCase):
+    def setUp(self):
+        self.usuario = crear_usuario('juan')
+        cliente = Cliente.objects.create(usuario=self.usuario, nombre='Juan', apellido='Perez',
+                                         email='juan.cliente@example.com')
+        otro = Cliente.objects.create(nombre='Otro', apellido='X', email='otro@example.com')
+        self.producto = Producto.objects.create(nombre='Laptop', precio=Decimal('500.00'), stock=10)
+        self.pedido = Pedido.objects.create(cliente=cliente, total=Decimal('500.00'))
+        self.ajeno = Pedido.objects.create(cliente=otro, total=Decimal('20.00'))
+        self.token = str(MyTokenObtainPairSerializer.get_token(self.usuario).access_token)
+
+    def pedir_ticket(self):
+        response = self.client.post('/api/async/eventos/ticket/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['ticket']
+
+    async def test_stock_y_estado_de_sus_pedidos(self):
+        ticket = await sync_to_async(self.pedir_ticket)()
+        response = await self.async_client.get('/api/async/eventos/', {'ticket': ticket})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        flujo = aiter(response.streaming_content)
+        self.assertEqual(await anext(flujo), b'retry: 3000\n\n')
+
+        await Producto.objects.filter(pk=self.producto.pk).aupdate(stock=7)
+        # El de otro cliente no le llega
+        await Pedido.objects.filter(pk=self.ajeno.pk).aupdate(estado='enviado')
+        await Pedido.objects.filter(pk=self.pedido.pk).aupdate(estado='enviado')
+        # Sin cambio de stock, no hay aviso
+        await Producto.objects.filter(pk=self.producto.pk).aupdate(precio=Decimal('450.00'))
+
+        texto = b''
+        while texto.count(b'\n\n') < 2:
+            texto += await asyncio.wait_for(anext(flujo), 5)
+        self.assertEqual(texto.decode().split('\n\n')[:2], [
+            f'event: stock\ndata: {{"tipo": "stock", "id": {self.producto.id}, "stock": 7}}',
+            f'event: pedido\ndata: {{"tipo": "pedido", "id": {self.pedido.id}, '
+            f'"cliente_id": {self.pedido.cliente_id}, "estado": "enviado"}}',
+        ])
+
+        # El cliente de pruebas no cierra el generador al cerrar la respuesta
+        # (el servidor ASGI lo cancela cuando el navegador se va)
+        for suscripcion in list(difusor().suscripciones):
+            difusor().cancelar(suscripcion)
+
+    async def test_la_conexion_se_cierra_con_el_ultimo_navegador(self):
+        usuario = UsuarioToken(MyTokenObtainPairSerializer.get_token(self.usuario).access_token)
+        primero, segundo = flujo_de_eventos(usuario), flujo_de_eventos(usuario)
+        await anext(primero)
+        await anext(segundo)
+        conexion = difusor().conexion
+        await primero.aclose()
+        self.assertIs(difusor().conexion, conexion)
+        await segundo.aclose()
+        self.assertIsNone(difusor().conexion)
+        self.assertTrue(conexion.closed)
+
+    async def test_sin_token(self):
+        response = await self.async_client.get('/api/async/eventos/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_el_ticket_sirve_una_vez_y_solo_para_los_eventos(self):
+        ticket = await sync_to_async(self.pedir_ticket)()
+        # Ni el ticket es un token de acceso ni el token va ya en la URL
+        response = await self.async_client.get('/api/async/pedidos/', headers={'Authorization': f'Bearer {ticket}'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/async/eventos/', {'ticket': self.token})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/async/eventos/', {'token': self.token})
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get('/api/async/eventos/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        for suscripcion in list(difusor().suscripciones):
+            difusor().cancelar(suscripcion)
+        response = await self.async_client.get('/api/async/eventos/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 401)
+
+        with override_settings(EVENTOS_TICKET_TTL=-1):
+            caducado = await sync_to_async(self.pedir_ticket)()
+        response = await self.async_client.get('/api/async/eventos/', {'ticket': caducado})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_un_navegador_lento_no_acumula_avisos(self):
+        suscripcion = Suscripcion(lambda evento: True, max_pendientes=2)
+        for stock in range(5):
+            suscripcion.publicar({'tipo': 'stock', 'id': 1, 'stock': stock})
+        suscripcion.publicar({'tipo': 'stock', 'id': 2, 'stock': 1})
+        # Del mismo producto, solo el último
+        self.assertEqual(await suscripcion.siguientes(1), [
+            {'tipo': 'stock', 'id': 1, 'stock': 4}, {'tipo': 'stock', 'id': 2, 'stock': 1},
+        ])
+        self.assertEqual(await suscripcion.siguientes(0.01), [])
+
+        for id in range(3):
+            suscripcion.publicar({'tipo': 'stock', 'id': id, 'stock': 0})
+        self.assertTrue(suscripcion.desbordada)
+        self.assertEqual(suscripcion.pendientes, {})
@@ -1,7 +1,9 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
+from . import asincronas
 from .views import (
     UsuarioViewSet, ClienteViewSet, ProductoViewSet, PedidoViewSet,
-    DetallePedidoViewSet, DevolucionViewSet
+    DetallePedidoViewSet, DevolucionViewSet, MetricasView, TicketDeEventosView
 )
 
 router = DefaultRouter()
@@ -18,4 +20,15 @@ router.register(r'detalle-pedidos', DetallePedidoViewSet)
 router.register(r'devoluciones', DevolucionViewSet)
 
 # Las URLs generadas por el router
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = router.urls + [
+    # Lecturas asíncronas para el worker ASGI (ver quicknotes/asincronas.py)
+    path('async/productos/', asincronas.productos, name='async-productos'),
+    path('async/productos/<int:pk>/', asincronas.producto, name='async-producto'),
+    path('async/pedidos/', asincronas.pedidos, name='async-pedidos'),
+    path('async/pedidos/<int:pk>/', asincronas.pedido, name='async-pedido'),
+    # Stock y estado de los pedidos en tiempo real (ver quicknotes/eventos.py)
+    path('async/eventos/', asincronas.eventos, name='async-eventos'),
+    path('async/eventos/ticket/', TicketDeEventosView.as_view(), name='async-eventos-ticket'),
+    # Métricas para Prometheus (ver quicknotes/metricas.py)
+    path('metricas/', MetricasView.as_view(), name='metricas'),
+]
\ No newline at end of file
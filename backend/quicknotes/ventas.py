@@ -0,0 +1,91 @@
+"""
+Informes de ventas a partir de acumulados.
+
+Antes, el informe de ventas agregaba la tabla de pedidos entera en cada
+consulta. Ahora PostgreSQL mantiene tres tablas de acumulados (migración 0007
+y postgres.sql):
+
+- ventas_diarias: pedidos, unidades e importe vendidos y devueltos por día;
+- ventas_producto_diarias: lo mismo por día y producto;
+- ventas_cliente_diarias: lo mismo por día y cliente.
+
+Los triggers de pedidos, detalle_pedidos y devoluciones suman o restan en
+ellas cada cambio (altas, ediciones y bajas; las devoluciones solo cuentan
+mientras están 'aprobada'). El importe vendido es la suma de los subtotales
+de las líneas y el devuelto se valora con el precio de la línea del pedido.
+Para no convertir la fila del día en un nuevo punto de contención, cada
+conexión suma en uno de varios fragmentos de la fila; las consultas suman los
+fragmentos.
+
+Un informe lee como mucho una fila por día (y producto o cliente) y
+fragmento, así que su coste no depende de cuántos pedidos haya.
+reconstruir_ventas() (manage.py reconstruir_ventas) los recalcula desde cero.
+"""
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import VentaDiaria, VentaProductoDiaria, VentaClienteDiaria
+
+METRICAS = ['unidades', 'importe', 'unidades_devueltas', 'importe_devuelto']
+
+# agrupar -> (tabla de acumulados, columnas del grupo, columnas calculadas, orden)
+AGRUPACIONES = {
+    'dia': (VentaDiaria, ['dia'], {}, ['dia']),
+    'mes': (VentaDiaria, [], {'mes': TruncMonth('dia')}, ['mes']),
+    'producto': (VentaProductoDiaria, ['producto_id'], {'producto_nombre': F('producto__nombre')},
+                 ['-neto', 'producto_id']),
+    'cliente': (VentaClienteDiaria, ['cliente_id'], {'cliente_nombre': F('cliente__nombre')},
+                ['-neto', 'cliente_id']),
+}
+
+
+def _en_rango(queryset, desde, hasta):
+    if desde:
+        queryset = queryset.filter(dia__gte=desde)
+    if hasta:
+        queryset = queryset.filter(dia__lte=hasta)
+    return queryset
+
+
+def _sumas(model):
+    # Los alias no pueden llamarse como las columnas: se renombran en _metricas()
+    metricas = METRICAS + (['pedidos'] if model is not VentaProductoDiaria else [])
+    sumas = {f'suma_{metrica}': Sum(metrica) for metrica in metricas}
+    sumas['neto'] = Sum('importe') - Sum('importe_devuelto')
+    return sumas
+
+
+def _metricas(fila):
+    return {
+        clave.removeprefix('suma_'): (valor or 0) if clave.startswith('suma_') or clave == 'neto' else valor
+        for clave, valor in fila.items()
+    }
+
+
+def resumen_ventas(desde=None, hasta=None, agrupar=None, limite=100):
+    """
+    Totales de ventas entre dos días (incluidos) y, si se pide, el desglose
+    por día, mes, producto o cliente (estos dos, los 'limite' con más ventas
+    netas). Son dos consultas sobre los acumulados.
+    """
+    totales = _en_rango(VentaDiaria.objects.all(), desde, hasta).aggregate(**_sumas(VentaDiaria))
+    resumen = _metricas(totales)
+    resumen['ventas_totales'] = resumen.pop('neto')
+
+    if agrupar:
+        model, columnas, calculadas, orden = AGRUPACIONES[agrupar]
+        filas = _en_rango(model.objects.all(), desde, hasta).values(*columnas, **calculadas).annotate(
+            **_sumas(model)
+        ).order_by(*orden)
+        if agrupar in ('producto', 'cliente'):
+            filas = filas[:limite]
+        resumen['resultados'] = [_metricas(fila) for fila in filas]
+
+    return resumen
+
+
+def reconstruir_ventas(desde=None, hasta=None):
+    """Recalcula los acumulados del rango de días indicado (todo el historial si no se indica)."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT reconstruir_ventas(%s, %s)", [desde, hasta])
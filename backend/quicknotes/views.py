@@ -1,74 +1,197 @@
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db import connection
-from rest_framework_simplejwt.views import TokenObtainPairView
-from .serializers import MyTokenObtainPairSerializer
+from rest_framework.views import APIView
+from django.conf import settings
+from django.http import HttpResponse
+from django.db import connection, transaction, DataError, IntegrityError
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .serializers import MyTokenObtainPairSerializer, MyTokenRefreshSerializer
 
-from .models import Usuario, Cliente, Producto, Pedido, DetallePedido, Devolucion
+from .models import Usuario, Cliente, Producto, DetallePedido, Devolucion
 from .serializers import (
     UsuarioSerializer, ClienteSerializer, ProductoSerializer,
     PedidoSerializer, DetallePedidoSerializer, DevolucionSerializer,
-    UsuarioRegisterSerializer
+    UsuarioRegisterSerializer, VentasConsultaSerializer, BusquedaProductoSerializer
 )
 # --- ¡IMPORTANTE! Importar los permisos que acabamos de crear ---
 from .permissions import IsAdminUser, IsEmpleadoUser
+from .authentication import TicketDeEventos
+from .pedidos import registrar_pedidos_lote, pedidos_visibles, MAX_PEDIDOS_POR_LOTE
+from .productos import actualizar_productos_lote, MAX_PRODUCTOS_POR_LOTE
+from .ventas import resumen_ventas
+from .cache import CatalogoCacheMixin
+from .busqueda import buscar_productos
+from .cambios import CambiosMixin
+from .exportacion import ExportacionMixin
+from .filtros import FiltrosBackend, PedidoFiltros, DetallePedidoFiltros, DevolucionFiltros
+from .importacion import importar_productos, importar_clientes, ErrorDeImportacion
+from .campos import CamposMixin
+from .lectura_rapida import LecturaRapidaMixin
+from .limites import Limite, LimitesMixin, ip_de
+from .metricas import MetricasMixin, exposicion, CONTENT_TYPE as CONTENT_TYPE_METRICAS
+from .pagination import (
+    UsuarioPagination, NombrePagination, PedidoPagination,
+    DetallePedidoPagination, DevolucionPagination, BusquedaPagination
+)
+
+# SQLSTATE de las restricciones CHECK y de RAISE ... USING ERRCODE = 'check_violation'
+CHECK_VIOLATION = '23514'
+
+
+def _sqlstate(error):
+    """El SQLSTATE de PostgreSQL de un error de la base de datos (psycopg 2 o 3)."""
+    causa = error.__cause__
+    return getattr(causa, 'pgcode', None) or getattr(causa, 'sqlstate', None)
+
+def _importar_csv(request, importar):
+    """Importa el CSV subido en 'archivo' (multipart) con quicknotes.importacion."""
+    archivo = request.FILES.get('archivo')
+    if archivo is None:
+        return Response({'error': "Falta el archivo CSV ('archivo')."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(importar(archivo), status=status.HTTP_200_OK)
+    except ErrorDeImportacion as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except DataError as e:
+        # CSV mal formado (comillas sin cerrar, codificación...): lo rechaza COPY
+        return Response({'error': str(e).splitlines()[0]}, status=status.HTTP_400_BAD_REQUEST)
 
 class UsuarioRegisterView(generics.CreateAPIView):
     queryset = Usuario.objects.all()
     permission_classes = (permissions.AllowAny,)
     serializer_class = UsuarioRegisterSerializer
 
-class UsuarioViewSet(viewsets.ModelViewSet):
+class UsuarioViewSet(MetricasMixin, CamposMixin, LecturaRapidaMixin, viewsets.ModelViewSet):
     queryset = Usuario.objects.all().order_by('username')
     serializer_class = UsuarioSerializer
+    pagination_class = UsuarioPagination
     # Solo los administradores pueden gestionar usuarios
     permission_classes = [IsAdminUser]
 
-class ClienteViewSet(viewsets.ModelViewSet):
-    queryset = Cliente.objects.all().order_by('nombre')
+class ClienteViewSet(MetricasMixin, CamposMixin, LecturaRapidaMixin, viewsets.ModelViewSet):
+    # El usuario anidado (UsuarioSerializer) viene en el mismo JOIN
+    queryset = Cliente.objects.select_related('usuario').order_by('nombre')
     serializer_class = ClienteSerializer
+    pagination_class = NombrePagination
     # Empleados y administradores pueden gestionar clientes
     permission_classes = [IsEmpleadoUser]
 
-class ProductoViewSet(viewsets.ModelViewSet):
-    queryset = Producto.objects.all().order_by('nombre')
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def importar(self, request):
+        """
+        Da de alta o actualiza (por email) los clientes de un CSV. Solo administradores.
+        Columnas: email, nombre, apellido, direccion, telefono.
+        """
+        return _importar_csv(request, importar_clientes)
+
+class ProductoViewSet(MetricasMixin, CamposMixin, CatalogoCacheMixin, LecturaRapidaMixin, CambiosMixin, viewsets.ModelViewSet):
+    # list y retrieve se sirven desde la caché del catálogo (ver quicknotes/cache.py);
+    # cualquier cambio en un producto la invalida
+    # El tsvector de búsqueda no se devuelve: no hace falta leerlo
+    queryset = Producto.objects.defer('busqueda').order_by('nombre')
     serializer_class = ProductoSerializer
-    
+    pagination_class = NombrePagination
+
     def get_permissions(self):
         """
         Asigna permisos basados en la acción.
-        - Cualquiera logueado puede ver la lista de productos (list, retrieve).
-        - Solo los administradores pueden crear, editar o borrar productos.
+        - Cualquiera logueado puede ver y buscar productos y pedir sus cambios
+          (list, retrieve, buscar, cambios).
+        - Solo los administradores pueden crear, editar, borrar, importar o
+          actualizar en lote productos.
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'buscar', 'cambios']:
             self.permission_classes = [permissions.IsAuthenticated]
         else:
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
-class PedidoViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def importar(self, request):
+        """
+        Da de alta o actualiza (por sku) los productos de un CSV de proveedor.
+        Columnas: sku, nombre, precio, descripcion, stock, activo. Responde
+        cuántos se insertaron, actualizaron y rechazaron, y por qué.
+        """
+        return _importar_csv(request, importar_productos)
+
+    @action(detail=False, methods=['post'], url_path='actualizar-lote')
+    def actualizar_lote(self, request):
+        """
+        Cambia precio, stock y/o activo de muchos productos en una llamada
+        (sincronizaciones de precios e inventario). Cada elemento de
+        'productos' lleva el id y, opcionalmente, la versión leída: si el
+        producto cambió desde entonces, no se aplica. El resultado se informa
+        producto a producto.
+        """
+        productos_data = request.data.get('productos')
+        if not isinstance(productos_data, list) or not productos_data:
+            return Response({'error': 'Se requiere una lista de productos.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(productos_data) > MAX_PRODUCTOS_POR_LOTE:
+            return Response({'error': f'Como máximo {MAX_PRODUCTOS_POR_LOTE} productos por lote.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        resultados = actualizar_productos_lote(productos_data)
+        aplicados = [resultado for resultado in resultados if resultado['ok']]
+        actualizados = sum(1 for resultado in aplicados if resultado['actualizado'])
+        return Response({
+            'actualizados': actualizados,
+            'sin_cambios': len(aplicados) - actualizados,
+            'rechazados': len(resultados) - len(aplicados),
+            'resultados': resultados,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def buscar(self, request):
+        """
+        Busca 'q' en el nombre y la descripción, por prefijos y tolerando
+        errores de escritura, ordenado por relevancia. Filtros opcionales:
+        'activo' (por defecto true), 'precio_min' y 'precio_max'. Se pagina por
+        cursor y, como el listado, se sirve desde la caché del catálogo.
+        """
+        return self._desde_cache(request, self._buscar)
+
+    def _buscar(self, request):
+        consulta = BusquedaProductoSerializer(data=request.query_params)
+        consulta.is_valid(raise_exception=True)
+        paginador = BusquedaPagination()
+        pagina = paginador.paginate_queryset(buscar_productos(**consulta.validated_data), request, view=self)
+        return paginador.get_paginated_response(self.get_serializer(pagina, many=True).data)
+
+class PedidoViewSet(MetricasMixin, LimitesMixin, CamposMixin, ExportacionMixin, LecturaRapidaMixin, CambiosMixin, viewsets.ModelViewSet):
     serializer_class = PedidoSerializer
+    pagination_class = PedidoPagination
     # Cualquier usuario autenticado puede interactuar con este endpoint
     permission_classes = [permissions.IsAuthenticated]
+    # ?estado=, ?cliente=, ?desde=, ?hasta=, ?total_min=, ?total_max=, ?ordenar= (ver quicknotes/filtros.py)
+    filter_backends = [FiltrosBackend]
+    filtros = PedidoFiltros
+    # pedidos/exportar/ (ver quicknotes/exportacion.py)
+    columnas_exportacion = [
+        ('id', 'id'), ('cliente_id', 'cliente_id'), ('cliente', 'cliente__nombre'),
+        ('fecha_pedido', 'fecha_pedido'), ('estado', 'estado'), ('total', 'total'),
+    ]
+    # Ráfagas de pedidos en las promociones (ver quicknotes/limites.py)
+    limites = {
+        'registrar_nuevo_pedido': Limite(
+            por_usuario={'cliente': '10/min', 'empleado': '120/min', 'administrador': '120/min'},
+            por_rol={'cliente': '3000/min'},
+            concurrentes=settings.LIMITE_PEDIDOS_CONCURRENTES,
+        ),
+        'registrar_pedidos_lote': Limite(
+            por_usuario={'empleado': '30/min', 'administrador': '30/min'},
+            concurrentes=2,
+        ),
+    }
 
     def get_queryset(self):
         """
         Filtra los pedidos para que los clientes solo vean los suyos,
         mientras que los empleados y administradores ven todos.
         """
-        user = self.request.user
-        if user.rol in ['administrador', 'empleado']:
-            return Pedido.objects.all().order_by('-fecha_pedido')
-        
-        # Para los clientes, filtramos por el cliente asociado a su usuario
-        # Esto asume que existe un 'Cliente' enlazado al 'Usuario' logueado
-        try:
-            cliente = Cliente.objects.get(usuario=user)
-            return Pedido.objects.filter(cliente=cliente).order_by('-fecha_pedido')
-        except Cliente.DoesNotExist:
-            # Si el usuario es un cliente pero no tiene un perfil de cliente, no devuelve nada
-            return Pedido.objects.none()
+        return pedidos_visibles(self.request.user)
 
     @action(detail=False, methods=['post'], url_path='registrar-nuevo-pedido')
     def registrar_nuevo_pedido(self, request):
@@ -85,44 +208,185 @@ class PedidoViewSet(viewsets.ModelViewSet):
         p_precios_unitarios = [item['precio_unitario'] for item in productos_data]
 
         try:
-            with connection.cursor() as cursor:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Las claves foráneas de Django se comprueban al confirmar: así
+                # un cliente o producto que no existe falla en el CALL, antes
+                # de que la reserva de stock lo confunda con falta de stock.
+                # Después se vuelven a diferir, porque las líneas y devoluciones
+                # que se insertan en la misma transacción las necesitan diferidas
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
                 cursor.execute(
-                    "CALL registrar_pedido(%s, %s, %s, %s, %s)",
+                    # Los precios llegan como texto desde el frontend ("500.00"): se castean a numeric
+                    "CALL registrar_pedido(%s, %s, %s::integer[], %s::integer[], %s::numeric[])",
                     [cliente_id, estado, p_productos_ids, p_cantidades, p_precios_unitarios]
                 )
+                cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+            # El catálogo no cambia: la venta descuenta de los cupos y
+            # productos.stock baja al liquidarla (ver quicknotes/reservas.py)
             return Response({'message': 'Pedido registrado exitosamente.'}, status=status.HTTP_201_CREATED)
+        except IntegrityError as e:
+            # reservar_stock() rechaza el pedido si no hay stock suficiente
+            # (check_violation); lo demás, como un cliente o un producto que
+            # no existe (foreign_key_violation), son datos incorrectos
+            if _sqlstate(e) == CHECK_VIOLATION:
+                return Response({'error': str(e).splitlines()[0]}, status=status.HTTP_409_CONFLICT)
+            return Response({'error': str(e).splitlines()[0]}, status=status.HTTP_400_BAD_REQUEST)
+        except DataError as e:
+            return Response({'error': str(e).splitlines()[0]}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], url_path='registrar-pedidos-lote')
+    def registrar_pedidos_lote(self, request):
+        """
+        Registra muchos pedidos en una sola llamada (importaciones de marketplaces,
+        sincronización de TPV). Cada elemento de 'pedidos' tiene el mismo formato
+        que 'registrar-nuevo-pedido' y el resultado se informa pedido a pedido.
+        """
+        # Solo empleados y admins pueden cargar pedidos de terceros
+        if request.user.rol not in ['administrador', 'empleado']:
+            return Response({'detail': 'No tienes permiso para realizar esta acción.'}, status=status.HTTP_403_FORBIDDEN)
+
+        pedidos_data = request.data.get('pedidos')
+        if not isinstance(pedidos_data, list) or not pedidos_data:
+            return Response({'error': 'Se requiere una lista de pedidos.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(pedidos_data) > MAX_PEDIDOS_POR_LOTE:
+            return Response({'error': f'Como máximo {MAX_PEDIDOS_POR_LOTE} pedidos por lote.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        resultados = registrar_pedidos_lote(pedidos_data)
+        registrados = sum(1 for resultado in resultados if resultado['ok'])
+        return Response({
+            'registrados': registrados,
+            'rechazados': len(resultados) - registrados,
+            'resultados': resultados,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'], url_path='ventas-totales')
     def obtener_ventas_totales(self, request):
+        """
+        Ventas netas (vendido menos devuelto) entre 'desde' y 'hasta' (días
+        incluidos, opcionales). Con 'agrupar' (dia, mes, producto o cliente)
+        añade el desglose en 'resultados'. Se responde desde los acumulados de
+        quicknotes.ventas, sin recorrer los pedidos.
+        """
         # Solo empleados y admins pueden ver las ventas totales
         if request.user.rol not in ['administrador', 'empleado']:
             return Response({'detail': 'No tienes permiso para realizar esta acción.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT ventas_totales()")
-                total = cursor.fetchone()[0]
-            return Response({'ventas_totales': total}, status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class DetallePedidoViewSet(viewsets.ModelViewSet):
-    queryset = DetallePedido.objects.all()
+        consulta = VentasConsultaSerializer(data=request.query_params)
+        consulta.is_valid(raise_exception=True)
+        return Response(resumen_ventas(**consulta.validated_data), status=status.HTTP_200_OK)
+
+class DetallePedidoViewSet(MetricasMixin, CamposMixin, ExportacionMixin, LecturaRapidaMixin, CambiosMixin, viewsets.ModelViewSet):
+    queryset = DetallePedido.objects.select_related('producto').only(
+        'id', 'pedido_id', 'producto_id', 'cantidad', 'precio_unitario', 'subtotal', 'producto__nombre'
+    )
     serializer_class = DetallePedidoSerializer
+    pagination_class = DetallePedidoPagination
     # Solo empleados y administradores pueden ver los detalles de todos los pedidos
     permission_classes = [IsEmpleadoUser]
+    filter_backends = [FiltrosBackend]
+    filtros = DetallePedidoFiltros
+    # Las fechas y el estado son los del pedido
+    columnas_exportacion = [
+        ('id', 'id'), ('pedido_id', 'pedido_id'), ('fecha_pedido', 'pedido__fecha_pedido'),
+        ('producto_id', 'producto_id'), ('producto', 'producto__nombre'), ('cantidad', 'cantidad'),
+        ('precio_unitario', 'precio_unitario'), ('subtotal', 'subtotal'),
+    ]
 
-class DevolucionViewSet(viewsets.ModelViewSet):
-    queryset = Devolucion.objects.all().order_by('-fecha_devolucion')
+class DevolucionViewSet(MetricasMixin, CamposMixin, ExportacionMixin, LecturaRapidaMixin, CambiosMixin, viewsets.ModelViewSet):
+    queryset = Devolucion.objects.select_related('producto').only(
+        'id', 'pedido_id', 'producto_id', 'cantidad', 'fecha_devolucion', 'motivo', 'estado', 'importe',
+        'producto__nombre'
+    ).order_by('-fecha_devolucion')
     serializer_class = DevolucionSerializer
+    pagination_class = DevolucionPagination
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [FiltrosBackend]
+    filtros = DevolucionFiltros
+    columnas_exportacion = [
+        ('id', 'id'), ('pedido_id', 'pedido_id'), ('producto_id', 'producto_id'),
+        ('producto', 'producto__nombre'), ('cantidad', 'cantidad'), ('fecha_devolucion', 'fecha_devolucion'),
+        ('motivo', 'motivo'), ('estado', 'estado'), ('importe', 'importe'),
+    ]
+
+    def get_permissions(self):
+        """
+        Asigna permisos basados en la acción.
+        - Cualquiera logueado puede solicitar devoluciones y ver (o exportar)
+          las de sus pedidos.
+        - Solo empleados y administradores pueden editarlas (aprobarlas o
+          rechazarlas) o borrarlas.
+        """
+        if self.action in ['update', 'partial_update', 'destroy']:
+            self.permission_classes = [IsEmpleadoUser]
+        return super().get_permissions()
+
+    def get_queryset(self):
+        """
+        Los clientes solo ven las devoluciones de sus propios pedidos; los
+        empleados y administradores, todas.
+        """
+        usuario = self.request.user
+        if usuario.rol in ['administrador', 'empleado']:
+            return self.queryset.all()
+        return self.queryset.filter(pedido__in=pedidos_visibles(usuario).values('id'))
+
+    def perform_create(self, serializer):
+        usuario = self.request.user
+        if usuario.rol in ['administrador', 'empleado']:
+            serializer.save()
+            return
+        # Un cliente solo pide devoluciones de sus pedidos, y siempre quedan
+        # 'solicitada': aprobarlas (y reponer el stock) es cosa de un empleado
+        pedido = serializer.validated_data['pedido']
+        if not pedidos_visibles(usuario).filter(id=pedido.id).exists():
+            raise ValidationError({'pedido': ['El pedido no existe.']})
+        serializer.save(estado='solicitada')
+
+class MetricasView(APIView):
+    """
+    Métricas de las peticiones (duración, SQL y serialización por vista y
+    acción) en el formato de Prometheus. Solo administradores.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(exposicion(), content_type=CONTENT_TYPE_METRICAS)
+
+class TicketDeEventosView(APIView):
+    """
+    Ticket de un solo uso para abrir api/async/eventos/?ticket= desde el
+    navegador sin poner el token de acceso en la URL (ver
+    quicknotes/authentication.py). Caduca en EVENTOS_TICKET_TTL segundos.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
-    # Aquí también podrías añadir lógica en get_queryset para que los clientes
-    # solo vean sus propias devoluciones
-class MyTokenObtainPairView(TokenObtainPairView):
+    def post(self, request):
+        ticket = TicketDeEventos.para(request.user.id)
+        return Response({'ticket': str(ticket), 'caduca_en': settings.EVENTOS_TICKET_TTL})
+
+class MyTokenObtainPairView(LimitesMixin, TokenObtainPairView):
     """
     Vista de obtención de token personalizada que utiliza nuestro serializador con mensajes en español.
     """
-    serializer_class = MyTokenObtainPairSerializer
\ No newline at end of file
+    serializer_class = MyTokenObtainPairSerializer
+    # Intentos por cuenta desde cada IP, intentos por IP en todas las cuentas
+    # (holgado: detrás de un NAT muchos comparten IP), y logins a la vez para
+    # no acaparar los núcleos
+    limites = {
+        'post': Limite(por_usuario={'anonimo': '20/min'}, por_ip={'anonimo': '60/min'},
+                       concurrentes=settings.LIMITE_LOGINS_CONCURRENTES),
+    }
+
+    def identidad_limites(self, request):
+        # El cubo de la cuenta es por IP: los intentos fallidos desde otra IP
+        # no bloquean al dueño de la cuenta
+        return f"login:{str(request.data.get('username', '')).strip().lower()}:{ip_de(request)}"
+
+class MyTokenRefreshView(TokenRefreshView):
+    """
+    Renueva el token de acceso con el rol y el cliente actuales del usuario.
+    """
+    serializer_class = MyTokenRefreshSerializer
@@ -4,7 +4,7 @@
 import { useState, useEffect, FormEvent } from 'react';
 import { useRouter } from 'next/navigation';
 // --- ¡PASO 1: Importar la configuración centralizada! ---
-import { apiUrls, getAuthHeaders } from '@/lib/api';
+import { apiUrls, getAuthHeaders, leerListado } from '@/lib/api';
 
 interface Cliente {
   id: number;
@@ -57,7 +57,7 @@ export default function ClientesPage() {
         throw new Error('Error al listar los clientes.');
       }
 
-      const data: Cliente[] = await res.json();
+      const data = await leerListado<Cliente>(res, { headers });
       setClientes(data);
     } catch (err: any) {
       setError(err.message);
@@ -2,7 +2,7 @@
 
 import { useState, useEffect, FormEvent } from 'react';
 import { useRouter } from 'next/navigation';
-import { apiUrls, getAuthHeaders } from '@/lib/api';
+import { apiUrls, getAuthHeaders, leerListado, leerPrimeraPagina } from '@/lib/api';
 
 // Interfaces
 interface Detalle {
@@ -59,9 +59,11 @@ export default function DetallesPedidosPage() {
         if (!resPedidos.ok) throw new Error(`Error al cargar pedidos: ${resPedidos.statusText}`);
         if (!resProductos.ok) throw new Error(`Error al cargar productos: ${resProductos.statusText}`);
         
-        const dataDetalles = await resDetalles.json();
-        const dataPedidos = await resPedidos.json();
-        const dataProductos = await resProductos.json();
+        // Las últimas líneas, y todos los pedidos y productos para el formulario
+        const init = { headers: headers ?? undefined };
+        const dataDetalles = await leerPrimeraPagina<Detalle>(resDetalles);
+        const dataPedidos = await leerListado<Pedido>(resPedidos, init);
+        const dataProductos = await leerListado<Producto>(resProductos, init);
 
         setDetalles(dataDetalles);
         setPedidos(dataPedidos);
@@ -2,7 +2,7 @@
 
 import { useState, useEffect, FormEvent } from 'react';
 import { useRouter } from 'next/navigation';
-import { apiUrls, getAuthHeaders } from '@/lib/api'; // Importamos nuestros helpers de API
+import { apiUrls, getAuthHeaders, leerListado, leerPrimeraPagina, suscribirEventos } from '@/lib/api'; // Importamos nuestros helpers de API
 
 // Definimos las interfaces para los datos que manejaremos
 interface Producto {
@@ -68,9 +68,10 @@ export default function PedidosPage() {
       }
 
       // Parseamos los datos
-      const dataPedidos: Pedido[] = await resPedidos.json();
-      const dataProductos: Producto[] = await resProductos.json();
-      const dataClientes: Cliente[] = await resClientes.json();
+      // Los pedidos más recientes, y todos los productos y clientes para el formulario
+      const dataPedidos = await leerPrimeraPagina<Pedido>(resPedidos);
+      const dataProductos = await leerListado<Producto>(resProductos, { headers });
+      const dataClientes = await leerListado<Cliente>(resClientes, { headers });
       
       setPedidos(dataPedidos);
       setProductos(dataProductos);
@@ -87,6 +88,18 @@ export default function PedidosPage() {
     cargarDatos();
   }, []);
 
+  // Stock y estados al día sin volver a pedir los listados
+  useEffect(() => {
+    const cerrar = suscribirEventos({
+      onStock: ({ id, stock }) =>
+        setProductos(prev => prev.map(p => (p.id === id ? { ...p, stock } : p))),
+      onPedido: ({ id, estado }) =>
+        setPedidos(prev => prev.map(p => (p.id === id ? { ...p, estado } : p))),
+      onDesbordado: cargarDatos,
+    });
+    return () => cerrar?.();
+  }, []);
+
   // Manejador para cambiar la cantidad de un producto en el pedido
   const handleCantidadChange = (productoId: number, cantidad: number) => {
     setProductosSeleccionados(prev => {
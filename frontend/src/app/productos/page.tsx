@@ -3,6 +3,7 @@
 'use client';
 
 import { useState, useEffect, FormEvent } from 'react';
+import { suscribirEventos } from '@/lib/api';
 
 interface Producto {
   id: number;
@@ -31,12 +32,13 @@ export default function ProductosPage() {
   const fetchProductos = async () => {
     try {
       setLoading(true);
-      const response = await fetch('http://localhost:8000/api/productos/');
+      const response = await fetch('http://localhost:8000/api/productos/?expand=descripcion');
       if (!response.ok) {
         throw new Error(`Error al obtener los productos. Estado: ${response.status}`);
       }
-      const data: Producto[] = await response.json();
-      setProductos(data);
+      // La API pagina por cursor: los productos vienen en 'results'
+      const data: { results: Producto[] } = await response.json();
+      setProductos(data.results);
     } catch (err: any) {
       setListError(err.message);
     } finally {
@@ -49,6 +51,16 @@ export default function ProductosPage() {
     fetchProductos();
   }, []);
 
+  // Stock al día sin volver a pedir el listado (con sesión iniciada)
+  useEffect(() => {
+    const cerrar = suscribirEventos({
+      onStock: ({ id, stock }) =>
+        setProductos(prev => prev.map(p => (p.id === id ? { ...p, stock } : p))),
+      onDesbordado: fetchProductos,
+    });
+    return () => cerrar?.();
+  }, []);
+
   // --- NUEVO: Función para manejar el envío del formulario ---
   const handleSubmit = async (event: FormEvent<HTMLFormElement>) => {
     event.preventDefault(); // Prevenir que la página se recargue
@@ -31,7 +31,7 @@ export default function ProductosPage() {
         // Hacemos la llamada GET al endpoint de productos de nuestra API de Django.
         // La URL debe coincidir con la que configuraste en docker-compose.yml (NEXT_PUBLIC_API_URL).
         // En este caso, asumimos que es http://localhost:8000/api
-        const response = await fetch('http://localhost:8000/api/productos/');
+        const response = await fetch('http://localhost:8000/api/productos/?expand=descripcion');
 
         // Si la respuesta no es exitosa (ej. error 500, 404), lanzamos un error.
         if (!response.ok) {
@@ -39,10 +39,11 @@ export default function ProductosPage() {
         }
 
         // Convertimos la respuesta del API de JSON a un objeto de JavaScript.
-        const data: Producto[] = await response.json();
+        // La API pagina por cursor: los productos vienen en 'results'
+        const data: { results: Producto[] } = await response.json();
         
         // Actualizamos nuestro estado con los datos recibidos.
-        setProductos(data);
+        setProductos(data.results);
       } catch (err: any) {
         // Si ocurre cualquier error (de red, de parseo, etc.), lo guardamos en el estado de error.
         setError(err.message);
@@ -27,4 +27,98 @@ export const getAuthHeaders = () => {
     'Authorization': `Bearer ${token}`,
     'Content-Type': 'application/json',
   };
-};
\ No newline at end of file
+};
+
+// Los listados de Django vienen paginados: { next, previous, results }.
+// Lee la respuesta de un listado y sigue 'next' hasta juntar todos los
+// registros (las rutas de /api de Next devuelven directamente un array).
+export async function leerListado<T>(res: Response, init?: RequestInit): Promise<T[]> {
+  let data = await res.json();
+  if (Array.isArray(data)) {
+    return data;
+  }
+  const registros: T[] = [...data.results];
+  while (data.next) {
+    const siguiente = await fetch(data.next, init);
+    if (!siguiente.ok) {
+      throw new Error(`Error al cargar la página siguiente. Estado: ${siguiente.status}`);
+    }
+    data = await siguiente.json();
+    registros.push(...data.results);
+  }
+  return registros;
+}
+
+// Solo la primera página de un listado (p. ej. los pedidos más recientes).
+export async function leerPrimeraPagina<T>(res: Response): Promise<T[]> {
+  const data = await res.json();
+  return Array.isArray(data) ? data : data.results;
+}
+
+// Avisos en tiempo real del backend (Server-Sent Events). Va directo al
+// worker ASGI de Django: el proxy de /api espera la respuesta entera.
+const EVENTOS_URL = process.env.NEXT_PUBLIC_EVENTOS_URL || 'http://localhost:8000/api/async/eventos/';
+
+export interface AvisoStock {
+  id: number;
+  stock: number;
+}
+export interface AvisoPedido {
+  id: number;
+  cliente_id: number;
+  estado: string;
+}
+
+// Se suscribe a los cambios de stock y de estado de los pedidos. 'onDesbordado'
+// se llama si el navegador se quedó atrás: hay que volver a pedir los listados.
+// Devuelve la función que cierra la suscripción (o null sin sesión).
+export const suscribirEventos = (handlers: {
+  onStock?: (aviso: AvisoStock) => void;
+  onPedido?: (aviso: AvisoPedido) => void;
+  onDesbordado?: () => void;
+}) => {
+  if (!getAuthHeaders()) {
+    return null;
+  }
+  let fuente: EventSource | null = null;
+  let reintento: ReturnType<typeof setTimeout> | undefined;
+  let cerrada = false;
+
+  // EventSource no permite cabeceras, y el token de acceso en la URL acabaría
+  // en los logs: se abre con un ticket de un solo uso que se pide con el token.
+  // Al reconectar, el navegador repetiría el ticket ya usado, así que cada
+  // reconexión pide uno nuevo.
+  const abrir = async () => {
+    const headers = getAuthHeaders();
+    if (cerrada || !headers) {
+      return;
+    }
+    const res = await fetch(`${EVENTOS_URL}ticket/`, { method: 'POST', headers }).catch(() => null);
+    if (cerrada || res?.status === 401) {
+      // Sin sesión válida no hay avisos
+      return;
+    }
+    if (!res?.ok) {
+      reintento = setTimeout(abrir, 3000);
+      return;
+    }
+    const { ticket } = await res.json();
+    fuente = new EventSource(`${EVENTOS_URL}?ticket=${encodeURIComponent(ticket)}`);
+    fuente.addEventListener('stock', (e) => handlers.onStock?.(JSON.parse((e as MessageEvent).data)));
+    fuente.addEventListener('pedido', (e) => handlers.onPedido?.(JSON.parse((e as MessageEvent).data)));
+    fuente.addEventListener('desbordado', () => handlers.onDesbordado?.());
+    fuente.onerror = () => {
+      fuente?.close();
+      if (!cerrada) {
+        reintento = setTimeout(abrir, 3000);
+      }
+    };
+  };
+  abrir();
+
+  return () => {
+    cerrada = true;
+    clearTimeout(reintento);
+    fuente?.close();
+  };
+};
@@ -2,16 +2,83 @@ CREATE DATABASE ecommerce_bd_dev;
 CREATE USER ecommerce_user WITH PASSWORD 'mi_password_seguro';
 GRANT ALL PRIVILEGES ON DATABASE ecommerce_bd_dev TO ecommerce_user;
 
+DROP TRIGGER IF EXISTS registrar_cambios_baja ON productos;
+DROP TRIGGER IF EXISTS registrar_cambios_cambio ON productos;
+DROP TRIGGER IF EXISTS registrar_cambios_alta ON productos;
+DROP TRIGGER IF EXISTS registrar_cambios_baja ON pedidos;
+DROP TRIGGER IF EXISTS registrar_cambios_cambio ON pedidos;
+DROP TRIGGER IF EXISTS registrar_cambios_alta ON pedidos;
+DROP TRIGGER IF EXISTS registrar_cambios_baja ON detalle_pedidos;
+DROP TRIGGER IF EXISTS registrar_cambios_cambio ON detalle_pedidos;
+DROP TRIGGER IF EXISTS registrar_cambios_alta ON detalle_pedidos;
+DROP TRIGGER IF EXISTS registrar_cambios_baja ON devoluciones;
+DROP TRIGGER IF EXISTS registrar_cambios_cambio ON devoluciones;
+DROP TRIGGER IF EXISTS registrar_cambios_alta ON devoluciones;
+DROP FUNCTION IF EXISTS fn_registrar_cambios();
+DROP TABLE IF EXISTS cambios;
+DROP TRIGGER IF EXISTS encolar_devoluciones_cambio ON devoluciones;
+DROP TRIGGER IF EXISTS encolar_devoluciones_alta ON devoluciones;
+DROP FUNCTION IF EXISTS fn_encolar_devoluciones_aprobadas();
+DROP FUNCTION IF EXISTS procesar_devoluciones(BIGINT[]);
+DROP TABLE IF EXISTS tareas;
+DROP FUNCTION IF EXISTS archivar_particiones_pedidos(DATE);
+DROP FUNCTION IF EXISTS crear_particiones_pedidos(DATE);
+DROP FUNCTION IF EXISTS fin_de_particion(REGCLASS);
+DROP TRIGGER IF EXISTS fecha_del_pedido ON devoluciones;
+DROP TRIGGER IF EXISTS fecha_del_pedido ON detalle_pedidos;
+DROP TABLE IF EXISTS devoluciones_por_asignar;
+DROP TABLE IF EXISTS detalle_pedidos_por_asignar;
+DROP FUNCTION IF EXISTS fn_asignar_fecha_pedido();
+DROP FUNCTION IF EXISTS fn_fecha_del_pedido();
+DROP TRIGGER IF EXISTS ventas_devoluciones_baja ON devoluciones;
+DROP TRIGGER IF EXISTS ventas_devoluciones_cambio ON devoluciones;
+DROP TRIGGER IF EXISTS ventas_devoluciones_alta ON devoluciones;
+DROP TRIGGER IF EXISTS valorar_devolucion ON devoluciones;
+DROP TRIGGER IF EXISTS ventas_lineas_baja ON detalle_pedidos;
+DROP TRIGGER IF EXISTS ventas_lineas_cambio ON detalle_pedidos;
+DROP TRIGGER IF EXISTS ventas_lineas_alta ON detalle_pedidos;
+DROP TRIGGER IF EXISTS ventas_pedidos_baja ON pedidos;
+DROP TRIGGER IF EXISTS ventas_pedidos_cambio ON pedidos;
+DROP TRIGGER IF EXISTS ventas_pedidos_alta ON pedidos;
+DROP FUNCTION IF EXISTS ventas_totales(DATE, DATE);
+DROP FUNCTION IF EXISTS reconstruir_ventas(DATE, DATE);
+DROP FUNCTION IF EXISTS fn_valorar_devolucion();
+DROP FUNCTION IF EXISTS fn_ventas_por_devoluciones();
+DROP FUNCTION IF EXISTS fn_ventas_por_lineas();
+DROP FUNCTION IF EXISTS fn_ventas_al_borrar_pedidos();
+DROP FUNCTION IF EXISTS fn_ventas_por_pedidos();
+DROP FUNCTION IF EXISTS acumular_ventas(venta_delta[]);
+DROP TYPE IF EXISTS venta_delta;
+DROP FUNCTION IF EXISTS importe_devolucion(BIGINT, BIGINT, INTEGER);
+DROP FUNCTION IF EXISTS dia_venta(TIMESTAMPTZ);
+DROP FUNCTION IF EXISTS fecha_de_pedido(BIGINT, TIMESTAMPTZ);
+DROP TRIGGER IF EXISTS version_producto ON productos;
+DROP FUNCTION IF EXISTS fn_version_producto();
+DROP TRIGGER IF EXISTS busqueda_producto ON productos;
+DROP FUNCTION IF EXISTS fn_busqueda_producto();
+DROP FUNCTION IF EXISTS producto_busqueda(TEXT, TEXT);
 DROP TRIGGER IF EXISTS actualizar_stock ON detalle_pedidos;
 DROP FUNCTION IF EXISTS fn_actualizar_stock_al_vender();
+DROP TRIGGER IF EXISTS repartir_cupos_cambio ON productos;
+DROP TRIGGER IF EXISTS repartir_cupos_alta ON productos;
+DROP FUNCTION IF EXISTS fn_repartir_cupos_al_cambiar_stock();
+DROP FUNCTION IF EXISTS liquidar_reservas(INTEGER);
+DROP FUNCTION IF EXISTS reservar_stock(BIGINT, INTEGER);
+DROP FUNCTION IF EXISTS repartir_cupos(BIGINT[]);
 DROP PROCEDURE IF EXISTS registrar_pedido(INTEGER, VARCHAR, INTEGER[], INTEGER[], DECIMAL[]);
 
+DROP TABLE IF EXISTS ventas_cliente_diarias;
+DROP TABLE IF EXISTS ventas_producto_diarias;
+DROP TABLE IF EXISTS ventas_diarias;
+DROP TABLE IF EXISTS reservas_stock;
+DROP TABLE IF EXISTS stock_cupos;
 DROP TABLE IF EXISTS devoluciones;
 DROP TABLE IF EXISTS detalle_pedidos;
 DROP TABLE IF EXISTS pedidos;
 DROP TABLE IF EXISTS productos;
 DROP TABLE IF EXISTS clientes;
 DROP TABLE IF EXISTS usuarios;
+DROP SCHEMA IF EXISTS archivo CASCADE;
 
 CREATE TABLE usuarios (
     id SERIAL PRIMARY KEY,
@@ -22,6 +89,10 @@ CREATE TABLE usuarios (
     fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Login sin distinguir mayúsculas por username o email (EmailBackend)
+CREATE INDEX usuarios_username_lower_idx ON usuarios (lower(username));
+CREATE INDEX usuarios_email_lower_idx ON usuarios (lower(email));
+
 CREATE TABLE clientes (
     id SERIAL PRIMARY KEY,
     usuario_id INTEGER UNIQUE REFERENCES usuarios(id) ON DELETE CASCADE,
@@ -34,40 +105,165 @@ CREATE TABLE clientes (
 
 CREATE TABLE productos (
     id SERIAL PRIMARY KEY,
+    sku VARCHAR(64) UNIQUE,
     nombre VARCHAR(150) NOT NULL,
     descripcion TEXT,
     precio DECIMAL(10, 2) NOT NULL CHECK (precio >= 0),
     stock INTEGER NOT NULL CHECK (stock >= 0),
     fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    activo BOOLEAN DEFAULT TRUE
+    activo BOOLEAN DEFAULT TRUE,
+    -- Concurrencia optimista: la incrementa el trigger version_producto
+    version INTEGER NOT NULL DEFAULT 1,
+    busqueda TSVECTOR
 );
 
+-- Búsqueda de productos: tsvector calculado por trigger y trigramas del nombre
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX productos_busqueda_idx ON productos USING gin (busqueda);
+CREATE INDEX productos_nombre_trgm_idx ON productos USING gin (nombre gin_trgm_ops);
+
+-- pedidos, detalle_pedidos y devoluciones se particionan por meses de la
+-- fecha del pedido (ver quicknotes/particiones.py). Las líneas y las
+-- devoluciones llevan copiada la fecha de su pedido; las que llegan sin ella
+-- pasan por la partición "<tabla>_por_asignar" (ver fn_asignar_fecha_pedido).
 CREATE TABLE pedidos (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     cliente_id INTEGER REFERENCES clientes(id) ON DELETE SET NULL,
-    fecha_pedido TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_pedido TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
     estado VARCHAR(50) NOT NULL DEFAULT 'pendiente',
-    total DECIMAL(10, 2) NOT NULL CHECK (total >= 0)
-);
+    total DECIMAL(10, 2) NOT NULL CHECK (total >= 0),
+    PRIMARY KEY (id, fecha_pedido)
+) PARTITION BY RANGE (fecha_pedido);
+-- Filtros y ordenamientos de los listados (quicknotes/filtros.py)
+CREATE INDEX pedidos_pendientes_idx ON pedidos (fecha_pedido DESC, id DESC) WHERE estado = 'pendiente';
+CREATE INDEX pedidos_total_id_idx ON pedidos (total, id);
 
 CREATE TABLE detalle_pedidos (
-    id SERIAL PRIMARY KEY,
-    pedido_id INTEGER REFERENCES pedidos(id) ON DELETE CASCADE,
+    id SERIAL,
+    pedido_id INTEGER NOT NULL,
+    fecha_pedido TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
     producto_id INTEGER REFERENCES productos(id) ON DELETE RESTRICT,
     cantidad INTEGER NOT NULL CHECK (cantidad > 0),
     precio_unitario DECIMAL(10, 2) NOT NULL CHECK (precio_unitario >= 0),
-    subtotal DECIMAL(10, 2) NOT NULL CHECK (subtotal >= 0)
-);
+    subtotal DECIMAL(10, 2) NOT NULL CHECK (subtotal >= 0),
+    PRIMARY KEY (id, fecha_pedido),
+    FOREIGN KEY (pedido_id, fecha_pedido) REFERENCES pedidos(id, fecha_pedido)
+        ON DELETE CASCADE ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED
+) PARTITION BY RANGE (fecha_pedido);
+CREATE INDEX detalle_pedidos_pedido_idx ON detalle_pedidos (pedido_id);
+CREATE INDEX detalle_producto_id_idx ON detalle_pedidos (producto_id, id DESC);
 
 CREATE TABLE devoluciones (
-    id SERIAL PRIMARY KEY,
-    pedido_id INTEGER REFERENCES pedidos(id) ON DELETE CASCADE,
+    id SERIAL,
+    pedido_id INTEGER NOT NULL,
+    fecha_pedido TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
     producto_id INTEGER REFERENCES productos(id) ON DELETE RESTRICT,
     cantidad INTEGER NOT NULL CHECK (cantidad > 0),
-    fecha_devolucion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_devolucion TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
     motivo TEXT,
-    estado VARCHAR(50) NOT NULL DEFAULT 'solicitada'
+    estado VARCHAR(50) NOT NULL DEFAULT 'solicitada',
+    importe DECIMAL(10, 2),
+    fecha_reposicion TIMESTAMPTZ,
+    PRIMARY KEY (id, fecha_pedido),
+    FOREIGN KEY (pedido_id, fecha_pedido) REFERENCES pedidos(id, fecha_pedido)
+        ON DELETE CASCADE ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED
+) PARTITION BY RANGE (fecha_pedido);
+CREATE INDEX devoluciones_pedido_idx ON devoluciones (pedido_id);
+CREATE INDEX devoluciones_solicitadas_idx ON devoluciones (fecha_devolucion DESC, id DESC) WHERE estado = 'solicitada';
+CREATE INDEX devoluciones_prod_fecha_idx ON devoluciones (producto_id, fecha_devolucion DESC, id DESC);
+
+-- Todo lo anterior al mes en curso; los meses siguientes los crea
+-- crear_particiones_pedidos (más abajo)
+CREATE TABLE pedidos_historico PARTITION OF pedidos
+    FOR VALUES FROM (MINVALUE) TO (date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') AT TIME ZONE 'UTC');
+CREATE TABLE detalle_pedidos_historico PARTITION OF detalle_pedidos
+    FOR VALUES FROM ('0001-01-01 00:00:00+00') TO (date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') AT TIME ZONE 'UTC');
+CREATE TABLE devoluciones_historico PARTITION OF devoluciones
+    FOR VALUES FROM ('0001-01-01 00:00:00+00') TO (date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') AT TIME ZONE 'UTC');
+CREATE TABLE detalle_pedidos_por_asignar PARTITION OF detalle_pedidos FOR VALUES FROM (MINVALUE) TO ('0001-01-01 00:00:00+00');
+CREATE TABLE devoluciones_por_asignar PARTITION OF devoluciones FOR VALUES FROM (MINVALUE) TO ('0001-01-01 00:00:00+00');
+
+CREATE TABLE stock_cupos (
+    id SERIAL PRIMARY KEY,
+    producto_id INTEGER NOT NULL REFERENCES productos(id) ON DELETE CASCADE,
+    disponible INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX stock_cupos_producto_idx ON stock_cupos (producto_id);
+
+CREATE TABLE reservas_stock (
+    id SERIAL PRIMARY KEY,
+    producto_id INTEGER NOT NULL REFERENCES productos(id) ON DELETE RESTRICT,
+    -- Sin clave foránea: pedidos está particionada y la reserva no lleva la fecha
+    pedido_id INTEGER,
+    cantidad INTEGER NOT NULL,
+    fecha_reserva TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_liquidacion TIMESTAMP
+);
+CREATE INDEX reservas_pendientes_idx ON reservas_stock (id) WHERE fecha_liquidacion IS NULL;
+CREATE INDEX reservas_pendientes_prod_idx ON reservas_stock (producto_id, id) WHERE fecha_liquidacion IS NULL;
+
+CREATE TABLE ventas_diarias (
+    id SERIAL PRIMARY KEY,
+    dia DATE NOT NULL,
+    fragmento SMALLINT NOT NULL DEFAULT 0,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    unidades INTEGER NOT NULL DEFAULT 0,
+    importe DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    unidades_devueltas INTEGER NOT NULL DEFAULT 0,
+    importe_devuelto DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    CONSTRAINT ventas_diarias_dia_fragmento_uniq UNIQUE (dia, fragmento)
+);
+
+CREATE TABLE ventas_producto_diarias (
+    id SERIAL PRIMARY KEY,
+    dia DATE NOT NULL,
+    producto_id INTEGER NOT NULL,
+    fragmento SMALLINT NOT NULL DEFAULT 0,
+    unidades INTEGER NOT NULL DEFAULT 0,
+    importe DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    unidades_devueltas INTEGER NOT NULL DEFAULT 0,
+    importe_devuelto DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    CONSTRAINT ventas_producto_dia_fragmento_uniq UNIQUE (dia, producto_id, fragmento)
+);
+
+CREATE TABLE ventas_cliente_diarias (
+    id SERIAL PRIMARY KEY,
+    dia DATE NOT NULL,
+    cliente_id INTEGER,
+    fragmento SMALLINT NOT NULL DEFAULT 0,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    unidades INTEGER NOT NULL DEFAULT 0,
+    importe DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    unidades_devueltas INTEGER NOT NULL DEFAULT 0,
+    importe_devuelto DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    CONSTRAINT ventas_cliente_dia_fragmento_uniq UNIQUE NULLS NOT DISTINCT (dia, cliente_id, fragmento)
+);
+
+-- Cola de tareas en segundo plano (manage.py procesar_tareas)
+CREATE TABLE tareas (
+    id SERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    clave VARCHAR(200) UNIQUE,
+    datos JSONB NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    max_intentos INTEGER NOT NULL DEFAULT 5,
+    disponible_desde TIMESTAMPTZ NOT NULL DEFAULT STATEMENT_TIMESTAMP(),
+    error TEXT,
+    fecha_creacion TIMESTAMPTZ NOT NULL DEFAULT STATEMENT_TIMESTAMP()
 );
+CREATE INDEX tareas_pendientes_idx ON tareas (tipo, disponible_desde, id) WHERE estado = 'pendiente';
+
+-- Registro de cambios para la sincronización incremental (quicknotes/cambios.py)
+CREATE TABLE cambios (
+    id BIGSERIAL PRIMARY KEY,
+    transaccion BIGINT NOT NULL,
+    tabla VARCHAR(30) NOT NULL,
+    registro_id BIGINT NOT NULL,
+    fecha TIMESTAMPTZ NOT NULL DEFAULT STATEMENT_TIMESTAMP()
+);
+CREATE INDEX cambios_tabla_txid_idx ON cambios (tabla, transaccion, id);
+CREATE INDEX cambios_fecha_brin ON cambios USING brin (fecha);
 
 CREATE ROLE administrador WITH LOGIN SUPERUSER PASSWORD 'tu_password_admin_superfuerte';
 
@@ -87,6 +283,7 @@ GRANT USAGE ON SCHEMA public TO clientes_rol;
 
 GRANT SELECT ON TABLE productos, pedidos, detalle_pedidos, devoluciones TO clientes_rol;
 
+-- Las líneas llevan la fecha del pedido: van directamente a su partición
 CREATE OR REPLACE PROCEDURE registrar_pedido(
     p_cliente_id INTEGER,
     p_estado VARCHAR(50),
@@ -97,49 +294,980 @@ CREATE OR REPLACE PROCEDURE registrar_pedido(
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    v_pedido_id INTEGER;
-    v_total_pedido DECIMAL(10, 2) := 0;
-    i INTEGER;
-    v_subtotal DECIMAL(10, 2);
+    v_pedido_id BIGINT;
+    v_fecha TIMESTAMPTZ := CURRENT_TIMESTAMP;
 BEGIN
-    INSERT INTO pedidos (cliente_id, estado, total)
-    VALUES (p_cliente_id, p_estado, 0)
+    -- El total se calcula de una vez sobre todas las líneas
+    INSERT INTO pedidos (cliente_id, estado, total, fecha_pedido)
+    SELECT p_cliente_id, p_estado, COALESCE(SUM(l.cantidad * l.precio_unitario), 0), v_fecha
+    FROM unnest(p_cantidades, p_precios_unitarios) AS l(cantidad, precio_unitario)
     RETURNING id INTO v_pedido_id;
 
-    FOR i IN 1 .. array_length(p_productos_ids, 1) LOOP
-        v_subtotal := p_cantidades[i] * p_precios_unitarios[i];
-        INSERT INTO detalle_pedidos (pedido_id, producto_id, cantidad, precio_unitario, subtotal)
-        VALUES (v_pedido_id, p_productos_ids[i], p_cantidades[i], p_precios_unitarios[i], v_subtotal);
+    -- Todas las líneas en un solo INSERT. El stock lo descuenta el trigger
+    -- actualizar_stock, una sola vez por producto.
+    INSERT INTO detalle_pedidos (pedido_id, fecha_pedido, producto_id, cantidad, precio_unitario, subtotal)
+    SELECT v_pedido_id, v_fecha, l.producto_id, l.cantidad, l.precio_unitario, l.cantidad * l.precio_unitario
+    FROM unnest(p_productos_ids, p_cantidades, p_precios_unitarios) AS l(producto_id, cantidad, precio_unitario);
+END;
+$$;
+CREATE OR REPLACE FUNCTION repartir_cupos(p_productos_ids BIGINT[])
+RETURNS VOID AS $$
+BEGIN
+    PERFORM set_config('quicknotes.liquidando', 'on', true);
+
+    -- Siempre se bloquean primero los productos, en orden de id
+    PERFORM 1 FROM productos WHERE id = ANY(p_productos_ids) ORDER BY id FOR UPDATE;
+
+    -- Espera a que terminen los checkouts que estén usando estos cupos
+    DELETE FROM stock_cupos WHERE producto_id = ANY(p_productos_ids);
+
+    -- Lo reservado y aún no liquidado se descuenta antes de repartir el stock
+    WITH pendientes AS (
+        UPDATE reservas_stock
+        SET fecha_liquidacion = CURRENT_TIMESTAMP
+        WHERE producto_id = ANY(p_productos_ids) AND fecha_liquidacion IS NULL
+        RETURNING producto_id, cantidad
+    )
+    UPDATE productos p
+    SET stock = p.stock - r.cantidad
+    FROM (SELECT producto_id, SUM(cantidad) AS cantidad FROM pendientes GROUP BY producto_id) r
+    WHERE p.id = r.producto_id;
+
+    INSERT INTO stock_cupos (producto_id, disponible)
+    SELECT p.id,
+           GREATEST(p.stock, 0) / 8
+           + CASE WHEN g <= GREATEST(p.stock, 0) % 8 THEN 1 ELSE 0 END
+    FROM productos p
+    CROSS JOIN generate_series(1, 8) AS g
+    WHERE p.id = ANY(p_productos_ids);
+
+    PERFORM set_config('quicknotes.liquidando', 'off', true);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reservar_stock(p_producto_id BIGINT, p_cantidad INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_cupo BIGINT;
+    v_total INTEGER;
+    v_cupos INTEGER;
+    v_resta INTEGER := p_cantidad;
+    v_tomado INTEGER;
+    c RECORD;
+BEGIN
+    FOR intento IN 1..3 LOOP
+        -- Camino rápido: cualquier cupo con saldo suficiente que nadie tenga bloqueado
+        UPDATE stock_cupos
+        SET disponible = disponible - p_cantidad
+        WHERE id = (
+            SELECT id FROM stock_cupos
+            WHERE producto_id = p_producto_id AND disponible >= p_cantidad
+            ORDER BY random()
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id INTO v_cupo;
+
+        IF v_cupo IS NOT NULL THEN
+            RETURN;
+        END IF;
+
+        -- Camino lento (poco stock o todos los cupos ocupados): se bloquean
+        -- todos los cupos del producto en orden de id y se toma de varios
+        SELECT COALESCE(SUM(disponible), 0), COUNT(*) INTO v_total, v_cupos
+        FROM (
+            SELECT disponible FROM stock_cupos
+            WHERE producto_id = p_producto_id
+            ORDER BY id
+            FOR UPDATE
+        ) bloqueados;
 
-        v_total_pedido := v_total_pedido + v_subtotal;
+        -- Sin cupos: repartir_cupos los está recreando, se vuelve a intentar
+        CONTINUE WHEN v_cupos = 0;
 
-        UPDATE productos
-        SET stock = stock - p_cantidades[i]
-        WHERE id = p_productos_ids[i];
+        IF v_total < p_cantidad THEN
+            RAISE EXCEPTION 'Stock insuficiente para el producto %', p_producto_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+
+        FOR c IN
+            SELECT id, disponible FROM stock_cupos
+            WHERE producto_id = p_producto_id AND disponible > 0
+            ORDER BY id
+        LOOP
+            v_tomado := LEAST(c.disponible, v_resta);
+            UPDATE stock_cupos SET disponible = disponible - v_tomado WHERE id = c.id;
+            v_resta := v_resta - v_tomado;
+            EXIT WHEN v_resta = 0;
+        END LOOP;
+        RETURN;
     END LOOP;
 
-    UPDATE pedidos
-    SET total = v_total_pedido
-    WHERE id = v_pedido_id;
+    RAISE EXCEPTION 'Stock insuficiente para el producto %', p_producto_id
+        USING ERRCODE = 'check_violation';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION liquidar_reservas(p_limite INTEGER DEFAULT 10000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_productos BIGINT[];
+    v_ids BIGINT[];
+BEGIN
+    PERFORM set_config('quicknotes.liquidando', 'on', true);
+
+    SELECT array_agg(DISTINCT producto_id) INTO v_productos
+    FROM (
+        SELECT producto_id FROM reservas_stock
+        WHERE fecha_liquidacion IS NULL
+        ORDER BY id
+        LIMIT p_limite
+    ) candidatas;
+
+    IF v_productos IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Mismo orden de bloqueo que repartir_cupos: productos primero, por id
+    PERFORM 1 FROM productos WHERE id = ANY(v_productos) ORDER BY id FOR UPDATE;
+
+    SELECT array_agg(id) INTO v_ids
+    FROM (
+        SELECT id FROM reservas_stock
+        WHERE fecha_liquidacion IS NULL AND producto_id = ANY(v_productos)
+        ORDER BY id
+        LIMIT p_limite
+        FOR UPDATE SKIP LOCKED
+    ) lote;
+
+    IF v_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    UPDATE productos p
+    SET stock = p.stock - r.cantidad
+    FROM (
+        SELECT producto_id, SUM(cantidad) AS cantidad
+        FROM reservas_stock
+        WHERE id = ANY(v_ids)
+        GROUP BY producto_id
+    ) r
+    WHERE p.id = r.producto_id;
+
+    UPDATE reservas_stock SET fecha_liquidacion = CURRENT_TIMESTAMP WHERE id = ANY(v_ids);
 
-    COMMIT;
-EXCEPTION
-    WHEN OTHERS THEN
-        ROLLBACK;
-        RAISE;
+    PERFORM set_config('quicknotes.liquidando', 'off', true);
+    RETURN array_length(v_ids, 1);
 END;
-$$;
+$$ LANGUAGE plpgsql;
+
+-- Las ventas ya no tocan productos.stock: reservan en los cupos y apuntan la
+-- reserva en el libro. Se mantiene el nombre del trigger (actualizar_stock).
 CREATE OR REPLACE FUNCTION fn_actualizar_stock_al_vender()
 RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN
+        SELECT producto_id, SUM(cantidad)::INTEGER AS cantidad
+        FROM lineas_nuevas
+        GROUP BY producto_id
+        ORDER BY producto_id
+    LOOP
+        PERFORM reservar_stock(r.producto_id, r.cantidad);
+    END LOOP;
+
+    INSERT INTO reservas_stock (producto_id, pedido_id, cantidad, fecha_reserva)
+    SELECT producto_id, pedido_id, SUM(cantidad), CURRENT_TIMESTAMP
+    FROM lineas_nuevas
+    GROUP BY pedido_id, producto_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cualquier cambio de stock hecho fuera del liquidador (altas, ediciones del
+-- administrador, reposiciones) vuelve a repartir los cupos del producto.
+CREATE OR REPLACE FUNCTION fn_repartir_cupos_al_cambiar_stock()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_ids BIGINT[];
+BEGIN
+    IF current_setting('quicknotes.liquidando', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(id) INTO v_ids FROM productos_nuevos;
+    ELSE
+        SELECT array_agg(n.id) INTO v_ids
+        FROM productos_nuevos n
+        JOIN productos_anteriores a ON a.id = n.id
+        WHERE n.stock IS DISTINCT FROM a.stock;
+    END IF;
+
+    IF v_ids IS NOT NULL THEN
+        PERFORM repartir_cupos(v_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER repartir_cupos_alta
+AFTER INSERT ON productos
+REFERENCING NEW TABLE AS productos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_repartir_cupos_al_cambiar_stock();
+
+CREATE TRIGGER repartir_cupos_cambio
+AFTER UPDATE ON productos
+REFERENCING OLD TABLE AS productos_anteriores NEW TABLE AS productos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_repartir_cupos_al_cambiar_stock();
+
+CREATE OR REPLACE FUNCTION producto_busqueda(p_nombre TEXT, p_descripcion TEXT)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('spanish', COALESCE(p_nombre, '')), 'A')
+        || setweight(to_tsvector('spanish', COALESCE(p_descripcion, '')), 'B');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION fn_busqueda_producto()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.busqueda := producto_busqueda(NEW.nombre, NEW.descripcion);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER busqueda_producto
+BEFORE INSERT OR UPDATE OF nombre, descripcion ON productos
+FOR EACH ROW EXECUTE FUNCTION fn_busqueda_producto();
+
+-- Los cambios de las columnas que edita el administrador incrementan la
+-- versión del producto (la anterior más uno, no la que se escribe). El stock
+-- no cuenta: lo mueven también las ventas, la liquidación y las devoluciones
+CREATE OR REPLACE FUNCTION fn_version_producto()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER version_producto
+BEFORE UPDATE ON productos
+FOR EACH ROW WHEN ((OLD.sku, OLD.nombre, OLD.descripcion, OLD.precio, OLD.activo)
+                   IS DISTINCT FROM (NEW.sku, NEW.nombre, NEW.descripcion, NEW.precio, NEW.activo))
+EXECUTE FUNCTION fn_version_producto();
+
+-- Día contable de una fecha. Se usa la zona de settings.TIME_ZONE (UTC).
+CREATE OR REPLACE FUNCTION dia_venta(p_fecha TIMESTAMPTZ)
+RETURNS DATE AS $$
+    SELECT (p_fecha AT TIME ZONE 'UTC')::date;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Precio de la línea del pedido por la cantidad devuelta
+CREATE OR REPLACE FUNCTION importe_devolucion(p_pedido_id BIGINT, p_producto_id BIGINT, p_cantidad INTEGER)
+RETURNS NUMERIC AS $$
+    SELECT COALESCE(ROUND(SUM(subtotal) / NULLIF(SUM(cantidad), 0) * p_cantidad, 2), 0)
+    FROM detalle_pedidos
+    WHERE pedido_id = p_pedido_id AND producto_id = p_producto_id;
+$$ LANGUAGE sql STABLE;
+
+-- Variación de los acumulados que provoca un cambio en pedidos, líneas o
+-- devoluciones. Las filas con producto_id NULL no cuentan por producto.
+CREATE TYPE venta_delta AS (
+    dia DATE,
+    producto_id BIGINT,
+    cliente_id BIGINT,
+    pedidos INTEGER,
+    unidades INTEGER,
+    importe NUMERIC(14, 2),
+    unidades_devueltas INTEGER,
+    importe_devuelto NUMERIC(14, 2)
+);
+
+CREATE OR REPLACE FUNCTION acumular_ventas(p_deltas venta_delta[])
+RETURNS VOID AS $$
+DECLARE
+    -- Cada conexión suma en su propio fragmento: los checkouts simultáneos
+    -- del mismo día no hacen cola sobre la misma fila
+    v_fragmento SMALLINT := pg_backend_pid() % 8;
+BEGIN
+    IF cardinality(p_deltas) = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO ventas_diarias AS v
+        (dia, fragmento, pedidos, unidades, importe, unidades_devueltas, importe_devuelto)
+    SELECT d.dia, v_fragmento, SUM(d.pedidos), SUM(d.unidades), SUM(d.importe),
+           SUM(d.unidades_devueltas), SUM(d.importe_devuelto)
+    FROM unnest(p_deltas) d
+    GROUP BY d.dia
+    ORDER BY d.dia
+    ON CONFLICT (dia, fragmento) DO UPDATE SET
+        pedidos = v.pedidos + EXCLUDED.pedidos,
+        unidades = v.unidades + EXCLUDED.unidades,
+        importe = v.importe + EXCLUDED.importe,
+        unidades_devueltas = v.unidades_devueltas + EXCLUDED.unidades_devueltas,
+        importe_devuelto = v.importe_devuelto + EXCLUDED.importe_devuelto;
+
+    INSERT INTO ventas_producto_diarias AS v
+        (dia, producto_id, fragmento, unidades, importe, unidades_devueltas, importe_devuelto)
+    SELECT d.dia, d.producto_id, v_fragmento, SUM(d.unidades), SUM(d.importe),
+           SUM(d.unidades_devueltas), SUM(d.importe_devuelto)
+    FROM unnest(p_deltas) d
+    WHERE d.producto_id IS NOT NULL
+    GROUP BY d.dia, d.producto_id
+    ORDER BY d.dia, d.producto_id
+    ON CONFLICT (dia, producto_id, fragmento) DO UPDATE SET
+        unidades = v.unidades + EXCLUDED.unidades,
+        importe = v.importe + EXCLUDED.importe,
+        unidades_devueltas = v.unidades_devueltas + EXCLUDED.unidades_devueltas,
+        importe_devuelto = v.importe_devuelto + EXCLUDED.importe_devuelto;
+
+    INSERT INTO ventas_cliente_diarias AS v
+        (dia, cliente_id, fragmento, pedidos, unidades, importe, unidades_devueltas, importe_devuelto)
+    SELECT d.dia, d.cliente_id, v_fragmento, SUM(d.pedidos), SUM(d.unidades), SUM(d.importe),
+           SUM(d.unidades_devueltas), SUM(d.importe_devuelto)
+    FROM unnest(p_deltas) d
+    GROUP BY d.dia, d.cliente_id
+    ORDER BY d.dia, d.cliente_id
+    ON CONFLICT (dia, cliente_id, fragmento) DO UPDATE SET
+        pedidos = v.pedidos + EXCLUDED.pedidos,
+        unidades = v.unidades + EXCLUDED.unidades,
+        importe = v.importe + EXCLUDED.importe,
+        unidades_devueltas = v.unidades_devueltas + EXCLUDED.unidades_devueltas,
+        importe_devuelto = v.importe_devuelto + EXCLUDED.importe_devuelto;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Pedidos: cuentan el pedido en su día y su cliente. Si un pedido cambia de
+-- día o de cliente, se mueve con él todo lo que le cuelga.
+CREATE OR REPLACE FUNCTION fn_ventas_por_pedidos()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(fecha_pedido), NULL, cliente_id, 1, 0, 0, 0, 0)::venta_delta
+            FROM pedidos_nuevos
+        ));
+        RETURN NULL;
+    END IF;
+
+    PERFORM acumular_ventas(ARRAY(
+        WITH movidos AS (
+            SELECT n.id,
+                   dia_venta(a.fecha_pedido) AS dia_anterior, a.cliente_id AS cliente_anterior,
+                   dia_venta(n.fecha_pedido) AS dia, n.cliente_id
+            FROM pedidos_anteriores a
+            JOIN pedidos_nuevos n ON n.id = a.id
+            WHERE dia_venta(a.fecha_pedido) IS DISTINCT FROM dia_venta(n.fecha_pedido)
+               OR a.cliente_id IS DISTINCT FROM n.cliente_id
+        )
+        SELECT ROW(m.dia_anterior, NULL, m.cliente_anterior, -1, 0, 0, 0, 0)::venta_delta FROM movidos m
+        UNION ALL
+        SELECT ROW(m.dia, NULL, m.cliente_id, 1, 0, 0, 0, 0)::venta_delta FROM movidos m
+        UNION ALL
+        SELECT ROW(m.dia_anterior, l.producto_id, m.cliente_anterior, 0, -l.cantidad, -l.subtotal, 0, 0)::venta_delta
+        FROM movidos m JOIN detalle_pedidos l ON l.pedido_id = m.id
+        UNION ALL
+        SELECT ROW(m.dia, l.producto_id, m.cliente_id, 0, l.cantidad, l.subtotal, 0, 0)::venta_delta
+        FROM movidos m JOIN detalle_pedidos l ON l.pedido_id = m.id
+        UNION ALL
+        -- Las devoluciones se quedan en su día; solo cambian de cliente
+        SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, m.cliente_anterior,
+                   0, 0, 0, -d.cantidad, -d.importe)::venta_delta
+        FROM movidos m JOIN devoluciones d ON d.pedido_id = m.id AND d.estado = 'aprobada'
+        UNION ALL
+        SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, m.cliente_id,
+                   0, 0, 0, d.cantidad, d.importe)::venta_delta
+        FROM movidos m JOIN devoluciones d ON d.pedido_id = m.id AND d.estado = 'aprobada'
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Al borrar pedidos se descuenta también lo que todavía les cuelga. Es de
+-- sentencia: un BEFORE DELETE por fila también se dispara cuando un UPDATE
+-- de la fecha mueve el pedido a otra partición.
+CREATE OR REPLACE FUNCTION fn_ventas_al_borrar_pedidos()
+RETURNS TRIGGER AS $$
 BEGIN
-    UPDATE productos
-    SET stock = stock - NEW.cantidad
-    WHERE id = NEW.producto_id;
+    PERFORM acumular_ventas(ARRAY(
+        SELECT ROW(dia_venta(b.fecha_pedido), NULL, b.cliente_id, -1, 0, 0, 0, 0)::venta_delta
+        FROM pedidos_borrados b
+        UNION ALL
+        SELECT ROW(dia_venta(b.fecha_pedido), l.producto_id, b.cliente_id,
+                   0, -l.cantidad, -l.subtotal, 0, 0)::venta_delta
+        FROM pedidos_borrados b
+        JOIN detalle_pedidos l ON l.pedido_id = b.id AND l.fecha_pedido = b.fecha_pedido
+        UNION ALL
+        SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, b.cliente_id,
+                   0, 0, 0, -d.cantidad, -d.importe)::venta_delta
+        FROM pedidos_borrados b
+        JOIN devoluciones d ON d.pedido_id = b.id AND d.fecha_pedido = b.fecha_pedido AND d.estado = 'aprobada'
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Líneas: unidades e importe, en el día y el cliente de su pedido. El pedido
+-- se busca por id y fecha, así que solo se lee su partición. Una edición
+-- solo cuenta si cambia algo de lo que se suma (no cuando la línea solo
+-- cambia de partición).
+CREATE OR REPLACE FUNCTION fn_ventas_por_lineas()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(p.fecha_pedido), l.producto_id, p.cliente_id,
+                       0, l.cantidad, l.subtotal, 0, 0)::venta_delta
+            FROM lineas_nuevas l
+            JOIN pedidos p ON p.id = l.pedido_id AND p.fecha_pedido = fecha_de_pedido(l.pedido_id, l.fecha_pedido)
+        ));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(p.fecha_pedido), l.producto_id, p.cliente_id,
+                       0, -l.cantidad, -l.subtotal, 0, 0)::venta_delta
+            FROM lineas_anteriores l
+            JOIN pedidos p ON p.id = l.pedido_id AND p.fecha_pedido = fecha_de_pedido(l.pedido_id, l.fecha_pedido)
+        ));
+    ELSE
+        PERFORM acumular_ventas(ARRAY(
+            WITH cambiadas AS (
+                SELECT a.pedido_id AS pedido_anterior, a.fecha_pedido AS fecha_anterior,
+                       a.producto_id AS producto_anterior, a.cantidad AS cantidad_anterior,
+                       a.subtotal AS subtotal_anterior,
+                       n.pedido_id, n.fecha_pedido, n.producto_id, n.cantidad, n.subtotal
+                FROM lineas_anteriores a
+                JOIN lineas_nuevas n ON n.id = a.id
+                WHERE (a.pedido_id, a.producto_id, a.cantidad, a.subtotal)
+                      IS DISTINCT FROM (n.pedido_id, n.producto_id, n.cantidad, n.subtotal)
+            )
+            SELECT ROW(dia_venta(p.fecha_pedido), c.producto_anterior, p.cliente_id,
+                       0, -c.cantidad_anterior, -c.subtotal_anterior, 0, 0)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_anterior
+                          AND p.fecha_pedido = fecha_de_pedido(c.pedido_anterior, c.fecha_anterior)
+            UNION ALL
+            SELECT ROW(dia_venta(p.fecha_pedido), c.producto_id, p.cliente_id,
+                       0, c.cantidad, c.subtotal, 0, 0)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_id AND p.fecha_pedido = fecha_de_pedido(c.pedido_id, c.fecha_pedido)
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
+-- Devoluciones: solo cuentan las aprobadas, en el día de la devolución
+CREATE OR REPLACE FUNCTION fn_ventas_por_devoluciones()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, p.cliente_id,
+                       0, 0, 0, d.cantidad, d.importe)::venta_delta
+            FROM devoluciones_nuevas d
+            JOIN pedidos p ON p.id = d.pedido_id AND p.fecha_pedido = fecha_de_pedido(d.pedido_id, d.fecha_pedido)
+            WHERE d.estado = 'aprobada'
+        ));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM acumular_ventas(ARRAY(
+            SELECT ROW(dia_venta(d.fecha_devolucion), d.producto_id, p.cliente_id,
+                       0, 0, 0, -d.cantidad, -d.importe)::venta_delta
+            FROM devoluciones_anteriores d
+            JOIN pedidos p ON p.id = d.pedido_id AND p.fecha_pedido = fecha_de_pedido(d.pedido_id, d.fecha_pedido)
+            WHERE d.estado = 'aprobada'
+        ));
+    ELSE
+        PERFORM acumular_ventas(ARRAY(
+            WITH cambiadas AS (
+                SELECT a.*, n.pedido_id AS pedido_nuevo, n.fecha_pedido AS fecha_nueva,
+                       n.producto_id AS producto_nuevo, n.cantidad AS cantidad_nueva,
+                       n.importe AS importe_nuevo, n.estado AS estado_nuevo,
+                       n.fecha_devolucion AS fecha_devolucion_nueva
+                FROM devoluciones_anteriores a
+                JOIN devoluciones_nuevas n ON n.id = a.id
+                WHERE (a.pedido_id, a.producto_id, a.cantidad, a.importe, a.estado, a.fecha_devolucion)
+                      IS DISTINCT FROM (n.pedido_id, n.producto_id, n.cantidad, n.importe, n.estado, n.fecha_devolucion)
+            )
+            SELECT ROW(dia_venta(c.fecha_devolucion), c.producto_id, p.cliente_id,
+                       0, 0, 0, -c.cantidad, -c.importe)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_id AND p.fecha_pedido = fecha_de_pedido(c.pedido_id, c.fecha_pedido)
+            WHERE c.estado = 'aprobada'
+            UNION ALL
+            SELECT ROW(dia_venta(c.fecha_devolucion_nueva), c.producto_nuevo, p.cliente_id,
+                       0, 0, 0, c.cantidad_nueva, c.importe_nuevo)::venta_delta
+            FROM cambiadas c
+            JOIN pedidos p ON p.id = c.pedido_nuevo AND p.fecha_pedido = fecha_de_pedido(c.pedido_nuevo, c.fecha_nueva)
+            WHERE c.estado_nuevo = 'aprobada'
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- El importe de la devolución se fija al registrarla, para descontar
+-- siempre lo mismo que se sumó aunque luego cambien las líneas (ni cuando la
+-- devolución cambia de partición, que es un INSERT en la nueva)
+CREATE OR REPLACE FUNCTION fn_valorar_devolucion()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.importe IS NULL
+       OR (TG_OP = 'UPDATE' AND (NEW.pedido_id IS DISTINCT FROM OLD.pedido_id
+                                 OR NEW.producto_id IS DISTINCT FROM OLD.producto_id
+                                 OR NEW.cantidad IS DISTINCT FROM OLD.cantidad)) THEN
+        NEW.importe := importe_devolucion(NEW.pedido_id, NEW.producto_id, NEW.cantidad);
+    END IF;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
+CREATE TRIGGER ventas_pedidos_alta
+AFTER INSERT ON pedidos
+REFERENCING NEW TABLE AS pedidos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_pedidos();
+
+CREATE TRIGGER ventas_pedidos_cambio
+AFTER UPDATE ON pedidos
+REFERENCING OLD TABLE AS pedidos_anteriores NEW TABLE AS pedidos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_pedidos();
+
+CREATE TRIGGER ventas_pedidos_baja
+AFTER DELETE ON pedidos
+REFERENCING OLD TABLE AS pedidos_borrados
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_al_borrar_pedidos();
+
+CREATE TRIGGER ventas_lineas_alta
+AFTER INSERT ON detalle_pedidos
+REFERENCING NEW TABLE AS lineas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_lineas();
+
+CREATE TRIGGER ventas_lineas_cambio
+AFTER UPDATE ON detalle_pedidos
+REFERENCING OLD TABLE AS lineas_anteriores NEW TABLE AS lineas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_lineas();
+
+CREATE TRIGGER ventas_lineas_baja
+AFTER DELETE ON detalle_pedidos
+REFERENCING OLD TABLE AS lineas_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_lineas();
+
+CREATE TRIGGER valorar_devolucion
+BEFORE INSERT OR UPDATE ON devoluciones
+FOR EACH ROW EXECUTE FUNCTION fn_valorar_devolucion();
+
+CREATE TRIGGER ventas_devoluciones_alta
+AFTER INSERT ON devoluciones
+REFERENCING NEW TABLE AS devoluciones_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_devoluciones();
+
+CREATE TRIGGER ventas_devoluciones_cambio
+AFTER UPDATE ON devoluciones
+REFERENCING OLD TABLE AS devoluciones_anteriores NEW TABLE AS devoluciones_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_devoluciones();
+
+CREATE TRIGGER ventas_devoluciones_baja
+AFTER DELETE ON devoluciones
+REFERENCING OLD TABLE AS devoluciones_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_ventas_por_devoluciones();
+
+-- Como en la 0007, pero las líneas se unen con su pedido por id y fecha: con
+-- un rango de días solo se leen las particiones de esos meses
+CREATE OR REPLACE FUNCTION reconstruir_ventas(p_desde DATE DEFAULT NULL, p_hasta DATE DEFAULT NULL)
+RETURNS VOID AS $$
+DECLARE
+    v_desde DATE := COALESCE(p_desde, '-infinity'::date);
+    v_hasta DATE := COALESCE(p_hasta, 'infinity'::date);
+    v_inicio TIMESTAMPTZ := COALESCE(p_desde::timestamp AT TIME ZONE 'UTC', '-infinity');
+    v_fin TIMESTAMPTZ := COALESCE((p_hasta + 1)::timestamp AT TIME ZONE 'UTC', 'infinity');
+BEGIN
+    LOCK TABLE ventas_diarias, ventas_producto_diarias, ventas_cliente_diarias IN EXCLUSIVE MODE;
+
+    DELETE FROM ventas_diarias WHERE dia BETWEEN v_desde AND v_hasta;
+    DELETE FROM ventas_producto_diarias WHERE dia BETWEEN v_desde AND v_hasta;
+    DELETE FROM ventas_cliente_diarias WHERE dia BETWEEN v_desde AND v_hasta;
+
+    WITH fuentes AS (
+        SELECT dia_venta(p.fecha_pedido) AS dia, NULL::BIGINT AS producto_id, p.cliente_id,
+               COUNT(*)::INTEGER AS pedidos, 0 AS unidades, 0::NUMERIC AS importe,
+               0 AS unidades_devueltas, 0::NUMERIC AS importe_devuelto
+        FROM pedidos p
+        WHERE p.fecha_pedido >= v_inicio AND p.fecha_pedido < v_fin
+        GROUP BY 1, 3
+        UNION ALL
+        SELECT dia_venta(p.fecha_pedido), l.producto_id, p.cliente_id,
+               0, SUM(l.cantidad)::INTEGER, SUM(l.subtotal), 0, 0
+        FROM detalle_pedidos l JOIN pedidos p ON p.id = l.pedido_id AND p.fecha_pedido = l.fecha_pedido
+        WHERE l.fecha_pedido >= v_inicio AND l.fecha_pedido < v_fin
+        GROUP BY 1, 2, 3
+        UNION ALL
+        SELECT dia_venta(d.fecha_devolucion), d.producto_id, p.cliente_id,
+               0, 0, 0, SUM(d.cantidad)::INTEGER, SUM(d.importe)
+        FROM devoluciones d JOIN pedidos p ON p.id = d.pedido_id AND p.fecha_pedido = d.fecha_pedido
+        WHERE d.estado = 'aprobada' AND d.fecha_devolucion >= v_inicio AND d.fecha_devolucion < v_fin
+        GROUP BY 1, 2, 3
+    ),
+    por_dia AS (
+        INSERT INTO ventas_diarias
+            (dia, fragmento, pedidos, unidades, importe, unidades_devueltas, importe_devuelto)
+        SELECT dia, 0, SUM(pedidos), SUM(unidades), SUM(importe), SUM(unidades_devueltas), SUM(importe_devuelto)
+        FROM fuentes
+        GROUP BY dia
+    ),
+    por_producto AS (
+        INSERT INTO ventas_producto_diarias
+            (dia, producto_id, fragmento, unidades, importe, unidades_devueltas, importe_devuelto)
+        SELECT dia, producto_id, 0, SUM(unidades), SUM(importe), SUM(unidades_devueltas), SUM(importe_devuelto)
+        FROM fuentes
+        WHERE producto_id IS NOT NULL
+        GROUP BY dia, producto_id
+    )
+    INSERT INTO ventas_cliente_diarias
+        (dia, cliente_id, fragmento, pedidos, unidades, importe, unidades_devueltas, importe_devuelto)
+    SELECT dia, cliente_id, 0, SUM(pedidos), SUM(unidades), SUM(importe), SUM(unidades_devueltas), SUM(importe_devuelto)
+    FROM fuentes
+    GROUP BY dia, cliente_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ventas netas (vendido menos devuelto), leídas de los acumulados
+CREATE OR REPLACE FUNCTION ventas_totales(p_desde DATE DEFAULT NULL, p_hasta DATE DEFAULT NULL)
+RETURNS NUMERIC AS $$
+    SELECT COALESCE(SUM(importe - importe_devuelto), 0)
+    FROM ventas_diarias
+    WHERE dia BETWEEN COALESCE(p_desde, '-infinity'::date) AND COALESCE(p_hasta, 'infinity'::date);
+$$ LANGUAGE sql STABLE;
+
+-- Fecha del pedido de una línea o devolución: la suya o, si aún no la tiene,
+-- la de su pedido
+CREATE OR REPLACE FUNCTION fecha_de_pedido(p_pedido_id BIGINT, p_fecha TIMESTAMPTZ)
+RETURNS TIMESTAMPTZ AS $$
+    SELECT CASE WHEN p_fecha = '-infinity'
+                THEN (SELECT fecha_pedido FROM pedidos WHERE id = p_pedido_id)
+                ELSE p_fecha END;
+$$ LANGUAGE sql STABLE;
+
+-- Una línea o devolución que cambia de pedido toma la fecha del nuevo (y,
+-- con ella, pasa a su partición). Mientras las tablas no están
+-- particionadas, también rellena la fecha de las que se insertan sin ella.
+CREATE OR REPLACE FUNCTION fn_fecha_del_pedido()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF (TG_OP = 'INSERT' AND NEW.fecha_pedido = '-infinity')
+       OR (TG_OP = 'UPDATE' AND NEW.pedido_id IS DISTINCT FROM OLD.pedido_id) THEN
+        NEW.fecha_pedido := COALESCE((SELECT fecha_pedido FROM pedidos WHERE id = NEW.pedido_id), '-infinity');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las filas que llegan sin fecha del pedido caen en la partición
+-- "<tabla>_por_asignar" (un BEFORE INSERT no puede cambiarlas de partición).
+-- Este trigger, en esa partición, las mueve a la de su mes. Si el pedido no
+-- existe, la fila se queda y la clave foránea falla al confirmar, como antes.
+CREATE OR REPLACE FUNCTION fn_asignar_fecha_pedido()
+RETURNS TRIGGER AS $$
+BEGIN
+    EXECUTE format(
+        'UPDATE %I t SET fecha_pedido = p.fecha_pedido FROM pedidos p '
+        'WHERE p.id = $1 AND t.id = $2 AND t.fecha_pedido = ''-infinity''::timestamptz',
+        TG_ARGV[0]
+    ) USING NEW.pedido_id, NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Límite superior de una partición (NULL si va hasta MAXVALUE)
+CREATE OR REPLACE FUNCTION fin_de_particion(p_particion REGCLASS)
+RETURNS TIMESTAMPTZ AS $$
+    SELECT substring(pg_get_expr(relpartbound, oid) FROM 'TO \(''([^'']+)''\)')::timestamptz
+    FROM pg_class
+    WHERE oid = p_particion;
+$$ LANGUAGE sql STABLE;
+
+-- Crea las particiones mensuales (meses UTC, como dia_venta) de pedidos,
+-- detalle_pedidos y devoluciones que falten hasta el mes de p_hasta
+-- incluido, a continuación de la última. Cada una se crea vacía y se engancha
+-- con ATTACH PARTITION, que no bloquea las lecturas ni las escrituras de la
+-- tabla particionada. Devuelve los nombres de las creadas.
+CREATE OR REPLACE FUNCTION crear_particiones_pedidos(p_hasta DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_tabla TEXT;
+    v_desde TIMESTAMPTZ;
+    v_hasta TIMESTAMPTZ;
+    v_nombre TEXT;
+BEGIN
+    FOREACH v_tabla IN ARRAY ARRAY['pedidos', 'detalle_pedidos', 'devoluciones'] LOOP
+        -- Durante la migración 0011, las que aún no están particionadas
+        CONTINUE WHEN (SELECT relkind FROM pg_class WHERE oid = v_tabla::regclass) <> 'p';
+        SELECT max(fin_de_particion(inhrelid)) INTO v_desde FROM pg_inherits WHERE inhparent = v_tabla::regclass;
+        WHILE v_desde IS NOT NULL AND v_desde <= p_hasta::timestamp AT TIME ZONE 'UTC' LOOP
+            v_hasta := ((v_desde AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC';
+            v_nombre := v_tabla || '_' || to_char(v_desde AT TIME ZONE 'UTC', 'YYYY_MM');
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', v_nombre, v_tabla);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           v_tabla, v_nombre, v_desde, v_hasta);
+            RETURN NEXT v_nombre;
+            v_desde := v_hasta;
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Desengancha las particiones de pedidos que terminan antes de p_antes_de,
+-- junto con las de sus líneas y devoluciones (mismos límites y sufijo), y
+-- las pasa al esquema archivo sin sus claves foráneas. Los acumulados de
+-- ventas no cambian. Devuelve los nombres de las archivadas.
+CREATE OR REPLACE FUNCTION archivar_particiones_pedidos(p_antes_de DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_particion RECORD;
+    v_nombre TEXT;
+    v_tabla TEXT;
+    v_fk TEXT;
+BEGIN
+    FOR v_particion IN
+        SELECT c.relname AS nombre, fin_de_particion(c.oid) AS hasta
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'pedidos'::regclass
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN v_particion.hasta IS NULL
+                   OR v_particion.hasta > p_antes_de::timestamp AT TIME ZONE 'UTC';
+        -- Primero las hijas: su clave foránea no deja desenganchar el pedido
+        FOREACH v_tabla IN ARRAY ARRAY['detalle_pedidos', 'devoluciones', 'pedidos'] LOOP
+            v_nombre := v_tabla || substring(v_particion.nombre FROM length('pedidos') + 1);
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', v_tabla, v_nombre);
+            FOR v_fk IN
+                SELECT conname FROM pg_constraint WHERE conrelid = v_nombre::regclass AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', v_nombre, v_fk);
+            END LOOP;
+            EXECUTE format('ALTER TABLE %I SET SCHEMA archivo', v_nombre);
+            RETURN NEXT 'archivo.' || v_nombre;
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE SCHEMA IF NOT EXISTS archivo;
+
+CREATE TRIGGER fecha_del_pedido
+BEFORE UPDATE ON detalle_pedidos
+FOR EACH ROW EXECUTE FUNCTION fn_fecha_del_pedido();
+
+CREATE TRIGGER fecha_del_pedido
+BEFORE UPDATE ON devoluciones
+FOR EACH ROW EXECUTE FUNCTION fn_fecha_del_pedido();
+
+CREATE TRIGGER asignar_fecha_pedido
+AFTER INSERT ON detalle_pedidos_por_asignar
+FOR EACH ROW EXECUTE FUNCTION fn_asignar_fecha_pedido('detalle_pedidos');
+
+CREATE TRIGGER asignar_fecha_pedido
+AFTER INSERT ON devoluciones_por_asignar
+FOR EACH ROW EXECUTE FUNCTION fn_asignar_fecha_pedido('devoluciones');
+
+-- El mes en curso y los tres siguientes (después, manage.py mantener_particiones)
+SELECT crear_particiones_pedidos((CURRENT_DATE + interval '3 months')::date);
+
+-- Repone el stock y descuenta del total del pedido las devoluciones
+-- aprobadas de p_ids que aún no se habían procesado. Una sola actualización
+-- por producto y por pedido; los productos se bloquean en orden de id, como
+-- en el liquidador. Devuelve cuántas devoluciones procesó.
+CREATE OR REPLACE FUNCTION procesar_devoluciones(p_ids BIGINT[])
+RETURNS INTEGER AS $$
+DECLARE
+    v_procesadas INTEGER;
+BEGIN
+    PERFORM 1 FROM productos
+    WHERE id IN (SELECT producto_id FROM devoluciones WHERE id = ANY(p_ids))
+    ORDER BY id
+    FOR UPDATE;
+
+    WITH procesadas AS (
+        -- fecha_reposicion hace que repetir la tarea no reponga dos veces
+        UPDATE devoluciones
+        SET fecha_reposicion = CURRENT_TIMESTAMP
+        WHERE id = ANY(p_ids) AND estado = 'aprobada' AND fecha_reposicion IS NULL
+        RETURNING pedido_id, fecha_pedido, producto_id, cantidad, COALESCE(importe, 0) AS importe
+    ), stock AS (
+        -- Vuelve a repartir los cupos (trigger repartir_cupos_cambio)
+        UPDATE productos p
+        SET stock = p.stock + r.cantidad
+        FROM (SELECT producto_id, SUM(cantidad) AS cantidad FROM procesadas GROUP BY producto_id) r
+        WHERE p.id = r.producto_id
+    ), totales AS (
+        UPDATE pedidos p
+        SET total = GREATEST(p.total - r.importe, 0)
+        FROM (SELECT pedido_id, fecha_pedido, SUM(importe) AS importe FROM procesadas GROUP BY 1, 2) r
+        WHERE p.id = r.pedido_id AND p.fecha_pedido = r.fecha_pedido
+    )
+    SELECT count(*) INTO v_procesadas FROM procesadas;
+
+    RETURN v_procesadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Encola una tarea por cada devolución que pasa a 'aprobada', en la misma
+-- transacción que la aprueba (desde la API, el admin o SQL)
+CREATE OR REPLACE FUNCTION fn_encolar_devoluciones_aprobadas()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tareas (tipo, clave, datos)
+        SELECT 'devolucion_aprobada', 'devolucion:' || id, jsonb_build_object('devolucion_id', id)
+        FROM devoluciones_nuevas
+        WHERE estado = 'aprobada' AND fecha_reposicion IS NULL
+        ON CONFLICT (clave) DO NOTHING;
+    ELSE
+        INSERT INTO tareas (tipo, clave, datos)
+        SELECT 'devolucion_aprobada', 'devolucion:' || n.id, jsonb_build_object('devolucion_id', n.id)
+        FROM devoluciones_nuevas n
+        JOIN devoluciones_anteriores a ON a.id = n.id
+        WHERE n.estado = 'aprobada' AND a.estado IS DISTINCT FROM 'aprobada' AND n.fecha_reposicion IS NULL
+        ON CONFLICT (clave) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER encolar_devoluciones_alta
+AFTER INSERT ON devoluciones
+REFERENCING NEW TABLE AS devoluciones_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_encolar_devoluciones_aprobadas();
+
+CREATE TRIGGER encolar_devoluciones_cambio
+AFTER UPDATE ON devoluciones
+REFERENCING OLD TABLE AS devoluciones_anteriores NEW TABLE AS devoluciones_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_encolar_devoluciones_aprobadas();
+
+-- Una fila en cambios por registro dado de alta, modificado o borrado en
+-- cada sentencia, con la transacción que lo hizo. Las actualizaciones que no
+-- cambian nada no se registran.
+CREATE OR REPLACE FUNCTION fn_registrar_cambios()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_transaccion BIGINT := pg_current_xact_id()::text::bigint;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO cambios (transaccion, tabla, registro_id)
+        SELECT v_transaccion, TG_TABLE_NAME, id FROM filas_nuevas;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO cambios (transaccion, tabla, registro_id)
+        SELECT v_transaccion, TG_TABLE_NAME, n.id
+        FROM filas_nuevas n
+        JOIN filas_anteriores a ON a.id = n.id
+        WHERE n IS DISTINCT FROM a;
+    ELSE
+        INSERT INTO cambios (transaccion, tabla, registro_id)
+        SELECT v_transaccion, TG_TABLE_NAME, id FROM filas_anteriores;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER registrar_cambios_alta
+AFTER INSERT ON productos
+REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_cambio
+AFTER UPDATE ON productos
+REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_baja
+AFTER DELETE ON productos
+REFERENCING OLD TABLE AS filas_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_alta
+AFTER INSERT ON pedidos
+REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_cambio
+AFTER UPDATE ON pedidos
+REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_baja
+AFTER DELETE ON pedidos
+REFERENCING OLD TABLE AS filas_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_alta
+AFTER INSERT ON detalle_pedidos
+REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_cambio
+AFTER UPDATE ON detalle_pedidos
+REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_baja
+AFTER DELETE ON detalle_pedidos
+REFERENCING OLD TABLE AS filas_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_alta
+AFTER INSERT ON devoluciones
+REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_cambio
+AFTER UPDATE ON devoluciones
+REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+CREATE TRIGGER registrar_cambios_baja
+AFTER DELETE ON devoluciones
+REFERENCING OLD TABLE AS filas_anteriores
+FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios();
+
+-- Avisos en tiempo real (quicknotes.eventos): cambios de stock y de estado de
+-- los pedidos, por NOTIFY en el canal quicknotes_eventos
+CREATE OR REPLACE FUNCTION fn_avisar_stock()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('quicknotes_eventos', json_build_object('tipo', 'stock', 'id', n.id, 'stock', n.stock)::text)
+    FROM productos_nuevos n
+    JOIN productos_anteriores a ON a.id = n.id
+    WHERE n.stock IS DISTINCT FROM a.stock;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER avisar_stock
+AFTER UPDATE ON productos
+REFERENCING OLD TABLE AS productos_anteriores NEW TABLE AS productos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_avisar_stock();
+
+CREATE OR REPLACE FUNCTION fn_avisar_estado_pedido()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('quicknotes_eventos', json_build_object(
+        'tipo', 'pedido', 'id', n.id, 'cliente_id', n.cliente_id, 'estado', n.estado
+    )::text)
+    FROM pedidos_nuevos n
+    JOIN pedidos_anteriores a ON a.id = n.id
+    WHERE n.estado IS DISTINCT FROM a.estado;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER avisar_estado_pedido
+AFTER UPDATE ON pedidos
+REFERENCING OLD TABLE AS pedidos_anteriores NEW TABLE AS pedidos_nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_avisar_estado_pedido();
+
+
 INSERT INTO usuarios (username, password, email, rol)
 VALUES ('juan', '123456', 'juan@example.com', 'cliente')
 RETURNING id;
@@ -159,7 +1287,8 @@ RETURNING id;
 
 CREATE TRIGGER actualizar_stock
 AFTER INSERT ON detalle_pedidos
-FOR EACH ROW EXECUTE FUNCTION fn_actualizar_stock_al_vender();
+REFERENCING NEW TABLE AS lineas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION fn_actualizar_stock_al_vender();
 
 
 